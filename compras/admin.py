@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import Compra, Semana
+from .variacion import invalidar_compras
 
 
 class CompraInline(admin.TabularInline):
@@ -23,3 +24,15 @@ class CompraAdmin(admin.ModelAdmin):
     ]
     list_filter = ["estado", "forma_pago", "es_subcontrato"]
     search_fields = ["item", "obra__nombre", "proveedor__nombre"]
+
+    # Compra no tiene signal de borrado (ver compras.signals).
+    def delete_model(self, request, obj):
+        company_id = obj.semana.company_id
+        super().delete_model(request, obj)
+        invalidar_compras(company_id)
+
+    def delete_queryset(self, request, queryset):
+        company_ids = set(queryset.values_list("semana__company_id", flat=True))
+        super().delete_queryset(request, queryset)
+        for company_id in company_ids:
+            invalidar_compras(company_id)
@@ -0,0 +1,75 @@
+"""
+Calendario de compras: resumen por año y mes para compras_list.
+
+El resumen sale de una sola consulta agrupada por año y mes de la semana
+(semanas, compras, monto total y monto a pagar) y queda en el cache por
+empresa con la versión de compras (compras.variacion), así que una empresa
+con años de semanas no las lee todas en cada visita. Las semanas de un mes
+se leen solo al abrirlo (semanas_del_mes), por rango de fecha sobre el
+índice (company, fecha), con los totales cacheados de compras.subtotales.
+"""
+from datetime import date
+
+from django.core.cache import cache
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+from .models import Semana
+from .subtotales import totales_semanas
+from .variacion import version_compras
+
+CALENDARIO_TIMEOUT = 60 * 60
+
+MESES = (
+    "Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio",
+    "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre",
+)
+
+
+def resumen(company_id):
+    """[{año, mes, nombre, semanas, compras_count, monto_total, monto_a_pagar}] del más reciente al más viejo."""
+    clave = f"compras:calendario:{company_id}:{version_compras(company_id)}"
+    filas = cache.get(clave)
+    if filas is None:
+        filas = list(
+            Semana.objects.filter(company_id=company_id)
+            .annotate(año=ExtractYear("fecha"), mes=ExtractMonth("fecha"))
+            .order_by()
+            .values("año", "mes")
+            .annotate(
+                semanas=Count("pk", distinct=True),
+                compras_count=Count("compras"),
+                monto_total=Sum("compras__monto_total"),
+                monto_a_pagar=Sum("compras__monto_a_pagar"),
+            )
+            .order_by("-año", "-mes")
+        )
+        for fila in filas:
+            fila["nombre"] = MESES[fila["mes"] - 1]
+        cache.set(clave, filas, timeout=CALENDARIO_TIMEOUT)
+    return filas
+
+
+def rango_mes(año, mes):
+    """(primer día del mes, primer día del siguiente)."""
+    desde = date(año, mes, 1)
+    hasta = date(año + 1, 1, 1) if mes == 12 else date(año, mes + 1, 1)
+    return desde, hasta
+
+
+def con_totales(company_id, semanas):
+    """Agrega a cada semana sus totales cacheados (compras.subtotales) en .totales."""
+    semanas = list(semanas)
+    totales = totales_semanas(company_id, [s.pk for s in semanas])
+    for s in semanas:
+        s.totales = totales[s.pk]
+    return semanas
+
+
+def semanas_del_mes(company_id, año, mes, semana_iso=None):
+    """Semanas del mes (más reciente primero) con sus totales."""
+    desde, hasta = rango_mes(año, mes)
+    semanas = Semana.objects.filter(company_id=company_id, fecha__gte=desde, fecha__lt=hasta)
+    if semana_iso:
+        semanas = semanas.filter(fecha__week=semana_iso)
+    return con_totales(company_id, semanas.order_by("-fecha"))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 01:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compras', '0002_reemplazar_por_semana_compra'),
+        ('general', '0011_trabajo'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='compra',
+            index=models.Index(fields=['semana', 'obra', 'rubro', 'subrubro'], name='compras_com_semana__020d18_idx'),
+        ),
+    ]
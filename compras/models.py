@@ -141,6 +141,7 @@ class Compra(models.Model):
         verbose_name = "Compra"
         verbose_name_plural = "Compras"
         ordering = ["obra__nombre", "rubro__nombre", "subrubro__nombre"]
+        indexes = [models.Index(fields=["semana", "obra", "rubro", "subrubro"])]
 
     def __str__(self):
         return f"{self.obra.nombre} - {self.item} ({self.proveedor.nombre})"
@@ -0,0 +1,153 @@
+"""
+Plan de compras de un presupuesto.
+
+Parte de los insumos del presupuesto (presupuestos.insumos) separados por
+rubro y subrubro de la tarea, se queda con materiales y subcontratos y los
+agrupa por proveedor. Las líneas elegidas pasan a Compra de una vez: la
+selección llega en un único campo ("clave=cantidad" por línea), se valida
+contra el plan recalculado (sin un formulario por línea) y las compras se
+crean con bulk_create en una transacción.
+"""
+from decimal import Decimal
+
+from general.lectura import leer_decimal
+
+from .models import Compra
+
+BATCH_SIZE = 500
+
+TIPOS_PLAN = ("material", "subcontrato")
+
+CENTAVO = Decimal("0.01")
+
+
+def clave(insumo):
+    return f"{insumo.tipo}:{insumo.recurso_id}:{insumo.rubro_id}:{insumo.subrubro_id}"
+
+
+def leer_seleccion(texto):
+    """[(clave, cantidad como texto)] de "clave=cantidad" separados por ; o saltos de línea."""
+    seleccion = []
+    for parte in (texto or "").replace("\n", ";").split(";"):
+        parte = parte.strip()
+        if parte:
+            clave_linea, _, cantidad = parte.partition("=")
+            seleccion.append((clave_linea.strip(), cantidad.strip()))
+    return seleccion
+
+
+class LineaPlan:
+    """Insumo del plan con su clave y su importe en pesos (None si no se puede calcular)."""
+
+    __slots__ = ("insumo", "clave", "monto")
+
+    def __init__(self, insumo, monto):
+        self.insumo = insumo
+        self.clave = clave(insumo)
+        self.monto = monto
+
+
+def _cantidad_texto(cantidad):
+    texto = f"{cantidad.quantize(Decimal('0.0001')):f}"
+    return texto.rstrip("0").rstrip(".") if "." in texto else texto
+
+
+class PlanCompras:
+    """
+    Líneas de compra del presupuesto agrupadas por proveedor.
+
+    Uso:
+        plan = PlanCompras(presupuesto)
+        plan.proveedores      # [(nombre, proveedor_id, [LineaPlan])], "Sin proveedor" al final
+        compras, errores = plan.compras(leer_seleccion(texto), "transferencia")
+        plan.guardar(compras, semana)
+    """
+
+    def __init__(self, presupuesto):
+        from presupuestos.insumos import InsumosPresupuesto
+
+        self.presupuesto = presupuesto
+        insumos = InsumosPresupuesto(presupuesto, por_subrubro=True)
+        self.cotizacion = insumos.cotizacion
+        self.lineas = {}
+        por_proveedor = {}
+        for insumo in insumos.filas:
+            if insumo.tipo not in TIPOS_PLAN:
+                continue
+            linea = LineaPlan(insumo, self.monto(insumo, insumo.cantidad))
+            self.lineas[linea.clave] = linea
+            por_proveedor.setdefault((insumo.proveedor_id, insumo.proveedor), []).append(linea)
+        self.proveedores = [
+            (nombre or "Sin proveedor", proveedor_id, lineas)
+            for (proveedor_id, nombre), lineas in sorted(
+                por_proveedor.items(), key=lambda p: (p[0][0] is None, (p[0][1] or "").lower())
+            )
+        ]
+
+    def monto(self, insumo, cantidad):
+        """Importe en pesos de la cantidad (USD con la cotización del presupuesto); None si no se puede."""
+        if insumo.precio is None:
+            return Decimal("0")
+        total = cantidad * insumo.precio
+        if insumo.moneda == "USD":
+            if not self.cotizacion:
+                return None
+            total *= self.cotizacion
+        return total.quantize(CENTAVO)
+
+    def compras(self, seleccion, forma_pago):
+        """
+        Compras (sin semana ni guardar) de las líneas elegidas, y los errores.
+        Si hay algún error no se debe guardar ninguna.
+        """
+        presupuesto = self.presupuesto
+        observaciones = f"Plan de compras del presupuesto {presupuesto.instancia} ({presupuesto.fecha:%d/%m/%Y})"
+        compras, errores = [], []
+        for clave_linea, texto in seleccion:
+            linea = self.lineas.get(clave_linea)
+            if linea is None:
+                errores.append(f"{clave_linea}: la línea ya no está en el plan.")
+                continue
+            insumo = linea.insumo
+            try:
+                cantidad = leer_decimal(texto)
+            except ValueError as exc:
+                errores.append(f"{insumo.nombre}: {exc}.")
+                continue
+            if cantidad is None or cantidad <= 0:
+                errores.append(f"{insumo.nombre}: la cantidad debe ser mayor a 0.")
+                continue
+            if not insumo.proveedor_id:
+                errores.append(f"{insumo.nombre}: no tiene proveedor.")
+                continue
+            monto = self.monto(insumo, cantidad)
+            if monto is None:
+                errores.append(f"{insumo.nombre}: está en USD y el presupuesto no tiene cotización.")
+                continue
+            item = f"{insumo.nombre} · {_cantidad_texto(cantidad)} {insumo.unidad or ''}".strip()
+            compras.append(
+                Compra(
+                    obra_id=presupuesto.obra_id,
+                    rubro_id=insumo.rubro_id,
+                    subrubro_id=insumo.subrubro_id,
+                    item=item[:255],
+                    proveedor_id=insumo.proveedor_id,
+                    forma_pago=forma_pago,
+                    monto_total=monto,
+                    observaciones=observaciones,
+                    es_subcontrato=insumo.tipo == "subcontrato",
+                )
+            )
+        return compras, errores
+
+    @staticmethod
+    def guardar(compras, semana):
+        """Crea las compras en la semana (llamar dentro de una transacción)."""
+        from .variacion import invalidar_compras
+
+        for compra in compras:
+            compra.semana = semana
+        creadas = Compra.objects.bulk_create(compras, batch_size=BATCH_SIZE)
+        # bulk_create no dispara signals.
+        invalidar_compras(semana.company_id)
+        return creadas
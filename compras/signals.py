@@ -0,0 +1,27 @@
+"""
+Signals para compras app: renuevan lo cacheado por empresa (variación en
+compras.variacion, calendario en compras.calendario) cuando cambia una
+compra o una semana. Las cargas con
+bulk_create no disparan signals; PlanCompras.guardar invalida a mano.
+
+Compra no tiene receiver de borrado: así borrar una semana sigue borrando
+sus compras en una sola consulta (el "fast delete" de Django), y el signal
+de la semana ya invalida. La vista que borra una compra invalida a mano.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Compra, Semana
+from .variacion import invalidar_compras
+
+
+@receiver(post_save, sender=Compra)
+def compra_cambiada(sender, instance, **kwargs):
+    # Las vistas dejan la semana cargada en la compra: no hace falta otra consulta.
+    invalidar_compras(instance.semana.company_id)
+
+
+@receiver(post_save, sender=Semana)
+@receiver(post_delete, sender=Semana)
+def semana_cambiada(sender, instance, **kwargs):
+    invalidar_compras(instance.company_id)
@@ -0,0 +1,181 @@
+"""
+Subtotales de una semana de compras.
+
+Todos los niveles (semana, obra, obra + rubro, proveedor, forma de pago y
+estado) salen de una sola consulta: un UNION ALL de consultas agrupadas con
+las mismas columnas, donde cada parte marca su nivel y deja en NULL las
+claves que no agrupa (el equivalente de GROUPING SETS, que SQLite no tiene).
+Cada fila trae cantidad de compras, monto total, sin IVA, IVA 21 %, IVA
+10,5 %, percepción de IIBB y monto a pagar.
+
+Los subtotales y el total de cada semana quedan en el cache con la versión
+de compras de la empresa (compras.variacion). La lista de compras usa los
+totales: los que faltan salen de una consulta agrupada por semana.
+"""
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import CharField, Count, F, IntegerField, Sum, Value
+
+from .models import Compra
+from .variacion import version_compras
+
+CERO = Decimal("0")
+
+CENTAVO = Decimal("0.01")
+
+SUBTOTALES_TIMEOUT = 60 * 60
+
+# Columnas de clave de la unión: (nombre, campo de Compra, tipo).
+CLAVES = (
+    ("clave_obra", "obra_id", IntegerField),
+    ("clave_rubro", "rubro_id", IntegerField),
+    ("clave_proveedor", "proveedor_id", IntegerField),
+    ("clave_forma_pago", "forma_pago", CharField),
+    ("clave_estado", "estado", CharField),
+)
+
+NIVELES = {
+    "semana": (),
+    "obra": ("clave_obra",),
+    "obra_rubro": ("clave_obra", "clave_rubro"),
+    "proveedor": ("clave_proveedor",),
+    "forma_pago": ("clave_forma_pago",),
+    "estado": ("clave_estado",),
+}
+
+# Sumas de cada fila: (nombre en la consulta, campo de Compra).
+SUMAS = (
+    ("suma_total", "monto_total"),
+    ("suma_sin_iva", "monto_sin_iva"),
+    ("suma_iva_21", "iva_21"),
+    ("suma_iva_105", "iva_105"),
+    ("suma_iibb", "perc_iibb"),
+    ("suma_a_pagar", "monto_a_pagar"),
+)
+
+
+def _agregados():
+    return {"cantidad": Count("pk"), **{nombre: Sum(campo) for nombre, campo in SUMAS}}
+
+
+def _importes(fila):
+    """{cantidad, monto_total, monto_sin_iva, iva_21, iva_105, perc_iibb, monto_a_pagar} de una fila."""
+    importes = {"cantidad": fila["cantidad"]}
+    for nombre, campo in SUMAS:
+        # Los montos tienen 2 decimales; SQLite puede devolver la suma con ruido de float.
+        importes[campo] = (fila[nombre] or CERO).quantize(CENTAVO)
+    return importes
+
+
+def _vacio():
+    return {"cantidad": 0, **{campo: CERO for _, campo in SUMAS}}
+
+
+def _consulta(semana):
+    """UNION ALL de un agrupado por nivel sobre las compras de la semana."""
+    base = Compra.objects.filter(semana=semana).order_by()
+    partes = []
+    for nivel, agrupa in NIVELES.items():
+        columnas = {"nivel": Value(nivel, output_field=CharField())}
+        for nombre, campo, tipo in CLAVES:
+            columnas[nombre] = F(campo) if nombre in agrupa else Value(None, output_field=tipo())
+        partes.append(base.values(**columnas).annotate(**_agregados()))
+    return partes[0].union(*partes[1:], all=True)
+
+
+def _clave_subtotales(semana):
+    return f"compras:semana:{semana.pk}:subtotales:{version_compras(semana.company_id)}"
+
+
+def _clave_total(semana_id, company_id):
+    return f"compras:semana:{semana_id}:total:{version_compras(company_id)}"
+
+
+def subtotales_semana(semana):
+    """
+    {"total", "obras", "proveedores", "formas_pago", "estados"} de la semana.
+    Cada obra trae sus "rubros"; cada fila tiene "nombre" y los importes.
+    """
+    from general.models import Obra, Proveedor, Rubro
+
+    clave = _clave_subtotales(semana)
+    subtotales = cache.get(clave)
+    if subtotales is not None:
+        return subtotales
+
+    niveles = {nivel: [] for nivel in NIVELES}
+    for fila in _consulta(semana):
+        niveles[fila["nivel"]].append(fila)
+
+    def nombres(modelo, clave_fila, *listas):
+        ids = {f[clave_fila] for filas in listas for f in filas}
+        if not ids:
+            return {}
+        return dict(modelo.objects.filter(pk__in=ids).values_list("pk", "nombre"))
+
+    obras = nombres(Obra, "clave_obra", niveles["obra"])
+    rubros = nombres(Rubro, "clave_rubro", niveles["obra_rubro"])
+    proveedores = nombres(Proveedor, "clave_proveedor", niveles["proveedor"])
+    formas_pago = dict(Compra.FORMA_PAGO_CHOICES)
+    estados = dict(Compra.ESTADO_CHOICES)
+
+    def ordenadas(filas):
+        return sorted(filas, key=lambda f: (f["nombre"] or "").lower())
+
+    por_obra = {}
+    for fila in niveles["obra"]:
+        por_obra[fila["clave_obra"]] = {
+            "nombre": obras.get(fila["clave_obra"]), "rubros": [], **_importes(fila)
+        }
+    for fila in niveles["obra_rubro"]:
+        por_obra[fila["clave_obra"]]["rubros"].append(
+            {"nombre": rubros.get(fila["clave_rubro"]), **_importes(fila)}
+        )
+    for obra in por_obra.values():
+        obra["rubros"] = ordenadas(obra["rubros"])
+
+    total = _importes(niveles["semana"][0]) if niveles["semana"] else _vacio()
+    subtotales = {
+        "total": total,
+        "obras": ordenadas(por_obra.values()),
+        "proveedores": ordenadas(
+            {"nombre": proveedores.get(f["clave_proveedor"]), **_importes(f)} for f in niveles["proveedor"]
+        ),
+        "formas_pago": ordenadas(
+            {"nombre": formas_pago.get(f["clave_forma_pago"], f["clave_forma_pago"]), **_importes(f)}
+            for f in niveles["forma_pago"]
+        ),
+        "estados": ordenadas(
+            {"nombre": estados.get(f["clave_estado"], f["clave_estado"]), **_importes(f)}
+            for f in niveles["estado"]
+        ),
+    }
+    cache.set_many(
+        {clave: subtotales, _clave_total(semana.pk, semana.company_id): total},
+        timeout=SUBTOTALES_TIMEOUT,
+    )
+    return subtotales
+
+
+def totales_semanas(company_id, semana_ids):
+    """{semana_id: importes} de las semanas, del cache o de una consulta agrupada por semana."""
+    claves = {_clave_total(pk, company_id): pk for pk in semana_ids}
+    totales = {claves[clave]: total for clave, total in cache.get_many(list(claves)).items()}
+    faltan = [pk for pk in semana_ids if pk not in totales]
+    if faltan:
+        calculados = {pk: _vacio() for pk in faltan}
+        filas = (
+            Compra.objects.filter(semana_id__in=faltan)
+            .order_by()
+            .values("semana_id")
+            .annotate(**_agregados())
+        )
+        for fila in filas:
+            calculados[fila["semana_id"]] = _importes(fila)
+        cache.set_many(
+            {_clave_total(pk, company_id): total for pk, total in calculados.items()},
+            timeout=SUBTOTALES_TIMEOUT,
+        )
+        totales.update(calculados)
+    return totales
@@ -1,3 +1,344 @@
+from datetime import date
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from django.db import connection
+from django.db.models.deletion import Collector
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from general.models import CotizacionDolar, Obra, Proveedor, Rubro, Subrubro
+from general.testing import EmpresaDePruebaMixin, PlanesDeConsultaMixin
+from presupuestos.models import PresupuestoTotal
+from recursos.models import HojaPrecioMaterial, Material, TareaRecurso
+
+from .calendario import resumen
+from .models import Compra, Semana
+from .plan import PlanCompras
+from .subtotales import SUMAS, subtotales_semana, totales_semanas
+from .variacion import variacion_obra, version_compras
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN de SQLite")
+class PlanesComprasTests(PlanesDeConsultaMixin, TestCase):
+    """Las vistas de compras no deben recorrer tablas enteras."""
+
+    def test_lista_y_semana(self):
+        self.assertSinEscaneoCompleto(reverse("compras:compras_list"))
+        self.assertSinEscaneoCompleto(f"{reverse('compras:compras_list')}?año=2026&mes=1")
+        self.assertSinEscaneoCompleto(f"{reverse('compras:compras_list')}?año=2026&mes=1&formato=json")
+        self.assertSinEscaneoCompleto(reverse("compras:semana_detalle", args=[self.datos.semana.pk]))
+        self.assertSinEscaneoCompleto(reverse("compras:plan_compras", args=[self.datos.presupuesto.pk]))
+        self.assertSinEscaneoCompleto(f"{reverse('compras:variacion')}?obra={self.datos.obra.pk}")
+
+    def test_compras_por_semana_obra_rubro_y_subrubro(self):
+        d = self.datos
+        self.assertUsaIndice(
+            Compra.objects.filter(semana=d.semana, obra=d.obra, rubro=d.rubro, subrubro=d.subrubro),
+            "semana_id", "obra_id", "rubro_id", "subrubro_id",
+        )
+
+
+class PlanComprasTests(EmpresaDePruebaMixin, TestCase):
+    """Compras creadas desde el plan de compras del presupuesto: todas o ninguna."""
+
+    def setUp(self):
+        super().setUp()
+        d = self.datos
+        self.url = reverse("compras:plan_compras", args=[d.presupuesto.pk])
+        self.material = f"material:{d.material.pk}:{d.rubro.pk}:{d.subrubro.pk}"
+        self.subcontrato = f"subcontrato:{d.subcontrato.pk}:{d.rubro.pk}:{d.subrubro.pk}"
+
+    def crear(self, *lineas, **datos):
+        datos.setdefault("fecha_semana", "2026-02-04")
+        return self.client.post(self.url, {"lineas": "\n".join(lineas), "forma_pago": "efectivo", **datos})
+
+    def test_plan_agrupa_materiales_y_subcontratos(self):
+        plan = PlanCompras(self.datos.presupuesto)
+        self.assertEqual(set(plan.lineas), {self.material, self.subcontrato})
+        self.assertEqual([nombre for nombre, _, _ in plan.proveedores], ["Corralón"])
+        # Arena: 50 × 100; Revoque: 10 × 800 USD × 1000.
+        self.assertEqual(plan.lineas[self.material].monto, Decimal("5000.00"))
+        self.assertEqual(plan.lineas[self.subcontrato].monto, Decimal("8000000.00"))
+
+    def test_crea_las_compras_en_una_semana_nueva(self):
+        d = self.datos
+        version = version_compras(d.company.pk)
+        respuesta = self.crear(f"{self.material}=12,5", f"{self.subcontrato}=2")
+        semana = Semana.objects.get(company=d.company, fecha=date(2026, 2, 2))
+        self.assertRedirects(respuesta, reverse("compras:semana_detalle", args=[semana.pk]))
+        compras = {c.es_subcontrato: c for c in Compra.objects.filter(semana=semana)}
+        self.assertEqual(len(compras), 2)
+        for compra in compras.values():
+            self.assertEqual(
+                (compra.obra_id, compra.rubro_id, compra.subrubro_id, compra.proveedor_id, compra.forma_pago),
+                (d.obra.pk, d.rubro.pk, d.subrubro.pk, d.proveedor.pk, "efectivo"),
+            )
+        self.assertEqual(compras[False].monto_total, Decimal("1250.00"))
+        self.assertEqual(compras[False].item, "Arena · 12.5 m2")
+        self.assertEqual(compras[True].monto_total, Decimal("1600000.00"))
+        self.assertNotEqual(version_compras(d.company.pk), version)
+
+    def test_semana_existente(self):
+        respuesta = self.crear(f"{self.material}=1", semana=str(self.datos.semana.pk))
+        self.assertRedirects(respuesta, reverse("compras:semana_detalle", args=[self.datos.semana.pk]))
+        self.assertEqual(Compra.objects.filter(semana=self.datos.semana).count(), 2)
+
+    def assertNoCrea(self, *lineas, error):
+        compras = Compra.objects.count()
+        respuesta = self.crear(f"{self.material}=1", *lineas)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertContains(respuesta, error)
+        self.assertEqual(Compra.objects.count(), compras)
+        self.assertFalse(Semana.objects.filter(fecha=date(2026, 2, 2)).exists())
+
+    def test_clave_desconocida(self):
+        self.assertNoCrea("material:0:0:0=1", error="la línea ya no está en el plan")
+
+    def test_cantidad_no_positiva(self):
+        self.assertNoCrea(f"{self.subcontrato}=0", error="la cantidad debe ser mayor a 0")
+        self.assertNoCrea(f"{self.subcontrato}=-2", error="la cantidad debe ser mayor a 0")
+
+    def test_sin_proveedor(self):
+        d = self.datos
+        cal = Material.objects.create(
+            nombre="Cal", company=d.company, tipo=d.tipo, categoria=d.categoria,
+            unidad_de_venta=d.unidad, precio_unidad_venta=Decimal("50"),
+        )
+        HojaPrecioMaterial.objects.create(
+            hoja=d.hoja_materiales, material=cal, cantidad_por_unidad_venta=1, precio_unidad_venta=Decimal("50")
+        )
+        TareaRecurso.objects.create(tarea=d.tarea, material=cal, cantidad=Decimal("1"))
+        self.assertNoCrea(f"material:{cal.pk}:{d.rubro.pk}:{d.subrubro.pk}=1", error="Cal: no tiene proveedor")
+
+    def test_usd_sin_cotizacion(self):
+        CotizacionDolar.objects.filter(tipo=self.datos.tipo_dolar).delete()
+        self.assertNoCrea(f"{self.subcontrato}=1", error="está en USD y el presupuesto no tiene cotización")
+
+
+class InvalidacionComprasTests(EmpresaDePruebaMixin, TestCase):
+    """Los signals de compras suben la versión sin consultas de más."""
+
+    def test_guardar_una_compra(self):
+        d = self.datos
+        compra = Compra.objects.select_related("semana").get(semana=d.semana)
+        version = version_compras(d.company.pk)
+        with CaptureQueriesContext(connection) as consultas:
+            compra.save(update_fields=["monto_total"])
+        self.assertFalse([q["sql"] for q in consultas if "compras_semana" in q["sql"]])
+        self.assertNotEqual(version_compras(d.company.pk), version)
+
+    def test_borrar_una_semana_borra_las_compras_de_una_vez(self):
+        self.assertTrue(Collector(using="default").can_fast_delete(Compra.objects.all()))
+        version = version_compras(self.datos.company.pk)
+        self.datos.semana.delete()
+        self.assertFalse(Compra.objects.exists())
+        self.assertNotEqual(version_compras(self.datos.company.pk), version)
+
+    def test_vista_de_borrado(self):
+        d = self.datos
+        compra = Compra.objects.get(semana=d.semana)
+        version = version_compras(d.company.pk)
+        respuesta = self.client.post(reverse("compras:compra_delete", args=[d.semana.pk, compra.pk]))
+        self.assertRedirects(respuesta, reverse("compras:semana_detalle", args=[d.semana.pk]))
+        self.assertNotEqual(version_compras(d.company.pk), version)
+
+
+class VariacionTests(EmpresaDePruebaMixin, TestCase):
+    """Presupuestado contra gastado de la obra de prueba."""
+
+    def setUp(self):
+        super().setUp()
+        d = self.datos
+        # Semana del 05/01 (datos de prueba): 1000 ARS a 1000 → 1 USD.
+        CotizacionDolar.objects.create(
+            fecha=date(2026, 1, 12), tipo=d.tipo_dolar, valor=Decimal("2000"), company=d.company
+        )
+        self.compra(date(2026, 1, 12), "4000")  # 2 USD
+        self.compra(date(2026, 1, 14), "9999", estado="cancelado")
+        self.compra(date(2025, 12, 29), "500")  # antes de la primera cotización
+
+    def compra(self, fecha, monto, **campos):
+        d = self.datos
+        semana, _ = Semana.objects.get_or_create(company=d.company, fecha=fecha)
+        return Compra.objects.create(
+            semana=semana, obra=d.obra, rubro=d.rubro, subrubro=d.subrubro, item="Cemento",
+            proveedor=d.proveedor, monto_total=Decimal(monto), **campos
+        )
+
+    def test_gastado_por_semana(self):
+        d = self.datos
+        reporte = variacion_obra(d.obra)
+        self.assertEqual(reporte["presupuesto_id"], d.presupuesto.pk)
+        (rubro,) = reporte["rubros"]
+        (subrubro,) = rubro["subrubros"]
+        self.assertEqual((rubro["nombre"], subrubro["nombre"]), ("Albañilería", "Muros"))
+        for nodo in (reporte["total"], rubro, subrubro):
+            # La cancelada no cuenta; cada semana con la cotización vigente a su fecha.
+            self.assertEqual(nodo["compras"], 3)
+            self.assertEqual(nodo["gastado_ars"], Decimal("5500"))
+            self.assertEqual(nodo["gastado_usd"], Decimal("3"))
+            self.assertEqual(nodo["sin_cotizacion_ars"], Decimal("500"))
+        total = PresupuestoTotal.objects.get(presupuesto=d.presupuesto, rubro=None, subrubro=None)
+        self.assertEqual(reporte["total"]["presupuestado_usd"], total.total_usd)
+        self.assertEqual(reporte["total"]["diferencia_usd"], total.total_usd - 3)
+
+    def test_se_renueva_con_cada_cambio(self):
+        d = self.datos
+        self.assertEqual(variacion_obra(d.obra)["total"]["gastado_ars"], Decimal("5500"))
+        with mock.patch("compras.variacion._calcular") as calcular:
+            variacion_obra(d.obra)
+        calcular.assert_not_called()
+
+        compra = Compra.objects.select_related("semana").get(semana=d.semana)
+        compra.monto_total = Decimal("3000")
+        compra.save()
+        self.assertEqual(variacion_obra(d.obra)["total"]["gastado_ars"], Decimal("7500"))
+
+        presupuestado = variacion_obra(d.obra)["total"]["presupuestado_ars"]
+        TareaRecurso.objects.filter(tarea=d.tarea, mano_de_obra=d.mano_de_obra).update(cantidad=Decimal("2"))
+        TareaRecurso.objects.get(tarea=d.tarea, mano_de_obra=d.mano_de_obra).save()
+        # Recalcula los totales: 10 × 500 más de mano de obra.
+        self.assertEqual(variacion_obra(d.obra)["total"]["presupuestado_ars"], presupuestado + 5000)
+
+        CotizacionDolar.objects.create(
+            fecha=date(2025, 12, 1), tipo=d.tipo_dolar, valor=Decimal("500"), company=d.company
+        )
+        total = variacion_obra(d.obra)["total"]
+        self.assertEqual(total["sin_cotizacion_ars"], Decimal("0"))
+        self.assertEqual(total["gastado_usd"], Decimal("6"))
+
+
+class SubtotalesTests(EmpresaDePruebaMixin, TestCase):
+    """Cada nivel de subtotales_semana contra las sumas hechas en Python."""
+
+    def setUp(self):
+        super().setUp()
+        d = self.datos
+        self.semana = Semana.objects.create(company=d.company, fecha=date(2026, 3, 2))
+        obra = Obra.objects.create(nombre="Casa", company=d.company)
+        rubro = Rubro.objects.create(nombre="Pintura", company=d.company)
+        subrubro = Subrubro.objects.create(nombre="Látex", rubro=rubro, company=d.company)
+        proveedor = Proveedor.objects.create(nombre="Pinturería", company=d.company)
+        combinaciones = [
+            (d.obra, d.rubro, d.subrubro, d.proveedor, "transferencia", "pendiente"),
+            (d.obra, rubro, subrubro, proveedor, "efectivo", "pagado"),
+            (obra, rubro, subrubro, proveedor, "transferencia", "cancelado"),
+            (obra, d.rubro, d.subrubro, d.proveedor, "cheque", "pendiente"),
+        ]
+        for i in range(12):
+            obra_i, rubro_i, subrubro_i, proveedor_i, forma_pago, estado = combinaciones[i % 4]
+            monto = Decimal(1000 + 37 * i) + Decimal("0.15")
+            Compra.objects.create(
+                semana=self.semana, obra=obra_i, rubro=rubro_i, subrubro=subrubro_i, item=f"Ítem {i}",
+                proveedor=proveedor_i, forma_pago=forma_pago, estado=estado, monto_total=monto,
+                monto_sin_iva=(monto / Decimal("1.21")).quantize(Decimal("0.01")) if i % 3 else None,
+                iva_21=Decimal("21.10") * i, iva_105=Decimal("10.55") * (i % 2),
+                perc_iibb=Decimal("3.33"), monto_a_pagar=monto if i % 2 else None,
+            )
+        self.compras = list(Compra.objects.filter(semana=self.semana).select_related("obra", "rubro", "proveedor"))
+
+    def esperado(self, compras):
+        importes = {"cantidad": len(compras)}
+        for _, campo in SUMAS:
+            importes[campo] = sum((getattr(c, campo) or Decimal("0") for c in compras), Decimal("0"))
+        return importes
+
+    def agrupado(self, clave):
+        grupos = {}
+        for compra in self.compras:
+            grupos.setdefault(clave(compra), []).append(compra)
+        return {nombre: self.esperado(compras) for nombre, compras in grupos.items()}
+
+    def importes(self, fila):
+        return {k: v for k, v in fila.items() if k not in ("nombre", "rubros")}
+
+    def por_nombre(self, filas):
+        return {f["nombre"]: self.importes(f) for f in filas}
+
+    def test_todos_los_niveles(self):
+        subtotales = subtotales_semana(self.semana)
+        self.assertEqual(subtotales["total"], self.esperado(self.compras))
+        self.assertEqual(self.por_nombre(subtotales["obras"]), self.agrupado(lambda c: c.obra.nombre))
+        for obra in subtotales["obras"]:
+            with self.subTest(obra=obra["nombre"]):
+                del_rubro = self.agrupado(lambda c: (c.obra.nombre, c.rubro.nombre))
+                self.assertEqual(
+                    self.por_nombre(obra["rubros"]),
+                    {rubro: importes for (o, rubro), importes in del_rubro.items() if o == obra["nombre"]},
+                )
+        self.assertEqual(self.por_nombre(subtotales["proveedores"]), self.agrupado(lambda c: c.proveedor.nombre))
+        self.assertEqual(
+            self.por_nombre(subtotales["formas_pago"]), self.agrupado(lambda c: c.get_forma_pago_display())
+        )
+        self.assertEqual(self.por_nombre(subtotales["estados"]), self.agrupado(lambda c: c.get_estado_display()))
+        self.assertEqual([o["nombre"] for o in subtotales["obras"]], ["Casa", "Edificio"])
+
+    def test_total_de_la_semana_igual_a_los_subtotales(self):
+        semanas = [self.semana.pk, self.datos.semana.pk]
+        # Sin nada en el cache: consulta agrupada por semana.
+        totales = totales_semanas(self.datos.company.pk, semanas)
+        self.assertEqual(totales[self.semana.pk], subtotales_semana(self.semana)["total"])
+        self.assertEqual(totales[self.datos.semana.pk], subtotales_semana(self.datos.semana)["total"])
+        # Ahora desde el cache.
+        self.assertEqual(totales_semanas(self.datos.company.pk, semanas), totales)
+
+    def test_semana_vacia(self):
+        vacia = Semana.objects.create(company=self.datos.company, fecha=date(2026, 3, 9))
+        subtotales = subtotales_semana(vacia)
+        self.assertEqual(subtotales["total"], self.esperado([]))
+        self.assertEqual(subtotales["obras"], [])
+        self.assertEqual(totales_semanas(self.datos.company.pk, [vacia.pk])[vacia.pk], self.esperado([]))
+
+
+class CalendarioTests(EmpresaDePruebaMixin, TestCase):
+    """Resumen por mes de compras_list y las semanas de un mes en JSON."""
+
+    def setUp(self):
+        super().setUp()
+        d = self.datos
+        self.semana = Semana.objects.create(company=d.company, fecha=date(2026, 1, 12))
+        for monto, a_pagar in (("250.50", "200"), ("100", None)):
+            Compra.objects.create(
+                semana=self.semana, obra=d.obra, rubro=d.rubro, subrubro=d.subrubro, item="Cemento",
+                proveedor=d.proveedor, monto_total=Decimal(monto),
+                monto_a_pagar=Decimal(a_pagar) if a_pagar else None,
+            )
+        Semana.objects.create(company=d.company, fecha=date(2026, 2, 2))
+        Semana.objects.create(company=d.company, fecha=date(2025, 12, 29))
+
+    def meses(self):
+        return {(m["año"], m["mes"]): m for m in resumen(self.datos.company.pk)}
+
+    def test_resumen_por_mes(self):
+        filas = resumen(self.datos.company.pk)
+        self.assertEqual([(m["año"], m["mes"]) for m in filas], [(2026, 2), (2026, 1), (2025, 12)])
+        enero = filas[1]
+        self.assertEqual(enero["nombre"], "Enero")
+        self.assertEqual((enero["semanas"], enero["compras_count"]), (2, 3))
+        self.assertEqual(enero["monto_total"], Decimal("1350.50"))
+        self.assertEqual(enero["monto_a_pagar"], Decimal("200"))
+        for vacio in (filas[0], filas[2]):
+            self.assertEqual((vacio["semanas"], vacio["compras_count"]), (1, 0))
+            self.assertIsNone(vacio["monto_total"])
+
+    def test_semanas_del_mes_en_json(self):
+        url = reverse("compras:compras_list")
+        datos = self.client.get(url, {"año": 2026, "mes": 1, "formato": "json"}).json()
+        self.assertEqual(
+            [(s["id"], s["fecha"], s["compras"]) for s in datos["semanas"]],
+            [(self.semana.pk, "12/01/2026", 2), (self.datos.semana.pk, "05/01/2026", 1)],
+        )
+        self.assertEqual(Decimal(datos["semanas"][0]["monto_total"]), Decimal("350.50"))
+        self.assertEqual(Decimal(datos["semanas"][0]["monto_a_pagar"]), Decimal("200"))
+        self.assertEqual(self.client.get(url, {"formato": "json"}).json(), {"semanas": []})
 
-# Create your tests here.
+    def test_se_renueva_al_guardar_una_compra(self):
+        self.assertEqual(self.meses()[(2026, 1)]["monto_total"], Decimal("1350.50"))
+        compra = Compra.objects.select_related("semana").get(semana=self.datos.semana)
+        compra.monto_total = Decimal("2000")
+        compra.save()
+        self.assertEqual(self.meses()[(2026, 1)]["monto_total"], Decimal("2350.50"))
+        Semana.objects.get(pk=self.semana.pk).delete()
+        self.assertEqual(self.meses()[(2026, 1)]["compras_count"], 1)
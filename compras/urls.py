@@ -7,6 +7,8 @@ app_name = "compras"
 urlpatterns = [
     path("", views.compras_list, name="compras_list"),
     path("semana/nueva/", views.semana_create, name="semana_create"),
+    path("plan/<int:presupuesto_pk>/", views.plan_compras, name="plan_compras"),
+    path("variacion/", views.variacion, name="variacion"),
     path("semana/<int:pk>/", views.semana_detalle, name="semana_detalle"),
     path("semana/<int:pk>/editar/", views.semana_edit, name="semana_edit"),
     path("<int:semana_pk>/compra/agregar/", views.compra_add, name="compra_add"),
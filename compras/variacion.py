@@ -0,0 +1,196 @@
+"""
+Presupuestado contra gastado por obra → rubro → subrubro.
+
+Presupuestado: los PresupuestoTotal guardados del presupuesto activo más
+reciente de la obra (o del elegido); si no están vigentes se recalculan antes.
+Gastado: monto_total de las compras de la obra (salvo las canceladas),
+sumado en SQL por rubro, subrubro y semana. Cada suma semanal se pasa a USD
+con la cotización del tipo de dólar del presupuesto en la fecha de la semana
+(o la anterior más cercana), desde la tabla memoizada de general.cotizaciones.
+
+El reporte queda en el cache por obra. La clave lleva la versión de compras
+de la empresa (la suben los signals de Compra y Semana y las cargas
+masivas), el presupuesto con la fecha de sus totales y la versión de la tabla
+de cotizaciones: cualquier cambio usa una clave nueva sin borrar nada a mano.
+La versión de compras se lee del cache compartido una vez por request
+(general.memo), como las de recursos.indice_precios.
+"""
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Count, Max, Sum
+
+from general import memo
+from general.cotizaciones import convertir_a_usd, cotizacion, tabla
+
+from .models import Compra
+
+CERO = Decimal("0")
+
+VARIACION_TIMEOUT = 60 * 60
+
+
+def _clave_version(company_id):
+    return f"compras:version:{company_id}"
+
+
+def version_compras(company_id):
+    return memo.version(_clave_version(company_id))
+
+
+def invalidar_compras(company_id):
+    """Renueva los reportes de la empresa (ahora y al confirmar la transacción)."""
+    if not company_id:
+        return
+    memo.invalidar_version(_clave_version(company_id))
+
+
+def presupuesto_activo(obra):
+    """Presupuesto activo más reciente de la obra, o None."""
+    from presupuestos.models import Presupuesto
+
+    return (
+        Presupuesto.objects.filter(obra=obra, activo=True)
+        .select_related("lote", "tipo_dolar")
+        .order_by("-fecha", "-creado_en")
+        .first()
+    )
+
+
+def _nodo(nombre, rubro_id=None, subrubro_id=None):
+    return {
+        "nombre": nombre,
+        "rubro_id": rubro_id,
+        "subrubro_id": subrubro_id,
+        "presupuestado_ars": CERO,
+        "presupuestado_usd": None,
+        "gastado_ars": CERO,
+        "gastado_usd": CERO,
+        # ARS de compras sin cotización para su semana (no entran en gastado_usd).
+        "sin_cotizacion_ars": CERO,
+        "compras": 0,
+    }
+
+
+def _calcular(obra, presupuesto):
+    """{(rubro_id, subrubro_id): nodo}; (rubro_id, None) es el rubro y (None, None) la obra."""
+    from presupuestos.models import PresupuestoTotal
+
+    nodos = {}
+
+    def nodo(rubro_id, subrubro_id):
+        clave = (rubro_id, subrubro_id)
+        if clave not in nodos:
+            nodos[clave] = _nodo(None, rubro_id, subrubro_id)
+        return nodos[clave]
+
+    nodo(None, None)
+    if presupuesto is not None:
+        presupuestados = PresupuestoTotal.objects.filter(presupuesto=presupuesto).values_list(
+            "rubro_id", "subrubro_id", "total_ars", "total_usd"
+        )
+        for rubro_id, subrubro_id, total_ars, total_usd in presupuestados:
+            n = nodo(rubro_id, subrubro_id)
+            n["presupuestado_ars"] = total_ars
+            n["presupuestado_usd"] = total_usd
+
+    tipo_dolar_id = presupuesto.tipo_dolar_id if presupuesto else None
+    gastos = (
+        Compra.objects.filter(obra=obra)
+        .exclude(estado="cancelado")
+        .order_by()
+        .values_list("rubro_id", "subrubro_id", "semana__fecha")
+        .annotate(total=Sum("monto_total"), compras=Count("pk"))
+    )
+    for rubro_id, subrubro_id, fecha, total, compras in gastos:
+        valor = cotizacion(obra.company_id, tipo_dolar_id, fecha, anterior=True)
+        usd = convertir_a_usd(total, "ARS", valor)
+        for n in (nodo(rubro_id, subrubro_id), nodo(rubro_id, None), nodo(None, None)):
+            n["gastado_ars"] += total
+            n["compras"] += compras
+            if usd is None:
+                n["sin_cotizacion_ars"] += total
+            else:
+                n["gastado_usd"] += usd
+    return nodos
+
+
+def _arbol(nodos):
+    """[rubro con "subrubros": [...]] ordenado por nombre, y el total de la obra."""
+    from general.models import Rubro, Subrubro
+
+    rubros = dict(
+        Rubro.objects.filter(pk__in={r for r, _ in nodos if r}).values_list("pk", "nombre")
+    )
+    subrubros = dict(
+        Subrubro.objects.filter(pk__in={s for _, s in nodos if s}).values_list("pk", "nombre")
+    )
+    arbol = {}
+    for (rubro_id, subrubro_id), n in nodos.items():
+        if rubro_id is None:
+            continue
+        rubro = arbol.setdefault(rubro_id, {"subrubros": []})
+        if subrubro_id is None:
+            n["nombre"] = rubros.get(rubro_id)
+            rubro.update(n)
+        else:
+            n["nombre"] = subrubros.get(subrubro_id)
+            rubro["subrubros"].append(n)
+    for rubro_id, rubro in arbol.items():
+        rubro.setdefault("nombre", rubros.get(rubro_id))
+        rubro["subrubros"].sort(key=lambda n: (n["nombre"] or "").lower())
+    total = nodos[(None, None)]
+    total["nombre"] = "Total obra"
+    return sorted(arbol.values(), key=lambda n: (n["nombre"] or "").lower()), total
+
+
+def _completar(n):
+    """Diferencia (presupuestado − gastado) y porcentaje gastado, en USD."""
+    presupuestado = n.get("presupuestado_usd")
+    gastado = n.get("gastado_usd", CERO)
+    n["diferencia_usd"] = presupuestado - gastado if presupuestado is not None else None
+    n["porcentaje"] = gastado / presupuestado * 100 if presupuestado else None
+    return n
+
+
+def variacion_obra(obra, presupuesto=None):
+    """
+    {"presupuesto_id", "rubros", "total"} de la obra contra el presupuesto (por
+    defecto el activo más reciente). Cada rubro trae sus "subrubros". Cacheado.
+    """
+    from presupuestos.models import Presupuesto, PresupuestoTotal
+    from presupuestos.totales import actualizar_totales
+
+    if presupuesto is None:
+        presupuesto = presupuesto_activo(obra)
+    totales_en = None
+    if presupuesto is not None:
+        actualizar_totales(Presupuesto.objects.filter(pk=presupuesto.pk))
+        totales_en = PresupuestoTotal.objects.filter(presupuesto=presupuesto).aggregate(
+            en=Max("actualizado_en")
+        )["en"]
+    clave = ":".join(
+        str(parte)
+        for parte in (
+            "compras:variacion",
+            obra.pk,
+            version_compras(obra.company_id),
+            presupuesto.pk if presupuesto else "-",
+            totales_en.timestamp() if totales_en else "-",
+            tabla(obra.company_id).version,
+        )
+    )
+    reporte = cache.get(clave)
+    if reporte is None:
+        rubros, total = _arbol(_calcular(obra, presupuesto))
+        for rubro in rubros:
+            _completar(rubro)
+            for subrubro in rubro["subrubros"]:
+                _completar(subrubro)
+        reporte = {
+            "presupuesto_id": presupuesto.pk if presupuesto else None,
+            "rubros": rubros,
+            "total": _completar(total),
+        }
+        cache.set(clave, reporte, timeout=VARIACION_TIMEOUT)
+    return reporte
@@ -2,12 +2,16 @@ from datetime import date
 from collections import defaultdict
 
 from django.contrib.auth.decorators import login_required
-from django.db.models import Count
+from django.db import transaction
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 
+from .calendario import con_totales, resumen, semanas_del_mes
 from .forms import CompraForm, SemanaForm
 from .models import Compra, Semana
+from .plan import PlanCompras, leer_seleccion
+from .subtotales import subtotales_semana
 
 
 def _get_week_start(d):
@@ -17,68 +21,82 @@ def _get_week_start(d):
 
 @login_required
 def compras_list(request):
+    """
+    Calendario de semanas: meses del resumen cacheado (compras.calendario); las
+    semanas de cada mes se cargan al abrirlo (?año=&mes=&formato=json).
+    """
     company = request.company
     if not company:
         return redirect("usuarios:company_select")
 
-    # Filtros
-    año = request.GET.get("año")
-    mes = request.GET.get("mes")
-    semana_filtro = request.GET.get("semana")
-
-    semanas_qs = Semana.objects.filter(company=company).annotate(
-        compras_count=Count("compras")
-    ).order_by("-fecha")
-
-    if año:
-        try:
-            año = int(año)
-            semanas_qs = semanas_qs.filter(fecha__year=año)
-        except ValueError:
-            año = None
-    if mes:
+    def entero(nombre, maximo):
         try:
-            mes = int(mes)
-            semanas_qs = semanas_qs.filter(fecha__month=mes)
+            valor = int(request.GET.get(nombre, ""))
         except ValueError:
-            mes = None
-    if semana_filtro:
-        try:
-            semana_filtro = int(semana_filtro)
-            semanas_qs = semanas_qs.filter(fecha__isoweek=semana_filtro)
-        except (ValueError, TypeError):
-            semana_filtro = None
-
-    semanas = list(semanas_qs[:200])
-    años = sorted(
-        set(s.fecha.year for s in Semana.objects.filter(company=company)),
-        reverse=True,
-    ) or [date.today().year]
-    meses = list(range(1, 13))
-
-    # Agrupar por año → mes → semanas
-    tree = defaultdict(lambda: defaultdict(list))
-    for s in semanas:
-        tree[s.fecha.year][s.fecha.month].append(s)
-
-    # Ordenar: año descendente, mes descendente, semanas descendente
-    tree = {
-        y: dict(
-            (m, sorted(weeks, key=lambda x: x.fecha, reverse=True))
-            for m, weeks in sorted(meses_dict.items(), reverse=True)
+            return None
+        return valor if 1 <= valor <= maximo else None
+
+    año = entero("año", 9999)
+    mes = entero("mes", 12)
+    semana_filtro = entero("semana", 53)
+
+    if request.GET.get("formato") == "json":
+        if not (año and mes):
+            return JsonResponse({"semanas": []})
+        semanas = semanas_del_mes(company.pk, año, mes, semana_filtro)
+        return JsonResponse(
+            {
+                "semanas": [
+                    {
+                        "id": s.pk,
+                        "fecha": s.fecha.strftime("%d/%m/%Y"),
+                        "compras": s.totales["cantidad"],
+                        "monto_total": str(s.totales["monto_total"]),
+                        "monto_a_pagar": str(s.totales["monto_a_pagar"]),
+                        "url": reverse("compras:semana_detalle", args=[s.pk]),
+                    }
+                    for s in semanas
+                ]
+            }
         )
-        for y, meses_dict in sorted(tree.items(), reverse=True)
-    }
+
+    meses_resumen = resumen(company.pk)
+    años = sorted({m["año"] for m in meses_resumen}, reverse=True) or [date.today().year]
+    visibles = [
+        dict(m, semanas_list=None)
+        for m in meses_resumen
+        if (not año or m["año"] == año) and (not mes or m["mes"] == mes)
+    ]
+    if semana_filtro:
+        # Filtro por semana ISO: pocas semanas (una por año), se muestran abiertas.
+        por_mes = defaultdict(list)
+        semanas_qs = Semana.objects.filter(company=company, fecha__week=semana_filtro)
+        if año:
+            semanas_qs = semanas_qs.filter(fecha__year=año)
+        for s in con_totales(company.pk, semanas_qs.order_by("-fecha")):
+            por_mes[(s.fecha.year, s.fecha.month)].append(s)
+        visibles = [m for m in visibles if (m["año"], m["mes"]) in por_mes]
+        for m in visibles:
+            m["semanas_list"] = por_mes[(m["año"], m["mes"])]
+    elif visibles:
+        # El mes más reciente (o el filtrado) ya viene abierto.
+        m = visibles[0]
+        m["semanas_list"] = semanas_del_mes(company.pk, m["año"], m["mes"])
+
+    # Agrupar por año → meses (ya vienen del más reciente al más viejo)
+    tree = {}
+    for m in visibles:
+        tree.setdefault(m["año"], []).append(m)
 
     return render(
         request,
         "compras/compras_list.html",
         {
-            "tree": dict(tree),
+            "tree": tree,
             "años": años,
-            "meses": meses,
+            "meses": list(range(1, 13)),
             "año_filtro": año,
-            "mes_filtro": int(mes) if mes else None,
+            "mes_filtro": mes,
             "semana_filtro": semana_filtro,
         },
     )
@@ -118,10 +136,20 @@ def semana_detalle(request, pk):
     compras = semana.compras.select_related(
         "obra", "rubro", "subrubro", "proveedor"
     ).order_by("obra__nombre", "rubro__nombre", "subrubro__nombre")
+    subtotales = subtotales_semana(semana)
     return render(
         request,
         "compras/semana_detalle.html",
-        {"semana": semana, "compras": compras},
+        {
+            "semana": semana,
+            "compras": compras,
+            "subtotales": subtotales,
+            "subtotales_secciones": [
+                ("Por proveedor", subtotales["proveedores"]),
+                ("Por forma de pago", subtotales["formas_pago"]),
+                ("Por estado", subtotales["estados"]),
+            ],
+        },
     )
 
 
@@ -165,7 +193,7 @@ def compra_edit(request, semana_pk, compra_pk):
     if not company:
         return redirect("usuarios:company_select")
     semana = get_object_or_404(Semana, pk=semana_pk, company=company)
-    compra = get_object_or_404(Compra, pk=compra_pk, semana=semana)
+    compra = get_object_or_404(Compra.objects.select_related("semana"), pk=compra_pk, semana=semana)
     if request.method == "POST":
         form = CompraForm(request.POST, instance=compra, request=request)
         if form.is_valid():
@@ -186,12 +214,121 @@ def compra_delete(request, semana_pk, compra_pk):
     if not company:
         return redirect("usuarios:company_select")
     semana = get_object_or_404(Semana, pk=semana_pk, company=company)
-    compra = get_object_or_404(Compra, pk=compra_pk, semana=semana)
+    compra = get_object_or_404(Compra.objects.select_related("semana"), pk=compra_pk, semana=semana)
     if request.method == "POST":
+        from .variacion import invalidar_compras
+
         compra.delete()
+        # Compra no tiene signal de borrado (ver compras.signals).
+        invalidar_compras(company.pk)
         return redirect("compras:semana_detalle", pk=semana_pk)
     return render(
         request,
         "compras/compra_confirm_delete.html",
         {"semana": semana, "compra": compra},
     )
+
+
+@login_required
+def plan_compras(request, presupuesto_pk):
+    """
+    Plan de compras del presupuesto: materiales y subcontratos por proveedor.
+    POST: crea las compras de las líneas elegidas en una semana (existente o
+    la de una fecha, que se crea si no existe), todas o ninguna.
+    """
+    from general.tabla_dolar import leer_fecha
+    from presupuestos.models import Presupuesto
+
+    company = request.company
+    if not company:
+        return redirect("usuarios:company_select")
+    presupuesto = get_object_or_404(
+        Presupuesto.objects.select_related("obra", "lote"), pk=presupuesto_pk, company=company
+    )
+    plan = PlanCompras(presupuesto)
+    semanas = Semana.objects.filter(company=company).order_by("-fecha")[:60]
+    errores = []
+    if request.method == "POST":
+        seleccion = leer_seleccion(request.POST.get("lineas"))
+        forma_pago = request.POST.get("forma_pago")
+        if forma_pago not in dict(Compra.FORMA_PAGO_CHOICES):
+            forma_pago = "transferencia"
+        semana_id = request.POST.get("semana", "")
+        semana = fecha = None
+        if semana_id.isdigit():
+            semana = Semana.objects.filter(company=company, pk=int(semana_id)).first()
+        else:
+            try:
+                fecha = _get_week_start(leer_fecha(request.POST.get("fecha_semana")))
+            except ValueError:
+                pass
+        if semana is None and fecha is None:
+            errores.append("Elegí una semana o la fecha de una semana nueva.")
+        elif not seleccion:
+            errores.append("Elegí al menos una línea.")
+        else:
+            compras, errores = plan.compras(seleccion, forma_pago)
+            if not errores:
+                with transaction.atomic():
+                    if semana is None:
+                        semana, _ = Semana.objects.get_or_create(company=company, fecha=fecha)
+                    plan.guardar(compras, semana)
+                return redirect("compras:semana_detalle", pk=semana.pk)
+    return render(
+        request,
+        "compras/plan_compras.html",
+        {
+            "presupuesto": presupuesto,
+            "plan": plan,
+            "semanas": semanas,
+            "formas_pago": Compra.FORMA_PAGO_CHOICES,
+            "errores": errores,
+        },
+    )
+
+
+@login_required
+def variacion(request):
+    """
+    Presupuestado contra gastado por obra → rubro → subrubro (USD). ?obra= elige
+    la obra y ?presupuesto= otro presupuesto que el activo más reciente.
+    """
+    from general.models import Obra
+    from presupuestos.models import Presupuesto
+
+    from .variacion import variacion_obra
+
+    company = request.company
+    if not company:
+        return redirect("usuarios:company_select")
+    obras = Obra.objects.filter(company=company).order_by("nombre")
+    obra = presupuesto = reporte = None
+    presupuestos = []
+    obra_id = request.GET.get("obra", "")
+    if obra_id.isdigit():
+        obra = obras.filter(pk=int(obra_id)).first()
+    if obra is not None:
+        presupuestos = list(
+            Presupuesto.objects.filter(obra=obra).order_by("-fecha", "-creado_en").only(
+                "pk", "instancia", "fecha", "activo"
+            )
+        )
+        presupuesto_id = request.GET.get("presupuesto", "")
+        if presupuesto_id.isdigit():
+            presupuesto = next((p for p in presupuestos if p.pk == int(presupuesto_id)), None)
+        if presupuesto is not None:
+            presupuesto = Presupuesto.objects.select_related("lote", "tipo_dolar").get(pk=presupuesto.pk)
+        reporte = variacion_obra(obra, presupuesto)
+        if presupuesto is None and reporte["presupuesto_id"]:
+            presupuesto = next((p for p in presupuestos if p.pk == reporte["presupuesto_id"]), None)
+    return render(
+        request,
+        "compras/variacion.html",
+        {
+            "obras": obras,
+            "obra": obra,
+            "presupuestos": presupuestos,
+            "presupuesto": presupuesto,
+            "reporte": reporte,
+        },
+    )
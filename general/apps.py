@@ -6,4 +6,5 @@ class GeneralConfig(AppConfig):
     name = 'general'
 
     def ready(self):
+        import general.checks  # noqa: F401
         import general.signals  # noqa: F401
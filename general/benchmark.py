@@ -0,0 +1,402 @@
+"""
+Benchmark de las vistas principales sobre datos sintéticos multiempresa.
+
+generar_datos() llena la base (normalmente una base de test descartable) con
+empresas completas: catálogos, hojas de precios, lotes con tareas y recursos,
+mezclas, presupuestos y semanas de compras, todo con bulk_create.
+correr() pasa por cada escenario con el cliente de test y mide cantidad de
+consultas, tiempo (en frío, con el cache vacío, y la mediana en caliente) y
+pico de memoria de Python. El resultado es un dict serializable a JSON para
+comparar entre commits (ver comparar()).
+
+Los escenarios que encolan trabajos (lote_create, material_bulk_update)
+ejecutan el trabajo en el mismo proceso y su costo entra en la medición.
+"""
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+BATCH_SIZE = 1000
+
+PARAMETROS = {
+    "companies": 2,
+    "materiales": 2000,
+    "hojas": 2,
+    "lotes": 2,
+    "tareas": 500,
+    "recursos_por_tarea": 4,
+    "mezclas": 50,
+    "presupuestos": 2,
+    "semanas": 20,
+    "compras_por_semana": 30,
+    "semilla": 1,
+}
+
+
+def _precio(azar, base):
+    return Decimal(base * azar.uniform(0.5, 2)).quantize(Decimal("0.01"))
+
+
+def _bulk(modelo, objetos):
+    return modelo.objects.bulk_create(objetos, batch_size=BATCH_SIZE)
+
+
+def _generar_empresa(numero, p, azar):
+    from django.contrib.auth.models import User
+
+    from compras.models import Compra, Semana
+    from presupuestos.models import Presupuesto, PresupuestoItem
+    from recursos.models import (
+        HojaPrecioManoDeObra,
+        HojaPrecioMaterial,
+        HojaPrecioSubcontrato,
+        HojaPrecios,
+        HojaPreciosManoDeObra,
+        HojaPreciosSubcontrato,
+        Lote,
+        ManoDeObra,
+        Material,
+        Mezcla,
+        MezclaMaterial,
+        Subcontrato,
+        Tarea,
+        TareaRecurso,
+    )
+
+    from .models import (
+        CategoriaMaterial,
+        Company,
+        CompanyMembership,
+        CotizacionDolar,
+        Equipo,
+        Obra,
+        Proveedor,
+        RefEquipo,
+        Rubro,
+        Subrubro,
+        TipoDolar,
+        TipoMaterial,
+        Unidad,
+    )
+
+    c = Company.objects.create(nombre=f"Empresa {numero}")
+    usuario = User.objects.create_user(f"benchmark{numero}", password="benchmark")
+    CompanyMembership.objects.create(user=usuario, company=c, is_admin=True)
+
+    rubros = _bulk(Rubro, [Rubro(nombre=f"Rubro {i:02d}", company=c) for i in range(10)])
+    subrubros = _bulk(Subrubro, [
+        Subrubro(nombre=f"Subrubro {i:02d}-{j}", rubro=r, company=c)
+        for i, r in enumerate(rubros) for j in range(4)
+    ])
+    unidades = _bulk(Unidad, [Unidad(nombre=n, company=c) for n in ("m2", "m3", "kg", "u")])
+    tipos = _bulk(TipoMaterial, [TipoMaterial(nombre=f"Tipo {i}", company=c) for i in range(5)])
+    categorias = _bulk(CategoriaMaterial, [
+        CategoriaMaterial(nombre=f"Categoría {i}-{j}", tipo=t, company=c)
+        for i, t in enumerate(tipos) for j in range(3)
+    ])
+    proveedores = _bulk(Proveedor, [Proveedor(nombre=f"Proveedor {i:02d}", company=c) for i in range(20)])
+    equipos = _bulk(Equipo, [Equipo(nombre=f"Equipo {i}", company=c) for i in range(3)])
+    refs = _bulk(RefEquipo, [
+        RefEquipo(nombre=f"Ref {i}-{j}", equipo=e, company=c) for i, e in enumerate(equipos) for j in range(2)
+    ])
+    tipo_dolar = TipoDolar.objects.create(nombre="Oficial", company=c)
+    hoy = date(2026, 1, 1)
+    _bulk(CotizacionDolar, [
+        CotizacionDolar(fecha=hoy - timedelta(days=i), tipo=tipo_dolar, valor=Decimal(1000 + i), company=c)
+        for i in range(60)
+    ])
+
+    materiales = _bulk(Material, [
+        Material(
+            nombre=f"Material {i:05d}", company=c, proveedor=azar.choice(proveedores + [None]),
+            tipo=cat.tipo, categoria=cat, unidad_de_venta=azar.choice(unidades),
+            precio_unidad_venta=_precio(azar, 100), moneda="USD" if i % 10 == 0 else "ARS",
+        )
+        for i, cat in ((i, azar.choice(categorias)) for i in range(p["materiales"]))
+    ])
+    manos = _bulk(ManoDeObra, [
+        ManoDeObra(
+            company=c, rubro=s.rubro, subrubro=s, tarea=f"Puesto {i:05d}", equipo=ref.equipo,
+            ref_equipo=ref, unidad_de_venta=azar.choice(unidades), precio_unidad_venta=_precio(azar, 500),
+        )
+        for i, s, ref in ((i, azar.choice(subrubros), azar.choice(refs)) for i in range(max(1, p["materiales"] // 4)))
+    ])
+    subcontratos = _bulk(Subcontrato, [
+        Subcontrato(
+            company=c, rubro=s.rubro, subrubro=s, tarea=f"Subcontrato {i:05d}",
+            proveedor=azar.choice(proveedores), unidad_de_venta=azar.choice(unidades),
+            precio_unidad_venta=_precio(azar, 2000), moneda="USD" if i % 5 == 0 else "ARS",
+        )
+        for i, s in ((i, azar.choice(subrubros)) for i in range(max(1, p["materiales"] // 10)))
+    ])
+
+    hojas = []
+    for h in range(max(1, p["hojas"])):
+        hm = HojaPrecios.objects.create(nombre=f"Hoja {h}", company=c)
+        _bulk(HojaPrecioMaterial, [
+            HojaPrecioMaterial(hoja=hm, material=m, cantidad_por_unidad_venta=1,
+                               precio_unidad_venta=_precio(azar, float(m.precio_unidad_venta)), moneda=m.moneda)
+            for m in materiales
+        ])
+        hmo = HojaPreciosManoDeObra.objects.create(nombre=f"Hoja {h}", company=c)
+        _bulk(HojaPrecioManoDeObra, [
+            HojaPrecioManoDeObra(hoja=hmo, mano_de_obra=m, cantidad_por_unidad_venta=1,
+                                 precio_unidad_venta=_precio(azar, float(m.precio_unidad_venta)))
+            for m in manos
+        ])
+        hs = HojaPreciosSubcontrato.objects.create(nombre=f"Hoja {h}", company=c)
+        _bulk(HojaPrecioSubcontrato, [
+            HojaPrecioSubcontrato(hoja=hs, subcontrato=s, cantidad_por_unidad_venta=1,
+                                  precio_unidad_venta=_precio(azar, float(s.precio_unidad_venta)), moneda=s.moneda)
+            for s in subcontratos
+        ])
+        mezclas = _bulk(Mezcla, [
+            Mezcla(nombre=f"Mezcla {i:03d}", company=c, unidad_de_mezcla=azar.choice(unidades), hoja=hm)
+            for i in range(p["mezclas"])
+        ])
+        _bulk(MezclaMaterial, [
+            MezclaMaterial(mezcla=mz, material=m, cantidad=Decimal(azar.randint(1, 20)) / 4)
+            for mz in mezclas for m in azar.sample(materiales, min(len(materiales), azar.randint(2, 5)))
+        ])
+        hojas.append((hm, hmo, hs, mezclas))
+
+    lotes = []
+    for n in range(max(1, p["lotes"])):
+        hm, hmo, hs, mezclas = hojas[n % len(hojas)]
+        lote = Lote.objects.create(
+            nombre=f"Lote {n}", company=c, hoja_materiales=hm, hoja_mano_de_obra=hmo,
+            hoja_subcontratos=hs, tipo_dolar=tipo_dolar, fecha_dolar=hoy,
+        )
+        tareas = _bulk(Tarea, [
+            Tarea(nombre=f"Tarea {i:05d}", company=c, rubro=s.rubro, subrubro=s, lote=lote)
+            for i, s in ((i, azar.choice(subrubros)) for i in range(p["tareas"]))
+        ])
+        recursos = []
+        for tarea in tareas:
+            for _ in range(p["recursos_por_tarea"]):
+                tipo = azar.random()
+                if tipo < 0.55:
+                    campos = {"material": azar.choice(materiales)}
+                elif tipo < 0.8:
+                    campos = {"mano_de_obra": azar.choice(manos)}
+                elif tipo < 0.9 or not mezclas:
+                    campos = {"subcontrato": azar.choice(subcontratos)}
+                else:
+                    campos = {"mezcla": azar.choice(mezclas)}
+                recursos.append(TareaRecurso(tarea=tarea, cantidad=Decimal(azar.randint(1, 40)) / 4, **campos))
+        _bulk(TareaRecurso, recursos)
+        lotes.append((lote, tareas))
+
+    presupuestos = []
+    for n in range(p["presupuestos"]):
+        lote, tareas = lotes[n % len(lotes)]
+        obra = Obra.objects.create(nombre=f"Obra {n}", company=c)
+        presupuesto = Presupuesto.objects.create(
+            obra=obra, fecha=hoy, instancia="1", lote=lote, tipo_dolar=tipo_dolar, fecha_dolar=hoy, company=c,
+        )
+        _bulk(PresupuestoItem, [
+            PresupuestoItem(presupuesto=presupuesto, tarea=t, cantidad=Decimal(azar.randint(1, 400)))
+            for t in tareas
+        ])
+        presupuestos.append(presupuesto)
+
+    obras = list(Obra.objects.filter(company=c)) or [Obra.objects.create(nombre="Obra", company=c)]
+    lunes = hoy - timedelta(days=hoy.weekday())
+    semanas = _bulk(Semana, [Semana(fecha=lunes - timedelta(weeks=i), company=c) for i in range(p["semanas"])])
+    _bulk(Compra, [
+        Compra(
+            semana=semana, obra=azar.choice(obras), rubro=s.rubro, subrubro=s, item=f"Compra {i}",
+            proveedor=azar.choice(proveedores), monto_total=_precio(azar, 100000),
+        )
+        for semana in semanas
+        for i, s in ((i, azar.choice(subrubros)) for i in range(p["compras_por_semana"]))
+    ])
+
+    return {
+        "company": c,
+        "usuario": usuario,
+        "lotes": [lote for lote, _ in lotes],
+        "presupuestos": presupuestos,
+        "hojas_materiales": [hm for hm, _, _, _ in hojas],
+    }
+
+
+def generar_datos(**parametros):
+    """Genera las empresas; devuelve la lista de dicts de generar_empresa (la primera se usa para medir)."""
+    p = {**PARAMETROS, **parametros}
+    azar = random.Random(p["semilla"])
+    return [_generar_empresa(n + 1, p, azar) for n in range(max(1, p["companies"]))]
+
+
+def _ejecutar_trabajos():
+    """Ejecuta los trabajos pendientes; un trabajo con error invalida la medición."""
+    from .models import Trabajo
+    from .trabajos import ejecutar, pendientes
+
+    ids = pendientes()
+    for pk in ids:
+        ejecutar(pk)
+    fallido = Trabajo.objects.filter(pk__in=ids, estado=Trabajo.ERROR).first()
+    if fallido:
+        raise RuntimeError(f"El trabajo {fallido.tipo} falló:\n{fallido.error}")
+
+
+class Escenario:
+    """Un pedido a una vista (y, si encola trabajos, su ejecución)."""
+
+    def __init__(self, nombre, url, metodo="get", datos=None, trabajos=False):
+        self.nombre = nombre
+        self.url = url
+        self.metodo = metodo
+        self.datos = datos
+        self.trabajos = trabajos
+        self.corridas = 0
+
+    def __call__(self, client):
+        self.corridas += 1
+        datos = self.datos(self.corridas) if callable(self.datos) else self.datos
+        respuesta = getattr(client, self.metodo)(self.url, datos or {})
+        if self.trabajos:
+            _ejecutar_trabajos()
+        return respuesta
+
+
+def escenarios(empresa):
+    """Escenarios sobre la primera empresa generada."""
+    from presupuestos.models import PresupuestoItem
+    from recursos.models import HojaPrecioMaterial
+
+    lote = empresa["lotes"][0]
+    tarea = lote.tareas.order_by("pk").first()
+    presupuesto = empresa["presupuestos"][0] if empresa["presupuestos"] else None
+    hoja = empresa["hojas_materiales"][0]
+    lista = [
+        Escenario("material_list", f"{reverse('recursos:material_list')}?hoja={hoja.pk}"),
+        Escenario("tarea_list", reverse("recursos:tarea_list", args=[lote.pk])),
+        Escenario("tarea_detalle", reverse("recursos:tarea_detalle", args=[lote.pk, tarea.pk])),
+        Escenario("mezcla_list", f"{reverse('recursos:mezcla_list')}?hoja={hoja.pk}"),
+        Escenario("presupuesto_list", reverse("presupuestos:presupuesto_list")),
+    ]
+    if presupuesto:
+        # El subrubro con más ítems (y su rubro).
+        mayor = (
+            PresupuestoItem.objects.filter(presupuesto=presupuesto)
+            .values("tarea__rubro_id", "tarea__subrubro_id")
+            .annotate(cantidad=Count("pk"))
+            .order_by("-cantidad")
+            .first()
+        )
+        rubro_id, subrubro_id = mayor["tarea__rubro_id"], mayor["tarea__subrubro_id"]
+        lista += [
+            Escenario("presupuesto_rubros", reverse("presupuestos:presupuesto_rubros", args=[presupuesto.pk])),
+            Escenario(
+                "presupuesto_subrubros",
+                reverse("presupuestos:presupuesto_subrubros", args=[presupuesto.pk, rubro_id]),
+            ),
+            Escenario(
+                "presupuesto_tareas",
+                reverse("presupuestos:presupuesto_tareas", args=[presupuesto.pk, rubro_id, subrubro_id]),
+            ),
+        ]
+    # Con hoja, material_bulk_update recibe ids de detalles de la hoja.
+    ids_hoja = list(HojaPrecioMaterial.objects.filter(hoja=hoja).order_by("pk").values_list("pk", flat=True)[:500])
+    lista += [
+        Escenario(
+            "lote_create",
+            reverse("recursos:lote_create"),
+            metodo="post",
+            datos=lambda n: {
+                "nombre": f"Lote benchmark {n}",
+                "origen_materiales": lote.pk,
+                "origen_mo": lote.pk,
+                "origen_subcontratos": lote.pk,
+                "origen_mezclas": lote.pk,
+                "origen_maestro": lote.pk,
+            },
+            trabajos=True,
+        ),
+        Escenario(
+            "material_bulk_update",
+            reverse("recursos:material_bulk_update"),
+            metodo="post",
+            datos={"selected_ids": ids_hoja, "porcentaje": "1", "hoja": hoja.pk},
+            trabajos=True,
+        ),
+        Escenario("compras_list", reverse("compras:compras_list")),
+    ]
+    return lista
+
+
+def _medir(escenario, client):
+    with CaptureQueriesContext(connection) as consultas:
+        inicio = time.perf_counter()
+        respuesta = escenario(client)
+        # Las respuestas en streaming se consumen dentro de la medición.
+        if getattr(respuesta, "streaming", False):
+            for _ in respuesta.streaming_content:
+                pass
+        ms = (time.perf_counter() - inicio) * 1000
+    return respuesta.status_code, len(consultas), ms
+
+
+def correr(empresa, repeticiones=5, solo=None):
+    """Mide los escenarios; devuelve {nombre: métricas}."""
+    client = Client()
+    client.force_login(empresa["usuario"])
+    sesion = client.session
+    sesion["company_id"] = empresa["company"].pk
+    sesion.save()
+
+    resultados = {}
+    for escenario in escenarios(empresa):
+        if solo and escenario.nombre not in solo:
+            continue
+        cache.clear()
+        status, consultas_frio, ms_frio = _medir(escenario, client)
+        tiempos, consultas = [], consultas_frio
+        for _ in range(max(1, repeticiones)):
+            _, consultas, ms = _medir(escenario, client)
+            tiempos.append(ms)
+        tracemalloc.start()
+        try:
+            escenario(client)
+            _, pico = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        resultados[escenario.nombre] = {
+            "status": status,
+            "consultas_frio": consultas_frio,
+            "ms_frio": round(ms_frio, 1),
+            "consultas": consultas,
+            "ms_mediana": round(statistics.median(tiempos), 1),
+            "ms_min": round(min(tiempos), 1),
+            "memoria_pico_kb": round(pico / 1024),
+        }
+    return resultados
+
+
+def comparar(anterior, actual):
+    """Filas (escenario, métrica, antes, ahora, variación %) entre dos reportes."""
+    filas = []
+    for nombre, metricas in actual.get("resultados", {}).items():
+        previas = anterior.get("resultados", {}).get(nombre)
+        if not previas:
+            filas.append((nombre, "(nuevo)", None, None, None))
+            continue
+        for metrica in ("consultas_frio", "consultas", "ms_frio", "ms_mediana", "memoria_pico_kb"):
+            antes, ahora = previas.get(metrica), metricas.get(metrica)
+            if antes is None or ahora is None:
+                continue
+            variacion = (ahora - antes) / antes * 100 if antes else None
+            filas.append((nombre, metrica, antes, ahora, variacion))
+    return filas
@@ -0,0 +1,28 @@
+"""
+Checks de configuración (`manage.py check`).
+
+Las invalidaciones por versión del cache (recursos.indice_precios,
+general.cotizaciones, compras.variacion, membership del middleware) solo
+llegan a otros procesos si el cache es compartido.
+"""
+from django.conf import settings
+from django.core.checks import Warning, register
+
+CACHES_POR_PROCESO = (
+    "django.core.cache.backends.locmem.LocMemCache",
+)
+
+
+@register()
+def cache_compartido(app_configs, **kwargs):
+    backend = settings.CACHES.get("default", {}).get("BACKEND")
+    if backend in CACHES_POR_PROCESO:
+        return [
+            Warning(
+                "El cache por defecto es por proceso: lo que invalida un worker (precios, "
+                "cotizaciones, permisos de miembros) no lo ven los demás ni procesar_trabajos.",
+                hint="Usar un cache compartido (DatabaseCache o Redis), ver CACHES en settings.",
+                id="general.W001",
+            )
+        ]
+    return []
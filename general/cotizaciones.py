@@ -0,0 +1,119 @@
+"""
+Cotizaciones del dólar por empresa y conversión de ARS a USD.
+
+La tabla de cotizaciones de una empresa se carga entera en una consulta y
+queda memoizada en el proceso; los lotes y presupuestos la consultan sin ir
+a la base. Cada empresa tiene una versión en el cache de Django: al guardar o
+borrar una cotización (ver general.signals) la versión cambia y la tabla se
+recarga en la próxima consulta. Los demás procesos ven la versión nueva solo
+si el cache es compartido (CACHES en settings; con un LocMemCache por proceso
+seguirían con la tabla vieja). La versión se lee del cache una vez por
+request (general.memo).
+"""
+import threading
+from bisect import bisect_right
+from decimal import Decimal
+
+from . import memo
+
+CERO = Decimal("0")
+
+_tablas = {}
+_lock = threading.Lock()
+
+
+def _clave_version(company_id):
+    # Versión numérica (general.memo.version); la clave vieja guardaba un uuid.
+    return f"general:cotizaciones:{company_id}:version"
+
+
+class TablaCotizaciones:
+    """Cotizaciones de una empresa: (tipo_id, fecha) → valor, y fechas ordenadas por tipo."""
+
+    def __init__(self, filas, version):
+        self.version = version
+        self._valores = {}
+        self._fechas = {}
+        for tipo_id, fecha, valor in filas:
+            self._valores[(tipo_id, fecha)] = valor
+            self._fechas.setdefault(tipo_id, []).append(fecha)
+        for fechas in self._fechas.values():
+            fechas.sort()
+
+    def valor(self, tipo_id, fecha, anterior=False):
+        """
+        Cotización del tipo en la fecha. anterior: si esa fecha no está, la de la
+        fecha previa más cercana. None si no hay.
+        """
+        valor = self._valores.get((tipo_id, fecha))
+        if valor is not None or not anterior:
+            return valor
+        fechas = self._fechas.get(tipo_id, ())
+        i = bisect_right(fechas, fecha)
+        if i == 0:
+            return None
+        return self._valores[(tipo_id, fechas[i - 1])]
+
+
+def _version(company_id):
+    return memo.version(_clave_version(company_id))
+
+
+def tabla(company_id):
+    """Tabla de cotizaciones de la empresa (se recarga solo si cambió)."""
+    from .models import CotizacionDolar
+
+    version = _version(company_id)
+    actual = _tablas.get(company_id)
+    if actual is not None and actual.version == version:
+        return actual
+    filas = CotizacionDolar.objects.filter(company_id=company_id).order_by().values_list(
+        "tipo_id", "fecha", "valor"
+    )
+    nueva = TablaCotizaciones(filas, version)
+    with _lock:
+        _tablas[company_id] = nueva
+    return nueva
+
+
+def cotizacion(company_id, tipo_id, fecha, anterior=False):
+    """Cotización ARS/USD, o None si falta algún dato o no está cargada."""
+    if not company_id or not tipo_id or not fecha:
+        return None
+    return tabla(company_id).valor(tipo_id, fecha, anterior)
+
+
+def invalidar_cotizaciones(company_id):
+    """
+    Cambia la versión de la tabla de la empresa (ahora y al confirmar): este
+    proceso la recarga en la próxima consulta y los demás en su próximo request.
+    """
+    if not company_id:
+        return
+
+    def olvidar_tabla():
+        with _lock:
+            _tablas.pop(company_id, None)
+
+    memo.invalidar_version(_clave_version(company_id), al_subir=olvidar_tabla)
+
+
+def convertir_a_usd(total, moneda, cotizacion):
+    """ARS se convierte con la cotización, USD queda igual. None si falta cotización."""
+    if total == 0:
+        return CERO
+    if moneda == "USD":
+        return total
+    if cotizacion and cotizacion > 0:
+        return total / cotizacion
+    return None
+
+
+def a_usd(montos, cotizacion, monedas=None):
+    """
+    convertir_a_usd de una lista de montos (ARS salvo que monedas diga otra
+    cosa, posición por posición). Devuelve una lista del mismo largo.
+    """
+    if monedas is None:
+        monedas = ("ARS",) * len(montos)
+    return [convertir_a_usd(total, moneda, cotizacion) for total, moneda in zip(montos, monedas)]
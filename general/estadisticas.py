@@ -0,0 +1,131 @@
+"""
+Estadísticas de catálogos por empresa para el Índice.
+
+Todos los contadores salen de una sola consulta (UNION ALL de un COUNT por
+modelo, más los conteos agrupados por hoja y por lote) y se guardan en el
+cache por empresa. Los signals de general.signals borran el cache cuando se
+crea o elimina una fila de cualquiera de los modelos contados; las cargas
+masivas (bulk_create) llaman a invalidar_estadisticas a mano.
+"""
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import CharField, Count, F, IntegerField, Value
+
+ESTADISTICAS_TIMEOUT = 60 * 60
+
+# clave → modelo con FK directa a company
+CONTADORES = {
+    "ref_equipos": "general.RefEquipo",
+    "rubros": "general.Rubro",
+    "subrubros": "general.Subrubro",
+    "unidades": "general.Unidad",
+    "tipos_material": "general.TipoMaterial",
+    "categorias_material": "general.CategoriaMaterial",
+    "equipos": "general.Equipo",
+    "proveedores": "general.Proveedor",
+    "tipos_dolar": "general.TipoDolar",
+    "obras": "general.Obra",
+    "materiales": "recursos.Material",
+    "mano_de_obra": "recursos.ManoDeObra",
+    "subcontratos": "recursos.Subcontrato",
+    "mezclas": "recursos.Mezcla",
+    "lotes": "recursos.Lote",
+    "tareas": "recursos.Tarea",
+}
+
+# clave → (modelo contado, campo de agrupación, ruta a company)
+AGRUPADOS = {
+    "materiales_por_hoja": ("recursos.HojaPrecioMaterial", "hoja", "hoja__company_id"),
+    "mano_de_obra_por_hoja": ("recursos.HojaPrecioManoDeObra", "hoja", "hoja__company_id"),
+    "subcontratos_por_hoja": ("recursos.HojaPrecioSubcontrato", "hoja", "hoja__company_id"),
+    "tareas_por_lote": ("recursos.Tarea", "lote", "company_id"),
+}
+
+
+# Modelos cuyo nombre se muestra en los conteos agrupados: renombrarlos también invalida.
+NOMBRES_MOSTRADOS = {
+    "recursos.HojaPrecios",
+    "recursos.HojaPreciosManoDeObra",
+    "recursos.HojaPreciosSubcontrato",
+    "recursos.Lote",
+}
+
+
+def _clave_cache(company_id):
+    return f"general:estadisticas:{company_id}"
+
+
+def modelos_contados():
+    """Modelos cuyas altas y bajas cambian las estadísticas (para los signals)."""
+    etiquetas = set(CONTADORES.values()) | {modelo for modelo, _, _ in AGRUPADOS.values()}
+    etiquetas |= NOMBRES_MOSTRADOS
+    return [apps.get_model(etiqueta) for etiqueta in sorted(etiquetas)]
+
+
+def _consulta(company_id):
+    """Un SELECT por contador unidos con UNION ALL: filas (clave, id, nombre, cantidad)."""
+    sin_id = Value(None, output_field=IntegerField())
+    sin_nombre = Value(None, output_field=CharField())
+    partes = []
+    for clave, etiqueta in CONTADORES.items():
+        partes.append(
+            apps.get_model(etiqueta).objects.filter(company_id=company_id)
+            .order_by()
+            .annotate(clave=Value(clave), objeto_id=sin_id, objeto_nombre=sin_nombre)
+            .values("clave", "objeto_id", "objeto_nombre")
+            .annotate(cantidad=Count("pk"))
+        )
+    for clave, (etiqueta, campo, ruta_company) in AGRUPADOS.items():
+        partes.append(
+            apps.get_model(etiqueta).objects.filter(**{ruta_company: company_id})
+            .order_by()
+            .annotate(
+                clave=Value(clave),
+                objeto_id=F(f"{campo}_id"),
+                objeto_nombre=F(f"{campo}__nombre"),
+            )
+            .values("clave", "objeto_id", "objeto_nombre")
+            .annotate(cantidad=Count("pk"))
+        )
+    primera, *resto = partes
+    return primera.union(*resto, all=True).values_list(
+        "clave", "objeto_id", "objeto_nombre", "cantidad"
+    )
+
+
+def _calcular(company_id):
+    datos = {clave: 0 for clave in CONTADORES}
+    datos.update({clave: [] for clave in AGRUPADOS})
+    for clave, objeto_id, nombre, cantidad in _consulta(company_id):
+        if clave in AGRUPADOS:
+            datos[clave].append({"id": objeto_id, "nombre": nombre, "cantidad": cantidad})
+        else:
+            datos[clave] = cantidad
+    for clave in AGRUPADOS:
+        datos[clave].sort(key=lambda fila: (fila["nombre"] or "").lower())
+    return datos
+
+
+def estadisticas(company):
+    """
+    Contadores de catálogos de la empresa (misma clave que antes usaba el
+    Índice) y, en *_por_hoja / tareas_por_lote, listas de {id, nombre, cantidad}.
+    """
+    if company is None:
+        return _calcular(None)
+    clave = _clave_cache(company.pk)
+    datos = cache.get(clave)
+    if datos is None:
+        datos = _calcular(company.pk)
+        cache.set(clave, datos, timeout=ESTADISTICAS_TIMEOUT)
+    return datos
+
+
+def invalidar_estadisticas(company_id):
+    """Borra las estadísticas cacheadas ahora y otra vez al confirmar la transacción."""
+    if not company_id:
+        return
+    clave = _clave_cache(company_id)
+    cache.delete(clave)
+    transaction.on_commit(lambda: cache.delete(clave))
@@ -0,0 +1,240 @@
+"""
+Instrumentación de requests (opcional, ver INSTRUMENTACION en settings).
+
+InstrumentacionMiddleware mide cada request: cantidad de consultas, tiempo
+total en la base, consultas repetidas agrupadas por huella (el SQL con los
+valores normalizados, así un N+1 aparece como una misma huella muchas veces),
+vista y empresa. Agrega el header Server-Timing y, si el request supera
+INSTRUMENTACION_UMBRAL_MS, lo escribe como una línea JSON en un log rotativo.
+En las respuestas en streaming la medición sigue hasta que se consume el
+cuerpo (ahí corren las consultas) y el log se escribe al terminar.
+`manage.py resumen_instrumentacion` resume ese log.
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Cuántas huellas repetidas se guardan por request (las de más repeticiones).
+MAX_REPETIDAS = 10
+# Largo del SQL de ejemplo que se guarda por huella.
+LARGO_SQL = 500
+
+_LISTA = re.compile(r"\((?:\s*%s\s*,)+\s*%s\s*\)")
+_CADENA = re.compile(r"'(?:[^']|'')*'")
+_NUMERO = re.compile(r"\b\d+(?:\.\d+)?\b")
+_ESPACIOS = re.compile(r"\s+")
+
+_log_lock = threading.Lock()
+_log_listo = False
+
+
+def normalizar_sql(sql):
+    """SQL sin valores: literales y listas IN de cualquier largo quedan iguales."""
+    sql = _CADENA.sub("?", sql)
+    sql = _NUMERO.sub("?", sql)
+    sql = _LISTA.sub("(%s, ...)", sql)
+    return _ESPACIOS.sub(" ", sql).strip()
+
+
+def huella(sql):
+    """Identificador corto del SQL normalizado."""
+    return hashlib.sha1(normalizar_sql(sql).encode()).hexdigest()[:12]
+
+
+class Medicion:
+    """execute_wrapper que acumula consultas, tiempo y repeticiones por huella."""
+
+    def __init__(self):
+        self.consultas = 0
+        self.db_ms = 0.0
+        self.por_huella = Counter()
+        self.ejemplos = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_ms += (time.perf_counter() - inicio) * 1000
+            self.consultas += 1
+            clave = huella(sql)
+            self.por_huella[clave] += 1
+            self.ejemplos.setdefault(clave, sql[:LARGO_SQL])
+
+    def repetidas(self):
+        """[{huella, veces, sql}] de las consultas ejecutadas más de una vez."""
+        return [
+            {"huella": clave, "veces": veces, "sql": self.ejemplos[clave]}
+            for clave, veces in self.por_huella.most_common(MAX_REPETIDAS)
+            if veces > 1
+        ]
+
+
+def _log_lentas():
+    """Logger de requests lentos; el handler rotativo se crea la primera vez."""
+    global _log_listo
+    log = logging.getLogger("general.instrumentacion.lentas")
+    if _log_listo:
+        return log
+    with _log_lock:
+        if not _log_listo:
+            archivo = Path(settings.INSTRUMENTACION_ARCHIVO)
+            archivo.parent.mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(
+                archivo,
+                maxBytes=settings.INSTRUMENTACION_MAX_BYTES,
+                backupCount=settings.INSTRUMENTACION_COPIAS,
+                encoding="utf-8",
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            log.addHandler(handler)
+            log.setLevel(logging.INFO)
+            log.propagate = False
+            _log_listo = True
+    return log
+
+
+def _vista(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return None
+    return match.view_name
+
+
+class InstrumentacionMiddleware:
+    """
+    Mide consultas y tiempos de cada request. Va antes de CompanyMiddleware
+    para contar también sus consultas; request.company se lee a la salida.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, "INSTRUMENTACION", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.umbral_ms = settings.INSTRUMENTACION_UMBRAL_MS
+
+    def __call__(self, request):
+        medicion = Medicion()
+        inicio = time.perf_counter()
+        with connection.execute_wrapper(medicion):
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - inicio) * 1000
+
+        response["Server-Timing"] = ", ".join((
+            f'db;dur={medicion.db_ms:.1f};desc="{medicion.consultas} consultas"',
+            f"total;dur={total_ms:.1f}",
+        ))
+        if response.streaming and not response.is_async:
+            # Los headers salen antes que el cuerpo: Server-Timing mide hasta la
+            # respuesta y el log espera a que termine el stream, con sus consultas.
+            response.streaming_content = self._medir_stream(
+                request, response, response.streaming_content, medicion, inicio
+            )
+        elif total_ms >= self.umbral_ms:
+            self._registrar(request, response, medicion, total_ms)
+        return response
+
+    def _medir_stream(self, request, response, contenido, medicion, inicio):
+        try:
+            with connection.execute_wrapper(medicion):
+                yield from contenido
+        finally:
+            total_ms = (time.perf_counter() - inicio) * 1000
+            if total_ms >= self.umbral_ms:
+                self._registrar(request, response, medicion, total_ms)
+
+    def _registrar(self, request, response, medicion, total_ms):
+        company = getattr(request, "company", None)
+        user = getattr(request, "user", None)
+        registro = {
+            "fecha": timezone.now().isoformat(timespec="seconds"),
+            "metodo": request.method,
+            "path": request.path,
+            "vista": _vista(request),
+            "status": response.status_code,
+            "company_id": company.pk if company is not None else None,
+            "usuario_id": user.pk if user is not None and user.is_authenticated else None,
+            "ms": round(total_ms, 1),
+            "db_ms": round(medicion.db_ms, 1),
+            "consultas": medicion.consultas,
+            "repetidas": medicion.repetidas(),
+        }
+        try:
+            _log_lentas().info(json.dumps(registro, ensure_ascii=False))
+        except OSError:
+            # No escribir el log nunca debe romper el request.
+            logger.exception("No se pudo escribir el log de instrumentación")
+
+
+def archivos_de_log(archivo=None):
+    """El log y sus copias rotadas (.1, .2, ...) que existan, del más viejo al más nuevo."""
+    archivo = Path(archivo or settings.INSTRUMENTACION_ARCHIVO)
+    rotados = sorted(
+        archivo.parent.glob(f"{archivo.name}.*"),
+        key=lambda p: int(p.suffix[1:]) if p.suffix[1:].isdigit() else 0,
+        reverse=True,
+    )
+    return [p for p in rotados + [archivo] if p.exists()]
+
+
+def leer_registros(archivos):
+    """Registros de los archivos; las líneas que no son JSON se saltean."""
+    for ruta in archivos:
+        with open(ruta, encoding="utf-8") as archivo:
+            for linea in archivo:
+                try:
+                    yield json.loads(linea)
+                except ValueError:
+                    continue
+
+
+def resumir(registros, top=10):
+    """
+    {"requests", "vistas", "repetidas"}: las `top` vistas más lentas (por tiempo
+    máximo) y las consultas repetidas con más repeticiones en total.
+    """
+    vistas = defaultdict(list)
+    repetidas = {}
+    total = 0
+    for registro in registros:
+        total += 1
+        vista = registro.get("vista") or registro.get("path") or "?"
+        vistas[vista].append(registro)
+        for rep in registro.get("repetidas", ()):
+            datos = repetidas.setdefault(
+                rep["huella"], {"huella": rep["huella"], "veces": 0, "requests": 0, "vistas": set(), "sql": rep["sql"]}
+            )
+            datos["veces"] += rep["veces"]
+            datos["requests"] += 1
+            datos["vistas"].add(vista)
+
+    filas_vistas = []
+    for vista, lista in vistas.items():
+        tiempos = sorted(r["ms"] for r in lista)
+        filas_vistas.append({
+            "vista": vista,
+            "requests": len(lista),
+            "ms_max": tiempos[-1],
+            "ms_mediana": tiempos[len(tiempos) // 2],
+            "db_ms_promedio": round(sum(r.get("db_ms", 0) for r in lista) / len(lista), 1),
+            "consultas_max": max(r.get("consultas", 0) for r in lista),
+        })
+    filas_vistas.sort(key=lambda f: f["ms_max"], reverse=True)
+
+    filas_repetidas = sorted(repetidas.values(), key=lambda d: d["veces"], reverse=True)[:top]
+    for datos in filas_repetidas:
+        datos["vistas"] = sorted(datos["vistas"])
+    return {"requests": total, "vistas": filas_vistas[:top], "repetidas": filas_repetidas}
@@ -0,0 +1,48 @@
+"""
+Lectura de datos cargados por el usuario (CSV, grillas): nombres, números y
+archivos con separador desconocido. Lo usan las importaciones de precios, la
+tabla de dólar y el plan de compras.
+"""
+import csv
+import unicodedata
+from decimal import Decimal, InvalidOperation
+
+
+def normalizar(texto):
+    """Minúsculas, sin acentos y con espacios simples."""
+    texto = unicodedata.normalize("NFKD", texto or "")
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.lower().split())
+
+
+def leer_decimal(texto):
+    """Acepta 1234.56, 1234,56, 1.234,56 y 1,234.56. None si está vacío."""
+    texto = (texto or "").strip().replace("$", "").replace(" ", "")
+    if not texto:
+        return None
+    if "," in texto and "." in texto:
+        if texto.rfind(",") > texto.rfind("."):
+            texto = texto.replace(".", "").replace(",", ".")
+        else:
+            texto = texto.replace(",", "")
+    else:
+        texto = texto.replace(",", ".")
+    try:
+        return Decimal(texto)
+    except InvalidOperation:
+        raise ValueError(f"número inválido: {texto}")
+
+
+def lector_csv(lineas):
+    """csv.DictReader detectando ; , o tabulador como separador."""
+    primera = next(lineas, "")
+    try:
+        dialecto = csv.Sniffer().sniff(primera, delimiters=";,\t")
+    except csv.Error:
+        dialecto = csv.excel
+
+    def todas():
+        yield primera
+        yield from lineas
+
+    return csv.DictReader(todas(), dialect=dialecto)
@@ -0,0 +1,86 @@
+import json
+import subprocess
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from general.benchmark import PARAMETROS, comparar, correr, generar_datos
+
+
+def _commit():
+    try:
+        salida = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return salida.stdout.strip() or None
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera datos sintéticos en una base de test descartable y mide consultas, tiempo y "
+        "memoria de las vistas principales. Escribe un reporte JSON comparable entre commits."
+    )
+
+    def add_arguments(self, parser):
+        for nombre, valor in PARAMETROS.items():
+            parser.add_argument(
+                f"--{nombre.replace('_', '-')}",
+                type=int,
+                default=valor,
+                dest=nombre,
+                help=f"(default {valor})",
+            )
+        parser.add_argument("--repeticiones", type=int, default=5, help="Corridas en caliente por escenario.")
+        parser.add_argument("--solo", nargs="*", metavar="ESCENARIO", help="Medir solo estos escenarios.")
+        parser.add_argument("--salida", default="benchmark.json", help="Archivo del reporte (default benchmark.json).")
+        parser.add_argument("--comparar", metavar="REPORTE", help="Reporte anterior para mostrar las diferencias.")
+
+    def handle(self, *args, **options):
+        parametros = {nombre: options[nombre] for nombre in PARAMETROS}
+        setup_test_environment()
+        base_original = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            # Los trabajos se ejecutan en el mismo hilo, dentro de la medición.
+            with override_settings(TRABAJOS_EN_PROCESO=False):
+                self.stdout.write("Generando datos...")
+                empresas = generar_datos(**parametros)
+                self.stdout.write("Midiendo...")
+                resultados = correr(empresas[0], options["repeticiones"], options["solo"])
+        finally:
+            connection.creation.destroy_test_db(base_original, verbosity=0)
+            teardown_test_environment()
+
+        reporte = {
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "commit": _commit(),
+            "parametros": parametros,
+            "repeticiones": options["repeticiones"],
+            "resultados": resultados,
+        }
+        with open(options["salida"], "w", encoding="utf-8") as archivo:
+            json.dump(reporte, archivo, indent=2, ensure_ascii=False)
+
+        self.stdout.write(f"{'Escenario':<24}{'status':>7}{'consultas':>11}{'frío ms':>10}{'mediana ms':>12}{'pico KB':>10}")
+        for nombre, m in resultados.items():
+            self.stdout.write(
+                f"{nombre:<24}{m['status']:>7}{m['consultas']:>11}{m['ms_frio']:>10}"
+                f"{m['ms_mediana']:>12}{m['memoria_pico_kb']:>10}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Reporte: {options['salida']}"))
+
+        if options["comparar"]:
+            with open(options["comparar"], encoding="utf-8") as archivo:
+                anterior = json.load(archivo)
+            self.stdout.write(f"\nComparado con {options['comparar']} (commit {anterior.get('commit') or '?'}):")
+            for nombre, metrica, antes, ahora, variacion in comparar(anterior, reporte):
+                if antes is None:
+                    self.stdout.write(f"  {nombre}: {metrica}")
+                    continue
+                texto = f"{variacion:+.0f}%" if variacion is not None else ""
+                self.stdout.write(f"  {nombre:<24}{metrica:<18}{antes:>10} → {ahora:<10}{texto}")
@@ -0,0 +1,75 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from general.models import Trabajo
+from general.trabajos import ejecutar, pendientes
+
+
+def _ejecutar(pk):
+    try:
+        return ejecutar(pk)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Ejecuta los trabajos en segundo plano pendientes con un pool de hilos."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hilos", type=int, default=2, help="Hilos del pool (default 2).")
+        parser.add_argument(
+            "--intervalo",
+            type=float,
+            default=2.0,
+            help="Segundos entre consultas cuando no hay trabajos (default 2).",
+        )
+        parser.add_argument(
+            "--una-vez",
+            action="store_true",
+            help="Procesa los pendientes y termina.",
+        )
+        parser.add_argument(
+            "--reencolar-colgados",
+            type=int,
+            metavar="MINUTOS",
+            help="Vuelve a pendiente los trabajos 'en curso' hace más de MINUTOS (p. ej. tras un reinicio).",
+        )
+        parser.add_argument(
+            "--purgar",
+            type=int,
+            metavar="DIAS",
+            help="Borra los trabajos terminados hace más de DIAS días.",
+        )
+
+    def handle(self, *args, **options):
+        if options["purgar"]:
+            limite = timezone.now() - timedelta(days=options["purgar"])
+            cantidad, _ = Trabajo.objects.filter(
+                estado__in=[Trabajo.TERMINADO, Trabajo.ERROR], terminado_en__lt=limite
+            ).delete()
+            if cantidad:
+                self.stdout.write(f"Borrados {cantidad} trabajos viejos.")
+
+        if options["reencolar_colgados"]:
+            limite = timezone.now() - timedelta(minutes=options["reencolar_colgados"])
+            cantidad = Trabajo.objects.filter(
+                estado=Trabajo.EN_CURSO, iniciado_en__lt=limite
+            ).update(estado=Trabajo.PENDIENTE, iniciado_en=None)
+            if cantidad:
+                self.stdout.write(f"Reencolados {cantidad} trabajos colgados.")
+
+        with ThreadPoolExecutor(max_workers=options["hilos"], thread_name_prefix="trabajos") as pool:
+            while True:
+                ids = pendientes()
+                if ids:
+                    ejecutados = sum(1 for tomado in pool.map(_ejecutar, ids) if tomado)
+                    self.stdout.write(f"Trabajos ejecutados: {ejecutados}")
+                    continue
+                if options["una_vez"]:
+                    break
+                time.sleep(options["intervalo"])
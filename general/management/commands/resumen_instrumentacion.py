@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from general.instrumentacion import archivos_de_log, leer_registros, resumir
+
+
+class Command(BaseCommand):
+    help = (
+        "Resume el log de requests lentos (INSTRUMENTACION_ARCHIVO y sus copias rotadas): "
+        "vistas más lentas y consultas más repetidas."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=10, help="Cuántas filas mostrar (default 10).")
+        parser.add_argument("--archivo", help="Log a leer (default INSTRUMENTACION_ARCHIVO).")
+        parser.add_argument("--vista", help="Solo requests de esta vista (ej. recursos:tarea_list).")
+        parser.add_argument("--company", type=int, help="Solo requests de esta empresa (id).")
+
+    def handle(self, *args, **options):
+        archivos = archivos_de_log(options["archivo"])
+        if not archivos:
+            raise CommandError("No hay log de instrumentación (¿está activa INSTRUMENTACION?).")
+
+        registros = leer_registros(archivos)
+        if options["vista"]:
+            registros = (r for r in registros if r.get("vista") == options["vista"])
+        if options["company"]:
+            registros = (r for r in registros if r.get("company_id") == options["company"])
+        resumen = resumir(registros, options["top"])
+
+        self.stdout.write(f"{resumen['requests']} requests lentos en {len(archivos)} archivo(s).\n")
+        self.stdout.write(self.style.MIGRATE_HEADING("Vistas más lentas"))
+        self.stdout.write(
+            f"{'Vista':<40}{'requests':>9}{'máx ms':>10}{'mediana ms':>12}{'db ms prom':>12}{'consultas':>11}"
+        )
+        for f in resumen["vistas"]:
+            self.stdout.write(
+                f"{f['vista'][:39]:<40}{f['requests']:>9}{f['ms_max']:>10}{f['ms_mediana']:>12}"
+                f"{f['db_ms_promedio']:>12}{f['consultas_max']:>11}"
+            )
+
+        self.stdout.write("")
+        self.stdout.write(self.style.MIGRATE_HEADING("Consultas más repetidas"))
+        for d in resumen["repetidas"]:
+            self.stdout.write(
+                f"{d['huella']}  {d['veces']} veces en {d['requests']} request(s) — {', '.join(d['vistas'])}"
+            )
+            self.stdout.write(f"    {d['sql'][:200]}")
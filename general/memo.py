@@ -0,0 +1,91 @@
+"""
+Memo por request de lo leído del cache compartido.
+
+Las versiones de invalidación y los índices viven en el cache compartido
+(settings.CACHES), pero leerlo en cada conversión o búsqueda de precio sería
+una ida al cache por fila. Cada hilo guarda lo que ya leyó hasta que termina
+el request (o el trabajo en segundo plano, ver general.trabajos): dentro de un
+request se trabaja con una sola foto y el siguiente vuelve a leer. Lo que
+invalida el propio hilo se olvida en el acto.
+
+version() / invalidar_version() son las claves versionadas que usan los
+índices de precios, las cotizaciones y los reportes de compras: lo guardado
+lleva la versión en su clave y subirla deja de usarlo sin borrar nada.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+from django.core.signals import request_finished, request_started
+from django.db import transaction
+from django.dispatch import receiver
+
+_local = threading.local()
+
+
+def _valores():
+    valores = getattr(_local, "valores", None)
+    if valores is None:
+        valores = _local.valores = {}
+    return valores
+
+
+def leer(clave, cargar):
+    """Valor de la clave en este request; cargar() lo trae la primera vez."""
+    valores = _valores()
+    if clave not in valores:
+        valores[clave] = cargar()
+    return valores[clave]
+
+
+def guardar(clave, valor):
+    _valores()[clave] = valor
+
+
+def olvidar(clave):
+    _valores().pop(clave, None)
+
+
+@receiver(request_started)
+@receiver(request_finished)
+def limpiar(**kwargs):
+    _local.valores = {}
+
+
+def _leer_version(clave):
+    version = cache.get(clave)
+    if version is None:
+        # Arranca en un valor que no se repite si el cache perdió la versión anterior.
+        version = time.time_ns()
+        if not cache.add(clave, version, timeout=None):
+            version = cache.get(clave, version)
+    return version
+
+
+def version(clave):
+    """Versión guardada en el cache compartido bajo clave (se lee una vez por request)."""
+    return leer(clave, lambda: _leer_version(clave))
+
+
+def _subir_version(clave):
+    try:
+        cache.incr(clave)
+    except ValueError:
+        cache.set(clave, time.time_ns(), timeout=None)
+    olvidar(clave)
+
+
+def invalidar_version(clave, al_subir=None):
+    """
+    Sube la versión ahora y otra vez al confirmar la transacción, por si otro
+    request volvió a cargar con los datos viejos mientras tanto. al_subir se
+    llama después de cada subida.
+    """
+
+    def subir():
+        _subir_version(clave)
+        if al_subir is not None:
+            al_subir()
+
+    subir()
+    transaction.on_commit(subir)
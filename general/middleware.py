@@ -2,8 +2,34 @@
 Middleware multi-tenant: setea request.company y request.membership desde la sesión.
 Controla acceso por secciones (Presupuestos, Sueldos, Compras).
 """
+from django.core.cache import cache
+from django.db import transaction
 from django.shortcuts import redirect
-from django.urls import resolve
+from django.urls import Resolver404, resolve
+
+
+# Membership resuelto por usuario + empresa, para no consultarlo en cada request.
+# Se invalida al editar/quitar miembros (ver general.signals y member_edit/member_remove).
+# Es un permiso: el cache tiene que ser compartido entre procesos (CACHES en
+# settings), si no un miembro quitado sigue entrando por los otros workers.
+MEMBERSHIP_CACHE_TIMEOUT = 300
+
+SECTION_NAMES = {"presupuestos": "Presupuestos", "sueldos": "Sueldos", "compras": "Compras"}
+
+
+def _membership_cache_key(user_id, company_id):
+    return f"general:membership:{user_id}:{company_id}"
+
+
+def invalidar_membership(user_id, company_id):
+    """
+    Borra el membership cacheado del usuario en esa empresa, ahora y al
+    confirmar la transacción (un request en paralelo pudo volver a guardar el
+    membership viejo antes del commit).
+    """
+    key = _membership_cache_key(user_id, company_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
 
 
 def get_user_membership(request):
@@ -13,14 +39,26 @@ def get_user_membership(request):
     company_id = request.session.get("company_id")
     if not company_id:
         return None, None
-    membership = (
-        request.user.company_memberships.select_related("company")
-        .prefetch_related("membership_sections__section")
-        .filter(company_id=company_id)
-        .first()
-    )
-    if not membership:
+    key = _membership_cache_key(request.user.pk, company_id)
+    cached = cache.get(key)
+    if cached is None:
+        membership = (
+            request.user.company_memberships.select_related("company")
+            .filter(company_id=company_id)
+            .first()
+        )
+        section_codes = []
+        if membership:
+            section_codes = list(
+                membership.membership_sections.values_list("section__code", flat=True)
+            )
+        # False = "no es miembro" (también se cachea).
+        cached = (membership, section_codes) if membership else False
+        cache.set(key, cached, MEMBERSHIP_CACHE_TIMEOUT)
+    if not cached:
         return None, None
+    membership, section_codes = cached
+    membership._section_codes = section_codes
     return membership.company, membership
 
 
@@ -70,16 +108,15 @@ def _path_requires_presupuestos(path):
     return any(path.startswith(p) for p in PRESUPUESTOS_PATH_PREFIXES)
 
 
-def _path_is_admin_only(path):
-    """True si el path es solo para admins."""
+def _url_name(path):
+    """Nombre de la URL con namespace (ej. 'general:member_list'), o None si no resuelve."""
     try:
         match = resolve(path)
-        name = match.url_name
-        if match.namespace:
-            name = f"{match.namespace}:{name}"
-        return name in ADMIN_ONLY_URL_NAMES
-    except Exception:
-        return False
+    except Resolver404:
+        return None
+    if match.namespace:
+        return f"{match.namespace}:{match.url_name}"
+    return match.url_name
 
 
 class CompanyMiddleware:
@@ -103,45 +140,27 @@ class CompanyMiddleware:
             request.membership = membership
 
             if membership:
-                request.user_sections = list(
-                    membership.membership_sections.values_list(
-                        "section__code", flat=True
-                    )
-                )
                 if membership.is_admin:
                     request.user_sections = ["presupuestos", "sueldos", "compras"]
+                else:
+                    request.user_sections = list(membership._section_codes)
                 # Para templates: lista de {code, nombre}
-                SECTION_NAMES = {"presupuestos": "Presupuestos", "sueldos": "Sueldos", "compras": "Compras"}
                 request.user_sections_info = [
                     {"code": c, "nombre": SECTION_NAMES.get(c, c)}
                     for c in request.user_sections
                 ]
 
-            if request.company is None:
-                try:
-                    match = resolve(request.path_info)
-                    name = match.url_name
-                    if match.namespace:
-                        name = f"{match.namespace}:{name}"
-                    if name not in NO_COMPANY_URL_NAMES and not request.path.startswith("/admin/"):
+            if not request.path.startswith("/admin/"):
+                # Una sola resolución de URL por request.
+                full_name = _url_name(request.path_info)
+                if request.company is None:
+                    if full_name is not None and full_name not in NO_COMPANY_URL_NAMES:
                         return redirect("usuarios:company_select")
-                except Exception:
-                    pass
-            elif request.membership and not request.path.startswith("/admin/"):
-                path = request.path
-                try:
-                    match = resolve(path)
-                    full_name = match.url_name
-                    if match.namespace:
-                        full_name = f"{match.namespace}:{full_name}"
-                except Exception:
-                    full_name = None
-
-                if full_name not in NO_COMPANY_URL_NAMES:
-                    if _path_is_admin_only(path):
+                elif request.membership and full_name not in NO_COMPANY_URL_NAMES:
+                    if full_name in ADMIN_ONLY_URL_NAMES:
                         if not request.membership.is_admin:
                             return redirect("no_section_access")
-                    elif _path_requires_presupuestos(path):
+                    elif _path_requires_presupuestos(request.path):
                         if not request.membership.has_section_access("presupuestos"):
                             return redirect("no_section_access")
                     # sueldos y compras se verifican cuando existan esas URLs
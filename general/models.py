@@ -70,6 +70,10 @@ class CompanyMembership(models.Model):
         """True si tiene acceso (es admin o tiene la sección asignada)."""
         if self.is_admin:
             return True
+        # CompanyMiddleware deja las secciones ya cargadas.
+        section_codes = getattr(self, "_section_codes", None)
+        if section_codes is not None:
+            return section_code in section_codes
         return self.membership_sections.filter(section__code=section_code).exists()
 
 
@@ -319,4 +323,59 @@ class Obra(models.Model):
         unique_together = ("company", "nombre")
 
     def __str__(self):
-        return self.nombre
\ No newline at end of file
+        return self.nombre
+
+
+class Trabajo(models.Model):
+    """
+    Trabajo en segundo plano (clonar lote, actualizar precios, recalcular
+    presupuestos). Lo encola una vista y lo ejecuta general.trabajos, en un
+    hilo del mismo proceso o con `manage.py procesar_trabajos`.
+    """
+    PENDIENTE = "pendiente"
+    EN_CURSO = "en_curso"
+    TERMINADO = "terminado"
+    ERROR = "error"
+    ESTADOS = [
+        (PENDIENTE, "Pendiente"),
+        (EN_CURSO, "En curso"),
+        (TERMINADO, "Terminado"),
+        (ERROR, "Error"),
+    ]
+
+    tipo = models.CharField(max_length=80)
+    parametros = models.JSONField(default=dict, blank=True)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=PENDIENTE)
+    progreso = models.CharField(max_length=255, blank=True)
+    resultado = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    company = models.ForeignKey(
+        Company,
+        on_delete=models.CASCADE,
+        related_name="trabajos",
+        null=True,
+        blank=True,
+    )
+    usuario = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        related_name="trabajos",
+        null=True,
+        blank=True,
+    )
+    creado_en = models.DateTimeField(auto_now_add=True)
+    iniciado_en = models.DateTimeField(null=True, blank=True)
+    terminado_en = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Trabajo"
+        verbose_name_plural = "Trabajos"
+        ordering = ["-creado_en"]
+        indexes = [models.Index(fields=["estado", "creado_en"])]
+
+    def __str__(self):
+        return f"{self.tipo} #{self.pk} ({self.get_estado_display()})"
+
+    @property
+    def finalizado(self):
+        return self.estado in (self.TERMINADO, self.ERROR)
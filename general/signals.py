@@ -1,10 +1,15 @@
 """
 Signals para general app.
 """
-from django.db.models.signals import post_save
+from functools import lru_cache
+
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from .models import CompanyMembership
+from .cotizaciones import invalidar_cotizaciones
+from .estadisticas import NOMBRES_MOSTRADOS, invalidar_estadisticas, modelos_contados
+from .middleware import invalidar_membership
+from .models import CompanyMembership, CompanyMembershipSection, CotizacionDolar
 
 
 @receiver(post_save, sender=CompanyMembership)
@@ -22,3 +27,57 @@ def first_member_is_admin(sender, instance, created, **kwargs):
     if not has_admin:
         instance.is_admin = True
         instance.save(update_fields=["is_admin"])
+
+
+@receiver(post_save, sender=CompanyMembership)
+@receiver(post_delete, sender=CompanyMembership)
+def membership_cambiado(sender, instance, **kwargs):
+    """Invalida el membership cacheado por CompanyMiddleware."""
+    invalidar_membership(instance.user_id, instance.company_id)
+
+
+@receiver(post_save, sender=CompanyMembershipSection)
+@receiver(post_delete, sender=CompanyMembershipSection)
+def membership_section_cambiada(sender, instance, **kwargs):
+    membership = CompanyMembership.objects.filter(pk=instance.membership_id).values_list(
+        "user_id", "company_id"
+    ).first()
+    if membership:
+        invalidar_membership(*membership)
+
+
+@receiver(post_save, sender=CotizacionDolar)
+@receiver(post_delete, sender=CotizacionDolar)
+def cotizacion_cambiada(sender, instance, **kwargs):
+    """Recarga la tabla de cotizaciones memoizada de la empresa."""
+    invalidar_cotizaciones(instance.company_id)
+
+
+# --- Estadísticas del Índice -------------------------------------------------
+
+@lru_cache(maxsize=1024)
+def _company_de_hoja(modelo_hoja, hoja_id):
+    # La empresa de una hoja no cambia: se resuelve una vez por hoja.
+    return modelo_hoja.objects.filter(pk=hoja_id).values_list("company_id", flat=True).first()
+
+
+def _company_id(instance):
+    if hasattr(instance, "company_id"):
+        return instance.company_id
+    hoja = type(instance)._meta.get_field("hoja")
+    return _company_de_hoja(hoja.related_model, instance.hoja_id)
+
+
+def estadisticas_guardado(sender, instance, created, **kwargs):
+    # Editar no cambia las cantidades, salvo el nombre de hojas y lotes.
+    if created or sender._meta.label in NOMBRES_MOSTRADOS:
+        invalidar_estadisticas(_company_id(instance))
+
+
+def estadisticas_borrado(sender, instance, **kwargs):
+    invalidar_estadisticas(_company_id(instance))
+
+
+for _modelo in modelos_contados():
+    post_save.connect(estadisticas_guardado, sender=_modelo, dispatch_uid=f"estadisticas_save_{_modelo._meta.label}")
+    post_delete.connect(estadisticas_borrado, sender=_modelo, dispatch_uid=f"estadisticas_delete_{_modelo._meta.label}")
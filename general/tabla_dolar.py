@@ -0,0 +1,246 @@
+"""
+Carga masiva y lectura de la Tabla de Dólar.
+
+Escritura: todas las cotizaciones de un envío (una fila, la grilla editable o
+un CSV pegado/subido) se guardan con un único bulk_create con
+update_conflicts sobre (company, fecha, tipo), dentro de una transacción.
+Como bulk_create no dispara signals, se invalidan a mano la tabla memoizada
+de general.cotizaciones y los totales de los presupuestos afectados.
+
+Lectura: la tabla pivoteada (una fila por fecha, una columna por tipo) sale
+de una sola consulta agrupada por fecha, paginada por rango de fechas.
+
+CSV: encabezado "fecha" y una columna por tipo de dólar (por nombre), o bien
+el formato largo "fecha, tipo, valor". Fechas AAAA-MM-DD o DD/MM/AAAA.
+"""
+from datetime import datetime
+
+from django.db import transaction
+from django.db.models import Max, Q
+
+from .cotizaciones import invalidar_cotizaciones
+from .lectura import leer_decimal, lector_csv, normalizar
+from .models import CotizacionDolar
+
+BATCH_SIZE = 500
+POR_PAGINA = 100
+MAX_POR_PAGINA = 1000
+
+# Filas problemáticas que se guardan para mostrar (las demás solo se cuentan).
+MAX_FILAS_REPORTE = 200
+
+FORMATOS_FECHA = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y")
+
+
+class ErrorTablaDolar(Exception):
+    """El CSV no se puede leer (columnas)."""
+
+
+def leer_fecha(texto):
+    """Fecha en alguno de FORMATOS_FECHA. ValueError si no se reconoce."""
+    texto = (texto or "").strip()
+    for formato in FORMATOS_FECHA:
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            continue
+    raise ValueError(f"fecha inválida: {texto or '(vacía)'}")
+
+
+class ResultadoCarga:
+    """Conteos y filas con problemas de una carga de cotizaciones."""
+
+    def __init__(self):
+        self.leidas = 0
+        self.guardadas = 0
+        self.con_error = 0
+        self.problemas = []
+
+    def problema(self, linea, texto, motivo):
+        self.con_error += 1
+        if len(self.problemas) < MAX_FILAS_REPORTE:
+            self.problemas.append((linea, texto, motivo))
+
+    def __str__(self):
+        return f"{self.leidas} filas: {self.guardadas} cotizaciones guardadas, {self.con_error} con error"
+
+
+def guardar_cotizaciones(company, valores):
+    """
+    Upsert de {(fecha, tipo_id): valor} en una transacción. Si un par aparece
+    más de una vez vale el último. Devuelve la cantidad guardada.
+    """
+    from presupuestos.models import Presupuesto
+    from presupuestos.totales import invalidar_totales
+
+    if not valores:
+        return 0
+    objetos = [
+        CotizacionDolar(company=company, fecha=fecha, tipo_id=tipo_id, valor=valor)
+        for (fecha, tipo_id), valor in valores.items()
+    ]
+    with transaction.atomic():
+        CotizacionDolar.objects.bulk_create(
+            objetos,
+            batch_size=BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=["company", "fecha", "tipo"],
+            update_fields=["valor"],
+        )
+        # bulk_create no dispara signals.
+        invalidar_cotizaciones(company.pk)
+        fechas = {fecha for fecha, _ in valores}
+        tipos = {tipo_id for _, tipo_id in valores}
+        invalidar_totales(
+            Presupuesto.objects.filter(
+                company=company, tipo_dolar_id__in=tipos, fecha_dolar__in=fechas
+            )
+        )
+    return len(objetos)
+
+
+def _tipos_por_nombre(tipos):
+    return {normalizar(t.nombre): t.pk for t in tipos}
+
+
+def leer_csv(lineas, tipos):
+    """
+    Lee cotizaciones de un CSV. Devuelve ({(fecha, tipo_id): valor}, ResultadoCarga).
+    ErrorTablaDolar si falta la columna fecha o no hay columnas reconocibles.
+    """
+    lector = lector_csv(iter(lineas))
+    columnas = {normalizar(c): c for c in lector.fieldnames or [] if c}
+    if "fecha" not in columnas:
+        raise ErrorTablaDolar("Falta la columna fecha.")
+    por_nombre = _tipos_por_nombre(tipos)
+    largo = "tipo" in columnas and "valor" in columnas
+    if largo:
+        por_columna = {}
+    else:
+        por_columna = {c: por_nombre[n] for n, c in columnas.items() if n in por_nombre}
+        if not por_columna:
+            raise ErrorTablaDolar(
+                "No hay columnas con nombres de tipos de dólar (ni columnas tipo y valor)."
+            )
+
+    valores = {}
+    resultado = ResultadoCarga()
+    for fila in lector:
+        if not any((v or "").strip() for v in fila.values() if isinstance(v, str)):
+            continue
+        resultado.leidas += 1
+        linea = lector.line_num
+        texto = fila.get(columnas["fecha"], "")
+        try:
+            fecha = leer_fecha(texto)
+            if largo:
+                tipo_id = por_nombre.get(normalizar(fila.get(columnas["tipo"])))
+                if tipo_id is None:
+                    raise ValueError(f"tipo desconocido: {fila.get(columnas['tipo'])}")
+                celdas = {tipo_id: fila.get(columnas["valor"])}
+            else:
+                celdas = {tipo_id: fila.get(columna) for columna, tipo_id in por_columna.items()}
+            leidos = {}
+            for tipo_id, celda in celdas.items():
+                valor = leer_decimal(celda)
+                if valor is None:
+                    continue
+                if valor <= 0:
+                    raise ValueError(f"valor inválido: {celda}")
+                leidos[(fecha, tipo_id)] = valor
+        except ValueError as exc:
+            resultado.problema(linea, texto, str(exc))
+            continue
+        valores.update(leidos)
+    return valores, resultado
+
+
+def leer_grilla(post, tipos):
+    """
+    Cotizaciones de la grilla editable: filas fecha_<i> con celdas
+    valor_<i>_<tipo_id>. Las celdas vacías no se tocan.
+    """
+    valores = {}
+    resultado = ResultadoCarga()
+    filas = sorted(
+        int(k.removeprefix("fecha_")) for k in post if k.startswith("fecha_") and k[6:].isdigit()
+    )
+    for i in filas:
+        texto = post.get(f"fecha_{i}", "")
+        celdas = {t.pk: post.get(f"valor_{i}_{t.pk}", "") for t in tipos}
+        if not texto.strip() and not any(c.strip() for c in celdas.values()):
+            continue
+        resultado.leidas += 1
+        try:
+            fecha = leer_fecha(texto)
+            leidos = {}
+            for tipo_id, celda in celdas.items():
+                valor = leer_decimal(celda)
+                if valor is None:
+                    continue
+                if valor <= 0:
+                    raise ValueError(f"valor inválido: {celda}")
+                leidos[(fecha, tipo_id)] = valor
+        except ValueError as exc:
+            resultado.problema(i + 1, texto, str(exc))
+            continue
+        valores.update(leidos)
+    return valores, resultado
+
+
+def _fecha_param(texto):
+    try:
+        return leer_fecha(texto) if texto else None
+    except ValueError:
+        return None
+
+
+class PaginaCotizaciones:
+    """
+    Tabla pivoteada de la empresa entre desde y hasta, de la fecha más nueva a
+    la más vieja. antes: fecha de la última fila de la página anterior.
+    """
+
+    def __init__(self, company, tipos, desde=None, hasta=None, antes=None, por_pagina=POR_PAGINA):
+        self.tipos = list(tipos)
+        self.desde = desde
+        self.hasta = hasta
+        self.antes = antes
+        qs = CotizacionDolar.objects.filter(company=company)
+        if desde:
+            qs = qs.filter(fecha__gte=desde)
+        if hasta:
+            qs = qs.filter(fecha__lte=hasta)
+        if antes:
+            qs = qs.filter(fecha__lt=antes)
+        columnas = {f"t{t.pk}": Max("valor", filter=Q(tipo_id=t.pk)) for t in self.tipos}
+        filas = list(
+            qs.order_by().values("fecha").annotate(**columnas).order_by("-fecha")[: por_pagina + 1]
+        )
+        self.hay_mas = len(filas) > por_pagina
+        self.filas = [
+            {"fecha": f["fecha"], "celdas": [(t, f[f"t{t.pk}"]) for t in self.tipos]}
+            for f in filas[:por_pagina]
+        ]
+
+    @property
+    def siguiente(self):
+        """Fecha para ?antes= de la página siguiente, o None si es la última."""
+        if self.hay_mas and self.filas:
+            return self.filas[-1]["fecha"]
+        return None
+
+    @classmethod
+    def desde_request(cls, company, tipos, params):
+        try:
+            por_pagina = int(params.get("por_pagina") or POR_PAGINA)
+        except ValueError:
+            por_pagina = POR_PAGINA
+        return cls(
+            company,
+            tipos,
+            desde=_fecha_param(params.get("desde")),
+            hasta=_fecha_param(params.get("hasta")),
+            antes=_fecha_param(params.get("antes")),
+            por_pagina=max(1, min(por_pagina, MAX_POR_PAGINA)),
+        )
@@ -0,0 +1,207 @@
+"""
+Utilidades para los tests: una empresa con datos mínimos de todos los
+módulos y la verificación de planes de consulta (EXPLAIN QUERY PLAN de SQLite).
+"""
+import re
+from datetime import date
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.core.cache import cache
+from django.db import connection
+
+from . import memo
+
+# "SCAN tabla" sin "USING ... INDEX": recorre la tabla entera.
+ESCANEO_COMPLETO = re.compile(r"^SCAN (\w+)$")
+
+
+def crear_empresa_de_prueba(nombre="ACME"):
+    """Empresa con usuario admin, catálogos, hojas, lote con tareas, presupuesto y compras."""
+    from django.contrib.auth.models import User
+
+    from compras.models import Compra, Semana
+    from presupuestos.models import Presupuesto, PresupuestoItem
+    from recursos.models import (
+        HojaPrecioManoDeObra,
+        HojaPrecioMaterial,
+        HojaPrecioSubcontrato,
+        HojaPrecios,
+        HojaPreciosManoDeObra,
+        HojaPreciosSubcontrato,
+        Lote,
+        ManoDeObra,
+        Material,
+        Mezcla,
+        MezclaMaterial,
+        Subcontrato,
+        Tarea,
+        TareaRecurso,
+    )
+
+    from .models import (
+        CategoriaMaterial,
+        Company,
+        CompanyMembership,
+        CotizacionDolar,
+        Equipo,
+        Obra,
+        Proveedor,
+        RefEquipo,
+        Rubro,
+        Subrubro,
+        TipoDolar,
+        TipoMaterial,
+        Unidad,
+    )
+
+    d = SimpleNamespace()
+    d.company = c = Company.objects.create(nombre=nombre)
+    d.user = User.objects.create_user(f"usuario-{nombre.lower()}", password="x")
+    CompanyMembership.objects.create(user=d.user, company=c, is_admin=True)
+    d.rubro = Rubro.objects.create(nombre="Albañilería", company=c)
+    d.subrubro = Subrubro.objects.create(nombre="Muros", rubro=d.rubro, company=c)
+    d.unidad = Unidad.objects.create(nombre="m2", company=c)
+    d.tipo = TipoMaterial.objects.create(nombre="Áridos", company=c)
+    d.categoria = CategoriaMaterial.objects.create(nombre="Arena", tipo=d.tipo, company=c)
+    d.proveedor = Proveedor.objects.create(nombre="Corralón", company=c)
+    d.equipo = Equipo.objects.create(nombre="Cuadrilla", company=c)
+    d.ref_equipo = RefEquipo.objects.create(nombre="Oficial", equipo=d.equipo, company=c)
+    d.tipo_dolar = TipoDolar.objects.create(nombre="Oficial", company=c)
+    d.fecha_dolar = date(2026, 1, 1)
+    CotizacionDolar.objects.create(
+        fecha=d.fecha_dolar, tipo=d.tipo_dolar, valor=Decimal("1000"), company=c
+    )
+
+    d.material = Material.objects.create(
+        nombre="Arena", company=c, proveedor=d.proveedor, tipo=d.tipo, categoria=d.categoria,
+        unidad_de_venta=d.unidad, precio_unidad_venta=Decimal("100"),
+    )
+    d.mano_de_obra = ManoDeObra.objects.create(
+        company=c, rubro=d.rubro, subrubro=d.subrubro, tarea="Levantar muro", equipo=d.equipo,
+        ref_equipo=d.ref_equipo, unidad_de_venta=d.unidad, precio_unidad_venta=Decimal("500"),
+    )
+    d.subcontrato = Subcontrato.objects.create(
+        company=c, rubro=d.rubro, subrubro=d.subrubro, tarea="Revoque", proveedor=d.proveedor,
+        unidad_de_venta=d.unidad, precio_unidad_venta=Decimal("800"), moneda="USD",
+    )
+    d.hoja_materiales = HojaPrecios.objects.create(nombre="Marzo", company=c)
+    HojaPrecioMaterial.objects.create(
+        hoja=d.hoja_materiales, material=d.material, cantidad_por_unidad_venta=1,
+        precio_unidad_venta=Decimal("100"),
+    )
+    d.hoja_mano_de_obra = HojaPreciosManoDeObra.objects.create(nombre="Marzo", company=c)
+    HojaPrecioManoDeObra.objects.create(
+        hoja=d.hoja_mano_de_obra, mano_de_obra=d.mano_de_obra, cantidad_por_unidad_venta=1,
+        precio_unidad_venta=Decimal("500"),
+    )
+    d.hoja_subcontratos = HojaPreciosSubcontrato.objects.create(nombre="Marzo", company=c)
+    HojaPrecioSubcontrato.objects.create(
+        hoja=d.hoja_subcontratos, subcontrato=d.subcontrato, cantidad_por_unidad_venta=1,
+        precio_unidad_venta=Decimal("800"), moneda="USD",
+    )
+    d.lote = Lote.objects.create(
+        nombre="Lote 1", company=c, hoja_materiales=d.hoja_materiales,
+        hoja_mano_de_obra=d.hoja_mano_de_obra, hoja_subcontratos=d.hoja_subcontratos,
+        tipo_dolar=d.tipo_dolar, fecha_dolar=d.fecha_dolar,
+    )
+    d.mezcla = Mezcla.objects.create(
+        nombre="Mortero", company=c, unidad_de_mezcla=d.unidad, hoja=d.hoja_materiales
+    )
+    MezclaMaterial.objects.create(mezcla=d.mezcla, material=d.material, cantidad=Decimal("2"))
+    d.tarea = Tarea.objects.create(
+        nombre="Muro 15", company=c, rubro=d.rubro, subrubro=d.subrubro, lote=d.lote
+    )
+    TareaRecurso.objects.create(tarea=d.tarea, material=d.material, cantidad=Decimal("3"))
+    TareaRecurso.objects.create(tarea=d.tarea, mano_de_obra=d.mano_de_obra, cantidad=Decimal("1"))
+    TareaRecurso.objects.create(tarea=d.tarea, subcontrato=d.subcontrato, cantidad=Decimal("1"))
+    TareaRecurso.objects.create(tarea=d.tarea, mezcla=d.mezcla, cantidad=Decimal("1"))
+
+    d.obra = Obra.objects.create(nombre="Edificio", company=c)
+    d.presupuesto = Presupuesto.objects.create(
+        obra=d.obra, fecha=date(2026, 1, 2), instancia="1", lote=d.lote,
+        tipo_dolar=d.tipo_dolar, fecha_dolar=d.fecha_dolar, company=c,
+    )
+    PresupuestoItem.objects.create(presupuesto=d.presupuesto, tarea=d.tarea, cantidad=Decimal("10"))
+    d.semana = Semana.objects.create(fecha=date(2026, 1, 5), company=c)
+    Compra.objects.create(
+        semana=d.semana, obra=d.obra, rubro=d.rubro, subrubro=d.subrubro, item="Arena",
+        proveedor=d.proveedor, monto_total=Decimal("1000"),
+    )
+    return d
+
+
+def plan_de_consulta(sql, params):
+    """Líneas de EXPLAIN QUERY PLAN de una consulta (solo SQLite)."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return [fila[-1] for fila in cursor.fetchall()]
+
+
+class CapturaSelects:
+    """execute_wrapper que guarda (sql, params) de cada SELECT ejecutado."""
+
+    def __init__(self):
+        self.consultas = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith("SELECT"):
+            self.consultas.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def escaneos_completos(consultas):
+    """[(tabla, sql)] de las consultas cuyo plan recorre alguna tabla entera."""
+    encontrados = []
+    for sql, params in consultas:
+        for detalle in plan_de_consulta(sql, params):
+            coincidencia = ESCANEO_COMPLETO.match(detalle)
+            if coincidencia:
+                encontrados.append((coincidencia.group(1), sql))
+    return encontrados
+
+
+class EmpresaDePruebaMixin:
+    """
+    Para TestCase: crea la empresa de prueba, arranca cada test con el cache
+    (y el memo por request) vacío e inicia sesión en la empresa.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = crear_empresa_de_prueba()
+
+    def setUp(self):
+        cache.clear()
+        memo.limpiar()
+        self.client.force_login(self.datos.user)
+        sesion = self.client.session
+        sesion["company_id"] = self.datos.company.pk
+        sesion.save()
+
+
+class PlanesDeConsultaMixin(EmpresaDePruebaMixin):
+    """Además permite verificar que las consultas de una vista no recorren tablas enteras."""
+
+    def assertSinEscaneoCompleto(self, url):
+        captura = CapturaSelects()
+        with connection.execute_wrapper(captura):
+            respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200, url)
+        self.assertTrue(captura.consultas, url)
+        escaneos = escaneos_completos(captura.consultas)
+        self.assertFalse(
+            escaneos,
+            f"{url} recorre tablas enteras:\n"
+            + "\n".join(f"  {tabla}: {sql}" for tabla, sql in escaneos),
+        )
+        return respuesta
+
+    def assertUsaIndice(self, queryset, *columnas):
+        """El plan de queryset busca en su tabla por todas las columnas dadas."""
+        sql, params = queryset.query.sql_with_params()
+        plan = " | ".join(plan_de_consulta(sql, params))
+        tabla = queryset.model._meta.db_table
+        self.assertRegex(plan, rf"SEARCH {tabla} USING (COVERING )?INDEX", plan)
+        for columna in columnas:
+            self.assertIn(f"{columna}=?", plan)
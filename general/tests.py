@@ -1,3 +1,519 @@
-from django.test import TestCase
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.core.cache import cache
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import reverse
+
+from presupuestos.totales import guardar_totales
+from recursos.models import HojaPrecioMaterial, HojaPrecios, Lote, Material, Tarea
+
+from . import memo, trabajos
+from .checks import cache_compartido
+from .lectura import lector_csv, normalizar
+from .instrumentacion import InstrumentacionMiddleware, huella, normalizar_sql, resumir
+from .cotizaciones import a_usd, cotizacion
+from .estadisticas import AGRUPADOS, CONTADORES, estadisticas, invalidar_estadisticas
+from .models import (
+    Company,
+    CompanyMembership,
+    CompanyMembershipSection,
+    CotizacionDolar,
+    Rubro,
+    Section,
+    TipoDolar,
+    Trabajo,
+)
+from .tabla_dolar import ErrorTablaDolar, PaginaCotizaciones, guardar_cotizaciones, leer_csv
+from .testing import EmpresaDePruebaMixin, crear_empresa_de_prueba
+
+
+class CotizacionesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(nombre="ACME")
+        cls.tipo = TipoDolar.objects.create(nombre="Oficial", company=cls.company)
+        for dia, valor in ((1, "1000"), (10, "1100")):
+            CotizacionDolar.objects.create(
+                fecha=date(2026, 1, dia), tipo=cls.tipo, valor=Decimal(valor), company=cls.company
+            )
+
+    def setUp(self):
+        cache.clear()
+        memo.limpiar()
+
+    def test_fecha_exacta_y_anterior(self):
+        c, t = self.company.pk, self.tipo.pk
+        self.assertEqual(cotizacion(c, t, date(2026, 1, 10)), Decimal("1100"))
+        self.assertIsNone(cotizacion(c, t, date(2026, 1, 5)))
+        self.assertEqual(cotizacion(c, t, date(2026, 1, 5), anterior=True), Decimal("1000"))
+        self.assertIsNone(cotizacion(c, t, date(2025, 12, 31), anterior=True))
+
+    def test_una_consulta_y_recarga_al_guardar(self):
+        c, t = self.company.pk, self.tipo.pk
+        cotizacion(c, t, date(2026, 1, 1))
+        with self.assertNumQueries(0):
+            for _ in range(5):
+                cotizacion(c, t, date(2026, 1, 1))
+        CotizacionDolar.objects.filter(fecha=date(2026, 1, 1)).get().delete()
+        self.assertIsNone(cotizacion(c, t, date(2026, 1, 1)))
+
+    def test_a_usd(self):
+        montos = [Decimal("2000"), Decimal("0"), Decimal("5")]
+        self.assertEqual(
+            a_usd(montos, Decimal("1000"), ["ARS", "ARS", "USD"]),
+            [Decimal("2"), Decimal("0"), Decimal("5")],
+        )
+        self.assertEqual(a_usd(montos, None), [None, Decimal("0"), None])
+
+
+class CacheCompartidoTests(TestCase):
+    def test_avisa_si_el_cache_es_por_proceso(self):
+        self.assertEqual(cache_compartido(None), [])
+        locmem = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+        with override_settings(CACHES=locmem):
+            self.assertEqual([w.id for w in cache_compartido(None)], ["general.W001"])
+
+
+class MembershipCacheadoTests(EmpresaDePruebaMixin, TestCase):
+    """Quitar o recortar a un miembro le corta el acceso en el request siguiente."""
+
+    def setUp(self):
+        super().setUp()
+        d = self.datos
+        self.usuario = User.objects.create_user("miembro", password="x")
+        self.membership = CompanyMembership.objects.create(user=self.usuario, company=d.company)
+        CompanyMembershipSection.objects.create(
+            membership=self.membership, section=Section.objects.get(code="presupuestos")
+        )
+        # Cliente aparte: el membership queda en el cache con sus secciones.
+        self.miembro = Client()
+        self.miembro.force_login(self.usuario)
+        sesion = self.miembro.session
+        sesion["company_id"] = d.company.pk
+        sesion.save()
+        self.assertEqual(self.miembro.get(reverse("presupuestos:presupuesto_list")).status_code, 200)
+
+    def test_quitar_miembro(self):
+        respuesta = self.client.post(reverse("general:member_remove", args=[self.membership.pk]))
+        self.assertEqual(respuesta.status_code, 302)
+        respuesta = self.miembro.get(reverse("presupuestos:presupuesto_list"))
+        self.assertRedirects(respuesta, reverse("usuarios:company_select"), fetch_redirect_response=False)
+
+    def test_quitar_seccion(self):
+        CompanyMembershipSection.objects.filter(membership=self.membership).delete()
+        respuesta = self.miembro.get(reverse("presupuestos:presupuesto_list"))
+        self.assertRedirects(respuesta, reverse("no_section_access"), fetch_redirect_response=False)
+
+
+def _sumar(job, a, b):
+    return {"suma": a + b}
+
+
+def _fallar(job):
+    raise RuntimeError("se rompió")
+
+
+TIPOS_DE_PRUEBA = {"prueba.sumar": _sumar, "prueba.fallar": _fallar}
+
+
+@override_settings(TRABAJOS_EN_PROCESO=False)
+class TrabajosTests(TestCase):
+    def setUp(self):
+        registro = mock.patch.dict(trabajos.REGISTRO, TIPOS_DE_PRUEBA)
+        registro.start()
+        self.addCleanup(registro.stop)
+
+    def test_encolar_y_ejecutar(self):
+        job = trabajos.encolar("prueba.sumar", a=2, b=3)
+        self.assertEqual(job.estado, Trabajo.PENDIENTE)
+        self.assertEqual(trabajos.pendientes(), [job.pk])
+        self.assertTrue(trabajos.ejecutar(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.estado, Trabajo.TERMINADO)
+        self.assertEqual(job.resultado, {"suma": 5})
+        self.assertIsNotNone(job.iniciado_en)
+        self.assertIsNotNone(job.terminado_en)
+        self.assertEqual(trabajos.pendientes(), [])
+        # Ya no está pendiente: otro ejecutor no lo vuelve a correr.
+        self.assertFalse(trabajos.ejecutar(job.pk))
+
+    def test_tomar_una_sola_vez(self):
+        job = trabajos.encolar("prueba.sumar", a=1, b=1)
+        self.assertTrue(trabajos.tomar(job.pk))
+        self.assertFalse(trabajos.tomar(job.pk))
+        self.assertEqual(Trabajo.objects.get(pk=job.pk).estado, Trabajo.EN_CURSO)
+
+    def test_error_queda_guardado(self):
+        job = trabajos.encolar("prueba.fallar")
+        with self.assertLogs("general.trabajos", "ERROR"):
+            self.assertTrue(trabajos.ejecutar(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.estado, Trabajo.ERROR)
+        self.assertIn("RuntimeError: se rompió", job.error)
+        self.assertIsNone(job.resultado)
+
+    def test_unico_no_duplica_pendientes(self):
+        primero = trabajos.encolar("prueba.sumar", unico=True, a=1, b=2)
+        self.assertEqual(trabajos.encolar("prueba.sumar", unico=True, a=1, b=2), primero)
+        otro = trabajos.encolar("prueba.sumar", unico=True, a=1, b=3)
+        self.assertNotEqual(otro, primero)
+        trabajos.ejecutar(primero.pk)
+        # El terminado ya no cuenta: se encola uno nuevo.
+        self.assertNotEqual(trabajos.encolar("prueba.sumar", unico=True, a=1, b=2), primero)
+
+    def test_tipo_no_registrado(self):
+        with self.assertRaises(ValueError):
+            trabajos.encolar("prueba.inexistente")
+
+
+@override_settings(TRABAJOS_EN_PROCESO=False)
+class ProcesarTrabajosTests(TransactionTestCase):
+    def setUp(self):
+        registro = mock.patch.dict(trabajos.REGISTRO, TIPOS_DE_PRUEBA)
+        registro.start()
+        self.addCleanup(registro.stop)
+
+    def procesar(self, *args):
+        salida = StringIO()
+        call_command("procesar_trabajos", "--una-vez", "--hilos", "1", *args, stdout=salida)
+        return salida.getvalue()
+
+    def test_ejecuta_los_pendientes(self):
+        job = trabajos.encolar("prueba.sumar", a=4, b=5)
+        self.assertIn("Trabajos ejecutados: 1", self.procesar())
+        job.refresh_from_db()
+        self.assertEqual(job.estado, Trabajo.TERMINADO)
+        self.assertEqual(job.resultado, {"suma": 9})
+
+    def test_reencolar_colgados(self):
+        hace_una_hora = timezone.now() - timedelta(hours=1)
+        colgado = trabajos.encolar("prueba.sumar", a=1, b=1)
+        reciente = trabajos.encolar("prueba.sumar", a=2, b=2)
+        Trabajo.objects.filter(pk=colgado.pk).update(estado=Trabajo.EN_CURSO, iniciado_en=hace_una_hora)
+        Trabajo.objects.filter(pk=reciente.pk).update(estado=Trabajo.EN_CURSO, iniciado_en=timezone.now())
+        salida = self.procesar("--reencolar-colgados", "30")
+        self.assertIn("Reencolados 1 trabajos colgados.", salida)
+        self.assertEqual(Trabajo.objects.get(pk=colgado.pk).estado, Trabajo.TERMINADO)
+        self.assertEqual(Trabajo.objects.get(pk=reciente.pk).estado, Trabajo.EN_CURSO)
+
+    def test_purgar(self):
+        viejo = timezone.now() - timedelta(days=40)
+        terminado = Trabajo.objects.create(tipo="prueba.sumar", estado=Trabajo.TERMINADO, terminado_en=viejo)
+        fallado = Trabajo.objects.create(tipo="prueba.fallar", estado=Trabajo.ERROR, terminado_en=viejo)
+        nuevo = Trabajo.objects.create(tipo="prueba.sumar", estado=Trabajo.TERMINADO, terminado_en=timezone.now())
+        colgado = Trabajo.objects.create(tipo="prueba.sumar", estado=Trabajo.EN_CURSO, iniciado_en=viejo)
+        self.assertIn("Borrados 2 trabajos viejos.", self.procesar("--purgar", "30"))
+        self.assertFalse(Trabajo.objects.filter(pk__in=[terminado.pk, fallado.pk]).exists())
+        self.assertEqual(Trabajo.objects.filter(pk__in=[nuevo.pk, colgado.pk]).count(), 2)
+
+
+class NormalizarSqlTests(TestCase):
+    def test_valores_y_listas_quedan_iguales(self):
+        a = normalizar_sql("SELECT * FROM t WHERE id = 12 AND nombre = 'O''Brien' AND x IN (%s, %s)")
+        b = normalizar_sql("SELECT *\n  FROM t WHERE id = 7 AND nombre = 'x' AND x IN (%s, %s, %s, %s)")
+        self.assertEqual(a, "SELECT * FROM t WHERE id = ? AND nombre = ? AND x IN (%s, ...)")
+        self.assertEqual(a, b)
+        self.assertEqual(huella("SELECT 1 FROM t"), huella("SELECT 2  FROM t"))
+        self.assertNotEqual(huella("SELECT 1 FROM t"), huella("SELECT 1 FROM u"))
+
+    def test_resumir(self):
+        repetida = {"huella": "abc", "veces": 3, "sql": "SELECT ..."}
+        registros = [
+            {"vista": "a", "ms": 100, "db_ms": 10, "consultas": 5, "repetidas": [repetida]},
+            {"vista": "a", "ms": 300, "db_ms": 30, "consultas": 9, "repetidas": [repetida]},
+            {"vista": "a", "ms": 200, "db_ms": 20, "consultas": 7},
+            {"path": "/b/", "ms": 900, "db_ms": 1, "consultas": 1, "repetidas": [dict(repetida, veces=2)]},
+        ]
+        resumen = resumir(registros, top=5)
+        self.assertEqual(resumen["requests"], 4)
+        self.assertEqual(
+            resumen["vistas"],
+            [
+                {"vista": "/b/", "requests": 1, "ms_max": 900, "ms_mediana": 900, "db_ms_promedio": 1.0,
+                 "consultas_max": 1},
+                {"vista": "a", "requests": 3, "ms_max": 300, "ms_mediana": 200, "db_ms_promedio": 20.0,
+                 "consultas_max": 9},
+            ],
+        )
+        self.assertEqual(
+            resumen["repetidas"],
+            [{"huella": "abc", "veces": 8, "requests": 3, "vistas": ["/b/", "a"], "sql": "SELECT ..."}],
+        )
+        self.assertEqual(len(resumir(registros, top=1)["vistas"]), 1)
+
+
+@override_settings(INSTRUMENTACION=True, INSTRUMENTACION_UMBRAL_MS=0)
+class InstrumentacionTests(EmpresaDePruebaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        registrar = mock.patch.object(InstrumentacionMiddleware, "_registrar")
+        self.registrar = registrar.start()
+        self.addCleanup(registrar.stop)
+
+    def test_server_timing_y_registro(self):
+        respuesta = self.client.get(reverse("compras:compras_list"))
+        self.assertRegex(respuesta["Server-Timing"], r'^db;dur=[\d.]+;desc="\d+ consultas", total;dur=[\d.]+$')
+        self.registrar.assert_called_once()
+        _, _, medicion, _ = self.registrar.call_args.args
+        self.assertGreater(medicion.consultas, 0)
+
+    def test_streaming_se_mide_hasta_el_final(self):
+        respuesta = self.client.get(
+            reverse("presupuestos:presupuesto_exportar", args=[self.datos.presupuesto.pk])
+        )
+        self.assertIn("Server-Timing", respuesta)
+        self.registrar.assert_not_called()
+        cuerpo = b"".join(respuesta.streaming_content).decode()
+        self.assertIn("Muro 15", cuerpo)
+        self.registrar.assert_called_once()
+        _, _, medicion, _ = self.registrar.call_args.args
+        # Las consultas del CSV corren mientras se consume el cuerpo.
+        consultas = int(respuesta["Server-Timing"].split('desc="')[1].split()[0])
+        self.assertGreater(medicion.consultas, consultas)
+
+    @override_settings(INSTRUMENTACION_UMBRAL_MS=60_000)
+    def test_bajo_el_umbral_no_registra(self):
+        respuesta = self.client.get(reverse("compras:compras_list"))
+        self.assertIn("Server-Timing", respuesta)
+        self.registrar.assert_not_called()
+
+
+class TablaDolarTests(EmpresaDePruebaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        d = self.datos
+        self.blue = TipoDolar.objects.create(nombre="Blue", company=d.company)
+        self.tipos = [self.blue, d.tipo_dolar]
+
+    def test_guardar_cotizaciones_actualiza_e_inserta(self):
+        d = self.datos
+        guardar_totales(d.presupuesto)
+        self.assertEqual(cotizacion(d.company.pk, d.tipo_dolar.pk, d.fecha_dolar), Decimal("1000"))
+        guardadas = guardar_cotizaciones(
+            d.company,
+            {
+                (d.fecha_dolar, d.tipo_dolar.pk): Decimal("1050"),
+                (d.fecha_dolar, self.blue.pk): Decimal("1400"),
+                (date(2026, 1, 2), d.tipo_dolar.pk): Decimal("1060"),
+            },
+        )
+        self.assertEqual(guardadas, 3)
+        self.assertEqual(CotizacionDolar.objects.filter(company=d.company).count(), 3)
+        # bulk_create no dispara signals: la tabla memoizada y los totales se invalidan a mano.
+        self.assertEqual(cotizacion(d.company.pk, d.tipo_dolar.pk, d.fecha_dolar), Decimal("1050"))
+        self.assertEqual(cotizacion(d.company.pk, self.blue.pk, d.fecha_dolar), Decimal("1400"))
+        d.presupuesto.refresh_from_db()
+        self.assertFalse(d.presupuesto.totales_vigentes)
+        self.assertEqual(guardar_cotizaciones(d.company, {}), 0)
+
+    def test_leer_csv_ancho(self):
+        d = self.datos
+        lineas = [
+            "Fecha;Oficial;BLUE",
+            "2026-01-02;1.050,5;1400",
+            "",
+            "03/01/2026;1060;",
+            "2026-01-02;1055;1410",  # fecha repetida: vale la última
+            "32/01/2026;1000;1000",
+            "2026-01-04;-5;1000",
+            "2026-01-05;mil;1000",
+        ]
+        valores, resultado = leer_csv(lineas, self.tipos)
+        self.assertEqual(
+            valores,
+            {
+                (date(2026, 1, 2), d.tipo_dolar.pk): Decimal("1055"),
+                (date(2026, 1, 2), self.blue.pk): Decimal("1410"),
+                (date(2026, 1, 3), d.tipo_dolar.pk): Decimal("1060"),
+            },
+        )
+        self.assertEqual((resultado.leidas, resultado.con_error), (6, 3))
+        self.assertEqual([p[1] for p in resultado.problemas], ["32/01/2026", "2026-01-04", "2026-01-05"])
+        # Una fila con error no guarda ninguna de sus celdas.
+        self.assertNotIn((date(2026, 1, 4), self.blue.pk), valores)
+
+    def test_leer_csv_largo(self):
+        d = self.datos
+        lineas = ["fecha,tipo,valor", "2026-01-02,oficial,1050", "2026-01-02,Tarjeta,1500", "2026-01-03,Blue,"]
+        valores, resultado = leer_csv(lineas, self.tipos)
+        self.assertEqual(valores, {(date(2026, 1, 2), d.tipo_dolar.pk): Decimal("1050")})
+        self.assertEqual(resultado.problemas, [(3, "2026-01-02", "tipo desconocido: Tarjeta")])
+
+    def test_leer_csv_sin_columnas(self):
+        with self.assertRaises(ErrorTablaDolar):
+            leer_csv(["dia,oficial", "2026-01-02,1000"], self.tipos)
+        with self.assertRaises(ErrorTablaDolar):
+            leer_csv(["fecha,euro", "2026-01-02,1000"], self.tipos)
+
+    def test_carga_csv_desde_la_vista(self):
+        d = self.datos
+        respuesta = self.client.post(
+            reverse("general:tabla_dolar"),
+            {"accion": "csv", "csv": "fecha,Oficial,Blue\n2026-01-01,1100,1500\n2026-13-01,1,1"},
+        )
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.context["resultado"].guardadas, 2)
+        self.assertEqual(respuesta.context["resultado"].con_error, 1)
+        self.assertEqual(
+            CotizacionDolar.objects.get(company=d.company, tipo=d.tipo_dolar, fecha=d.fecha_dolar).valor,
+            Decimal("1100"),
+        )
+
+    def test_pagina_pivoteada(self):
+        d = self.datos
+        guardar_cotizaciones(
+            d.company,
+            {(date(2026, 1, dia), tipo.pk): Decimal(1000 + dia) for dia in range(2, 6) for tipo in self.tipos},
+        )
+        # Solo Oficial el 1/1 (viene de crear_empresa_de_prueba).
+        with self.assertNumQueries(1):
+            pagina = PaginaCotizaciones(d.company, self.tipos, por_pagina=2)
+        self.assertEqual([f["fecha"] for f in pagina.filas], [date(2026, 1, 5), date(2026, 1, 4)])
+        self.assertEqual(pagina.filas[0]["celdas"], [(self.blue, Decimal("1005")), (d.tipo_dolar, Decimal("1005"))])
+        fechas = []
+        while True:
+            fechas += [f["fecha"] for f in pagina.filas]
+            if not pagina.siguiente:
+                break
+            pagina = PaginaCotizaciones(d.company, self.tipos, antes=pagina.siguiente, por_pagina=2)
+        self.assertEqual(fechas, [date(2026, 1, dia) for dia in range(5, 0, -1)])
+        self.assertEqual(pagina.filas[-1]["celdas"], [(self.blue, None), (d.tipo_dolar, Decimal("1000"))])
+
+        pagina = PaginaCotizaciones.desde_request(
+            d.company, self.tipos, {"desde": "02/01/2026", "hasta": "2026-01-04", "antes": "x", "por_pagina": "0"}
+        )
+        self.assertEqual([f["fecha"] for f in pagina.filas], [date(2026, 1, 4)])
+        self.assertEqual(pagina.siguiente, date(2026, 1, 4))
+        pagina = PaginaCotizaciones.desde_request(d.company, self.tipos, {"por_pagina": "mucho"})
+        self.assertEqual(len(pagina.filas), 5)
+        self.assertIsNone(pagina.siguiente)
+
+
+class LecturaTests(TestCase):
+    def test_normalizar(self):
+        self.assertEqual(normalizar("  Dólar   BLUE "), "dolar blue")
+        self.assertEqual(normalizar(None), "")
+
+    def test_lector_csv_detecta_separador(self):
+        for separador in (";", ",", "\t"):
+            with self.subTest(separador=separador):
+                lineas = iter([f"fecha{separador}valor", f"2026-01-01{separador}1.5"])
+                self.assertEqual(list(lector_csv(lineas)), [{"fecha": "2026-01-01", "valor": "1.5"}])
+
+
+class EstadisticasTests(EmpresaDePruebaMixin, TestCase):
+    def consultas_de_datos(self, consultas):
+        # Sin las del cache de base de datos (y sus savepoints).
+        return [q["sql"] for q in consultas if q["sql"].startswith("SELECT") and "cache_presupuesto" not in q["sql"]]
+
+    def test_contadores_iguales_a_count(self):
+        d = self.datos
+        crear_empresa_de_prueba("Otra")  # no se cuenta
+        HojaPrecios.objects.create(nombre="Abril", company=d.company)  # hoja vacía: no aparece
+        otro_lote = Lote.objects.create(
+            nombre="Lote 2", company=d.company, hoja_materiales=d.hoja_materiales,
+            hoja_mano_de_obra=d.hoja_mano_de_obra, hoja_subcontratos=d.hoja_subcontratos,
+        )
+        Tarea.objects.create(nombre="Piso", company=d.company, rubro=d.rubro, subrubro=d.subrubro, lote=otro_lote)
+        Tarea.objects.create(nombre="Techo", company=d.company, rubro=d.rubro, subrubro=d.subrubro, lote=otro_lote)
+        with CaptureQueriesContext(connection) as consultas:
+            datos = estadisticas(d.company)
+        self.assertEqual(len(self.consultas_de_datos(consultas)), 1)
+        for clave, etiqueta in CONTADORES.items():
+            with self.subTest(clave):
+                self.assertEqual(datos[clave], apps.get_model(etiqueta).objects.filter(company=d.company).count())
+        for clave, (etiqueta, campo, ruta_company) in AGRUPADOS.items():
+            with self.subTest(clave):
+                esperado = [
+                    {"id": f[f"{campo}_id"], "nombre": f[f"{campo}__nombre"], "cantidad": f["cantidad"]}
+                    for f in apps.get_model(etiqueta).objects.filter(**{ruta_company: d.company.pk})
+                    .values(f"{campo}_id", f"{campo}__nombre")
+                    .annotate(cantidad=Count("pk"))
+                    .order_by(f"{campo}__nombre")
+                ]
+                self.assertEqual(datos[clave], esperado)
+        self.assertEqual(
+            [(f["nombre"], f["cantidad"]) for f in datos["tareas_por_lote"]], [("Lote 1", 1), ("Lote 2", 2)]
+        )
+        # Cacheado: la segunda vez no consulta la base.
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(estadisticas(d.company), datos)
+        self.assertFalse(self.consultas_de_datos(consultas))
+
+    def test_signals_refrescan_los_contadores(self):
+        d = self.datos
+        self.assertEqual(estadisticas(d.company)["materiales"], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            material = Material.objects.create(
+                nombre="Cal", company=d.company, tipo=d.tipo, categoria=d.categoria,
+                unidad_de_venta=d.unidad, precio_unidad_venta=Decimal("40"),
+            )
+        self.assertEqual(estadisticas(d.company)["materiales"], 2)
+
+        # Editar no cambia cantidades: no invalida.
+        material.precio_unidad_venta = Decimal("45")
+        material.save()
+        self.assertIsNotNone(cache.get(f"general:estadisticas:{d.company.pk}"))
+
+        # Renombrar un lote sí (su nombre se muestra), y borrar una fila de hoja también.
+        d.lote.nombre = "Lote renombrado"
+        d.lote.save()
+        self.assertEqual(estadisticas(d.company)["tareas_por_lote"][0]["nombre"], "Lote renombrado")
+        HojaPrecioMaterial.objects.filter(hoja=d.hoja_materiales).get().delete()
+        self.assertEqual(estadisticas(d.company)["materiales_por_hoja"], [])
+
+        material.delete()
+        self.assertEqual(estadisticas(d.company)["materiales"], 1)
+
+    def test_invalidar_a_mano_despues_de_bulk_create(self):
+        d = self.datos
+        self.assertEqual(estadisticas(d.company)["rubros"], 1)
+        Rubro.objects.bulk_create([Rubro(nombre=f"Rubro {i}", company=d.company) for i in range(3)])
+        self.assertEqual(estadisticas(d.company)["rubros"], 1)  # bulk_create no dispara signals
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            invalidar_estadisticas(d.company.pk)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(estadisticas(d.company)["rubros"], 4)
+        # Otra empresa no se toca.
+        otra = crear_empresa_de_prueba("Otra")
+        estadisticas(otra.company)
+        invalidar_estadisticas(d.company.pk)
+        self.assertIsNotNone(cache.get(f"general:estadisticas:{otra.company.pk}"))
+
+
+class VersionMemoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        memo.limpiar()
+
+    def test_version_se_lee_una_vez_por_request(self):
+        version = memo.version("prueba:version")
+        cache.incr("prueba:version")  # otro proceso
+        self.assertEqual(memo.version("prueba:version"), version)
+        memo.limpiar()
+        self.assertEqual(memo.version("prueba:version"), version + 1)
+
+    def test_invalidar_sube_ahora_y_al_confirmar(self):
+        version = memo.version("prueba:version")
+        llamadas = []
+        with self.captureOnCommitCallbacks(execute=True):
+            memo.invalidar_version("prueba:version", al_subir=lambda: llamadas.append(1))
+            self.assertEqual(memo.version("prueba:version"), version + 1)
+        self.assertEqual(memo.version("prueba:version"), version + 2)
+        self.assertEqual(len(llamadas), 2)
+
+    def test_version_perdida_no_se_repite(self):
+        version = memo.version("prueba:version")
+        cache.delete("prueba:version")
+        memo.invalidar_version("prueba:version")
+        self.assertGreater(memo.version("prueba:version"), version)
@@ -0,0 +1,137 @@
+"""
+Trabajos en segundo plano sin broker externo.
+
+Los trabajos se guardan en la tabla Trabajo. Una vista llama a encolar(); al
+confirmar la transacción el trabajo se manda al pool de hilos del propio
+proceso (si TRABAJOS_EN_PROCESO está activo) y, en todo caso, cualquier
+`manage.py procesar_trabajos` puede tomarlo. Tomar un trabajo es un UPDATE
+condicionado al estado, así que dos ejecutores nunca corren el mismo.
+
+Cada tipo de trabajo se registra con el decorador @trabajo("nombre"); la
+función recibe el Trabajo y sus parámetros, y lo que devuelve (serializable a
+JSON) queda en Trabajo.resultado.
+"""
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from . import memo
+from .models import Trabajo
+
+logger = logging.getLogger(__name__)
+
+REGISTRO = {}
+
+_pool = None
+
+
+def trabajo(tipo):
+    """Registra la función que ejecuta los trabajos de este tipo."""
+    def decorador(funcion):
+        REGISTRO[tipo] = funcion
+        return funcion
+    return decorador
+
+
+def _en_proceso():
+    return getattr(settings, "TRABAJOS_EN_PROCESO", True)
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(
+            max_workers=getattr(settings, "TRABAJOS_HILOS", 2),
+            thread_name_prefix="trabajos",
+        )
+    return _pool
+
+
+def encolar(tipo, company=None, usuario=None, unico=False, **parametros):
+    """
+    Crea un Trabajo pendiente y lo programa al confirmar la transacción.
+    Con unico=True no crea otro si ya hay uno pendiente igual (mismo tipo,
+    empresa y parámetros) y devuelve ese.
+    """
+    if tipo not in REGISTRO:
+        raise ValueError(f"Tipo de trabajo no registrado: {tipo}")
+    if unico:
+        existente = Trabajo.objects.filter(
+            tipo=tipo, company=company, estado=Trabajo.PENDIENTE, parametros=parametros
+        ).first()
+        if existente:
+            return existente
+    if usuario is not None and not usuario.is_authenticated:
+        usuario = None
+    job = Trabajo.objects.create(
+        tipo=tipo, company=company, usuario=usuario, parametros=parametros
+    )
+    if _en_proceso():
+        transaction.on_commit(lambda: _get_pool().submit(_ejecutar_en_hilo, job.pk))
+    return job
+
+
+def _ejecutar_en_hilo(pk):
+    try:
+        ejecutar(pk)
+    finally:
+        connection.close()
+
+
+def tomar(pk):
+    """Pasa el trabajo a 'en curso' si sigue pendiente. True si lo tomó este ejecutor."""
+    return bool(
+        Trabajo.objects.filter(pk=pk, estado=Trabajo.PENDIENTE).update(
+            estado=Trabajo.EN_CURSO, iniciado_en=timezone.now()
+        )
+    )
+
+
+def ejecutar(pk):
+    """Toma y ejecuta el trabajo. Devuelve False si otro ejecutor ya lo tenía."""
+    close_old_connections()
+    if not tomar(pk):
+        return False
+    job = Trabajo.objects.get(pk=pk)
+    funcion = REGISTRO.get(job.tipo)
+    # Como un request: lee el cache compartido de nuevo (ver general.memo).
+    memo.limpiar()
+    try:
+        if funcion is None:
+            raise ValueError(f"Tipo de trabajo no registrado: {job.tipo}")
+        resultado = funcion(job, **job.parametros)
+    except Exception:
+        logger.exception("Trabajo %s (%s) falló", job.pk, job.tipo)
+        Trabajo.objects.filter(pk=job.pk).update(
+            estado=Trabajo.ERROR,
+            error=traceback.format_exc(),
+            terminado_en=timezone.now(),
+        )
+    else:
+        Trabajo.objects.filter(pk=job.pk).update(
+            estado=Trabajo.TERMINADO,
+            resultado=resultado,
+            terminado_en=timezone.now(),
+        )
+    finally:
+        memo.limpiar()
+    return True
+
+
+def informar_progreso(job, texto):
+    """Guarda un texto de progreso visible en la página del trabajo."""
+    job.progreso = texto[:255]
+    Trabajo.objects.filter(pk=job.pk).update(progreso=job.progreso)
+
+
+def pendientes():
+    """Ids de trabajos pendientes, del más viejo al más nuevo."""
+    return list(
+        Trabajo.objects.filter(estado=Trabajo.PENDIENTE)
+        .order_by("creado_en", "pk")
+        .values_list("pk", flat=True)
+    )
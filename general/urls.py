@@ -109,6 +109,10 @@ urlpatterns = [
     path("tipos-dolar/<int:pk>/eliminar/", views.tipo_dolar_delete, name="tipo_dolar_delete"),
     # Tabla de dólar
     path("tabla-dolar/", views.tabla_dolar, name="tabla_dolar"),
+    # Trabajos en segundo plano
+    path("trabajos/", views.trabajo_list, name="trabajo_list"),
+    path("trabajos/<int:pk>/", views.trabajo_detalle, name="trabajo_detalle"),
+    path("trabajos/<int:pk>/estado/", views.trabajo_estado, name="trabajo_estado"),
     # Gestión de usuarios (solo admin)
     path("miembros/", views.member_list, name="member_list"),
     path("miembros/agregar/", views.member_add, name="member_add"),
@@ -1,6 +1,8 @@
+import io
 from decimal import Decimal, InvalidOperation
 
 from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 
@@ -16,10 +18,11 @@ from general.models import (
     Subrubro,
     TipoDolar,
     TipoMaterial,
+    Trabajo,
     Unidad,
 )
-from recursos.models import Lote, ManoDeObra, Material, Mezcla, Subcontrato, Tarea
 
+from .estadisticas import estadisticas
 from .forms import (
     CategoriaMaterialForm,
     EquipoForm,
@@ -34,27 +37,10 @@ from .forms import (
     TipoMaterialForm,
     UnidadForm,
 )
+from .middleware import invalidar_membership
 
-
-def _get_totales(company):
-    return {
-        "ref_equipos": RefEquipo.objects.filter(company=company).count(),
-        "rubros": Rubro.objects.filter(company=company).count(),
-        "subrubros": Subrubro.objects.filter(company=company).count(),
-        "unidades": Unidad.objects.filter(company=company).count(),
-        "tipos_material": TipoMaterial.objects.filter(company=company).count(),
-        "categorias_material": CategoriaMaterial.objects.filter(company=company).count(),
-        "equipos": Equipo.objects.filter(company=company).count(),
-        "materiales": Material.objects.filter(company=company).count(),
-        "mano_de_obra": ManoDeObra.objects.filter(company=company).count(),
-        "subcontratos": Subcontrato.objects.filter(company=company).count(),
-        "mezclas": Mezcla.objects.filter(company=company).count(),
-        "lotes": Lote.objects.filter(company=company).count(),
-        "tareas": Tarea.objects.filter(company=company).count(),
-        "proveedores": Proveedor.objects.filter(company=company).count(),
-        "tipos_dolar": TipoDolar.objects.filter(company=company).count(),
-        "obras": Obra.objects.filter(company=company).count(),
-    }
+# Filas vacías que se agregan al final de la grilla editable de la Tabla de Dólar.
+FILAS_NUEVAS_GRILLA = 5
 
 
 @login_required
@@ -66,8 +52,7 @@ def dashboard(request):
 @login_required
 def indice(request):
     """Catálogos generales (antes Catálogos generales)."""
-    company = request.company
-    return render(request, "general/indice.html", {"totales": _get_totales(company)})
+    return render(request, "general/indice.html", {"totales": estadisticas(request.company)})
 
 
 @login_required
@@ -648,57 +633,82 @@ def tipo_dolar_delete(request, pk):
 
 @login_required
 def tabla_dolar(request):
-    """Tabla de cotizaciones: fecha + columnas por tipo de dólar."""
+    """
+    Tabla de cotizaciones: fecha + columnas por tipo de dólar. Se carga de a una
+    fila, editando la grilla (?editar=1) o pegando/subiendo un CSV; todo se
+    guarda con un solo upsert (ver general.tabla_dolar).
+    """
+    from .tabla_dolar import (
+        ErrorTablaDolar,
+        PaginaCotizaciones,
+        ResultadoCarga,
+        guardar_cotizaciones,
+        leer_csv,
+        leer_fecha,
+        leer_grilla,
+    )
+
     company = request.company
-    tipos = TipoDolar.objects.filter(company=company).order_by("nombre")
+    tipos = list(TipoDolar.objects.filter(company=company).order_by("nombre"))
+    resultado = None
+    error_csv = None
 
     if request.method == "POST":
-        fecha_str = request.POST.get("fecha")
-        if fecha_str:
-            from datetime import datetime
+        accion = request.POST.get("accion", "fila")
+        if accion == "fila":
+            valores = {}
             try:
-                fecha = datetime.strptime(fecha_str, "%Y-%m-%d").date()
+                fecha = leer_fecha(request.POST.get("fecha"))
+            except ValueError:
+                fecha = None
+            if fecha:
                 for tipo in tipos:
                     val = request.POST.get(f"tipo_{tipo.pk}")
                     if val is not None and val.strip() != "":
                         try:
-                            valor = Decimal(val.strip().replace(",", "."))
-                            CotizacionDolar.objects.update_or_create(
-                                company=company,
-                                fecha=fecha,
-                                tipo=tipo,
-                                defaults={"valor": valor},
-                            )
-                        except (ValueError, InvalidOperation):
+                            valores[(fecha, tipo.pk)] = Decimal(val.strip().replace(",", "."))
+                        except InvalidOperation:
                             pass
+                guardar_cotizaciones(company, valores)
                 return redirect("general:tabla_dolar")
-            except ValueError:
-                pass
-
-    from django.db.models import Min
-    fechas = CotizacionDolar.objects.filter(company=company).values_list(
-        "fecha", flat=True
-    ).distinct().order_by("-fecha")[:200]  # últimas 200 fechas
-
-    cotizacion_por_fecha = {}
-    for c in CotizacionDolar.objects.filter(
-        company=company, fecha__in=fechas
-    ).select_related("tipo"):
-        if c.fecha not in cotizacion_por_fecha:
-            cotizacion_por_fecha[c.fecha] = {}
-        cotizacion_por_fecha[c.fecha][c.tipo_id] = c.valor
-
-    rows = []
-    for fecha in fechas:
-        valores = [cotizacion_por_fecha.get(fecha, {}).get(t.pk) for t in tipos]
-        rows.append({"fecha": fecha, "valores": valores})
-
+        else:
+            valores, resultado = {}, ResultadoCarga()
+            if accion == "grilla":
+                valores, resultado = leer_grilla(request.POST, tipos)
+            elif accion == "csv":
+                archivo = request.FILES.get("archivo")
+                if archivo:
+                    lineas = io.TextIOWrapper(archivo.file, encoding="utf-8-sig", errors="replace", newline="")
+                else:
+                    lineas = request.POST.get("csv", "").splitlines()
+                try:
+                    valores, resultado = leer_csv(lineas, tipos)
+                except ErrorTablaDolar as exc:
+                    error_csv = str(exc)
+            resultado.guardadas = guardar_cotizaciones(company, valores)
+            if accion == "grilla" and not resultado.problemas:
+                return redirect(request.get_full_path())
+
+    pagina = PaginaCotizaciones.desde_request(company, tipos, request.GET)
+    editar = request.GET.get("editar") == "1"
+    params = request.GET.copy()
+    params.pop("antes", None)
+    url_siguiente = None
+    if pagina.siguiente:
+        params["antes"] = pagina.siguiente.isoformat()
+        url_siguiente = f"?{params.urlencode()}"
     return render(
         request,
         "general/tabla_dolar.html",
         {
             "tipos": tipos,
-            "rows": rows,
+            "rows": pagina.filas,
+            "pagina": pagina,
+            "url_siguiente": url_siguiente,
+            "editar": editar,
+            "filas_nuevas": range(len(pagina.filas), len(pagina.filas) + FILAS_NUEVAS_GRILLA),
+            "resultado": resultado,
+            "error_csv": error_csv,
         },
     )
 
@@ -755,6 +765,7 @@ def member_edit(request, pk):
         form = MemberEditForm(request.POST, company=company, membership=membership)
         if form.is_valid():
             form.save()
+            invalidar_membership(membership.user_id, membership.company_id)
             return redirect("general:member_list")
     else:
         form = MemberEditForm(company=company, membership=membership)
@@ -773,6 +784,7 @@ def member_remove(request, pk):
     membership = get_object_or_404(CompanyMembership, pk=pk, company=request.company)
     if request.method == "POST":
         membership.delete()
+        invalidar_membership(membership.user_id, membership.company_id)
         return redirect("general:member_list")
     return render(
         request,
@@ -783,3 +795,39 @@ def member_remove(request, pk):
             "message": "¿Quitar este usuario de la empresa?",
         },
     )
+
+
+def _trabajo_json(job):
+    return {
+        "id": job.pk,
+        "tipo": job.tipo,
+        "estado": job.estado,
+        "estado_display": job.get_estado_display(),
+        "progreso": job.progreso,
+        "finalizado": job.finalizado,
+        "resultado": job.resultado,
+        "error": bool(job.error),
+    }
+
+
+@login_required
+def trabajo_list(request):
+    """Últimos trabajos en segundo plano de la empresa."""
+    trabajos = Trabajo.objects.filter(company=request.company).select_related(
+        "usuario"
+    )[:50]
+    return render(request, "general/trabajo_list.html", {"trabajos": trabajos})
+
+
+@login_required
+def trabajo_detalle(request, pk):
+    """Estado de un trabajo; la página consulta trabajo_estado hasta que termina."""
+    job = get_object_or_404(Trabajo, pk=pk, company=request.company)
+    return render(request, "general/trabajo_detalle.html", {"trabajo": job})
+
+
+@login_required
+def trabajo_estado(request, pk):
+    """Estado del trabajo en JSON (para polling)."""
+    job = get_object_or_404(Trabajo, pk=pk, company=request.company)
+    return JsonResponse(_trabajo_json(job))
@@ -75,6 +75,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "general.instrumentacion.InstrumentacionMiddleware",  # solo con INSTRUMENTACION activa
     "general.middleware.CompanyMiddleware",  # request.company por sesión
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
@@ -112,6 +113,32 @@ DATABASES = {
 }
 
 
+# Cache compartido entre procesos. Los índices de precios por hoja, la tabla de
+# cotizaciones, los totales de compras y los memberships se invalidan subiendo
+# versiones o borrando claves del cache: tiene que ser el mismo para todos los
+# workers web y para `manage.py procesar_trabajos`. Con el LocMemCache por
+# defecto cada proceso tiene el suyo y no ve lo que invalidan los demás (ver el
+# check general.W001). Por defecto es una tabla de la base (crearla con
+# `manage.py createcachetable`); con DJANGO_REDIS_URL usa Redis (paquete redis).
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+if os.environ.get("DJANGO_REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ["DJANGO_REDIS_URL"],
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+            "LOCATION": "cache_presupuesto",
+            "OPTIONS": {"MAX_ENTRIES": 20000},
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -157,6 +184,21 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 # Directorio de recopilación para despliegue (collectstatic)
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Trabajos en segundo plano (general.trabajos): si está activo, cada proceso web
+# ejecuta los trabajos que encola en un pool de hilos propio. Con False solo los
+# ejecuta `manage.py procesar_trabajos`.
+TRABAJOS_EN_PROCESO = True
+TRABAJOS_HILOS = 2
+
+# Instrumentación de requests (general.instrumentacion): Server-Timing en cada
+# respuesta y log rotativo (JSON por línea) de los requests más lentos que el
+# umbral. Se resume con `manage.py resumen_instrumentacion`.
+INSTRUMENTACION = os.environ.get("DJANGO_INSTRUMENTACION", "").lower() in ("true", "1", "yes")
+INSTRUMENTACION_UMBRAL_MS = int(os.environ.get("DJANGO_INSTRUMENTACION_UMBRAL_MS", "500"))
+INSTRUMENTACION_ARCHIVO = BASE_DIR / "logs" / "requests_lentos.jsonl"
+INSTRUMENTACION_MAX_BYTES = 10 * 1024 * 1024
+INSTRUMENTACION_COPIAS = 5
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class PresupuestosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'presupuestos'
+
+    def ready(self):
+        import presupuestos.signals  # noqa: F401
+        import presupuestos.trabajos  # noqa: F401
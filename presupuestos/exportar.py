@@ -0,0 +1,218 @@
+"""
+Exportación de un presupuesto a CSV.
+
+Las filas se generan de a tandas de ítems: para cada tanda se arma un
+CostosLote solo con sus tareas (los precios salen del índice cacheado de cada
+hoja) y una consulta con los nombres y unidades de sus recursos. La memoria no
+crece con el tamaño del presupuesto, así que la respuesta puede ir en streaming.
+"""
+import csv
+from decimal import Decimal
+from itertools import islice
+
+from recursos.costos import CostosLote
+
+from .totales import TotalesItem
+
+CERO = Decimal("0")
+
+TANDA_ITEMS = 500
+
+ENCABEZADO = [
+    "Fila",
+    "Rubro",
+    "Subrubro",
+    "Tarea",
+    "Recurso",
+    "Tipo",
+    "Unidad",
+    "Cantidad",
+    "Cantidad total",
+    "Moneda",
+    "Materiales",
+    "MO / Subc.",
+    "Total",
+    "Total USD",
+]
+
+TIPOS = {
+    "material": "Material",
+    "mano_de_obra": "Mano de obra",
+    "subcontrato": "Subcontrato",
+    "mezcla": "Mezcla",
+}
+
+
+def _num(valor, decimales=2):
+    if valor is None:
+        return ""
+    return f"{valor:.{decimales}f}"
+
+
+class _Subtotal:
+    def __init__(self, nombre, con_cotizacion):
+        self.nombre = nombre
+        self.con_cotizacion = con_cotizacion
+        self.materiales = CERO
+        self.mo = CERO
+        self.total = CERO
+        self.total_usd = CERO
+        self.falta_usd = False
+
+    def sumar(self, fila):
+        self.materiales += fila.materiales_ars
+        self.mo += fila.mo_ars
+        self.total += fila.total_ars
+        # Igual que NodoTotales: un ítem sin USD cuenta como 0.
+        self.total_usd += fila.total_usd or CERO
+        self.falta_usd = self.falta_usd or fila.total_usd is None
+
+    def columnas(self, estricto=False):
+        """Columnas desde Tarea en adelante. estricto: USD vacío si falta algún ítem (como Presupuesto.total_usd)."""
+        sin_usd = not self.con_cotizacion or (estricto and self.falta_usd)
+        return [
+            "", "", "", "", "", "", "",
+            _num(self.materiales),
+            _num(self.mo),
+            _num(self.total),
+            "" if sin_usd else _num(self.total_usd),
+        ]
+
+
+def _recursos_de(tarea_ids):
+    """tarea_id → [(recurso_id, nombre, unidad, cantidad)] ordenados por pk."""
+    from recursos.models import TareaRecurso
+
+    por_tarea = {}
+    filas = (
+        TareaRecurso.objects.filter(tarea_id__in=tarea_ids)
+        .order_by("tarea_id", "pk")
+        .values_list(
+            "pk",
+            "tarea_id",
+            "cantidad",
+            "material__nombre",
+            "material__unidad_de_venta__nombre",
+            "mano_de_obra__tarea",
+            "mano_de_obra__unidad_de_venta__nombre",
+            "subcontrato__tarea",
+            "subcontrato__unidad_de_venta__nombre",
+            "mezcla__nombre",
+            "mezcla__unidad_de_mezcla__nombre",
+        )
+    )
+    for pk, tarea_id, cantidad, *nombres_y_unidades in filas:
+        nombre = unidad = None
+        # Mismo orden de prioridad que recursos.costos._tipo_recurso.
+        for i in range(0, len(nombres_y_unidades), 2):
+            if nombres_y_unidades[i] is not None:
+                nombre, unidad = nombres_y_unidades[i], nombres_y_unidades[i + 1]
+                break
+        por_tarea.setdefault(tarea_id, []).append((pk, nombre, unidad, cantidad))
+    return por_tarea
+
+
+def filas_presupuesto(presupuesto):
+    """
+    Genera las filas del CSV: encabezado, una fila por tarea seguida de sus
+    recursos, subtotales al cerrar cada subrubro y rubro, y el total general.
+    """
+    cotizacion = presupuesto.get_cotizacion_usd()
+    con_cotizacion = bool(cotizacion)
+    lote = presupuesto.lote
+    yield ENCABEZADO
+
+    items = (
+        presupuesto.items.select_related("tarea", "tarea__rubro", "tarea__subrubro")
+        .order_by("tarea__rubro__nombre", "tarea__subrubro__nombre", "tarea__nombre", "pk")
+        .iterator(chunk_size=TANDA_ITEMS)
+    )
+    general = _Subtotal("Total", con_cotizacion)
+    rubro = subrubro = None
+    rubro_id = subrubro_id = None
+
+    while True:
+        tanda = list(islice(items, TANDA_ITEMS))
+        if not tanda:
+            break
+        tarea_ids = [item.tarea_id for item in tanda]
+        costos = CostosLote(lote, tareas=tarea_ids)
+        recursos = _recursos_de(tarea_ids)
+
+        for item in tanda:
+            tarea = item.tarea
+            if tarea.subrubro_id != subrubro_id or tarea.rubro_id != rubro_id:
+                if subrubro:
+                    yield ["Subtotal subrubro", rubro.nombre, subrubro.nombre, *subrubro.columnas()]
+                if tarea.rubro_id != rubro_id:
+                    if rubro:
+                        yield ["Subtotal rubro", rubro.nombre, "", *rubro.columnas()]
+                    rubro = _Subtotal(tarea.rubro.nombre, con_cotizacion)
+                    rubro_id = tarea.rubro_id
+                subrubro = _Subtotal(tarea.subrubro.nombre, con_cotizacion)
+                subrubro_id = tarea.subrubro_id
+
+            fila = TotalesItem(item, costos, cotizacion)
+            for nodo in (general, rubro, subrubro):
+                nodo.sumar(fila)
+            recursos_tarea = recursos.get(item.tarea_id, [])
+            # Como Tarea.get_unidad: la del primer recurso.
+            unidad = next((u for _, nombre, u, _ in recursos_tarea if nombre is not None), None)
+            yield [
+                "Tarea",
+                rubro.nombre,
+                subrubro.nombre,
+                tarea.nombre,
+                "",
+                "",
+                unidad or "-",
+                _num(item.cantidad, 4),
+                _num(item.cantidad, 4),
+                "",
+                _num(fila.materiales_ars),
+                _num(fila.mo_ars),
+                _num(fila.total_ars),
+                _num(fila.total_usd),
+            ]
+            for recurso_id, nombre, unidad_recurso, cantidad in recursos_tarea:
+                costo = costos.recurso(recurso_id)
+                total = item.cantidad * costo.total
+                usd = costo.total_usd(cotizacion)
+                es_material = costo.tipo in ("material", "mezcla")
+                yield [
+                    "Recurso",
+                    rubro.nombre,
+                    subrubro.nombre,
+                    tarea.nombre,
+                    nombre or "",
+                    TIPOS.get(costo.tipo, ""),
+                    unidad_recurso or "",
+                    _num(cantidad, 4),
+                    _num(item.cantidad * cantidad, 4),
+                    costo.moneda,
+                    _num(total) if es_material else "",
+                    "" if es_material else _num(total),
+                    _num(total),
+                    _num(item.cantidad * usd if usd is not None else None),
+                ]
+
+    if subrubro:
+        yield ["Subtotal subrubro", rubro.nombre, subrubro.nombre, *subrubro.columnas()]
+        yield ["Subtotal rubro", rubro.nombre, "", *rubro.columnas()]
+    yield ["Total", "", "", *general.columnas(estricto=True)]
+
+
+class Eco:
+    """Buffer que devuelve lo que se le escribe (para csv.writer en streaming)."""
+
+    def write(self, valor):
+        return valor
+
+
+def csv_presupuesto(presupuesto):
+    """Genera el CSV del presupuesto línea por línea."""
+    writer = csv.writer(Eco())
+    # BOM: Excel abre el archivo como UTF-8.
+    yield "\ufeff"
+    for fila in filas_presupuesto(presupuesto):
+        yield writer.writerow(fila)
@@ -0,0 +1,258 @@
+"""
+Insumos de un presupuesto: cuánto de cada material, mano de obra y
+subcontrato consume (cantidad del ítem × cantidad del recurso en la tarea),
+con las mezclas abiertas en sus materiales (× cantidad en MezclaMaterial).
+
+Las cantidades salen de dos consultas agregadas (recursos directos y
+materiales de mezclas), agrupadas por recurso y opcionalmente por rubro de
+la tarea (o por rubro y subrubro). Los precios vienen de los índices cacheados de las hojas del lote
+(recursos.indice_precios) y los nombres de una consulta por tipo de recurso,
+así que la cantidad de consultas no depende del tamaño del presupuesto.
+
+Las mezclas se abren aunque no sean de la hoja de materiales del lote (el
+consumo es el mismo); en los totales del presupuesto esas mezclas valen 0.
+Cada material abierto conserva su moneda, mientras que los totales del
+presupuesto toman el precio de la mezcla como ARS: con materiales en USD
+dentro de mezclas, el total USD de los insumos difiere del presupuesto.
+"""
+import csv
+from decimal import Decimal
+
+from django.db import models
+from django.db.models import F, Q, Sum
+
+from general.cotizaciones import convertir_a_usd
+
+CERO = Decimal("0")
+
+TIPOS = (
+    ("material", "Materiales"),
+    ("mano_de_obra", "Mano de obra"),
+    ("subcontrato", "Subcontratos"),
+)
+
+_DECIMAL = models.DecimalField(max_digits=24, decimal_places=6)
+
+
+class Insumo:
+    """Un recurso del presupuesto con su cantidad total e importe según el lote."""
+
+    __slots__ = (
+        "tipo", "recurso_id", "rubro_id", "rubro", "subrubro_id", "subrubro", "nombre", "unidad",
+        "proveedor_id", "proveedor", "cantidad", "precio", "moneda", "total", "total_usd",
+    )
+
+    def __init__(self, tipo, recurso_id, rubro_id, subrubro_id, cantidad):
+        self.tipo = tipo
+        self.recurso_id = recurso_id
+        self.rubro_id = rubro_id
+        self.rubro = None
+        self.subrubro_id = subrubro_id
+        self.subrubro = None
+        self.nombre = None
+        self.unidad = None
+        self.proveedor_id = None
+        self.proveedor = None
+        self.cantidad = cantidad
+        self.precio = None
+        self.moneda = "ARS"
+        self.total = CERO
+        self.total_usd = None
+
+    @property
+    def tipo_display(self):
+        return dict(TIPOS)[self.tipo]
+
+
+def _grupos(ruta, por_rubro, por_subrubro):
+    grupos = {}
+    if por_rubro or por_subrubro:
+        grupos["rubro_id"] = F(f"{ruta}rubro_id")
+    if por_subrubro:
+        grupos["subrubro_id"] = F(f"{ruta}subrubro_id")
+    return grupos
+
+
+def _cantidades(presupuesto, por_rubro, por_subrubro):
+    """{(tipo, recurso_id, rubro_id, subrubro_id): cantidad} en dos consultas agregadas."""
+    from recursos.models import MezclaMaterial, TareaRecurso
+
+    grupos = _grupos("tarea__", por_rubro, por_subrubro)
+    directos = (
+        TareaRecurso.objects.filter(tarea__presupuesto_items__presupuesto=presupuesto)
+        .filter(
+            Q(material_id__isnull=False)
+            | Q(mano_de_obra_id__isnull=False)
+            | Q(subcontrato_id__isnull=False)
+        )
+        .order_by()
+        .values("material_id", "mano_de_obra_id", "subcontrato_id", **grupos)
+        .annotate(
+            total=Sum(F("cantidad") * F("tarea__presupuesto_items__cantidad"), output_field=_DECIMAL)
+        )
+    )
+    cantidades = {}
+    for fila in directos:
+        # Misma prioridad que recursos.costos: material > mano de obra > subcontrato.
+        for tipo in ("material", "mano_de_obra", "subcontrato"):
+            if fila[f"{tipo}_id"]:
+                clave = (tipo, fila[f"{tipo}_id"], fila.get("rubro_id"), fila.get("subrubro_id"))
+                cantidades[clave] = cantidades.get(clave, CERO) + fila["total"]
+                break
+
+    # Recursos que son solo mezcla (sin material, MO ni subcontrato): sus materiales.
+    uso = "mezcla__tarea_recursos__"
+    grupos = _grupos(f"{uso}tarea__", por_rubro, por_subrubro)
+    de_mezclas = (
+        MezclaMaterial.objects.filter(
+            **{
+                f"{uso}tarea__presupuesto_items__presupuesto": presupuesto,
+                f"{uso}material_id__isnull": True,
+                f"{uso}mano_de_obra_id__isnull": True,
+                f"{uso}subcontrato_id__isnull": True,
+            }
+        )
+        .order_by()
+        .values("material_id", **grupos)
+        .annotate(
+            total=Sum(
+                F("cantidad") * F(f"{uso}cantidad") * F(f"{uso}tarea__presupuesto_items__cantidad"),
+                output_field=_DECIMAL,
+            )
+        )
+    )
+    for fila in de_mezclas:
+        clave = ("material", fila["material_id"], fila.get("rubro_id"), fila.get("subrubro_id"))
+        cantidades[clave] = cantidades.get(clave, CERO) + fila["total"]
+    return cantidades
+
+
+class InsumosPresupuesto:
+    """
+    Lista de insumos del presupuesto, ordenada por tipo, rubro, subrubro y
+    nombre. por_subrubro separa por rubro y subrubro.
+
+    Uso:
+        insumos = InsumosPresupuesto(presupuesto, por_rubro=True)
+        insumos.filas
+        insumos.totales["material"]  # (ARS, USD)
+    """
+
+    def __init__(self, presupuesto, por_rubro=False, por_subrubro=False):
+        from general.models import Rubro, Subrubro
+        from recursos.indice_precios import indice_mano_de_obra, indice_materiales, indice_subcontratos
+        from recursos.models import ManoDeObra, Material, Subcontrato
+
+        self.presupuesto = presupuesto
+        self.por_rubro = por_rubro or por_subrubro
+        self.por_subrubro = por_subrubro
+        self.cotizacion = presupuesto.get_cotizacion_usd()
+        lote = presupuesto.lote
+        catalogos = {
+            "material": (Material, "nombre", True, indice_materiales, lote.hoja_materiales_id),
+            "mano_de_obra": (ManoDeObra, "tarea", False, indice_mano_de_obra, lote.hoja_mano_de_obra_id),
+            "subcontrato": (Subcontrato, "tarea", True, indice_subcontratos, lote.hoja_subcontratos_id),
+        }
+
+        filas = [
+            Insumo(tipo, recurso_id, rubro_id, subrubro_id, cantidad)
+            for (tipo, recurso_id, rubro_id, subrubro_id), cantidad in _cantidades(
+                presupuesto, por_rubro, por_subrubro
+            ).items()
+        ]
+        rubros = subrubros = {}
+        if self.por_rubro:
+            rubros = dict(
+                Rubro.objects.filter(pk__in={f.rubro_id for f in filas}).values_list("pk", "nombre")
+            )
+        if por_subrubro:
+            subrubros = dict(
+                Subrubro.objects.filter(pk__in={f.subrubro_id for f in filas}).values_list("pk", "nombre")
+            )
+        for tipo, (modelo, campo, con_proveedor, indice, hoja_id) in catalogos.items():
+            del_tipo = [f for f in filas if f.tipo == tipo]
+            if not del_tipo:
+                continue
+            columnas = ["pk", campo, "unidad_de_venta__nombre"]
+            if con_proveedor:
+                columnas += ["proveedor_id", "proveedor__nombre"]
+            datos = {
+                fila[0]: fila[1:]
+                for fila in modelo.objects.filter(pk__in={f.recurso_id for f in del_tipo}).values_list(
+                    *columnas
+                )
+            }
+            precios = indice(hoja_id)
+            for fila in del_tipo:
+                dato = datos.get(fila.recurso_id, (None, None, None, None))
+                fila.nombre, fila.unidad = dato[:2]
+                if con_proveedor:
+                    fila.proveedor_id, fila.proveedor = dato[2:]
+                fila.rubro = rubros.get(fila.rubro_id)
+                fila.subrubro = subrubros.get(fila.subrubro_id)
+                hp = precios.get(fila.recurso_id)
+                if hp:
+                    fila.precio, fila.moneda = hp[0], hp[2]
+                    fila.total = fila.cantidad * fila.precio
+                fila.total_usd = convertir_a_usd(fila.total, fila.moneda, self.cotizacion)
+
+        orden = {tipo: i for i, (tipo, _) in enumerate(TIPOS)}
+        filas.sort(
+            key=lambda f: (
+                orden[f.tipo], (f.rubro or "").lower(), (f.subrubro or "").lower(), (f.nombre or "").lower()
+            )
+        )
+        self.filas = filas
+
+        # Como el total del presupuesto: USD es None si algún importe no se pudo convertir.
+        self.totales = {}
+        for tipo, _ in TIPOS:
+            del_tipo = [f for f in filas if f.tipo == tipo]
+            usd = [f.total_usd for f in del_tipo]
+            self.totales[tipo] = (
+                sum((f.total for f in del_tipo), CERO),
+                None if any(u is None for u in usd) else sum(usd, CERO),
+            )
+        self.total_ars = sum((ars for ars, _ in self.totales.values()), CERO)
+        usd = [u for _, u in self.totales.values()]
+        self.total_usd = None if any(u is None for u in usd) else sum(usd, CERO)
+
+    def secciones(self):
+        """[(tipo, nombre, filas, total ARS, total USD)] de los tipos con filas."""
+        return [
+            (tipo, nombre, [f for f in self.filas if f.tipo == tipo], *self.totales[tipo])
+            for tipo, nombre in TIPOS
+            if any(f.tipo == tipo for f in self.filas)
+        ]
+
+
+def _num(valor):
+    return "" if valor is None else f"{valor:.4f}"
+
+
+def csv_insumos(insumos):
+    """Genera el CSV de los insumos línea por línea."""
+    from .exportar import Eco
+
+    writer = csv.writer(Eco())
+    # BOM: Excel abre el archivo como UTF-8.
+    yield "\ufeff"
+    encabezado = ["Tipo", "Recurso", "Unidad", "Cantidad", "Precio unitario", "Moneda", "Total", "Total USD"]
+    if insumos.por_rubro:
+        encabezado.insert(1, "Rubro")
+    yield writer.writerow(encabezado)
+    for f in insumos.filas:
+        fila = [
+            f.tipo_display,
+            f.nombre,
+            f.unidad or "",
+            _num(f.cantidad),
+            _num(f.precio),
+            f.moneda,
+            _num(f.total),
+            _num(f.total_usd),
+        ]
+        if insumos.por_rubro:
+            fila.insert(1, f.rubro or "")
+        yield writer.writerow(fila)
+    yield writer.writerow(["Total", *([""] * (len(encabezado) - 3)), _num(insumos.total_ars), _num(insumos.total_usd)])
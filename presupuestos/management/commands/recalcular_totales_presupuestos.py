@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from presupuestos.models import Presupuesto, PresupuestoTotal
+from presupuestos.totales import actualizar_totales
+
+
+class Command(BaseCommand):
+    help = "Recalcula desde cero los totales guardados (PresupuestoTotal) de los presupuestos."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--company",
+            type=int,
+            help="Solo los presupuestos de esta empresa (id).",
+        )
+        parser.add_argument(
+            "--pendientes",
+            action="store_true",
+            help="Solo los presupuestos con totales desactualizados.",
+        )
+
+    def handle(self, *args, **options):
+        presupuestos = Presupuesto.objects.all()
+        if options["company"]:
+            presupuestos = presupuestos.filter(company_id=options["company"])
+        if not options["pendientes"]:
+            PresupuestoTotal.objects.filter(presupuesto__in=presupuestos).delete()
+            presupuestos.update(totales_vigentes=False, totales_version=F("totales_version") + 1)
+        cantidad = actualizar_totales(presupuestos)
+        self.stdout.write(self.style.SUCCESS(f"Totales recalculados: {cantidad} presupuestos."))
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.3 on 2026-10-18 00:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('general', '0010_backfill_admin_and_presupuestos'),
+        ('presupuestos', '0002_add_activo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='presupuesto',
+            name='totales_vigentes',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='PresupuestoTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('materiales_ars', models.DecimalField(decimal_places=4, default=0, max_digits=18)),
+                ('mo_ars', models.DecimalField(decimal_places=4, default=0, max_digits=18)),
+                ('total_ars', models.DecimalField(decimal_places=4, default=0, max_digits=18)),
+                ('materiales_usd', models.DecimalField(blank=True, decimal_places=4, max_digits=18, null=True)),
+                ('mo_usd', models.DecimalField(blank=True, decimal_places=4, max_digits=18, null=True)),
+                ('total_usd', models.DecimalField(blank=True, decimal_places=4, max_digits=18, null=True)),
+                ('actualizado_en', models.DateTimeField(auto_now=True)),
+                ('presupuesto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='totales', to='presupuestos.presupuesto')),
+                ('rubro', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='general.rubro')),
+                ('subrubro', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='general.subrubro')),
+            ],
+            options={
+                'verbose_name': 'Total de Presupuesto',
+                'verbose_name_plural': 'Totales de Presupuesto',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 01:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('presupuestos', '0003_presupuesto_totales'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='presupuesto',
+            name='totales_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -1,9 +1,8 @@
-from decimal import Decimal
-
 from django.db import models
 
-from general.models import Company, Obra, TipoDolar
-from recursos.models import CotizacionDolar, Lote, Tarea
+from general.cotizaciones import cotizacion
+from general.models import Company, Obra, Rubro, Subrubro, TipoDolar
+from recursos.models import Lote, Tarea
 
 
 class Presupuesto(models.Model):
@@ -32,6 +31,10 @@ class Presupuesto(models.Model):
     )
     fecha_dolar = models.DateField(null=True, blank=True)
     activo = models.BooleanField(default=True)
+    # False cuando cambió algo que afecta los totales guardados (PresupuestoTotal).
+    totales_vigentes = models.BooleanField(default=False)
+    # Sube con cada invalidación: un recálculo que empezó antes no marca vigentes sus totales.
+    totales_version = models.PositiveBigIntegerField(default=0)
     company = models.ForeignKey(
         Company,
         on_delete=models.CASCADE,
@@ -50,27 +53,13 @@ class Presupuesto(models.Model):
 
     def get_cotizacion_usd(self):
         """Cotización ARS/USD para este presupuesto."""
-        if not self.tipo_dolar_id or not self.fecha_dolar:
-            return None
-        try:
-            c = CotizacionDolar.objects.get(
-                company=self.company,
-                fecha=self.fecha_dolar,
-                tipo=self.tipo_dolar,
-            )
-            return c.valor
-        except CotizacionDolar.DoesNotExist:
-            return None
+        return cotizacion(self.company_id, self.tipo_dolar_id, self.fecha_dolar)
 
     def total_usd(self):
-        """Total del presupuesto en USD."""
-        total = Decimal("0")
-        for item in self.items.all():
-            t = item.total_general_usd()
-            if t is None:
-                return None
-            total += t
-        return total
+        """Total del presupuesto en USD. None si algún ítem no se puede convertir."""
+        from .totales import TotalesPresupuesto
+
+        return TotalesPresupuesto(self).total_usd
 
 
 class PresupuestoItem(models.Model):
@@ -118,3 +107,45 @@ class PresupuestoItem(models.Model):
         if mat is None or mo is None:
             return None
         return mat + mo
+
+
+class PresupuestoTotal(models.Model):
+    """
+    Totales guardados de un presupuesto: una fila general (sin rubro), una por
+    rubro y una por subrubro. Se recalculan cuando cambia algo que los afecta
+    (ver presupuestos.signals) o con `manage.py recalcular_totales_presupuestos`.
+    """
+    presupuesto = models.ForeignKey(
+        Presupuesto,
+        on_delete=models.CASCADE,
+        related_name="totales",
+    )
+    rubro = models.ForeignKey(
+        Rubro,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    subrubro = models.ForeignKey(
+        Subrubro,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    materiales_ars = models.DecimalField(max_digits=18, decimal_places=4, default=0)
+    mo_ars = models.DecimalField(max_digits=18, decimal_places=4, default=0)
+    total_ars = models.DecimalField(max_digits=18, decimal_places=4, default=0)
+    materiales_usd = models.DecimalField(max_digits=18, decimal_places=4, null=True, blank=True)
+    mo_usd = models.DecimalField(max_digits=18, decimal_places=4, null=True, blank=True)
+    total_usd = models.DecimalField(max_digits=18, decimal_places=4, null=True, blank=True)
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Total de Presupuesto"
+        verbose_name_plural = "Totales de Presupuesto"
+
+    def __str__(self):
+        nivel = self.subrubro or self.rubro or "Total"
+        return f"{self.presupuesto_id} - {nivel}"
@@ -0,0 +1,106 @@
+"""
+Signals para presupuestos app: mantienen al día los PresupuestoTotal.
+
+Cada cambio que afecta el precio de un presupuesto marca sus totales como
+desactualizados y los recalcula al confirmar la transacción. Las
+actualizaciones masivas con F() no disparan signals; esas vistas llaman a
+invalidar_totales() a mano.
+
+Los receivers de recursos.signals (índice de precios por hoja) se conectan
+antes que estos (recursos va antes en INSTALLED_APPS), así que el recálculo ya
+ve el índice invalidado.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from general.models import CotizacionDolar
+from recursos.models import (
+    HojaPrecioManoDeObra,
+    HojaPrecioMaterial,
+    HojaPrecioSubcontrato,
+    Lote,
+    Mezcla,
+    MezclaMaterial,
+    Tarea,
+    TareaRecurso,
+)
+
+from .models import Presupuesto, PresupuestoItem
+from .totales import invalidar_totales
+
+
+@receiver(post_save, sender=Presupuesto)
+def presupuesto_guardado(sender, instance, update_fields=None, **kwargs):
+    # Activar/cancelar no cambia los importes.
+    if update_fields and set(update_fields) <= {"activo", "totales_vigentes", "totales_version"}:
+        return
+    invalidar_totales(Presupuesto.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=PresupuestoItem)
+@receiver(post_delete, sender=PresupuestoItem)
+def item_cambiado(sender, instance, **kwargs):
+    invalidar_totales(Presupuesto.objects.filter(pk=instance.presupuesto_id))
+
+
+@receiver(post_save, sender=Tarea)
+def tarea_cambiada(sender, instance, created, **kwargs):
+    # Cambiar rubro/subrubro mueve los importes dentro del árbol.
+    if not created:
+        invalidar_totales(Presupuesto.objects.filter(items__tarea_id=instance.pk))
+
+
+@receiver(post_save, sender=TareaRecurso)
+@receiver(post_delete, sender=TareaRecurso)
+def tarea_recurso_cambiado(sender, instance, **kwargs):
+    invalidar_totales(Presupuesto.objects.filter(items__tarea_id=instance.tarea_id))
+
+
+@receiver(post_save, sender=HojaPrecioMaterial)
+@receiver(post_delete, sender=HojaPrecioMaterial)
+def hoja_material_cambiada(sender, instance, **kwargs):
+    invalidar_totales(Presupuesto.objects.filter(lote__hoja_materiales_id=instance.hoja_id))
+
+
+@receiver(post_save, sender=HojaPrecioManoDeObra)
+@receiver(post_delete, sender=HojaPrecioManoDeObra)
+def hoja_mano_de_obra_cambiada(sender, instance, **kwargs):
+    invalidar_totales(Presupuesto.objects.filter(lote__hoja_mano_de_obra_id=instance.hoja_id))
+
+
+@receiver(post_save, sender=HojaPrecioSubcontrato)
+@receiver(post_delete, sender=HojaPrecioSubcontrato)
+def hoja_subcontrato_cambiada(sender, instance, **kwargs):
+    invalidar_totales(Presupuesto.objects.filter(lote__hoja_subcontratos_id=instance.hoja_id))
+
+
+@receiver(post_save, sender=Mezcla)
+@receiver(post_delete, sender=Mezcla)
+def mezcla_cambiada(sender, instance, **kwargs):
+    if instance.hoja_id:
+        invalidar_totales(Presupuesto.objects.filter(lote__hoja_materiales_id=instance.hoja_id))
+
+
+@receiver(post_save, sender=MezclaMaterial)
+@receiver(post_delete, sender=MezclaMaterial)
+def mezcla_material_cambiado(sender, instance, **kwargs):
+    hojas = Mezcla.objects.filter(pk=instance.mezcla_id).values("hoja_id")
+    invalidar_totales(Presupuesto.objects.filter(lote__hoja_materiales_id__in=hojas))
+
+
+@receiver(post_save, sender=Lote)
+def lote_cambiado(sender, instance, created, **kwargs):
+    if not created:
+        invalidar_totales(Presupuesto.objects.filter(lote_id=instance.pk))
+
+
+@receiver(post_save, sender=CotizacionDolar)
+@receiver(post_delete, sender=CotizacionDolar)
+def cotizacion_cambiada(sender, instance, **kwargs):
+    invalidar_totales(
+        Presupuesto.objects.filter(
+            company_id=instance.company_id,
+            tipo_dolar_id=instance.tipo_id,
+            fecha_dolar=instance.fecha,
+        )
+    )
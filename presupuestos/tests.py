@@ -1,3 +1,545 @@
+import csv
+import io
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from django.db import connection
 from django.test import TestCase
+from django.urls import reverse
+
+from general import trabajos
+from general.models import CotizacionDolar, Rubro, Subrubro, Trabajo
+from general.testing import EmpresaDePruebaMixin, PlanesDeConsultaMixin
+from recursos.costos import TIPOS_MANO_DE_OBRA, TIPOS_MATERIALES, CostosLote
+from recursos.models import (
+    HojaPrecioManoDeObra,
+    HojaPrecioMaterial,
+    HojaPrecios,
+    HojaPrecioSubcontrato,
+    Material,
+    Mezcla,
+    MezclaMaterial,
+    Tarea,
+    TareaRecurso,
+)
+
+from .exportar import ENCABEZADO, _num
+from .insumos import InsumosPresupuesto
+from .models import Presupuesto, PresupuestoItem
+from .totales import TotalesPresupuesto, actualizar_totales, guardar_totales, invalidar_totales
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN de SQLite")
+class PlanesPresupuestosTests(PlanesDeConsultaMixin, TestCase):
+    """Las vistas de presupuestos no deben recorrer tablas enteras."""
+
+    def test_lista_y_niveles(self):
+        d = self.datos
+        p = d.presupuesto
+        for url in (
+            reverse("presupuestos:presupuesto_list"),
+            reverse("presupuestos:presupuesto_rubros", args=[p.pk]),
+            reverse("presupuestos:presupuesto_subrubros", args=[p.pk, d.rubro.pk]),
+            reverse("presupuestos:presupuesto_tareas", args=[p.pk, d.rubro.pk, d.subrubro.pk]),
+            reverse("presupuestos:presupuesto_insumos", args=[p.pk]),
+            reverse("presupuestos:presupuesto_insumos", args=[p.pk]) + "?por_rubro=1",
+        ):
+            with self.subTest(url):
+                self.assertSinEscaneoCompleto(url)
+
+
+def _cuatro(valor):
+    return None if valor is None else Decimal(valor).quantize(Decimal("0.0001"))
+
+
+class TotalesGuardadosTests(EmpresaDePruebaMixin, TestCase):
+    """PresupuestoTotal guardados, su vigencia y los signals que la invalidan."""
+
+    def setUp(self):
+        super().setUp()
+        d = self.datos
+        # Un segundo rubro para que el árbol tenga más de una rama.
+        rubro = Rubro.objects.create(nombre="Pintura", company=d.company)
+        subrubro = Subrubro.objects.create(nombre="Látex", rubro=rubro, company=d.company)
+        tarea = Tarea.objects.create(nombre="Pintar", company=d.company, rubro=rubro, subrubro=subrubro, lote=d.lote)
+        TareaRecurso.objects.create(tarea=tarea, material=d.material, cantidad=Decimal("0.5"))
+        PresupuestoItem.objects.create(presupuesto=d.presupuesto, tarea=tarea, cantidad=Decimal("3"))
+        self.presupuesto = Presupuesto.objects.get(pk=d.presupuesto.pk)
+
+    def vigentes(self):
+        return Presupuesto.objects.get(pk=self.presupuesto.pk).totales_vigentes
+
+    def test_filas_guardadas_coinciden_con_el_calculo(self):
+        guardar_totales(self.presupuesto)
+        calculo = TotalesPresupuesto(self.presupuesto)
+        esperadas = {(None, None): calculo.general}
+        for rubro_id, rubro in calculo.rubros.items():
+            esperadas[(rubro_id, None)] = rubro
+            for subrubro_id, subrubro in rubro.hijos.items():
+                esperadas[(rubro_id, subrubro_id)] = subrubro
+        guardadas = {(t.rubro_id, t.subrubro_id): t for t in self.presupuesto.totales.all()}
+        self.assertEqual(set(guardadas), set(esperadas))
+        self.assertEqual(len(calculo.rubros), 2)
+        for clave, nodo in esperadas.items():
+            with self.subTest(clave):
+                fila = guardadas[clave]
+                for campo in ("materiales_ars", "mo_ars", "total_ars", "materiales_usd", "mo_usd", "total_usd"):
+                    self.assertEqual(_cuatro(getattr(fila, campo)), _cuatro(getattr(nodo, campo)), campo)
+        self.assertTrue(self.vigentes())
+
+    def test_actualizar_solo_recalcula_los_pendientes(self):
+        qs = Presupuesto.objects.filter(pk=self.presupuesto.pk)
+        self.assertEqual(actualizar_totales(qs), 1)
+        self.assertEqual(actualizar_totales(qs), 0)
+        invalidar_totales(qs)
+        self.assertFalse(self.vigentes())
+        self.assertEqual(actualizar_totales(qs), 1)
+        self.assertTrue(self.vigentes())
+
+    def test_recalculo_cruzado_con_un_cambio_no_queda_vigente(self):
+        guardar_totales(self.presupuesto)
+        antes = {t.pk for t in self.presupuesto.totales.all()}
+        qs = Presupuesto.objects.filter(pk=self.presupuesto.pk)
+
+        def calculo_con_cambio_en_medio(presupuesto, *args, **kwargs):
+            # Otro request invalida mientras este recálculo está calculando.
+            invalidar_totales(qs)
+            return TotalesPresupuesto(presupuesto, *args, **kwargs)
+
+        with mock.patch("presupuestos.totales.TotalesPresupuesto", side_effect=calculo_con_cambio_en_medio):
+            guardar_totales(self.presupuesto)
+        self.assertFalse(self.vigentes())
+        self.assertEqual({t.pk for t in self.presupuesto.totales.all()}, antes)
+        # El recálculo encolado por el cambio sí lo guarda.
+        self.assertEqual(actualizar_totales(qs), 1)
+        self.assertTrue(self.vigentes())
+
+    def test_signals_marcan_los_totales_desactualizados(self):
+        d = self.datos
+        cambios = {
+            "Presupuesto": lambda: self.presupuesto.save(),
+            "PresupuestoItem": lambda: d.presupuesto.items.first().save(),
+            "Tarea": lambda: d.tarea.save(),
+            "TareaRecurso": lambda: TareaRecurso.objects.filter(tarea=d.tarea).first().save(),
+            "HojaPrecioMaterial": lambda: HojaPrecioMaterial.objects.get(hoja=d.hoja_materiales).save(),
+            "HojaPrecioManoDeObra": lambda: HojaPrecioManoDeObra.objects.get(hoja=d.hoja_mano_de_obra).save(),
+            "HojaPrecioSubcontrato": lambda: HojaPrecioSubcontrato.objects.get(hoja=d.hoja_subcontratos).save(),
+            "Mezcla": lambda: d.mezcla.save(),
+            "MezclaMaterial": lambda: MezclaMaterial.objects.filter(mezcla=d.mezcla).first().save(),
+            "Lote": lambda: d.lote.save(),
+            "CotizacionDolar": lambda: CotizacionDolar.objects.get(tipo=d.tipo_dolar, fecha=d.fecha_dolar).save(),
+        }
+        for modelo, cambiar in cambios.items():
+            with self.subTest(modelo):
+                guardar_totales(self.presupuesto)
+                self.assertTrue(self.vigentes())
+                cambiar()
+                self.assertFalse(self.vigentes())
+
+    def test_lista_muestra_lo_guardado_y_encola_el_recalculo(self):
+        guardar_totales(self.presupuesto)
+        guardado = self.presupuesto.totales.get(rubro__isnull=True, subrubro__isnull=True).total_usd
+        PresupuestoItem.objects.filter(presupuesto=self.presupuesto).update(cantidad=Decimal("100"))
+        invalidar_totales(Presupuesto.objects.filter(pk=self.presupuesto.pk))
+        Trabajo.objects.all().delete()
+
+        url = reverse("presupuestos:presupuesto_list")
+        with mock.patch("presupuestos.totales.TotalesPresupuesto") as calculo:
+            respuesta = self.client.get(url)
+            self.client.get(url)
+        calculo.assert_not_called()
+        self.assertFalse(self.vigentes())
+        fila = next(p for p in respuesta.context["presupuestos"] if p.pk == self.presupuesto.pk)
+        self.assertEqual(fila.total_usd_guardado, guardado)
+        self.assertContains(respuesta, "recalculando")
+        # Un solo trabajo aunque se recargue la lista.
+        trabajo = Trabajo.objects.get()
+        self.assertEqual((trabajo.tipo, trabajo.parametros), ("presupuestos.recalcular_totales", {"ids": [self.presupuesto.pk]}))
+
+        trabajos.ejecutar(trabajo.pk)
+        self.assertTrue(self.vigentes())
+        self.assertNotContains(self.client.get(url), "recalculando")
+        self.assertEqual(Trabajo.objects.count(), 1)
+
+    def test_activar_no_invalida(self):
+        guardar_totales(self.presupuesto)
+        self.presupuesto.activo = False
+        self.presupuesto.save(update_fields=["activo"])
+        self.assertTrue(self.vigentes())
+
+
+class InsumosTests(EmpresaDePruebaMixin, TestCase):
+    """Cantidades e importes de InsumosPresupuesto con la empresa de prueba."""
+
+    def setUp(self):
+        super().setUp()
+        d = self.datos
+        self.presupuesto = Presupuesto.objects.get(pk=d.presupuesto.pk)
+        # "Muro 15" × 10: Arena 3 directa + 2 de la mezcla, MO 1, subcontrato 1.
+        rubro = Rubro.objects.create(nombre="Pintura", company=d.company)
+        self.subrubro = Subrubro.objects.create(nombre="Látex", rubro=rubro, company=d.company)
+        tarea = Tarea.objects.create(
+            nombre="Pintar", company=d.company, rubro=rubro, subrubro=self.subrubro, lote=d.lote
+        )
+        # Un recurso con material y mano de obra cuenta solo como material;
+        # con material y mezcla, la mezcla no se abre.
+        TareaRecurso.objects.create(
+            tarea=tarea, material=d.material, mano_de_obra=d.mano_de_obra, cantidad=Decimal("0.5")
+        )
+        TareaRecurso.objects.create(tarea=tarea, material=d.material, mezcla=d.mezcla, cantidad=Decimal("1"))
+        PresupuestoItem.objects.create(presupuesto=self.presupuesto, tarea=tarea, cantidad=Decimal("4"))
+        self.rubro = rubro
+
+    def cantidades(self, insumos):
+        return {(f.tipo, f.rubro, f.subrubro): f.cantidad for f in insumos.filas}
+
+    def test_mezclas_abiertas_y_prioridad_de_tipos(self):
+        insumos = InsumosPresupuesto(self.presupuesto)
+        # Arena: 30 directa + 20 de la mezcla + 2 + 4 de "Pintar".
+        self.assertEqual(
+            self.cantidades(insumos),
+            {
+                ("material", None, None): Decimal("56"),
+                ("mano_de_obra", None, None): Decimal("10"),
+                ("subcontrato", None, None): Decimal("10"),
+            },
+        )
+        material, mano_de_obra, subcontrato = insumos.filas
+        self.assertEqual(
+            (material.nombre, material.precio, material.total), ("Arena", Decimal("100"), Decimal("5600"))
+        )
+        self.assertEqual(mano_de_obra.total, Decimal("5000"))
+        self.assertEqual(
+            (subcontrato.moneda, subcontrato.total, subcontrato.total_usd),
+            ("USD", Decimal("8000"), Decimal("8000")),
+        )
+        self.assertEqual(material.total_usd, Decimal("5.6"))
+        self.assertEqual(insumos.totales["material"], (Decimal("5600"), Decimal("5.6")))
+        self.assertEqual(insumos.total_ars, Decimal("18600"))
+        self.assertEqual(insumos.total_usd, Decimal("8010.6"))
+
+    def test_por_rubro_y_por_subrubro(self):
+        d = self.datos
+        por_rubro = InsumosPresupuesto(self.presupuesto, por_rubro=True)
+        self.assertEqual(
+            self.cantidades(por_rubro),
+            {
+                ("material", "Albañilería", None): Decimal("50"),
+                ("material", "Pintura", None): Decimal("6"),
+                ("mano_de_obra", "Albañilería", None): Decimal("10"),
+                ("subcontrato", "Albañilería", None): Decimal("10"),
+            },
+        )
+        por_subrubro = InsumosPresupuesto(self.presupuesto, por_subrubro=True)
+        self.assertTrue(por_subrubro.por_rubro)
+        self.assertEqual(
+            {(f.tipo, f.rubro_id, f.subrubro_id, f.subrubro): f.cantidad for f in por_subrubro.filas},
+            {
+                ("material", d.rubro.pk, d.subrubro.pk, "Muros"): Decimal("50"),
+                ("material", self.rubro.pk, self.subrubro.pk, "Látex"): Decimal("6"),
+                ("mano_de_obra", d.rubro.pk, d.subrubro.pk, "Muros"): Decimal("10"),
+                ("subcontrato", d.rubro.pk, d.subrubro.pk, "Muros"): Decimal("10"),
+            },
+        )
+        # Agrupar no cambia los totales.
+        self.assertEqual(por_rubro.total_ars, InsumosPresupuesto(self.presupuesto).total_ars)
+
+    def test_sin_cotizacion_no_hay_total_usd(self):
+        d = self.datos
+        CotizacionDolar.objects.filter(tipo=d.tipo_dolar).delete()
+        insumos = InsumosPresupuesto(self.presupuesto)
+        self.assertIsNone(insumos.cotizacion)
+        self.assertIsNone(insumos.totales["material"][1])
+        self.assertIsNone(insumos.totales["mano_de_obra"][1])
+        # USD no necesita cotización.
+        self.assertEqual(insumos.totales["subcontrato"], (Decimal("8000"), Decimal("8000")))
+        self.assertEqual(insumos.total_ars, Decimal("18600"))
+        self.assertIsNone(insumos.total_usd)
+
+
+class ExportarTests(EmpresaDePruebaMixin, TestCase):
+    """El CSV en streaming contra TotalesPresupuesto."""
+
+    def setUp(self):
+        super().setUp()
+        d = self.datos
+        rubro = Rubro.objects.create(nombre="Pintura", company=d.company)
+        latex = Subrubro.objects.create(nombre="Látex", rubro=rubro, company=d.company)
+        tabiques = Subrubro.objects.create(nombre="Tabiques", rubro=d.rubro, company=d.company)
+        pintar = Tarea.objects.create(nombre="Pintar", company=d.company, rubro=rubro, subrubro=latex, lote=d.lote)
+        TareaRecurso.objects.create(tarea=pintar, material=d.material, cantidad=Decimal("0.5"))
+        TareaRecurso.objects.create(tarea=pintar, subcontrato=d.subcontrato, cantidad=Decimal("0.25"))
+        tabique = Tarea.objects.create(
+            nombre="Tabique", company=d.company, rubro=d.rubro, subrubro=tabiques, lote=d.lote
+        )
+        TareaRecurso.objects.create(tarea=tabique, mano_de_obra=d.mano_de_obra, cantidad=Decimal("2.5"))
+        vacia = Tarea.objects.create(nombre="Limpieza", company=d.company, rubro=rubro, subrubro=latex, lote=d.lote)
+        for tarea, cantidad in ((pintar, "3"), (tabique, "7.5"), (vacia, "1")):
+            PresupuestoItem.objects.create(presupuesto=d.presupuesto, tarea=tarea, cantidad=Decimal(cantidad))
+        self.presupuesto = Presupuesto.objects.get(pk=d.presupuesto.pk)
+
+    def filas(self):
+        respuesta = self.client.get(reverse("presupuestos:presupuesto_exportar", args=[self.presupuesto.pk]))
+        self.assertEqual(respuesta.status_code, 200)
+        texto = b"".join(respuesta.streaming_content).decode("utf-8")
+        self.assertTrue(texto.startswith("\ufeff"))
+        return list(csv.reader(io.StringIO(texto[1:])))
+
+    def importes(self, nodo, total_usd):
+        return [_num(nodo.materiales_ars), _num(nodo.mo_ars), _num(nodo.total_ars), _num(total_usd)]
+
+    def assertCoincide(self, filas):
+        totales = TotalesPresupuesto(self.presupuesto)
+        self.assertEqual(filas[0], ENCABEZADO)
+        tareas = {f.item.tarea.nombre: f for f in totales.filas}
+        vistas = {"Tarea": [], "Subtotal subrubro": [], "Subtotal rubro": []}
+        for i, fila in enumerate(filas[1:], 1):
+            tipo = fila[0]
+            if tipo == "Tarea":
+                vistas[tipo].append(fila[3])
+                self.assertEqual(fila[10:], self.importes(tareas[fila[3]], tareas[fila[3]].total_usd), fila)
+                recursos = []
+                for recurso in filas[i + 1:]:
+                    if recurso[0] != "Recurso":
+                        break
+                    recursos.append(recurso)
+                # Los recursos suman lo mismo que su tarea.
+                for columna in (10, 11, 12):
+                    self.assertEqual(
+                        _num(sum((Decimal(r[columna] or "0") for r in recursos), Decimal("0"))),
+                        fila[columna] if recursos else "0.00",
+                    )
+            elif tipo == "Subtotal subrubro":
+                vistas[tipo].append((fila[1], fila[2]))
+                nodo = next(
+                    s for r in totales.rubros.values() for s in r.hijos.values()
+                    if (r.objeto.nombre, s.objeto.nombre) == (fila[1], fila[2])
+                )
+                self.assertEqual(fila[10:], self.importes(nodo, nodo.total_usd), fila)
+            elif tipo == "Subtotal rubro":
+                vistas[tipo].append(fila[1])
+                nodo = next(r for r in totales.rubros.values() if r.objeto.nombre == fila[1])
+                self.assertEqual(fila[10:], self.importes(nodo, nodo.total_usd), fila)
+        self.assertEqual(sorted(vistas["Tarea"]), sorted(tareas))
+        self.assertEqual(len(vistas["Subtotal subrubro"]), sum(len(r.hijos) for r in totales.rubros.values()))
+        self.assertEqual(sorted(vistas["Subtotal rubro"]), sorted(r.objeto.nombre for r in totales.rubros.values()))
+        # Total general: USD estricto, como Presupuesto.total_usd.
+        self.assertEqual(filas[-1][0], "Total")
+        self.assertEqual(filas[-1][10:], self.importes(totales.general, totales.total_usd))
+        return totales
+
+    def test_coincide_con_los_totales(self):
+        filas = self.filas()
+        totales = self.assertCoincide(filas)
+        self.assertIsNotNone(totales.total_usd)
+        # Tandas de un ítem: mismo resultado.
+        with mock.patch("presupuestos.exportar.TANDA_ITEMS", 1):
+            self.assertEqual(self.filas(), filas)
+
+    def test_sin_cotizacion(self):
+        CotizacionDolar.objects.filter(tipo=self.datos.tipo_dolar).delete()
+        filas = self.filas()
+        totales = self.assertCoincide(filas)
+        self.assertIsNone(totales.total_usd)
+        por_tarea = {f[3]: f for f in filas if f[0] == "Tarea"}
+        # Sin cotización solo queda en USD lo que ya está en USD (o no tiene recursos).
+        self.assertEqual(por_tarea["Tabique"][13], "")
+        self.assertEqual(por_tarea["Limpieza"][13], "0.00")
+        self.assertTrue(all(f[13] == "" for f in filas if f[0].startswith("Subtotal") or f[0] == "Total"))
+
+
+def _hoja_precio(modelo, **filtro):
+    return modelo.objects.filter(**filtro).first()
+
+
+def _costo_por_fila(recurso, lote):
+    """(total, moneda) de un TareaRecurso resuelto de a una fila, como antes de CostosLote."""
+    cantidad = recurso.cantidad
+    if recurso.material_id:
+        hp = _hoja_precio(HojaPrecioMaterial, hoja=lote.hoja_materiales_id, material=recurso.material_id)
+        if hp is None:
+            return Decimal("0"), "ARS"
+        return cantidad * hp.precio_unidad_venta, hp.moneda or "ARS"
+    if recurso.mano_de_obra_id:
+        hp = _hoja_precio(
+            HojaPrecioManoDeObra, hoja=lote.hoja_mano_de_obra_id, mano_de_obra=recurso.mano_de_obra_id
+        )
+        return (cantidad * hp.precio_unidad_venta if hp else Decimal("0")), "ARS"
+    if recurso.subcontrato_id:
+        hp = _hoja_precio(
+            HojaPrecioSubcontrato, hoja=lote.hoja_subcontratos_id, subcontrato=recurso.subcontrato_id
+        )
+        if hp is None:
+            return Decimal("0"), "ARS"
+        return cantidad * hp.precio_unidad_venta, hp.moneda or "ARS"
+    if recurso.mezcla_id:
+        mezcla = recurso.mezcla
+        if mezcla.hoja_id != lote.hoja_materiales_id:
+            return Decimal("0"), "ARS"
+        precio = Decimal("0")
+        for det in MezclaMaterial.objects.filter(mezcla=mezcla):
+            hp = _hoja_precio(HojaPrecioMaterial, hoja=mezcla.hoja_id, material=det.material_id)
+            if hp is not None:
+                precio += det.cantidad * hp.precio_unidad_venta
+        return cantidad * precio, "ARS"
+    return Decimal("0"), "ARS"
+
+
+def _usd_por_fila(total, moneda, cotizacion):
+    if total == 0:
+        return Decimal("0")
+    if moneda == "USD":
+        return total
+    if cotizacion and cotizacion > 0:
+        return total / cotizacion
+    return None
+
+
+def _tarea_por_fila(tarea, tipos, cotizacion):
+    """(ARS, USD) de una tarea sumando sus recursos de a uno; USD None si alguno no convierte."""
+    ars, usd = Decimal("0"), Decimal("0")
+    for recurso in tarea.recursos.all():
+        if recurso.get_tipo() not in tipos:
+            continue
+        total, moneda = _costo_por_fila(recurso, tarea.lote)
+        ars += total
+        convertido = _usd_por_fila(total, moneda, cotizacion)
+        usd = None if usd is None or convertido is None else usd + convertido
+    return ars, usd
+
+
+class CostosPorFilaTests(EmpresaDePruebaMixin, TestCase):
+    """CostosLote y TotalesPresupuesto contra el cálculo recurso por recurso."""
+
+    def setUp(self):
+        super().setUp()
+        d = self.datos
+        c = d.company
+        self.presupuesto = Presupuesto.objects.get(pk=d.presupuesto.pk)
+        lote = d.lote
+        cemento = Material.objects.create(
+            nombre="Cemento", company=c, proveedor=d.proveedor, tipo=d.tipo, categoria=d.categoria,
+            unidad_de_venta=d.unidad, precio_unidad_venta=Decimal("9"), moneda="USD",
+        )
+        HojaPrecioMaterial.objects.create(
+            hoja=d.hoja_materiales, material=cemento, cantidad_por_unidad_venta=1,
+            precio_unidad_venta=Decimal("7.25"), moneda="USD",
+        )
+        # Sin precio en la hoja del lote: vale cero.
+        cal = Material.objects.create(
+            nombre="Cal", company=c, proveedor=d.proveedor, tipo=d.tipo, categoria=d.categoria,
+            unidad_de_venta=d.unidad, precio_unidad_venta=Decimal("40"),
+        )
+        # Mezcla con un material en USD: se suma nominal, como ARS.
+        revoque = Mezcla.objects.create(
+            nombre="Revoque grueso", company=c, unidad_de_mezcla=d.unidad, hoja=d.hoja_materiales
+        )
+        MezclaMaterial.objects.create(mezcla=revoque, material=d.material, cantidad=Decimal("1.5"))
+        MezclaMaterial.objects.create(mezcla=revoque, material=cemento, cantidad=Decimal("0.3"))
+        MezclaMaterial.objects.create(mezcla=revoque, material=cal, cantidad=Decimal("2"))
+        # Mezcla de otra hoja: tiene precio allí, pero en este lote vale cero.
+        otra_hoja = HojaPrecios.objects.create(nombre="Abril", company=c)
+        HojaPrecioMaterial.objects.create(
+            hoja=otra_hoja, material=d.material, cantidad_por_unidad_venta=1,
+            precio_unidad_venta=Decimal("120"),
+        )
+        ajena = Mezcla.objects.create(nombre="Ajena", company=c, unidad_de_mezcla=d.unidad, hoja=otra_hoja)
+        MezclaMaterial.objects.create(mezcla=ajena, material=d.material, cantidad=Decimal("4"))
+
+        rubro = Rubro.objects.create(nombre="Revoques", company=c)
+        subrubro = Subrubro.objects.create(nombre="Interior", rubro=rubro, company=c)
+
+        def tarea(nombre, *recursos):
+            t = Tarea.objects.create(nombre=nombre, company=c, rubro=rubro, subrubro=subrubro, lote=lote)
+            for cantidad, campos in recursos:
+                TareaRecurso.objects.create(tarea=t, cantidad=Decimal(cantidad), **campos)
+            return t
+
+        mixta = tarea(
+            "Mixta",
+            ("4", {"material": cemento}),
+            ("10", {"material": cal}),
+            ("2", {"mano_de_obra": d.mano_de_obra}),
+            ("0.5", {"subcontrato": d.subcontrato}),
+            ("1.5", {"mezcla": revoque}),
+            ("3", {"mezcla": ajena}),
+            # Material y mano de obra en la misma fila: cuenta como material.
+            ("0.75", {"material": cemento, "mano_de_obra": d.mano_de_obra}),
+        )
+        solo_usd = tarea("Solo USD", ("2", {"material": cemento}), ("1", {"subcontrato": d.subcontrato}))
+        vacia = tarea("Vacía")
+        for t, cantidad in ((mixta, "2.5"), (solo_usd, "3"), (vacia, "4")):
+            PresupuestoItem.objects.create(presupuesto=self.presupuesto, tarea=t, cantidad=Decimal(cantidad))
+        self.tareas = [d.tarea, mixta, solo_usd, vacia]
+
+    def referencia(self, cotizacion):
+        """Totales del presupuesto como los sumaba Presupuesto.total_usd, ítem por ítem."""
+        filas = {}
+        total_usd = Decimal("0")
+        for item in PresupuestoItem.objects.filter(presupuesto=self.presupuesto).select_related("tarea__lote"):
+            mat_ars, mat_usd = _tarea_por_fila(item.tarea, TIPOS_MATERIALES, cotizacion)
+            mo_ars, mo_usd = _tarea_por_fila(item.tarea, TIPOS_MANO_DE_OBRA, cotizacion)
+            mat_usd = None if mat_usd is None else mat_usd * item.cantidad
+            mo_usd = None if mo_usd is None else mo_usd * item.cantidad
+            usd = None if mat_usd is None or mo_usd is None else mat_usd + mo_usd
+            filas[item.tarea_id] = (
+                item.cantidad * mat_ars, item.cantidad * mo_ars, mat_usd, mo_usd, usd,
+            )
+            total_usd = None if total_usd is None or usd is None else total_usd + usd
+        return filas, total_usd
+
+    def assertCoincide(self, cotizacion):
+        d = self.datos
+        costos = CostosLote(d.lote)
+        for recurso in TareaRecurso.objects.filter(tarea__in=self.tareas).select_related("tarea__lote", "mezcla"):
+            total, moneda = _costo_por_fila(recurso, d.lote)
+            costo = costos.recurso(recurso.pk)
+            with self.subTest(recurso=recurso.pk, tipo=recurso.get_tipo()):
+                self.assertEqual((costo.tipo, costo.total, costo.moneda), (recurso.get_tipo(), total, moneda))
+                self.assertEqual(costo.total_usd(cotizacion), _usd_por_fila(total, moneda, cotizacion))
+        for tarea in self.tareas:
+            for tipos in (TIPOS_MATERIALES, TIPOS_MANO_DE_OBRA):
+                ars, usd = _tarea_por_fila(tarea, tipos, cotizacion)
+                with self.subTest(tarea=tarea.nombre, tipos=tipos):
+                    self.assertEqual(costos.total_tarea(tarea.pk, tipos), ars)
+                    self.assertEqual(costos.total_tarea_usd(tarea.pk, tipos, cotizacion), usd)
+
+        filas, total_usd = self.referencia(cotizacion)
+        totales = TotalesPresupuesto(self.presupuesto)
+        self.assertEqual(totales.cotizacion, cotizacion)
+        self.assertEqual(
+            {
+                f.item.tarea_id: (f.materiales_ars, f.mo_ars, f.materiales_usd, f.mo_usd, f.total_usd)
+                for f in totales.filas
+            },
+            filas,
+        )
+        self.assertEqual(totales.total_ars, sum((f[0] + f[1] for f in filas.values()), Decimal("0")))
+        self.assertEqual(totales.total_usd, total_usd)
+        self.assertEqual(self.presupuesto.total_usd(), total_usd)
+        return filas, totales
+
+    def test_ars_y_usd_mezclados(self):
+        filas, totales = self.assertCoincide(Decimal("1000"))
+        self.assertIsNotNone(totales.total_usd)
+        d = self.datos
+        mixta = self.tareas[1]
+        # La mezcla ajena y la Cal sin precio no suman; el Cemento queda en USD.
+        self.assertEqual(
+            CostosLote(d.lote).total_tarea(mixta.pk, TIPOS_MATERIALES),
+            Decimal("4") * Decimal("7.25")
+            + Decimal("1.5") * (Decimal("1.5") * 100 + Decimal("0.3") * Decimal("7.25"))
+            + Decimal("0.75") * Decimal("7.25"),
+        )
+        self.assertEqual(filas[self.tareas[3].pk], (0, 0, 0, 0, 0))
 
-# Create your tests here.
+    def test_sin_cotizacion(self):
+        CotizacionDolar.objects.filter(tipo=self.datos.tipo_dolar).delete()
+        filas, totales = self.assertCoincide(None)
+        self.assertIsNone(totales.total_usd)
+        # Lo que ya está en USD, o no tiene recursos, se convierte igual.
+        _, _, mat_usd, mo_usd, usd = filas[self.tareas[2].pk]
+        self.assertEqual((mat_usd, mo_usd), (Decimal("43.5"), Decimal("2400")))
+        self.assertEqual(usd, Decimal("2443.5"))
+        self.assertEqual(filas[self.tareas[3].pk][4], Decimal("0"))
+        self.assertIsNone(filas[self.tareas[1].pk][4])
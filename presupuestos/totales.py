@@ -0,0 +1,310 @@
+"""
+Totales de un presupuesto: árbol rubro → subrubro → ítem con los importes de
+materiales/mezclas y mano de obra/subcontratos, en ARS y USD.
+
+Se arma en una sola pasada sobre datos precargados (ítems + CostosLote del
+lote del presupuesto), así que la cantidad de consultas no depende de la
+cantidad de rubros, ítems ni recursos.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+
+from recursos.costos import TIPOS_MANO_DE_OBRA, TIPOS_MATERIALES, CostosLote
+
+CERO = Decimal("0")
+
+
+class TotalesItem:
+    """Importes de un PresupuestoItem (cantidad × precio unitario de la tarea)."""
+
+    def __init__(self, item, costos, cotizacion):
+        self.item = item
+        self.unidad = None
+        tarea_id = item.tarea_id
+        cantidad = item.cantidad
+        self.materiales_ars = cantidad * costos.total_tarea(tarea_id, TIPOS_MATERIALES)
+        self.mo_ars = cantidad * costos.total_tarea(tarea_id, TIPOS_MANO_DE_OBRA)
+        self.total_ars = self.materiales_ars + self.mo_ars
+
+        mat = costos.total_tarea_usd(tarea_id, TIPOS_MATERIALES, cotizacion)
+        mo = costos.total_tarea_usd(tarea_id, TIPOS_MANO_DE_OBRA, cotizacion)
+        self.materiales_usd = mat * cantidad if mat is not None else None
+        self.mo_usd = mo * cantidad if mo is not None else None
+        if self.materiales_usd is None or self.mo_usd is None:
+            self.total_usd = None
+        else:
+            self.total_usd = self.materiales_usd + self.mo_usd
+
+
+class NodoTotales:
+    """Rubro o subrubro del árbol con sus totales acumulados."""
+
+    def __init__(self, objeto, con_cotizacion):
+        self.objeto = objeto
+        self.hijos = {}
+        self.items = []
+        self.materiales_ars = CERO
+        self.mo_ars = CERO
+        self.total_ars = CERO
+        self._con_cotizacion = con_cotizacion
+        self._materiales_usd = CERO
+        self._mo_usd = CERO
+        self._total_usd = CERO
+
+    def sumar(self, fila):
+        self.materiales_ars += fila.materiales_ars
+        self.mo_ars += fila.mo_ars
+        self.total_ars += fila.total_ars
+        # Igual que las vistas originales: un ítem sin USD cuenta como 0.
+        self._materiales_usd += fila.materiales_usd or CERO
+        self._mo_usd += fila.mo_usd or CERO
+        self._total_usd += fila.total_usd or CERO
+
+    @property
+    def materiales_usd(self):
+        return self._materiales_usd if self._con_cotizacion else None
+
+    @property
+    def mo_usd(self):
+        return self._mo_usd if self._con_cotizacion else None
+
+    @property
+    def total_usd(self):
+        """Total en USD; None si el presupuesto no tiene cotización."""
+        return self._total_usd if self._con_cotizacion else None
+
+
+class TotalesPresupuesto:
+    """
+    Árbol de totales de un presupuesto.
+
+    Uso:
+        totales = TotalesPresupuesto(presupuesto)
+        totales.total_usd
+        totales.rubro(rubro_id).total_usd
+        totales.subrubro(rubro_id, subrubro_id).items
+    """
+
+    def __init__(self, presupuesto, costos=None):
+        self.presupuesto = presupuesto
+        self.cotizacion = presupuesto.get_cotizacion_usd()
+        items = list(
+            presupuesto.items.select_related(
+                "tarea", "tarea__rubro", "tarea__subrubro"
+            ).order_by("tarea__nombre")
+        )
+        if costos is None:
+            costos = CostosLote(
+                presupuesto.lote,
+                tareas=presupuesto.lote.tareas.filter(presupuesto_items__presupuesto=presupuesto),
+            )
+        self.costos = costos
+
+        con_cotizacion = bool(self.cotizacion)
+        self.general = NodoTotales(None, con_cotizacion)
+        self.rubros = {}
+        self.filas = []
+        total_usd = CERO
+        for item in items:
+            fila = TotalesItem(item, costos, self.cotizacion)
+            self.filas.append(fila)
+            tarea = item.tarea
+            rubro = self.rubros.get(tarea.rubro_id)
+            if rubro is None:
+                rubro = self.rubros[tarea.rubro_id] = NodoTotales(tarea.rubro, con_cotizacion)
+            subrubro = rubro.hijos.get(tarea.subrubro_id)
+            if subrubro is None:
+                subrubro = rubro.hijos[tarea.subrubro_id] = NodoTotales(
+                    tarea.subrubro, con_cotizacion
+                )
+            rubro.sumar(fila)
+            subrubro.sumar(fila)
+            subrubro.items.append(fila)
+            self.general.sumar(fila)
+            if total_usd is not None:
+                total_usd = None if fila.total_usd is None else total_usd + fila.total_usd
+        # Como Presupuesto.total_usd: None si algún ítem no se pudo convertir.
+        self.total_usd = total_usd
+        self.total_ars = self.general.total_ars
+
+    def rubro(self, rubro_id):
+        return self.rubros.get(rubro_id)
+
+    def subrubro(self, rubro_id, subrubro_id):
+        rubro = self.rubros.get(rubro_id)
+        return rubro.hijos.get(subrubro_id) if rubro else None
+
+    def total_rubro_usd(self, rubro_id):
+        """Total USD del rubro (0 si no tiene ítems); None sin cotización."""
+        if not self.cotizacion:
+            return None
+        nodo = self.rubros.get(rubro_id)
+        return nodo.total_usd if nodo else CERO
+
+    def total_subrubro_usd(self, rubro_id, subrubro_id):
+        if not self.cotizacion:
+            return None
+        nodo = self.subrubro(rubro_id, subrubro_id)
+        return nodo.total_usd if nodo else CERO
+
+
+def cargar_unidades(filas):
+    """Completa fila.unidad como Tarea.get_unidad, con una sola consulta para todas las filas."""
+    from recursos.models import TareaRecurso
+
+    tarea_ids = {fila.item.tarea_id for fila in filas}
+    if not tarea_ids:
+        return filas
+    unidades = {}
+    recursos = TareaRecurso.objects.filter(tarea_id__in=tarea_ids).select_related(
+        "material__unidad_de_venta",
+        "mano_de_obra__unidad_de_venta",
+        "subcontrato__unidad_de_venta",
+        "mezcla__unidad_de_mezcla",
+    ).order_by("pk")
+    for rec in recursos:
+        if rec.tarea_id in unidades:
+            continue
+        if rec.material_id:
+            unidad = rec.material.unidad_de_venta
+        elif rec.mano_de_obra_id:
+            unidad = rec.mano_de_obra.unidad_de_venta
+        elif rec.subcontrato_id:
+            unidad = rec.subcontrato.unidad_de_venta
+        elif rec.mezcla_id:
+            unidad = rec.mezcla.unidad_de_mezcla
+        else:
+            continue
+        unidades[rec.tarea_id] = unidad.nombre if unidad else None
+    for fila in filas:
+        fila.unidad = unidades.get(fila.item.tarea_id, "-")
+    return filas
+
+
+def chart_data(nodos_con_total, total):
+    """Datos del pie chart: [{label, value, percentage}] de los nodos con importe > 0."""
+    data = []
+    if total and total > 0:
+        for objeto, total_usd in nodos_con_total:
+            val = float(total_usd or 0)
+            pct = float((total_usd or 0) / total * 100)
+            if val > 0:
+                data.append({
+                    "label": objeto.nombre,
+                    "value": val,
+                    "percentage": round(pct, 1),
+                })
+    return data
+
+
+def _filas_guardadas(totales):
+    from .models import PresupuestoTotal
+
+    presupuesto = totales.presupuesto
+
+    def fila(nodo, rubro_id=None, subrubro_id=None):
+        return PresupuestoTotal(
+            presupuesto=presupuesto,
+            rubro_id=rubro_id,
+            subrubro_id=subrubro_id,
+            materiales_ars=nodo.materiales_ars,
+            mo_ars=nodo.mo_ars,
+            total_ars=nodo.total_ars,
+            materiales_usd=nodo.materiales_usd,
+            mo_usd=nodo.mo_usd,
+            total_usd=nodo.total_usd,
+        )
+
+    general = fila(totales.general)
+    # El total general sigue la regla de Presupuesto.total_usd: None si falta algún ítem.
+    if totales.total_usd is None:
+        general.materiales_usd = general.mo_usd = general.total_usd = None
+    filas = [general]
+    for rubro_id, rubro in totales.rubros.items():
+        filas.append(fila(rubro, rubro_id))
+        for subrubro_id, subrubro in rubro.hijos.items():
+            filas.append(fila(subrubro, rubro_id, subrubro_id))
+    return filas
+
+
+def guardar_totales(presupuesto):
+    """
+    Recalcula y guarda los PresupuestoTotal del presupuesto. Devuelve el árbol.
+
+    El cálculo se hace fuera de la transacción, así que puede cruzarse con un
+    cambio: se lee totales_version antes de calcular y las filas se guardan
+    (y se marcan vigentes) solo si nadie la subió mientras tanto. Si la
+    subieron, el recálculo que encoló ese cambio guarda los totales nuevos.
+    """
+    from .models import Presupuesto, PresupuestoTotal
+
+    version = (
+        Presupuesto.objects.filter(pk=presupuesto.pk)
+        .values_list("totales_version", flat=True)
+        .first()
+    )
+    totales = TotalesPresupuesto(presupuesto)
+    with transaction.atomic():
+        # El UPDATE condicionado bloquea la fila hasta el commit: dos recálculos no se pisan.
+        guardado = bool(
+            Presupuesto.objects.filter(pk=presupuesto.pk, totales_version=version).update(
+                totales_vigentes=True
+            )
+        )
+        if guardado:
+            PresupuestoTotal.objects.filter(presupuesto=presupuesto).delete()
+            PresupuestoTotal.objects.bulk_create(_filas_guardadas(totales))
+    presupuesto.totales_vigentes = guardado
+    return totales
+
+
+def actualizar_totales(presupuestos):
+    """
+    Recalcula los totales de los presupuestos (queryset) que no estén vigentes.
+    Devuelve cuántos guardó.
+    """
+    pendientes = presupuestos.filter(totales_vigentes=False).select_related(
+        "lote", "tipo_dolar"
+    )
+    cantidad = 0
+    for presupuesto in pendientes:
+        guardar_totales(presupuesto)
+        cantidad += presupuesto.totales_vigentes
+    return cantidad
+
+
+def invalidar_totales(presupuestos):
+    """
+    Marca como desactualizados los totales de los presupuestos (queryset) y
+    encola su recálculo en segundo plano (general.trabajos). La marca va en la
+    misma transacción que el cambio, así que si se hace rollback no queda nada
+    pendiente; mientras tanto presupuesto_list muestra lo guardado como
+    "recalculando".
+    """
+    from general.trabajos import encolar
+
+    from .models import Presupuesto
+
+    ids = sorted(presupuestos.values_list("pk", flat=True))
+    if not ids:
+        return
+    Presupuesto.objects.filter(pk__in=ids).update(
+        totales_vigentes=False, totales_version=F("totales_version") + 1
+    )
+    encolar("presupuestos.recalcular_totales", unico=True, ids=ids)
+
+
+def encolar_desactualizados(presupuestos):
+    """
+    Encola el recálculo de los presupuestos (queryset) con totales
+    desactualizados, sin repetir un trabajo pendiente igual. Para las vistas
+    que muestran lo guardado en vez de recalcular. Devuelve los ids.
+    """
+    from general.trabajos import encolar
+
+    ids = sorted(presupuestos.filter(totales_vigentes=False).values_list("pk", flat=True))
+    if ids:
+        encolar("presupuestos.recalcular_totales", unico=True, ids=ids)
+    return ids
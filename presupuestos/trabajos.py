@@ -0,0 +1,13 @@
+"""
+Trabajos en segundo plano de presupuestos (ver general.trabajos).
+"""
+from general.trabajos import trabajo
+
+from .models import Presupuesto
+from .totales import actualizar_totales
+
+
+@trabajo("presupuestos.recalcular_totales")
+def recalcular_totales_trabajo(job, ids):
+    cantidad = actualizar_totales(Presupuesto.objects.filter(pk__in=ids))
+    return {"presupuestos": cantidad}
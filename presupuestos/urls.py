@@ -11,6 +11,8 @@ urlpatterns = [
     path("<int:pk>/eliminar/", views.presupuesto_delete, name="presupuesto_delete"),
     path("<int:pk>/toggle-activo/", views.presupuesto_toggle_activo, name="presupuesto_toggle_activo"),
     path("<int:pk>/rubros/", views.presupuesto_rubros, name="presupuesto_rubros"),
+    path("<int:pk>/exportar/", views.presupuesto_exportar, name="presupuesto_exportar"),
+    path("<int:pk>/insumos/", views.presupuesto_insumos, name="presupuesto_insumos"),
     path(
         "<int:pk>/rubros/<int:rubro_pk>/subrubros/",
         views.presupuesto_subrubros,
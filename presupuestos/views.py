@@ -1,21 +1,35 @@
 from decimal import Decimal
 
 from django.contrib.auth.decorators import login_required
+from django.db.models import OuterRef, Subquery
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
+from django.utils.text import slugify
 
 from recursos.models import Rubro, Subrubro
 
+from .exportar import csv_presupuesto
 from .forms import PresupuestoForm, PresupuestoItemForm
-from .models import Presupuesto, PresupuestoItem
+from .insumos import InsumosPresupuesto, csv_insumos
+from .models import Presupuesto, PresupuestoItem, PresupuestoTotal
+from .totales import (
+    TotalesPresupuesto,
+    cargar_unidades,
+    chart_data,
+    encolar_desactualizados,
+)
 
 
 @login_required
 def presupuesto_list(request):
+    total_guardado = PresupuestoTotal.objects.filter(
+        presupuesto=OuterRef("pk"), rubro__isnull=True, subrubro__isnull=True
+    ).values("total_usd")[:1]
     presupuestos = Presupuesto.objects.filter(
         company=request.company
-    ).select_related("obra", "lote", "tipo_dolar").prefetch_related(
-        "items__tarea"
+    ).select_related("obra", "lote", "tipo_dolar").annotate(
+        total_usd_guardado=Subquery(total_guardado)
     ).order_by("-creado_en")
 
     # Filtro: activos, todos, cancelados
@@ -30,6 +44,9 @@ def presupuesto_list(request):
     if buscar:
         presupuestos = presupuestos.filter(obra__nombre__icontains=buscar)
 
+    # Los desactualizados se muestran con lo guardado y se recalculan en segundo plano.
+    encolar_desactualizados(presupuestos)
+
     return render(
         request,
         "presupuestos/presupuesto_list.html",
@@ -114,7 +131,7 @@ def presupuesto_rubros(request, pk):
         pk=pk,
         company=request.company,
     )
-    cotiz = presupuesto.get_cotizacion_usd()
+    totales = TotalesPresupuesto(presupuesto)
 
     # Rubros del lote (que tienen tareas) - para poder navegar y agregar
     rubro_ids = presupuesto.lote.tareas.values_list("rubro_id", flat=True).distinct()
@@ -122,30 +139,10 @@ def presupuesto_rubros(request, pk):
         pk__in=rubro_ids, company=request.company
     ).order_by("nombre")
 
-    rubros_con_total = []
-    for rubro in rubros:
-        items = presupuesto.items.filter(tarea__rubro=rubro)
-        total_usd = None
-        if cotiz:
-            total_usd = sum(
-                (item.total_general_usd() or Decimal("0")) for item in items
-            )
-        rubros_con_total.append((rubro, total_usd))
-
-    presupuesto_total = presupuesto.total_usd()
-
-    # Datos para el pie chart (etiqueta, valor, porcentaje)
-    chart_data = []
-    if presupuesto_total and presupuesto_total > 0:
-        for rubro, total_usd in rubros_con_total:
-            val = float(total_usd or 0)
-            pct = float((total_usd or 0) / presupuesto_total * 100)
-            if val > 0:
-                chart_data.append({
-                    "label": rubro.nombre,
-                    "value": val,
-                    "percentage": round(pct, 1),
-                })
+    rubros_con_total = [
+        (rubro, totales.total_rubro_usd(rubro.pk)) for rubro in rubros
+    ]
+    presupuesto_total = totales.total_usd
 
     return render(
         request,
@@ -154,7 +151,7 @@ def presupuesto_rubros(request, pk):
             "presupuesto": presupuesto,
             "rubros_con_total": rubros_con_total,
             "presupuesto_total": presupuesto_total,
-            "chart_data": chart_data,
+            "chart_data": chart_data(rubros_con_total, presupuesto_total),
         },
     )
 
@@ -167,7 +164,7 @@ def presupuesto_subrubros(request, pk, rubro_pk):
         company=request.company,
     )
     rubro = get_object_or_404(Rubro, pk=rubro_pk, company=request.company)
-    cotiz = presupuesto.get_cotizacion_usd()
+    totales = TotalesPresupuesto(presupuesto)
 
     # Subrubros del lote en este rubro
     subrubro_ids = presupuesto.lote.tareas.filter(
@@ -177,34 +174,13 @@ def presupuesto_subrubros(request, pk, rubro_pk):
         pk__in=subrubro_ids, company=request.company
     ).order_by("nombre")
 
-    subrubros_con_total = []
-    for subrubro in subrubros:
-        items = presupuesto.items.filter(
-            tarea__rubro=rubro, tarea__subrubro=subrubro
-        )
-        total_usd = None
-        if cotiz:
-            total_usd = sum(
-                (item.total_general_usd() or Decimal("0")) for item in items
-            )
-        subrubros_con_total.append((subrubro, total_usd))
-
+    subrubros_con_total = [
+        (subrubro, totales.total_subrubro_usd(rubro.pk, subrubro.pk))
+        for subrubro in subrubros
+    ]
     rubro_total = sum(
         (t or Decimal("0")) for _, t in subrubros_con_total
-    ) if cotiz else None
-
-    # Datos para el pie chart (subrubros y sus %)
-    chart_data = []
-    if rubro_total and rubro_total > 0:
-        for subrubro, total_usd in subrubros_con_total:
-            val = float(total_usd or 0)
-            pct = float((total_usd or 0) / rubro_total * 100)
-            if val > 0:
-                chart_data.append({
-                    "label": subrubro.nombre,
-                    "value": val,
-                    "percentage": round(pct, 1),
-                })
+    ) if totales.cotizacion else None
 
     return render(
         request,
@@ -214,7 +190,7 @@ def presupuesto_subrubros(request, pk, rubro_pk):
             "rubro": rubro,
             "subrubros_con_total": subrubros_con_total,
             "rubro_total": rubro_total,
-            "chart_data": chart_data,
+            "chart_data": chart_data(subrubros_con_total, rubro_total),
         },
     )
 
@@ -229,15 +205,6 @@ def presupuesto_tareas(request, pk, rubro_pk, subrubro_pk):
     rubro = get_object_or_404(Rubro, pk=rubro_pk, company=request.company)
     subrubro = get_object_or_404(Subrubro, pk=subrubro_pk, company=request.company)
 
-    items = presupuesto.items.filter(
-        tarea__rubro=rubro,
-        tarea__subrubro=subrubro,
-    ).select_related(
-        "tarea",
-        "tarea__rubro",
-        "tarea__subrubro",
-    ).order_by("tarea__nombre")
-
     if request.method == "POST":
         form = PresupuestoItemForm(request.POST, presupuesto=presupuesto)
         if form.is_valid():
@@ -262,10 +229,10 @@ def presupuesto_tareas(request, pk, rubro_pk, subrubro_pk):
             rubro=rubro, subrubro=subrubro
         )
 
-    cotiz = presupuesto.get_cotizacion_usd()
-    subrubro_total = sum(
-        (item.total_general_usd() or Decimal("0")) for item in items
-    ) if cotiz else None
+    totales = TotalesPresupuesto(presupuesto)
+    nodo = totales.subrubro(rubro.pk, subrubro.pk)
+    filas = cargar_unidades(nodo.items if nodo else [])
+    subrubro_total = totales.total_subrubro_usd(rubro.pk, subrubro.pk)
 
     return render(
         request,
@@ -274,7 +241,7 @@ def presupuesto_tareas(request, pk, rubro_pk, subrubro_pk):
             "presupuesto": presupuesto,
             "rubro": rubro,
             "subrubro": subrubro,
-            "items": items,
+            "filas": filas,
             "form": form,
             "subrubro_total": subrubro_total,
         },
@@ -295,3 +262,39 @@ def presupuesto_item_delete(request, pk, item_pk):
         rubro_pk=rubro_pk,
         subrubro_pk=subrubro_pk,
     )
+
+
+@login_required
+def presupuesto_exportar(request, pk):
+    """Descarga el presupuesto completo (tareas y recursos) como CSV, en streaming."""
+    presupuesto = get_object_or_404(
+        Presupuesto.objects.select_related("obra", "lote"), pk=pk, company=request.company
+    )
+    response = StreamingHttpResponse(csv_presupuesto(presupuesto), content_type="text/csv; charset=utf-8")
+    nombre = slugify(f"{presupuesto.obra.nombre} {presupuesto.instancia}") or "presupuesto"
+    response["Content-Disposition"] = f'attachment; filename="{nombre}-{presupuesto.pk}.csv"'
+    return response
+
+
+@login_required
+def presupuesto_insumos(request, pk):
+    """
+    Materiales, mano de obra y subcontratos que consume el presupuesto (mezclas
+    abiertas en sus materiales), con precios del lote. ?por_rubro=1 los separa
+    por rubro de la tarea; ?formato=csv descarga la lista.
+    """
+    presupuesto = get_object_or_404(
+        Presupuesto.objects.select_related("obra", "lote"), pk=pk, company=request.company
+    )
+    por_rubro = request.GET.get("por_rubro") == "1"
+    insumos = InsumosPresupuesto(presupuesto, por_rubro=por_rubro)
+    if request.GET.get("formato") == "csv":
+        response = StreamingHttpResponse(csv_insumos(insumos), content_type="text/csv; charset=utf-8")
+        nombre = slugify(f"{presupuesto.obra.nombre} {presupuesto.instancia}") or "presupuesto"
+        response["Content-Disposition"] = f'attachment; filename="{nombre}-{presupuesto.pk}-insumos.csv"'
+        return response
+    return render(
+        request,
+        "presupuestos/presupuesto_insumos.html",
+        {"presupuesto": presupuesto, "insumos": insumos, "por_rubro": por_rubro},
+    )
@@ -1,7 +1,10 @@
 from django.contrib import admin
+from django.db import transaction
 from django.urls import path, reverse
 from django.http import HttpResponseRedirect
 from django.shortcuts import render
+from general.models import Company
+from .historial import actualizar_por_porcentaje
 from .models import Material, ManoDeObra, Subcontrato
 from decimal import Decimal, InvalidOperation
 from django.contrib import messages
@@ -65,7 +68,17 @@ class MaterialAdmin(admin.ModelAdmin):
                     self.message_user(request, _("No se aplicó ningún cambio de precio ya que el porcentaje es 0%."), level=messages.WARNING)
                     return HttpResponseRedirect(changelist_url)
 
-                updated_count = Material.actualizar_precios_por_porcentaje(queryset, porcentaje)
+                # Por recursos.historial: queda registrada y se puede revertir (una operación por empresa).
+                por_empresa = {}
+                for pk, company_id in queryset.values_list('pk', 'company_id'):
+                    por_empresa.setdefault(company_id, []).append(pk)
+                empresas = Company.objects.in_bulk(list(por_empresa))
+                with transaction.atomic():
+                    operaciones = [
+                        actualizar_por_porcentaje(empresas[company_id], 'material', ids, porcentaje, usuario=request.user)
+                        for company_id, ids in por_empresa.items()
+                    ]
+                updated_count = sum(operacion.filas for operacion in operaciones)
 
                 self.message_user(request, _(f"Se actualizaron {updated_count} materiales con un porcentaje del {porcentaje}%."), level=messages.SUCCESS)
                 return HttpResponseRedirect(changelist_url)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class RecursosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recursos'
+
+    def ready(self):
+        import recursos.signals  # noqa: F401
+        import recursos.trabajos  # noqa: F401
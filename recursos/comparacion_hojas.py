@@ -0,0 +1,200 @@
+"""
+Comparación de precios entre dos hojas del mismo recurso, calculada en SQL.
+
+Las filas de las dos hojas se agrupan por recurso con Max(filter=hoja): el
+resultado equivale a un FULL OUTER JOIN (un recurso que está en una sola hoja
+queda con el otro precio en NULL). La diferencia y la variación se calculan
+en la misma consulta, así que se ordena y pagina en la base y el CSV se
+genera con iterator() sin armar la lista en memoria. La página va con
+LIMIT/OFFSET y no por cursor como en recursos.listados: el agrupado (y el
+orden por variación) se calcula entero antes del LIMIT, así que un cursor no
+ahorraría nada.
+
+El impacto por categoría (materiales) o rubro (MO y subcontratos) sale de
+otra consulta agrupada por esa columna: cada fila sabe con EXISTS si el mismo
+recurso está (y con el mismo precio) en la otra hoja; (hoja, recurso) está
+indexado en las tres tablas de detalle.
+"""
+import csv
+from decimal import Decimal
+
+from django.db.models import (
+    Count,
+    DecimalField,
+    Exists,
+    ExpressionWrapper,
+    F,
+    FloatField,
+    Max,
+    OuterRef,
+    Q,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Abs, Cast, NullIf
+
+from .historial import NOMBRES
+
+POR_PAGINA = 100
+MAX_POR_PAGINA = 1000
+
+# recurso → (campo del catálogo por el que se agrupa el impacto, título)
+GRUPOS = {
+    "material": ("categoria", "Categoría"),
+    "mano_de_obra": ("rubro", "Rubro"),
+    "subcontrato": ("rubro", "Rubro"),
+}
+
+ESTADOS = (
+    ("", "Con diferencias"),
+    ("cambiados", "Cambiaron de precio"),
+    ("nuevos", "Solo en la hoja B"),
+    ("quitados", "Solo en la hoja A"),
+    ("todos", "Todos"),
+)
+
+ORDENES = (
+    ("nombre", "Nombre"),
+    ("variacion", "Mayor variación %"),
+    ("diferencia", "Mayor diferencia"),
+)
+
+_DECIMAL = DecimalField(max_digits=13, decimal_places=4)
+
+
+def _porcentaje(nuevo, anterior):
+    if not anterior or nuevo is None:
+        return None
+    return (nuevo - anterior) / anterior * 100
+
+
+class ComparacionHojas:
+    """Precios de un recurso en la hoja A contra la hoja B (ambas de la empresa)."""
+
+    def __init__(self, company, recurso, hoja_a_id, hoja_b_id):
+        from .trabajos import RECURSOS_CON_PRECIO
+
+        self.recurso = recurso
+        self.hoja_a_id = hoja_a_id
+        self.hoja_b_id = hoja_b_id
+        self.detalle = RECURSOS_CON_PRECIO[recurso][1]
+        self.campo = f"{recurso}_id"
+        self.grupo, self.titulo_grupo = GRUPOS[recurso]
+        self.detalles = self.detalle.objects.filter(
+            hoja_id__in=(hoja_a_id, hoja_b_id), hoja__company=company
+        ).order_by()
+
+    def filas(self, estado="", orden="nombre"):
+        """
+        Queryset de dicts {recurso_id, nombre, grupo, precio_a, precio_b,
+        diferencia, variacion}, una fila por recurso.
+        """
+        a, b = self.hoja_a_id, self.hoja_b_id
+        filas = (
+            self.detalles.values(
+                recurso_id=F(self.campo),
+                nombre=F(f"{self.recurso}__{NOMBRES[self.recurso]}"),
+                grupo=F(f"{self.recurso}__{self.grupo}__nombre"),
+            )
+            .annotate(
+                precio_a=Max("precio_unidad_venta", filter=Q(hoja_id=a)),
+                precio_b=Max("precio_unidad_venta", filter=Q(hoja_id=b)),
+            )
+            .annotate(
+                diferencia=ExpressionWrapper(F("precio_b") - F("precio_a"), output_field=_DECIMAL),
+            )
+            .annotate(
+                variacion=Cast("diferencia", FloatField())
+                * Value(100.0)
+                / NullIf(Cast("precio_a", FloatField()), Value(0.0)),
+            )
+        )
+        solo_b = Q(precio_a__isnull=True)
+        solo_a = Q(precio_b__isnull=True)
+        cambio = Q(diferencia__lt=0) | Q(diferencia__gt=0)
+        if estado == "nuevos":
+            filas = filas.filter(solo_b)
+        elif estado == "quitados":
+            filas = filas.filter(solo_a)
+        elif estado == "cambiados":
+            filas = filas.filter(cambio)
+        elif estado != "todos":
+            filas = filas.filter(solo_a | solo_b | cambio)
+        if orden == "variacion":
+            return filas.order_by(Abs("variacion").desc(nulls_last=True), "nombre", "recurso_id")
+        if orden == "diferencia":
+            return filas.order_by(Abs("diferencia").desc(nulls_last=True), "nombre", "recurso_id")
+        return filas.order_by("nombre", "recurso_id")
+
+    def pagina(self, numero=1, por_pagina=POR_PAGINA, estado="", orden="nombre"):
+        """(filas de la página, hay más páginas)."""
+        desde = (numero - 1) * por_pagina
+        filas = list(self.filas(estado, orden)[desde : desde + por_pagina + 1])
+        return filas[:por_pagina], len(filas) > por_pagina
+
+    def impacto(self):
+        """
+        Por grupo: recursos nuevos, quitados, que cambiaron e iguales, y la suma
+        de precios en A y en B de los que están en ambas hojas, con su variación.
+        """
+        a, b = self.hoja_a_id, self.hoja_b_id
+        en = {
+            hoja_id: self.detalle.objects.filter(hoja_id=hoja_id, **{self.campo: OuterRef(self.campo)})
+            for hoja_id in (a, b)
+        }
+        grupos = list(
+            self.detalles.annotate(
+                en_a=Exists(en[a]),
+                en_b=Exists(en[b]),
+                igual_en_a=Exists(en[a].filter(precio_unidad_venta=OuterRef("precio_unidad_venta"))),
+            )
+            .values(grupo=F(f"{self.recurso}__{self.grupo}__nombre"))
+            .annotate(
+                nuevos=Count("pk", filter=Q(hoja_id=b, en_a=False)),
+                quitados=Count("pk", filter=Q(hoja_id=a, en_b=False)),
+                cambiados=Count("pk", filter=Q(hoja_id=b, en_a=True, igual_en_a=False)),
+                iguales=Count("pk", filter=Q(hoja_id=b, igual_en_a=True)),
+                suma_a=Sum("precio_unidad_venta", filter=Q(hoja_id=a, en_b=True)),
+                suma_b=Sum("precio_unidad_venta", filter=Q(hoja_id=b, en_a=True)),
+            )
+            .order_by("grupo")
+        )
+        total = {"grupo": "Total", "nuevos": 0, "quitados": 0, "cambiados": 0, "iguales": 0}
+        total["suma_a"] = total["suma_b"] = Decimal("0")
+        for g in grupos:
+            for clave in ("nuevos", "quitados", "cambiados", "iguales"):
+                total[clave] += g[clave]
+            for clave in ("suma_a", "suma_b"):
+                g[clave] = g[clave] or Decimal("0")
+                total[clave] += g[clave]
+        for g in (*grupos, total):
+            g["diferencia"] = g["suma_b"] - g["suma_a"]
+            g["variacion"] = _porcentaje(g["suma_b"], g["suma_a"])
+        return grupos, total
+
+
+def _num(valor, decimales=4):
+    return "" if valor is None else f"{valor:.{decimales}f}"
+
+
+def csv_comparacion(comparacion, titulos, estado="", orden="nombre"):
+    """Genera el CSV de la comparación línea por línea."""
+    from presupuestos.exportar import Eco
+
+    writer = csv.writer(Eco())
+    # BOM: Excel abre el archivo como UTF-8.
+    yield "\ufeff"
+    yield writer.writerow(
+        ["Recurso", comparacion.titulo_grupo, titulos[0], titulos[1], "Diferencia", "Variación %"]
+    )
+    for f in comparacion.filas(estado, orden).iterator(chunk_size=2000):
+        yield writer.writerow(
+            [
+                f["nombre"],
+                f["grupo"],
+                _num(f["precio_a"]),
+                _num(f["precio_b"]),
+                _num(f["diferencia"]),
+                _num(f["variacion"], 2),
+            ]
+        )
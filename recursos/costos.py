@@ -0,0 +1,354 @@
+"""
+Motor de costos por lote.
+
+Toma las tres hojas de precios del lote (materiales, mano de obra y
+subcontratos) del índice cacheado por hoja (ver indice_precios) y calcula el
+costo de cada TareaRecurso en una sola pasada. La cantidad de consultas es
+constante, sin importar cuántas tareas o recursos tenga el lote.
+"""
+from decimal import Decimal
+
+from django.db import models
+from django.db.models import (
+    Case,
+    ExpressionWrapper,
+    F,
+    Func,
+    OuterRef,
+    Q,
+    QuerySet,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
+
+from general.cotizaciones import a_usd, convertir_a_usd
+
+from .indice_precios import (
+    indice_mano_de_obra,
+    indice_materiales,
+    indice_subcontratos,
+    precios_mezclas,
+)
+
+CERO = Decimal("0")
+
+TIPOS_MATERIALES = ("material", "mezcla")
+TIPOS_MANO_DE_OBRA = ("mano_de_obra", "subcontrato")
+
+# Marca para "usar la cotización del propio lote" (None significa "sin cotización").
+COTIZACION_LOTE = object()
+
+
+def _tipo_recurso(material_id, mano_de_obra_id, subcontrato_id, mezcla_id):
+    if material_id:
+        return "material"
+    if mano_de_obra_id:
+        return "mano_de_obra"
+    if subcontrato_id:
+        return "subcontrato"
+    if mezcla_id:
+        return "mezcla"
+    return None
+
+
+class CostoRecurso:
+    """Costo de un recurso de tarea ya resuelto contra las hojas del lote."""
+
+    __slots__ = ("recurso_id", "tarea_id", "tipo", "cantidad", "total", "moneda")
+
+    def __init__(self, recurso_id, tarea_id, tipo, cantidad, total, moneda):
+        self.recurso_id = recurso_id
+        self.tarea_id = tarea_id
+        self.tipo = tipo
+        self.cantidad = cantidad
+        self.total = total
+        self.moneda = moneda
+
+    def precio_unitario(self):
+        if self.total and self.cantidad:
+            return self.total / self.cantidad
+        return CERO
+
+    def total_usd(self, cotizacion):
+        return convertir_a_usd(self.total, self.moneda, cotizacion)
+
+
+class CostosLote:
+    """
+    Costos de todas las tareas de un lote (o de un subconjunto de tareas).
+
+    Uso:
+        costos = CostosLote(lote)
+        costos.total_tarea(tarea.pk)
+        costos.total_tarea_usd(tarea.pk)
+    """
+
+    def __init__(self, lote, tareas=None, recursos=None):
+        from .models import TareaRecurso
+
+        self.lote = lote
+        self._cotizacion_cargada = False
+        self._cotizacion = None
+
+        recursos_qs = TareaRecurso.objects.filter(tarea__lote_id=lote.pk)
+        if recursos is not None:
+            recursos_qs = recursos_qs.filter(pk__in=[r.pk for r in recursos])
+        elif isinstance(tareas, QuerySet):
+            recursos_qs = recursos_qs.filter(tarea_id__in=tareas.values("pk"))
+        elif tareas is not None:
+            recursos_qs = recursos_qs.filter(
+                tarea_id__in=[t.pk if hasattr(t, "pk") else t for t in tareas]
+            )
+
+        filas = list(
+            recursos_qs.values_list(
+                "pk",
+                "tarea_id",
+                "material_id",
+                "mano_de_obra_id",
+                "subcontrato_id",
+                "mezcla_id",
+                "mezcla__hoja_id",
+                "cantidad",
+            )
+        )
+
+        material_ids = {f[2] for f in filas if f[2]}
+        mo_ids = {f[3] for f in filas if f[3]}
+        sub_ids = {f[4] for f in filas if f[4]}
+        mezcla_ids = {
+            f[5] for f in filas if f[5] and f[6] == lote.hoja_materiales_id
+        }
+
+        # Precios desde el índice cacheado de cada hoja (ver indice_precios).
+        self.precios_materiales = indice_materiales(lote.hoja_materiales_id) if material_ids else {}
+        self.precios_mano_de_obra = indice_mano_de_obra(lote.hoja_mano_de_obra_id) if mo_ids else {}
+        self.precios_subcontratos = indice_subcontratos(lote.hoja_subcontratos_id) if sub_ids else {}
+
+        # Solo las mezclas de la hoja del lote tienen precio (precalculado por hoja).
+        self.precios_mezclas = {}
+        if mezcla_ids:
+            precios = precios_mezclas(lote.hoja_materiales_id)
+            self.precios_mezclas = {m: precios.get(m, CERO) for m in mezcla_ids}
+
+        self.recursos = {}
+        self.recursos_por_tarea = {}
+        for pk, tarea_id, material_id, mo_id, sub_id, mezcla_id, _, cantidad in filas:
+            costo = self._costo(pk, tarea_id, material_id, mo_id, sub_id, mezcla_id, cantidad)
+            self.recursos[pk] = costo
+            self.recursos_por_tarea.setdefault(tarea_id, []).append(costo)
+
+    def _costo(self, pk, tarea_id, material_id, mo_id, sub_id, mezcla_id, cantidad):
+        tipo = _tipo_recurso(material_id, mo_id, sub_id, mezcla_id)
+        total = CERO
+        moneda = "ARS"
+        if tipo == "material":
+            hp = self.precios_materiales.get(material_id)
+            if hp:
+                total = cantidad * hp[0]
+                moneda = hp[2]
+        elif tipo == "mano_de_obra":
+            hp = self.precios_mano_de_obra.get(mo_id)
+            if hp:
+                total = cantidad * hp[0]
+        elif tipo == "subcontrato":
+            hp = self.precios_subcontratos.get(sub_id)
+            if hp:
+                total = cantidad * hp[0]
+                moneda = hp[2]
+        elif tipo == "mezcla":
+            precio = self.precios_mezclas.get(mezcla_id)
+            if precio is not None:
+                total = cantidad * precio
+        return CostoRecurso(pk, tarea_id, tipo, cantidad, total, moneda)
+
+    @property
+    def cotizacion(self):
+        """Cotización ARS/USD del lote (se consulta una sola vez)."""
+        if not self._cotizacion_cargada:
+            self._cotizacion = self.lote.get_cotizacion_usd()
+            self._cotizacion_cargada = True
+        return self._cotizacion
+
+    def recurso(self, recurso_id):
+        return self.recursos.get(recurso_id)
+
+    def _recursos_de(self, tarea_id, tipos=None):
+        for costo in self.recursos_por_tarea.get(tarea_id, ()):
+            if tipos is None or costo.tipo in tipos:
+                yield costo
+
+    def total_tarea(self, tarea_id, tipos=None):
+        """Total de la tarea (suma nominal, como Tarea.precio_total)."""
+        return sum((c.total for c in self._recursos_de(tarea_id, tipos)), CERO)
+
+    def total_tarea_usd(self, tarea_id, tipos=None, cotizacion=COTIZACION_LOTE):
+        """Total en USD. Usa la cotización del lote salvo que se pase otra. None si falta."""
+        if cotizacion is COTIZACION_LOTE:
+            cotizacion = self.cotizacion
+        costos = list(self._recursos_de(tarea_id, tipos))
+        usd = a_usd([c.total for c in costos], cotizacion, [c.moneda for c in costos])
+        if any(u is None for u in usd):
+            return None
+        return sum(usd, CERO)
+
+    def asignar(self, objetos):
+        """Deja este motor en cada Tarea/TareaRecurso para que sus métodos lo usen."""
+        for obj in objetos:
+            obj._costos_lote = self
+        return objetos
+
+
+# --- Costos en SQL -----------------------------------------------------------
+#
+# Las mismas reglas que CostosLote, pero como agregados sobre los recursos de
+# cada tarea: sirve para ordenar o filtrar un queryset de tareas por costo sin
+# traer los recursos a Python. Se suma por tipo de recurso y moneda, con
+# expresiones planas (SQLite corta si se anidan demasiados CASE).
+#
+# Tolerancia: los precios de mezcla entran como los Decimal ya calculados por
+# precios_mezclas, pero la aritmética la hace la base. En PostgreSQL es numeric
+# (exacta salvo el redondeo de la división por la cotización); en SQLite es
+# REAL, unas 15 cifras significativas. Por eso estos costos sirven para ordenar
+# y para un primer filtro con margen_sql(); lo que se muestra y el corte final
+# de un filtro salen de CostosLote (ver con_costos_exactos).
+
+_DECIMAL = models.DecimalField(max_digits=24, decimal_places=6)
+
+
+def _precio_hoja(modelo, hoja_id, campo, moneda=None):
+    """Subconsulta: precio del recurso del JOIN en la hoja (opcionalmente solo en esa moneda)."""
+    qs = modelo.objects.filter(hoja_id=hoja_id, **{f"{campo}_id": OuterRef(f"recursos__{campo}_id")})
+    if moneda == "USD":
+        qs = qs.filter(moneda="USD")
+    elif moneda == "ARS":
+        qs = qs.exclude(moneda="USD")
+    return Subquery(qs.order_by().values("precio_unidad_venta")[:1], output_field=_DECIMAL)
+
+
+def _precio_mezcla(hoja_materiales_id):
+    """Precio de la mezcla del JOIN: el mismo Decimal que usa CostosLote (0 si no es de la hoja)."""
+    precios = precios_mezclas(hoja_materiales_id) if hoja_materiales_id else {}
+    if not precios:
+        return Value(CERO, output_field=_DECIMAL)
+    return Case(
+        *(When(recursos__mezcla_id=pk, then=Value(precio)) for pk, precio in precios.items()),
+        default=Value(CERO),
+        output_field=_DECIMAL,
+    )
+
+
+def _suma(precio, condicion):
+    return Coalesce(
+        Sum(F("recursos__cantidad") * precio, filter=condicion, output_field=_DECIMAL),
+        Value(CERO),
+        output_field=_DECIMAL,
+    )
+
+
+class _Division(Func):
+    arg_joiner = " / "
+    template = "(%(expressions)s)"
+    output_field = _DECIMAL
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # En SQLite dos enteros se dividen como enteros: el dividendo pasa a REAL.
+        dividendo, divisor = (compiler.compile(e) for e in self.get_source_expressions())
+        return f"(CAST({dividendo[0]} AS REAL) / {divisor[0]})", (*dividendo[1], *divisor[1])
+
+
+def _a_usd(usd, ars, cotizacion):
+    # Como convertir_a_usd recurso por recurso: sin cotización, NULL si hay algo en ARS.
+    return Case(
+        When(**{ars: 0}, then=F(usd)),
+        When(_cotizacion__gt=0, then=F(usd) + _Division(F(ars), cotizacion)),
+        default=Value(None),
+        output_field=_DECIMAL,
+    )
+
+
+def anotar_costos(tareas, lote):
+    """
+    Anota un queryset de tareas del lote con:
+    costo_total, costo_materiales, costo_mo (nominal, como precio_total) y
+    costo_total_usd, costo_materiales_usd, costo_mo_usd (NULL si falta cotización).
+    Todo en una sola consulta SQL.
+    """
+    from .models import HojaPrecioManoDeObra, HojaPrecioMaterial, HojaPrecioSubcontrato
+
+    # Mismo orden de prioridad que _tipo_recurso.
+    es_material = Q(recursos__material_id__isnull=False)
+    es_mo = Q(recursos__material_id__isnull=True, recursos__mano_de_obra_id__isnull=False)
+    es_subcontrato = Q(
+        recursos__material_id__isnull=True,
+        recursos__mano_de_obra_id__isnull=True,
+        recursos__subcontrato_id__isnull=False,
+    )
+    es_mezcla = Q(
+        recursos__material_id__isnull=True,
+        recursos__mano_de_obra_id__isnull=True,
+        recursos__subcontrato_id__isnull=True,
+        recursos__mezcla_id__isnull=False,
+    )
+
+    # La cotización sale de la tabla memoizada (general.cotizaciones), no de una subconsulta.
+    cotizacion = Value(lote.get_cotizacion_usd(), output_field=_DECIMAL)
+
+    hoja_mat = lote.hoja_materiales_id
+    hoja_sub = lote.hoja_subcontratos_id
+    return tareas.alias(
+        _cotizacion=cotizacion,
+        _mat_usd=_suma(_precio_hoja(HojaPrecioMaterial, hoja_mat, "material", "USD"), es_material),
+        _mat_ars=_suma(_precio_hoja(HojaPrecioMaterial, hoja_mat, "material", "ARS"), es_material)
+        + _suma(_precio_mezcla(hoja_mat), es_mezcla),
+        _mo_usd=_suma(_precio_hoja(HojaPrecioSubcontrato, hoja_sub, "subcontrato", "USD"), es_subcontrato),
+        _mo_ars=_suma(_precio_hoja(HojaPrecioSubcontrato, hoja_sub, "subcontrato", "ARS"), es_subcontrato)
+        + _suma(_precio_hoja(HojaPrecioManoDeObra, lote.hoja_mano_de_obra_id, "mano_de_obra"), es_mo),
+    ).alias(
+        _total_usd=F("_mat_usd") + F("_mo_usd"),
+        _total_ars=F("_mat_ars") + F("_mo_ars"),
+    ).annotate(
+        costo_materiales=ExpressionWrapper(F("_mat_usd") + F("_mat_ars"), output_field=_DECIMAL),
+        costo_mo=ExpressionWrapper(F("_mo_usd") + F("_mo_ars"), output_field=_DECIMAL),
+        costo_total=ExpressionWrapper(F("_total_usd") + F("_total_ars"), output_field=_DECIMAL),
+        costo_materiales_usd=_a_usd("_mat_usd", "_mat_ars", F("_cotizacion")),
+        costo_mo_usd=_a_usd("_mo_usd", "_mo_ars", F("_cotizacion")),
+        costo_total_usd=_a_usd("_total_usd", "_total_ars", F("_cotizacion")),
+    )
+
+
+def margen_sql(valor):
+    """Holgura para filtrar por un costo calculado en SQL (ver la tolerancia más arriba)."""
+    return abs(valor) * Decimal("1e-9") + Decimal("0.000001")
+
+
+def con_costos_exactos(tareas, lote, costo_min=None, costo_max=None):
+    """
+    Evalúa un queryset de tareas anotado con anotar_costos y pisa los costo_*
+    con los de CostosLote, así la lista muestra lo mismo que el detalle de la
+    tarea. Si se pasan costo_min/costo_max, descarta las tareas que quedan fuera
+    según esos costos exactos (el queryset ya debería venir prefiltrado con
+    margen_sql). Respeta el orden del queryset.
+    """
+    tareas = list(tareas)
+    if not tareas:
+        return tareas
+    # Con muchas tareas conviene traer todo el lote antes que un IN enorme.
+    costos = CostosLote(lote, tareas=tareas if len(tareas) <= 500 else None)
+    resultado = []
+    for tarea in tareas:
+        tarea.costo_materiales = costos.total_tarea(tarea.pk, TIPOS_MATERIALES)
+        tarea.costo_mo = costos.total_tarea(tarea.pk, TIPOS_MANO_DE_OBRA)
+        tarea.costo_total = costos.total_tarea(tarea.pk)
+        tarea.costo_materiales_usd = costos.total_tarea_usd(tarea.pk, TIPOS_MATERIALES)
+        tarea.costo_mo_usd = costos.total_tarea_usd(tarea.pk, TIPOS_MANO_DE_OBRA)
+        tarea.costo_total_usd = costos.total_tarea_usd(tarea.pk)
+        if costo_min is not None and tarea.costo_total < costo_min:
+            continue
+        if costo_max is not None and tarea.costo_total > costo_max:
+            continue
+        resultado.append(tarea)
+    return resultado
@@ -348,3 +348,13 @@ class HojaPrecioSubcontratoForm(forms.ModelForm):
         model = HojaPrecioSubcontrato
         fields = ["cantidad_por_unidad_venta", "precio_unidad_venta", "moneda"]
 
+
+
+class ImportarPreciosForm(forms.Form):
+    """Archivo CSV con precios para cargar en una hoja."""
+    archivo = forms.FileField(label="Archivo CSV")
+    crear_faltantes = forms.BooleanField(
+        label="Agregar a la hoja los recursos que todavía no están",
+        required=False,
+        initial=True,
+    )
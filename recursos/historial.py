@@ -0,0 +1,193 @@
+"""
+Historial de precios de las actualizaciones masivas.
+
+Cada actualización por porcentaje (o reversión) es una OperacionPrecios; sus
+precios anteriores y nuevos se guardan en CambioPrecio, una fila por precio
+que cambió, con bulk_create dentro de la misma transacción. El costo extra es
+leer los precios antes y después del UPDATE (dos SELECT) más los INSERT.
+
+Con el historial se puede revertir una operación (solo las filas cuyo precio
+sigue siendo el que dejó la operación) y comparar los precios de una hoja (o
+del catálogo) en dos momentos. La comparación entre dos hojas está en
+recursos.comparacion_hojas.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+
+from .indice_precios import invalidar_hoja
+from .models import CambioPrecio, OperacionPrecios
+
+BATCH_SIZE = 1000
+
+# recurso → campo con el nombre en el catálogo
+NOMBRES = {"material": "nombre", "mano_de_obra": "tarea", "subcontrato": "tarea"}
+
+
+def _config(recurso):
+    from .trabajos import RECURSOS_CON_PRECIO
+
+    return RECURSOS_CON_PRECIO[recurso]
+
+
+def _filas(company, recurso, hoja_id):
+    """(queryset de filas con precio, campo con el id del recurso) del catálogo o de la hoja."""
+    catalogo, detalle, _, _, _, _ = _config(recurso)
+    if hoja_id:
+        return detalle.objects.filter(hoja_id=hoja_id, hoja__company=company), f"{recurso}_id"
+    return catalogo.objects.filter(company=company), "pk"
+
+
+def _invalidar(recurso, hoja_id):
+    """update()/bulk_update no disparan signals: índice de la hoja y presupuestos que la usan."""
+    from presupuestos.models import Presupuesto
+    from presupuestos.totales import invalidar_totales
+
+    if not hoja_id:
+        return
+    _, _, _, indice, campo_lote, _ = _config(recurso)
+    invalidar_hoja(indice, hoja_id)
+    invalidar_totales(Presupuesto.objects.filter(**{f"lote__{campo_lote}_id": hoja_id}))
+
+
+def _aplicar(company, recurso, hoja_id, ids, actualizar, usuario=None, **datos):
+    """
+    Corre actualizar(queryset, {pk: precio actual}) sobre las filas ids y
+    registra la operación con los precios que cambiaron. Las filas quedan
+    bloqueadas desde que se leen sus precios hasta el final de la transacción.
+    Devuelve la OperacionPrecios.
+    """
+    queryset, campo_recurso = _filas(company, recurso, hoja_id)
+    queryset = queryset.filter(pk__in=ids).order_by()
+    with transaction.atomic():
+        antes = {
+            pk: (recurso_id, precio)
+            for pk, recurso_id, precio in queryset.select_for_update().values_list(
+                "pk", campo_recurso, "precio_unidad_venta"
+            )
+        }
+        actualizar(queryset, {pk: precio for pk, (_, precio) in antes.items()})
+        despues = queryset.values_list("pk", "precio_unidad_venta")
+        cambios = [
+            CambioPrecio(
+                fila_id=pk, recurso_id=antes[pk][0], precio_anterior=antes[pk][1], precio_nuevo=precio
+            )
+            for pk, precio in despues
+            if pk in antes and antes[pk][1] != precio
+        ]
+        operacion = OperacionPrecios.objects.create(
+            company=company,
+            recurso=recurso,
+            hoja_id=hoja_id or None,
+            usuario=usuario,
+            filas=len(cambios),
+            **datos,
+        )
+        for cambio in cambios:
+            cambio.operacion = operacion
+        CambioPrecio.objects.bulk_create(cambios, batch_size=BATCH_SIZE)
+        _invalidar(recurso, hoja_id)
+    return operacion
+
+
+def actualizar_por_porcentaje(company, recurso, ids, porcentaje, hoja_id=None, usuario=None):
+    """Multiplica precio_unidad_venta por (1 + porcentaje/100) y guarda el historial."""
+    porcentaje = Decimal(str(porcentaje))
+    factor = Decimal("1") + (porcentaje / Decimal("100"))
+
+    def actualizar(queryset, actuales):
+        queryset.update(precio_unidad_venta=F("precio_unidad_venta") * factor)
+
+    return _aplicar(company, recurso, hoja_id, ids, actualizar, usuario, porcentaje=porcentaje)
+
+
+def revertir(operacion, usuario=None):
+    """
+    Vuelve al precio anterior las filas de la operación que todavía tienen el
+    precio que ella dejó (las que se cambiaron después no se tocan). Devuelve
+    (operación de reversión, filas saltadas).
+    """
+    catalogo, detalle, _, _, _, _ = _config(operacion.recurso)
+    modelo = detalle if operacion.hoja_id else catalogo
+    cambios = {
+        fila_id: (anterior, nuevo)
+        for fila_id, anterior, nuevo in operacion.cambios.values_list(
+            "fila_id", "precio_anterior", "precio_nuevo"
+        )
+    }
+    revertidas = []
+
+    def actualizar(queryset, actuales):
+        # Los precios actuales se leen bloqueados en la misma transacción que el UPDATE.
+        revertidas.extend(pk for pk, precio in actuales.items() if precio == cambios[pk][1])
+        modelo.objects.bulk_update(
+            [modelo(pk=pk, precio_unidad_venta=cambios[pk][0]) for pk in revertidas],
+            ["precio_unidad_venta"],
+            batch_size=BATCH_SIZE,
+        )
+
+    nueva = _aplicar(
+        operacion.company, operacion.recurso, operacion.hoja_id, list(cambios), actualizar, usuario,
+        revierte=operacion,
+    )
+    return nueva, len(cambios) - len(revertidas)
+
+
+def _variacion(anterior, nuevo):
+    """Variación porcentual, o None si falta alguno de los dos o el anterior es 0."""
+    if not anterior or nuevo is None:
+        return None
+    return (nuevo - anterior) / anterior * 100
+
+
+def _nombres(recurso, recurso_ids):
+    catalogo = _config(recurso)[0]
+    return dict(
+        catalogo.objects.filter(pk__in=recurso_ids).order_by().values_list("pk", NOMBRES[recurso])
+    )
+
+
+def diferencias_en_el_tiempo(company, recurso, hoja_id, desde, hasta=None):
+    """
+    Precios que cambiaron entre desde y hasta (por defecto, ahora) en la hoja o
+    el catálogo, según el historial: [{fila_id, recurso_id, nombre, precio_a,
+    precio_b, variacion}]. El precio en un momento es el anterior del primer cambio
+    posterior, o el actual si no hubo cambios después.
+    """
+    cambios = (
+        CambioPrecio.objects.filter(
+            operacion__company=company,
+            operacion__recurso=recurso,
+            operacion__hoja_id=hoja_id or None,
+            operacion__creado_en__gt=desde,
+        )
+        .order_by("operacion__creado_en", "pk")
+        .values_list("fila_id", "recurso_id", "precio_anterior", "operacion__creado_en")
+    )
+    en_desde, en_hasta, recurso_de = {}, {}, {}
+    for fila_id, recurso_id, anterior, creado_en in cambios:
+        recurso_de[fila_id] = recurso_id
+        en_desde.setdefault(fila_id, anterior)
+        if hasta is not None and creado_en > hasta:
+            en_hasta.setdefault(fila_id, anterior)
+    # Sin cambios después de hasta: el precio de hasta es el actual.
+    pendientes = [f for f in en_desde if f not in en_hasta]
+    if pendientes:
+        queryset, _ = _filas(company, recurso, hoja_id)
+        en_hasta.update(queryset.filter(pk__in=pendientes).order_by().values_list("pk", "precio_unidad_venta"))
+    filas = [f for f in en_desde if en_desde[f] != en_hasta.get(f)]
+    nombres = _nombres(recurso, {recurso_de[f] for f in filas})
+    resultado = [
+        {
+            "fila_id": f,
+            "recurso_id": recurso_de[f],
+            "nombre": nombres.get(recurso_de[f]),
+            "precio_a": en_desde[f],
+            "precio_b": en_hasta.get(f),
+            "variacion": _variacion(en_desde[f], en_hasta.get(f)),
+        }
+        for f in filas
+    ]
+    resultado.sort(key=lambda fila: (fila["nombre"] or "").lower())
+    return resultado
@@ -0,0 +1,237 @@
+"""
+Importación de listas de precios (CSV) a una hoja de precios.
+
+El archivo se lee fila por fila. Cada fila se busca en un índice en memoria
+del catálogo de la empresa (nombre normalizado → candidatos con proveedor o
+rubro/subrubro), armado con una sola consulta. Los cambios se aplican con
+bulk_update / bulk_create por tandas dentro de una transacción; las filas que
+no se encuentran (o que coinciden con más de un recurso) quedan en el reporte.
+
+Columnas (encabezado obligatorio, sin importar mayúsculas ni acentos):
+    nombre (o tarea), precio; opcionales: cantidad, moneda, proveedor,
+    rubro, subrubro.
+"""
+from django.db import transaction
+
+from general.estadisticas import invalidar_estadisticas
+from general.lectura import leer_decimal, lector_csv, normalizar
+
+from .indice_precios import invalidar_hoja
+
+BATCH_SIZE = 1000
+
+# Filas problemáticas que se guardan para mostrar (las demás solo se cuentan).
+MAX_FILAS_REPORTE = 200
+
+COLUMNAS = {
+    "nombre": ("nombre", "tarea", "descripcion", "material"),
+    "precio": ("precio", "precio_unidad_venta", "precio unidad venta"),
+    "cantidad": ("cantidad", "cantidad_por_unidad_venta", "cantidad por unidad venta"),
+    "moneda": ("moneda",),
+    "proveedor": ("proveedor",),
+    "rubro": ("rubro",),
+    "subrubro": ("subrubro",),
+}
+
+# recurso → (campo del nombre, columnas que desempatan y su campo en el catálogo)
+CLAVES = {
+    "material": ("nombre", (("proveedor", "proveedor__nombre"),)),
+    "mano_de_obra": ("tarea", (("rubro", "rubro__nombre"), ("subrubro", "subrubro__nombre"))),
+    "subcontrato": (
+        "tarea",
+        (("proveedor", "proveedor__nombre"), ("rubro", "rubro__nombre"), ("subrubro", "subrubro__nombre")),
+    ),
+}
+
+
+class ErrorImportacion(Exception):
+    """El archivo no se puede importar (formato o columnas)."""
+
+
+class ResultadoImportacion:
+    """Conteos y filas con problemas de una importación."""
+
+    def __init__(self):
+        self.leidas = 0
+        self.actualizadas = 0
+        self.creadas = 0
+        self.sin_cambios = 0
+        self.no_encontradas = 0
+        self.ambiguas = 0
+        self.con_error = 0
+        self.problemas = []
+
+    def problema(self, linea, fila, motivo):
+        if len(self.problemas) < MAX_FILAS_REPORTE:
+            self.problemas.append((linea, fila, motivo))
+
+    def __str__(self):
+        return (
+            f"{self.leidas} filas: {self.actualizadas} actualizadas, {self.creadas} agregadas, "
+            f"{self.sin_cambios} sin cambios, {self.no_encontradas} no encontradas, "
+            f"{self.ambiguas} ambiguas, {self.con_error} con error"
+        )
+
+
+class IndiceCatalogo:
+    """Recursos de la empresa por nombre normalizado, con los datos para desempatar."""
+
+    def __init__(self, catalogo, recurso, company):
+        campo_nombre, desempates = CLAVES[recurso]
+        self.desempates = [columna for columna, _ in desempates]
+        self.candidatos = {}
+        # Moneda por defecto de la fila nueva; mano de obra no tiene moneda.
+        tiene_moneda = recurso != "mano_de_obra"
+        campos = [
+            "pk",
+            campo_nombre,
+            "cantidad_por_unidad_venta",
+            *(["moneda"] if tiene_moneda else []),
+            *(campo for _, campo in desempates),
+        ]
+        inicio_extras = 4 if tiene_moneda else 3
+        for fila in catalogo.objects.filter(company=company).order_by().values_list(*campos):
+            pk, nombre, cantidad = fila[:3]
+            moneda = fila[3] if tiene_moneda else None
+            extras = tuple(normalizar(v) for v in fila[inicio_extras:])
+            self.candidatos.setdefault(normalizar(nombre), []).append((pk, cantidad, moneda, extras))
+
+    def buscar(self, nombre, valores):
+        """Devuelve (candidato, motivo); motivo es None si hubo un único candidato."""
+        candidatos = self.candidatos.get(normalizar(nombre), [])
+        for i, columna in enumerate(self.desempates):
+            valor = normalizar(valores.get(columna))
+            if valor:
+                candidatos = [c for c in candidatos if c[3][i] == valor]
+        if not candidatos:
+            return None, "no encontrado"
+        if len(candidatos) > 1:
+            return None, "ambiguo"
+        return candidatos[0], None
+
+
+def _columnas(encabezado):
+    """Nombre de columna del archivo → columna conocida."""
+    alias = {normalizar(a): columna for columna, nombres in COLUMNAS.items() for a in nombres}
+    mapa = {}
+    for original in encabezado or []:
+        columna = alias.get(normalizar(original))
+        if columna and columna not in mapa.values():
+            mapa[original] = columna
+    faltan = {"nombre", "precio"} - set(mapa.values())
+    if faltan:
+        raise ErrorImportacion(f"Faltan columnas: {', '.join(sorted(faltan))}.")
+    return mapa
+
+
+def importar_precios(hoja, recurso, lineas, crear_faltantes=True):
+    """
+    Importa a `hoja` los precios de `lineas` (iterable de líneas de texto CSV).
+    Con crear_faltantes agrega a la hoja los recursos del catálogo que todavía
+    no están. Devuelve un ResultadoImportacion.
+    """
+    from presupuestos.models import Presupuesto
+    from presupuestos.totales import invalidar_totales
+
+    from .trabajos import RECURSOS_CON_PRECIO
+
+    catalogo, detalle, _, indice, campo_lote, _ = RECURSOS_CON_PRECIO[recurso]
+    campo = f"{recurso}_id"
+    tiene_moneda = recurso != "mano_de_obra"
+    lector = lector_csv(iter(lineas))
+    mapa = _columnas(lector.fieldnames)
+    catalogo_indice = IndiceCatalogo(catalogo, recurso, hoja.company)
+    resultado = ResultadoImportacion()
+
+    with transaction.atomic():
+        existentes = {d[campo]: d for d in detalle.objects.filter(hoja=hoja).order_by().values()}
+        vistos = set()
+        actualizar, crear = [], []
+        campos_update = ["precio_unidad_venta", "cantidad_por_unidad_venta"]
+        if tiene_moneda:
+            campos_update.append("moneda")
+
+        def guardar():
+            if actualizar:
+                detalle.objects.bulk_update(actualizar, campos_update, batch_size=BATCH_SIZE)
+                actualizar.clear()
+            if crear:
+                detalle.objects.bulk_create(crear, batch_size=BATCH_SIZE)
+                crear.clear()
+
+        for fila in lector:
+            linea = lector.line_num
+            valores = {mapa[k]: (v or "").strip() for k, v in fila.items() if k in mapa}
+            if not any(valores.values()):
+                continue
+            resultado.leidas += 1
+            try:
+                precio = leer_decimal(valores.get("precio"))
+                cantidad = leer_decimal(valores.get("cantidad"))
+                if precio is None:
+                    raise ValueError("falta el precio")
+                moneda = valores.get("moneda", "").upper()
+                if moneda and moneda not in ("ARS", "USD"):
+                    raise ValueError(f"moneda inválida: {moneda}")
+            except ValueError as exc:
+                resultado.con_error += 1
+                resultado.problema(linea, valores, str(exc))
+                continue
+
+            candidato, motivo = catalogo_indice.buscar(valores.get("nombre"), valores)
+            if candidato is None:
+                if motivo == "ambiguo":
+                    resultado.ambiguas += 1
+                else:
+                    resultado.no_encontradas += 1
+                resultado.problema(linea, valores, motivo)
+                continue
+            recurso_id, cantidad_catalogo, moneda_catalogo, _ = candidato
+            if recurso_id in vistos:
+                resultado.con_error += 1
+                resultado.problema(linea, valores, "repetido en el archivo")
+                continue
+            vistos.add(recurso_id)
+
+            actual = existentes.get(recurso_id)
+            if actual is None:
+                if not crear_faltantes:
+                    resultado.no_encontradas += 1
+                    resultado.problema(linea, valores, "no está en la hoja")
+                    continue
+                nuevo = detalle(
+                    hoja=hoja,
+                    precio_unidad_venta=precio,
+                    cantidad_por_unidad_venta=cantidad if cantidad is not None else cantidad_catalogo,
+                    **{campo: recurso_id},
+                )
+                if tiene_moneda:
+                    nuevo.moneda = moneda or moneda_catalogo
+                crear.append(nuevo)
+                resultado.creadas += 1
+            else:
+                nuevos = {
+                    "precio_unidad_venta": precio,
+                    "cantidad_por_unidad_venta": (
+                        cantidad if cantidad is not None else actual["cantidad_por_unidad_venta"]
+                    ),
+                }
+                if tiene_moneda:
+                    nuevos["moneda"] = moneda or actual["moneda"]
+                if all(actual[k] == v for k, v in nuevos.items()):
+                    resultado.sin_cambios += 1
+                    continue
+                actualizar.append(detalle(pk=actual["id"], **nuevos))
+                resultado.actualizadas += 1
+
+            if len(actualizar) + len(crear) >= BATCH_SIZE:
+                guardar()
+        guardar()
+
+        if resultado.actualizadas or resultado.creadas:
+            # bulk_update/bulk_create no disparan signals.
+            invalidar_hoja(indice, hoja.pk)
+            invalidar_totales(Presupuesto.objects.filter(**{f"lote__{campo_lote}": hoja}))
+        if resultado.creadas:
+            invalidar_estadisticas(hoja.company_id)
+    return resultado
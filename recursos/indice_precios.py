@@ -0,0 +1,148 @@
+"""
+Índice de precios por hoja, guardado en el cache de Django.
+
+Para cada hoja (de materiales, mano de obra o subcontratos) se arma una vez el
+diccionario recurso_id → (precio_unidad_venta, cantidad_por_unidad_venta,
+moneda) y se guarda en el cache bajo una clave que incluye la versión de la
+hoja. Cualquier escritura sobre los detalles de la hoja sube la versión (ver
+recursos.signals; los update() masivos llaman a invalidar_hoja a mano), así
+que la próxima lectura vuelve a armar el índice.
+
+El cache tiene que ser compartido entre procesos (ver CACHES en settings):
+una versión subida en un worker o en `procesar_trabajos` la leen todos. Las
+versiones y los índices ya leídos se reusan hasta el final del request
+(general.memo), así que cada request va al cache una vez por hoja.
+
+El precio por unidad de las mezclas de una hoja de materiales se calcula para
+todas juntas con una consulta de su composición y el índice de materiales de
+la hoja (suma de cantidad × precio, sin redondear) y se guarda igual, con una
+clave que depende de la versión de los precios de la hoja y de la versión de
+sus mezclas (que sube al cambiar una mezcla o su composición).
+"""
+from decimal import Decimal
+
+from django.core.cache import cache
+
+from general import memo
+
+CERO = Decimal("0")
+
+MATERIALES = "materiales"
+MANO_DE_OBRA = "mano_de_obra"
+SUBCONTRATOS = "subcontratos"
+# Composición de las mezclas de una hoja de materiales (solo versión, sin índice propio).
+MEZCLAS = "mezclas"
+
+# Los índices viejos quedan huérfanos al subir la versión; que no vivan para siempre.
+TIMEOUT_INDICE = 60 * 60 * 24
+
+
+def _modelo_y_campo(tipo):
+    from .models import HojaPrecioManoDeObra, HojaPrecioMaterial, HojaPrecioSubcontrato
+
+    return {
+        MATERIALES: (HojaPrecioMaterial, "material_id"),
+        MANO_DE_OBRA: (HojaPrecioManoDeObra, "mano_de_obra_id"),
+        SUBCONTRATOS: (HojaPrecioSubcontrato, "subcontrato_id"),
+    }[tipo]
+
+
+def _clave_version(tipo, hoja_id):
+    return f"recursos:hoja:{tipo}:{hoja_id}:version"
+
+
+def version_hoja(tipo, hoja_id):
+    return memo.version(_clave_version(tipo, hoja_id))
+
+
+def invalidar_hoja(tipo, hoja_id):
+    """
+    Sube la versión de la hoja: el índice guardado deja de usarse (ver
+    general.memo.invalidar_version).
+    """
+    if not hoja_id:
+        return
+    memo.invalidar_version(_clave_version(tipo, hoja_id))
+
+
+def indice_hoja(tipo, hoja_id):
+    """
+    Diccionario recurso_id → (precio, cantidad_por_unidad_venta, moneda) de la hoja.
+    Vacío si no hay hoja.
+    """
+    if not hoja_id:
+        return {}
+    clave = f"recursos:hoja:{tipo}:{hoja_id}:v{version_hoja(tipo, hoja_id)}"
+    return memo.leer(clave, lambda: _cargar_indice(tipo, hoja_id, clave))
+
+
+def _cargar_indice(tipo, hoja_id, clave):
+    indice = cache.get(clave)
+    if indice is None:
+        modelo, campo = _modelo_y_campo(tipo)
+        # order_by() vacío: el orden por defecto de las hojas agrega JOINs innecesarios.
+        qs = modelo.objects.filter(hoja_id=hoja_id).order_by()
+        if tipo == MANO_DE_OBRA:
+            filas = (
+                (recurso_id, precio, cantidad, "ARS")
+                for recurso_id, precio, cantidad in qs.values_list(
+                    campo, "precio_unidad_venta", "cantidad_por_unidad_venta"
+                )
+            )
+        else:
+            filas = qs.values_list(
+                campo, "precio_unidad_venta", "cantidad_por_unidad_venta", "moneda"
+            )
+        indice = {
+            recurso_id: (precio, cantidad, moneda or "ARS")
+            for recurso_id, precio, cantidad, moneda in filas
+        }
+        cache.set(clave, indice, timeout=TIMEOUT_INDICE)
+    return indice
+
+
+def indice_materiales(hoja_id):
+    return indice_hoja(MATERIALES, hoja_id)
+
+
+def indice_mano_de_obra(hoja_id):
+    return indice_hoja(MANO_DE_OBRA, hoja_id)
+
+
+def indice_subcontratos(hoja_id):
+    return indice_hoja(SUBCONTRATOS, hoja_id)
+
+
+def precios_mezclas(hoja_id):
+    """
+    Diccionario mezcla_id → precio por unidad de mezcla, para las mezclas de la
+    hoja de materiales. Los materiales que no están en la hoja valen 0 (las
+    mezclas sin materiales con precio no aparecen).
+    """
+    if not hoja_id:
+        return {}
+    clave = (
+        f"recursos:hoja:{MEZCLAS}:{hoja_id}"
+        f":v{version_hoja(MATERIALES, hoja_id)}.{version_hoja(MEZCLAS, hoja_id)}"
+    )
+    return memo.leer(clave, lambda: _cargar_precios_mezclas(hoja_id, clave))
+
+
+def _cargar_precios_mezclas(hoja_id, clave):
+    from .models import MezclaMaterial
+
+    precios = cache.get(clave)
+    if precios is None:
+        # Se suma en Python con los Decimal del índice: un SUM en SQL redondearía
+        # cantidad × precio a los decimales de su output_field.
+        materiales = indice_materiales(hoja_id)
+        precios = {}
+        composicion = MezclaMaterial.objects.filter(mezcla__hoja_id=hoja_id).order_by().values_list(
+            "mezcla_id", "material_id", "cantidad"
+        )
+        for mezcla_id, material_id, cantidad in composicion:
+            hp = materiales.get(material_id)
+            if hp:
+                precios[mezcla_id] = precios.get(mezcla_id, CERO) + cantidad * hp[0]
+        cache.set(clave, precios, timeout=TIMEOUT_INDICE)
+    return precios
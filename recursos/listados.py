@@ -0,0 +1,303 @@
+"""
+Listados paginados del catálogo de materiales, mano de obra y subcontratos
+(y de las filas de sus hojas de precios).
+
+La paginación es por cursor (keyset): la página siguiente se pide con los
+valores de orden de la última fila mostrada (?despues=...) en lugar de un
+OFFSET, así cada página cuesta lo mismo sin importar cuán adentro de la lista
+esté. Búsqueda, filtros y orden se resuelven en la consulta; los índices
+(company, nombre) / (company, tarea) cubren el orden por defecto por nombre.
+"""
+import base64
+import binascii
+import json
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce
+
+POR_PAGINA = 50
+MAX_POR_PAGINA = 500
+
+# Campos propios de cada fila (catálogo o detalle de hoja): no llevan el prefijo del recurso.
+CAMPOS_DE_FILA = {"precio_unidad_venta", "cantidad_por_unidad_venta", "moneda"}
+
+# Columnas de orden que pueden ser NULL (se ordenan como "").
+ANULABLES = {"proveedor__nombre"}
+
+# recurso → configuración (rutas relativas al objeto del catálogo)
+LISTADOS = {
+    "material": {
+        "relacionados": ("proveedor", "tipo", "categoria", "unidad_de_venta"),
+        "busqueda": ("nombre", "proveedor__nombre", "tipo__nombre", "categoria__nombre"),
+        "filtros": {"proveedor": "proveedor_id", "tipo": "tipo_id", "categoria": "categoria_id"},
+        "ordenes": {
+            "nombre": ("nombre",),
+            "proveedor": ("proveedor__nombre", "nombre"),
+            "tipo": ("tipo__nombre", "categoria__nombre", "nombre"),
+            "categoria": ("categoria__nombre", "nombre"),
+            "precio": ("precio_unidad_venta",),
+        },
+        "orden_defecto": "nombre",
+        "columnas": {
+            "nombre": "nombre",
+            "proveedor": "proveedor.nombre",
+            "tipo": "tipo.nombre",
+            "categoria": "categoria.nombre",
+            "unidad_de_venta": "unidad_de_venta.nombre",
+        },
+    },
+    "mano_de_obra": {
+        "relacionados": ("rubro", "subrubro", "equipo", "ref_equipo", "unidad_de_venta"),
+        "busqueda": ("tarea", "rubro__nombre", "subrubro__nombre", "equipo__nombre", "ref_equipo__nombre"),
+        "filtros": {"rubro": "rubro_id", "subrubro": "subrubro_id"},
+        "ordenes": {
+            "rubro": ("rubro__nombre", "subrubro__nombre", "tarea"),
+            "subrubro": ("subrubro__nombre", "tarea"),
+            "tarea": ("tarea",),
+            "precio": ("precio_unidad_venta",),
+        },
+        "orden_defecto": "rubro",
+        "columnas": {
+            "tarea": "tarea",
+            "rubro": "rubro.nombre",
+            "subrubro": "subrubro.nombre",
+            "equipo": "equipo.nombre",
+            "ref_equipo": "ref_equipo.nombre",
+            "unidad_de_venta": "unidad_de_venta.nombre",
+        },
+    },
+    "subcontrato": {
+        "relacionados": ("rubro", "subrubro", "proveedor", "unidad_de_venta"),
+        "busqueda": ("tarea", "proveedor__nombre", "rubro__nombre", "subrubro__nombre"),
+        "filtros": {"rubro": "rubro_id", "subrubro": "subrubro_id", "proveedor": "proveedor_id"},
+        "ordenes": {
+            "rubro": ("rubro__nombre", "subrubro__nombre", "tarea"),
+            "subrubro": ("subrubro__nombre", "tarea"),
+            "tarea": ("tarea",),
+            "proveedor": ("proveedor__nombre", "tarea"),
+            "precio": ("precio_unidad_venta",),
+        },
+        "orden_defecto": "rubro",
+        "columnas": {
+            "tarea": "tarea",
+            "rubro": "rubro.nombre",
+            "subrubro": "subrubro.nombre",
+            "proveedor": "proveedor.nombre",
+            "unidad_de_venta": "unidad_de_venta.nombre",
+        },
+    },
+}
+
+
+def _ruta(campo, prefijo):
+    return campo if campo in CAMPOS_DE_FILA else f"{prefijo}{campo}"
+
+
+def _codificar(valores):
+    texto = json.dumps([str(v) if isinstance(v, Decimal) else v for v in valores])
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip("=")
+
+
+def _decodificar(cursor, largo):
+    """Valores del cursor, o None si está vacío o no es válido."""
+    if not cursor:
+        return None
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(valores, list) or len(valores) != largo:
+        return None
+    return valores
+
+
+def _entero(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _valor(objeto, ruta):
+    for parte in ruta.split("."):
+        if objeto is None:
+            return None
+        objeto = getattr(objeto, parte)
+    return objeto
+
+
+class Pagina:
+    """Una página del listado y los cursores para moverse."""
+
+    def __init__(self, filas, siguiente, anterior, request, prefijo):
+        self.filas = filas
+        self.siguiente = siguiente
+        self.anterior = anterior
+        self._request = request
+        self._prefijo = prefijo
+
+    def __iter__(self):
+        return iter(self.filas)
+
+    def __len__(self):
+        return len(self.filas)
+
+    def __bool__(self):
+        return bool(self.filas)
+
+    def _url(self, parametro, cursor):
+        if cursor is None:
+            return None
+        params = self._request.GET.copy()
+        for nombre in ("despues", "antes", "editar"):
+            params.pop(f"{self._prefijo}{nombre}", None)
+        params[f"{self._prefijo}{parametro}"] = cursor
+        return f"?{params.urlencode()}"
+
+    @property
+    def url_siguiente(self):
+        return self._url("despues", self.siguiente)
+
+    @property
+    def url_anterior(self):
+        return self._url("antes", self.anterior)
+
+
+class Listado:
+    """
+    Búsqueda, filtros, orden y cursor de un recurso. en_hoja: el queryset es
+    de detalles de hoja (HojaPrecioMaterial, etc.) en vez del catálogo.
+    prefijo: para tener dos listados en la misma página (p. ej. "agregar_").
+    """
+
+    def __init__(self, recurso, request, en_hoja=False, prefijo=""):
+        self.recurso = recurso
+        self.config = LISTADOS[recurso]
+        self.request = request
+        self.en_hoja = en_hoja
+        self.prefijo = prefijo
+        self.ruta = f"{recurso}__" if en_hoja else ""
+        params = request.GET
+        self.q = params.get("q", "").strip()
+        self.filtros = {
+            nombre: _entero(params.get(nombre))
+            for nombre in self.config["filtros"]
+            if _entero(params.get(nombre)) is not None
+        }
+        orden = params.get("orden", "")
+        self.descendente = orden.startswith("-")
+        self.orden = orden.lstrip("-")
+        if self.orden not in self.config["ordenes"]:
+            self.orden = self.config["orden_defecto"]
+            self.descendente = False
+        # Valor de ?orden= efectivo (para el form y el JSON).
+        self.orden_actual = f"{'-' if self.descendente else ''}{self.orden}"
+        por_pagina = _entero(params.get("por_pagina")) or POR_PAGINA
+        self.por_pagina = max(1, min(por_pagina, MAX_POR_PAGINA))
+
+    def filtrar(self, queryset):
+        """Aplica la búsqueda (todas las palabras, en cualquier columna) y los filtros."""
+        for palabra in self.q.split():
+            condicion = Q()
+            for campo in self.config["busqueda"]:
+                condicion |= Q(**{f"{_ruta(campo, self.ruta)}__icontains": palabra})
+            queryset = queryset.filter(condicion)
+        for nombre, valor in self.filtros.items():
+            queryset = queryset.filter(**{_ruta(self.config["filtros"][nombre], self.ruta): valor})
+        return queryset
+
+    def _claves(self):
+        claves = []
+        for campo in self.config["ordenes"][self.orden]:
+            ruta = _ruta(campo, self.ruta)
+            expresion = Coalesce(ruta, Value("")) if campo in ANULABLES else F(ruta)
+            claves.append(expresion)
+        return claves
+
+    def paginar(self, queryset):
+        """Devuelve la Pagina pedida (?despues= / ?antes=) de queryset."""
+        relacionados = [_ruta(r, self.ruta) for r in self.config["relacionados"]]
+        if self.en_hoja:
+            relacionados.insert(0, self.recurso)
+        claves = self._claves()
+        alias = [f"_orden_{i}" for i in range(len(claves))]
+        queryset = (
+            self.filtrar(queryset)
+            .select_related(*relacionados)
+            .annotate(**dict(zip(alias, claves)))
+        )
+        alias.append("pk")
+
+        despues = self._cursor(queryset, alias, "despues")
+        antes = None if despues else self._cursor(queryset, alias, "antes")
+        hacia_atras = antes is not None
+        cursor = despues or antes
+        # Comparación y orden efectivos: ir hacia atrás invierte ambos.
+        mayor = self.descendente == hacia_atras
+        if cursor is not None:
+            queryset = queryset.filter(self._despues_de(alias, cursor, mayor))
+        queryset = queryset.order_by(*(a if mayor else f"-{a}" for a in alias))
+
+        filas = list(queryset[: self.por_pagina + 1])
+        hay_mas = len(filas) > self.por_pagina
+        filas = filas[: self.por_pagina]
+        if hacia_atras:
+            filas.reverse()
+
+        def cursor_de(fila):
+            return _codificar([getattr(fila, a) for a in alias])
+
+        siguiente = anterior = None
+        if filas:
+            if hay_mas or hacia_atras:
+                siguiente = cursor_de(filas[-1])
+            if (hay_mas and hacia_atras) or despues:
+                anterior = cursor_de(filas[0])
+        return Pagina(filas, siguiente, anterior, self.request, self.prefijo)
+
+    def _cursor(self, queryset, alias, parametro):
+        """Valores de ?despues= / ?antes=, o None si falta o no va con las columnas de orden."""
+        valores = _decodificar(self.request.GET.get(f"{self.prefijo}{parametro}"), len(alias))
+        if valores is None:
+            return None
+        try:
+            # Solo arma el filtro (no consulta): acá falla un cursor adulterado.
+            queryset.filter(self._despues_de(alias, valores, True))
+        except (TypeError, ValueError, ValidationError):
+            return None
+        return valores
+
+    @staticmethod
+    def _despues_de(alias, valores, mayor):
+        """(a0, a1, ..., pk) > valores (o <): OR de prefijos iguales y un campo estricto."""
+        lookup = "gt" if mayor else "lt"
+        condicion = Q()
+        iguales = {}
+        for nombre, valor in zip(alias, valores):
+            condicion |= Q(**iguales, **{f"{nombre}__{lookup}": valor})
+            iguales[nombre] = valor
+        return condicion
+
+    def como_json(self, pagina):
+        """Datos de la página para ?formato=json."""
+        resultados = []
+        for fila in pagina:
+            objeto = getattr(fila, self.recurso) if self.en_hoja else fila
+            datos = {"id": fila.pk}
+            if self.en_hoja:
+                datos[f"{self.recurso}_id"] = objeto.pk
+            for clave, ruta in self.config["columnas"].items():
+                datos[clave] = _valor(objeto, ruta)
+            for campo in sorted(CAMPOS_DE_FILA):
+                if hasattr(fila, campo):
+                    valor = getattr(fila, campo)
+                    datos[campo] = str(valor) if isinstance(valor, Decimal) else valor
+            resultados.append(datos)
+        return {
+            "resultados": resultados,
+            "siguiente": pagina.siguiente,
+            "anterior": pagina.anterior,
+            "orden": self.orden_actual,
+        }
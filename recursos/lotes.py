@@ -0,0 +1,290 @@
+"""
+Clonado de lotes.
+
+Crea las tres hojas de un lote nuevo (copiando de otras hojas o de los precios
+actuales), las mezclas y las tareas con sus recursos, todo con bulk_create por
+tandas. Cada paso va en su propia transacción y el progreso se informa entre
+pasos: así el trabajo en segundo plano guarda un progreso que las demás
+conexiones ven mientras corre (SQLite no deja escribir desde otra conexión
+mientras hay una transacción de escritura abierta). Si un paso falla se borra
+lo que crearon los anteriores. Devuelve un reporte con la cantidad de filas y
+el tiempo de cada paso.
+"""
+import logging
+import time
+
+from django.db import transaction
+
+from general.estadisticas import invalidar_estadisticas
+
+from .indice_precios import MEZCLAS, invalidar_hoja
+from .models import (
+    HojaPrecioManoDeObra,
+    HojaPrecioMaterial,
+    HojaPrecios,
+    HojaPrecioSubcontrato,
+    HojaPreciosManoDeObra,
+    HojaPreciosSubcontrato,
+    Lote,
+    ManoDeObra,
+    Material,
+    Mezcla,
+    MezclaMaterial,
+    Subcontrato,
+    Tarea,
+    TareaRecurso,
+)
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+
+class ReporteClonado:
+    """Filas creadas y segundos de cada paso del clonado."""
+
+    def __init__(self, progreso=None):
+        self.pasos = []
+        self._progreso = progreso
+        self._inicio = time.perf_counter()
+
+    def paso(self, nombre, filas, inicio):
+        segundos = time.perf_counter() - inicio
+        self.pasos.append((nombre, filas, segundos))
+        logger.info("Clonado de lote: %s, %s filas en %.2fs", nombre, filas, segundos)
+        if self._progreso:
+            self._progreso(nombre, filas)
+
+    @property
+    def filas(self):
+        return sum(filas for _, filas, _ in self.pasos)
+
+    @property
+    def segundos(self):
+        return time.perf_counter() - self._inicio
+
+    def __str__(self):
+        detalle = ", ".join(f"{nombre}: {filas}" for nombre, filas, _ in self.pasos if filas)
+        texto = f"{self.filas} filas en {self.segundos:.1f}s"
+        return f"{texto} ({detalle})" if detalle else texto
+
+
+def _copiar_hoja(modelo_hoja, modelo_detalle, campo, campos, hoja_origen, catalogo, nombre, company):
+    """
+    Crea la hoja y copia sus detalles desde hoja_origen o, si no hay, desde el
+    catálogo (precios actuales). Devuelve (hoja, filas creadas).
+    """
+    hoja = modelo_hoja.objects.create(nombre=nombre, company=company, origen=hoja_origen)
+    if hoja_origen:
+        # order_by() vacío: el orden por defecto de las hojas agrega JOINs innecesarios.
+        filas = hoja_origen.detalles.order_by().values_list(f"{campo}_id", *campos)
+    else:
+        filas = catalogo.filter(company=company).order_by().values_list("pk", *campos)
+    detalles = [
+        modelo_detalle(hoja=hoja, **{f"{campo}_id": fila[0]}, **dict(zip(campos, fila[1:])))
+        for fila in filas.iterator(chunk_size=BATCH_SIZE)
+    ]
+    modelo_detalle.objects.bulk_create(detalles, batch_size=BATCH_SIZE)
+    return hoja, len(detalles)
+
+
+def copiar_hoja_materiales(hoja_origen, nombre, company):
+    """Copia una hoja de materiales desde otra hoja o desde precios actuales."""
+    return _copiar_hoja(
+        HojaPrecios, HojaPrecioMaterial, "material",
+        ("cantidad_por_unidad_venta", "precio_unidad_venta", "moneda"),
+        hoja_origen, Material.objects, nombre, company,
+    )
+
+
+def copiar_hoja_mano_de_obra(hoja_origen, nombre, company):
+    """Copia hoja de mano de obra."""
+    return _copiar_hoja(
+        HojaPreciosManoDeObra, HojaPrecioManoDeObra, "mano_de_obra",
+        ("cantidad_por_unidad_venta", "precio_unidad_venta"),
+        hoja_origen, ManoDeObra.objects, nombre, company,
+    )
+
+
+def copiar_hoja_subcontratos(hoja_origen, nombre, company):
+    """Copia hoja de subcontratos."""
+    return _copiar_hoja(
+        HojaPreciosSubcontrato, HojaPrecioSubcontrato, "subcontrato",
+        ("cantidad_por_unidad_venta", "precio_unidad_venta", "moneda"),
+        hoja_origen, Subcontrato.objects, nombre, company,
+    )
+
+
+def copiar_mezclas(hoja_origen, hoja_nueva, company):
+    """
+    Copia las mezclas de hoja_origen a hoja_nueva con sus materiales.
+    Devuelve (mezclas, materiales) creados.
+    """
+    if not hoja_origen:
+        return 0, 0
+    origenes = list(
+        Mezcla.objects.filter(company=company, hoja=hoja_origen)
+        .order_by()
+        .values_list("pk", "nombre", "unidad_de_mezcla_id")
+    )
+    nuevas = Mezcla.objects.bulk_create(
+        [
+            Mezcla(nombre=nombre, company=company, unidad_de_mezcla_id=unidad_id, hoja=hoja_nueva)
+            for _, nombre, unidad_id in origenes
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    id_nuevo = {origen[0]: nueva.pk for origen, nueva in zip(origenes, nuevas)}
+    detalles = [
+        MezclaMaterial(mezcla_id=id_nuevo[mezcla_id], material_id=material_id, cantidad=cantidad)
+        for mezcla_id, material_id, cantidad in MezclaMaterial.objects.filter(
+            mezcla_id__in=id_nuevo
+        ).order_by().values_list("mezcla_id", "material_id", "cantidad").iterator(
+            chunk_size=BATCH_SIZE
+        )
+    ]
+    MezclaMaterial.objects.bulk_create(detalles, batch_size=BATCH_SIZE)
+    # bulk_create no dispara signals.
+    invalidar_hoja(MEZCLAS, hoja_nueva.pk)
+    return len(nuevas), len(detalles)
+
+
+def copiar_tareas(lote_origen, lote_nuevo, company):
+    """
+    Copia tareas y recursos desde un lote a otro. Las mezclas se buscan por
+    nombre en la hoja de materiales del lote nuevo (las copiadas por
+    copiar_mezclas); si no hay una con ese nombre el recurso queda sin mezcla.
+    Devuelve (tareas, recursos) creados.
+    """
+    if not lote_origen:
+        return 0, 0
+    origenes = list(
+        Tarea.objects.filter(lote=lote_origen, company=company)
+        .order_by()
+        .values_list("pk", "nombre", "rubro_id", "subrubro_id")
+    )
+    nuevas = Tarea.objects.bulk_create(
+        [
+            Tarea(
+                nombre=nombre,
+                company=company,
+                rubro_id=rubro_id,
+                subrubro_id=subrubro_id,
+                lote=lote_nuevo,
+            )
+            for _, nombre, rubro_id, subrubro_id in origenes
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    tarea_nueva = {origen[0]: nueva.pk for origen, nueva in zip(origenes, nuevas)}
+
+    # Mapa mezcla vieja → nueva, armado una sola vez.
+    mezcla_por_nombre = dict(
+        Mezcla.objects.filter(company=company, hoja_id=lote_nuevo.hoja_materiales_id)
+        .order_by()
+        .values_list("nombre", "pk")
+    )
+    recursos = [
+        TareaRecurso(
+            tarea_id=tarea_nueva[tarea_id],
+            material_id=material_id,
+            mano_de_obra_id=mano_de_obra_id,
+            subcontrato_id=subcontrato_id,
+            mezcla_id=mezcla_por_nombre.get(mezcla_nombre) if mezcla_id else None,
+            cantidad=cantidad,
+        )
+        for (
+            tarea_id, material_id, mano_de_obra_id, subcontrato_id, mezcla_id, mezcla_nombre, cantidad
+        ) in TareaRecurso.objects.filter(tarea__lote=lote_origen, tarea__company=company)
+        .order_by("pk")
+        .values_list(
+            "tarea_id",
+            "material_id",
+            "mano_de_obra_id",
+            "subcontrato_id",
+            "mezcla_id",
+            "mezcla__nombre",
+            "cantidad",
+        )
+        .iterator(chunk_size=BATCH_SIZE)
+    ]
+    TareaRecurso.objects.bulk_create(recursos, batch_size=BATCH_SIZE)
+    return len(nuevas), len(recursos)
+
+
+def clonar_lote(
+    company,
+    nombre,
+    hoja_materiales_origen=None,
+    hoja_mano_de_obra_origen=None,
+    hoja_subcontratos_origen=None,
+    hoja_mezclas_origen=None,
+    lote_maestro_origen=None,
+    progreso=None,
+):
+    """
+    Crea un lote nuevo. Cada hoja se copia de su origen o queda vacía; las
+    mezclas se copian de hoja_mezclas_origen y las tareas de lote_maestro_origen.
+    `progreso(paso, filas)` se llama al terminar cada paso, fuera de la
+    transacción del paso. Si un paso falla se borra lo creado en los anteriores.
+    Devuelve (lote, ReporteClonado).
+    """
+    reporte = ReporteClonado(progreso)
+    # Lo creado hasta ahora, en el orden en que hay que borrarlo si algo falla
+    # (el lote antes que las hojas: sus recursos protegen las mezclas de la hoja).
+    creados = []
+    try:
+        inicio = time.perf_counter()
+        with transaction.atomic():
+            if hoja_materiales_origen:
+                hoja_mat, filas = copiar_hoja_materiales(hoja_materiales_origen, nombre, company)
+            else:
+                hoja_mat, filas = HojaPrecios.objects.create(nombre=nombre, company=company), 0
+        creados.insert(0, hoja_mat)
+        reporte.paso("materiales", filas, inicio)
+
+        inicio = time.perf_counter()
+        with transaction.atomic():
+            if hoja_mano_de_obra_origen:
+                hoja_mo, filas = copiar_hoja_mano_de_obra(hoja_mano_de_obra_origen, nombre, company)
+            else:
+                hoja_mo, filas = HojaPreciosManoDeObra.objects.create(nombre=nombre, company=company), 0
+        creados.insert(0, hoja_mo)
+        reporte.paso("mano de obra", filas, inicio)
+
+        inicio = time.perf_counter()
+        with transaction.atomic():
+            if hoja_subcontratos_origen:
+                hoja_sub, filas = copiar_hoja_subcontratos(hoja_subcontratos_origen, nombre, company)
+            else:
+                hoja_sub, filas = HojaPreciosSubcontrato.objects.create(nombre=nombre, company=company), 0
+        creados.insert(0, hoja_sub)
+        reporte.paso("subcontratos", filas, inicio)
+
+        inicio = time.perf_counter()
+        with transaction.atomic():
+            mezclas, componentes = copiar_mezclas(hoja_mezclas_origen, hoja_mat, company)
+        reporte.paso("mezclas", mezclas + componentes, inicio)
+
+        inicio = time.perf_counter()
+        with transaction.atomic():
+            lote = Lote.objects.create(
+                nombre=nombre,
+                company=company,
+                hoja_materiales=hoja_mat,
+                hoja_mano_de_obra=hoja_mo,
+                hoja_subcontratos=hoja_sub,
+            )
+            tareas, recursos = copiar_tareas(lote_maestro_origen, lote, company)
+        creados.insert(0, lote)
+        reporte.paso("tareas", tareas + recursos, inicio)
+    except Exception:
+        with transaction.atomic():
+            for objeto in creados:
+                objeto.delete()
+        raise
+    finally:
+        # bulk_create no dispara signals.
+        invalidar_estadisticas(company.pk)
+    logger.info("Lote %s clonado: %s", lote.pk, reporte)
+    return lote, reporte
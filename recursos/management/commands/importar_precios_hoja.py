@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recursos.importacion import ErrorImportacion, importar_precios
+from recursos.trabajos import RECURSOS_CON_PRECIO
+
+
+class Command(BaseCommand):
+    help = "Importa precios desde un CSV a una hoja de precios (materiales, mano de obra o subcontratos)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("recurso", choices=sorted(RECURSOS_CON_PRECIO))
+        parser.add_argument("hoja", type=int, help="Id de la hoja de precios.")
+        parser.add_argument("archivo", help="Ruta del CSV.")
+        parser.add_argument(
+            "--no-crear",
+            action="store_true",
+            help="No agregar a la hoja los recursos que todavía no están.",
+        )
+        parser.add_argument(
+            "--encoding",
+            default="utf-8-sig",
+            help="Codificación del archivo (por defecto utf-8).",
+        )
+
+    def handle(self, *args, **options):
+        modelo_hoja = RECURSOS_CON_PRECIO[options["recurso"]][2]
+        hoja = modelo_hoja.objects.select_related("company").filter(pk=options["hoja"]).first()
+        if hoja is None:
+            raise CommandError(f"No existe la hoja {options['hoja']}.")
+        try:
+            with open(options["archivo"], encoding=options["encoding"], newline="") as archivo:
+                resultado = importar_precios(
+                    hoja, options["recurso"], archivo, crear_faltantes=not options["no_crear"]
+                )
+        except (OSError, ErrorImportacion) as exc:
+            raise CommandError(str(exc))
+        for linea, fila, motivo in resultado.problemas:
+            self.stdout.write(f"  línea {linea}: {fila.get('nombre', '')} ({motivo})")
+        self.stdout.write(self.style.SUCCESS(f"Hoja {hoja.nombre}: {resultado}."))
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.3 on 2026-10-18 00:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('general', '0011_trabajo'),
+        ('recursos', '0012_add_dolar'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='manodeobra',
+            index=models.Index(fields=['company', 'tarea'], name='recursos_ma_company_5aa9b3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='material',
+            index=models.Index(fields=['company', 'nombre'], name='recursos_ma_company_ab0730_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subcontrato',
+            index=models.Index(fields=['company', 'tarea'], name='recursos_su_company_14336d_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.3 on 2026-10-18 01:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('general', '0011_trabajo'),
+        ('recursos', '0013_indices_listados'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='hojapreciomanodeobra',
+            index=models.Index(fields=['hoja', 'mano_de_obra'], name='recursos_ho_hoja_id_f3f398_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hojapreciomaterial',
+            index=models.Index(fields=['hoja', 'material'], name='recursos_ho_hoja_id_f011cd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hojaprecios',
+            index=models.Index(fields=['company', 'creado_en'], name='recursos_ho_company_1cceb5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hojapreciosmanodeobra',
+            index=models.Index(fields=['company', 'creado_en'], name='recursos_ho_company_f432d0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hojapreciossubcontrato',
+            index=models.Index(fields=['company', 'creado_en'], name='recursos_ho_company_e570fe_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hojapreciosubcontrato',
+            index=models.Index(fields=['hoja', 'subcontrato'], name='recursos_ho_hoja_id_67d7db_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lote',
+            index=models.Index(fields=['company', 'creado_en'], name='recursos_lo_company_e5b519_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tarea',
+            index=models.Index(fields=['lote', 'rubro', 'subrubro'], name='recursos_ta_lote_id_a8082c_idx'),
+        ),
+    ]
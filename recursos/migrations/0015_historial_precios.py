@@ -0,0 +1,59 @@
+# Generated by Django 5.2.3 on 2026-10-18 01:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('general', '0011_trabajo'),
+        ('recursos', '0014_indices_compuestos'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OperacionPrecios',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recurso', models.CharField(choices=[('material', 'Materiales'), ('mano_de_obra', 'Mano de obra'), ('subcontrato', 'Subcontratos')], max_length=20)),
+                ('hoja_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('porcentaje', models.DecimalField(blank=True, decimal_places=4, max_digits=9, null=True)),
+                ('filas', models.PositiveIntegerField(default=0)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='operaciones_precios', to='general.company')),
+                ('revierte', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reversiones', to='recursos.operacionprecios')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='operaciones_precios', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Operación de precios',
+                'verbose_name_plural': 'Operaciones de precios',
+                'ordering': ['-creado_en'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CambioPrecio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fila_id', models.PositiveBigIntegerField()),
+                ('recurso_id', models.PositiveBigIntegerField()),
+                ('precio_anterior', models.DecimalField(decimal_places=4, max_digits=12)),
+                ('precio_nuevo', models.DecimalField(decimal_places=4, max_digits=12)),
+                ('operacion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cambios', to='recursos.operacionprecios')),
+            ],
+            options={
+                'verbose_name': 'Cambio de precio',
+                'verbose_name_plural': 'Cambios de precio',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='operacionprecios',
+            index=models.Index(fields=['company', 'recurso', 'hoja_id', 'creado_en'], name='recursos_op_company_c22509_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cambioprecio',
+            index=models.Index(fields=['operacion', 'fila_id'], name='recursos_ca_operaci_4896f0_idx'),
+        ),
+    ]
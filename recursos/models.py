@@ -1,11 +1,12 @@
 from decimal import Decimal
 
+from django.conf import settings
 from django.db import models
 
+from general.cotizaciones import cotizacion
 from general.models import (
     CategoriaMaterial,
     Company,
-    CotizacionDolar,
     Equipo,
     Proveedor,
     RefEquipo,
@@ -16,6 +17,9 @@ from general.models import (
     Unidad,
 )
 
+from .costos import TIPOS_MANO_DE_OBRA, TIPOS_MATERIALES, CostosLote, anotar_costos
+from .indice_precios import indice_materiales, precios_mezclas
+
 
 class Material(models.Model):
     MONEDA_CHOICES = [
@@ -67,6 +71,7 @@ class Material(models.Model):
         verbose_name_plural = "Materiales"
         ordering = ["nombre"]
         unique_together = ("company", "nombre", "proveedor")
+        indexes = [models.Index(fields=["company", "nombre"])]
 
     def __str__(self):
         if self.proveedor_id:
@@ -124,6 +129,7 @@ class ManoDeObra(models.Model):
         verbose_name_plural = "Mano de Obra"
         ordering = ["rubro__nombre", "subrubro__nombre", "tarea"]
         unique_together = ("company", "rubro", "subrubro", "tarea", "equipo", "ref_equipo")
+        indexes = [models.Index(fields=["company", "tarea"])]
 
     def __str__(self):
         return f"{self.tarea} ({self.subrubro.nombre} · {self.equipo.nombre} / {self.ref_equipo.nombre})"
@@ -185,6 +191,7 @@ class Subcontrato(models.Model):
         verbose_name_plural = "Subcontratos"
         ordering = ["rubro__nombre", "subrubro__nombre", "tarea"]
         unique_together = ("company", "rubro", "subrubro", "tarea")
+        indexes = [models.Index(fields=["company", "tarea"])]
 
     def __str__(self):
         return f"{self.tarea} ({self.subrubro.nombre})"
@@ -234,6 +241,7 @@ class HojaPrecios(models.Model):
         verbose_name_plural = "Hojas de Precios"
         ordering = ["-creado_en"]
         unique_together = ("company", "nombre")
+        indexes = [models.Index(fields=["company", "creado_en"])]
 
     def __str__(self):
         return self.nombre
@@ -261,6 +269,7 @@ class HojaPrecioMaterial(models.Model):
         verbose_name = "Precio de Material en Hoja"
         verbose_name_plural = "Precios de Material en Hoja"
         ordering = ["material__nombre"]
+        indexes = [models.Index(fields=["hoja", "material"])]
 
     def __str__(self):
         return f"{self.material.nombre} @ {self.hoja.nombre}"
@@ -309,9 +318,15 @@ class Mezcla(models.Model):
         return f"{self.nombre} ({hoja_nom})"
 
     def precio_por_unidad_mezcla(self):
-        """Suma de (cantidad × precio) de cada material en la mezcla."""
+        """
+        Suma de (cantidad × precio) de cada material en la mezcla. Con hoja, sale
+        del precálculo de todas las mezclas de la hoja (indice_precios.precios_mezclas).
+        """
+        if self.hoja_id:
+            return precios_mezclas(self.hoja_id).get(self.pk, Decimal("0"))
         total = Decimal("0")
         for det in self.detalles.select_related("material", "material__unidad_de_venta").all():
+            det.mezcla = self
             total += det.costo_en_hoja()
         return total
 
@@ -340,26 +355,13 @@ class MezclaMaterial(models.Model):
 
     def costo_en_hoja(self):
         """Costo de este material en la mezcla según la hoja (o precios actuales)."""
-        if self.mezcla.hoja:
-            try:
-                hp = HojaPrecioMaterial.objects.get(
-                    hoja=self.mezcla.hoja, material=self.material
-                )
-                return self.cantidad * hp.precio_unidad_venta
-            except HojaPrecioMaterial.DoesNotExist:
-                return Decimal("0")
-        return self.cantidad * self.material.precio_unidad_venta
+        return self.cantidad * self.precio_unidad_desde_hoja()
 
     def precio_unidad_desde_hoja(self):
-        """Precio unitario del material desde la hoja o actual."""
-        if self.mezcla.hoja:
-            try:
-                hp = HojaPrecioMaterial.objects.get(
-                    hoja=self.mezcla.hoja, material=self.material
-                )
-                return hp.precio_unidad_venta
-            except HojaPrecioMaterial.DoesNotExist:
-                return Decimal("0")
+        """Precio unitario del material desde la hoja (índice cacheado) o actual."""
+        if self.mezcla.hoja_id:
+            hp = indice_materiales(self.mezcla.hoja_id).get(self.material_id)
+            return hp[0] if hp else Decimal("0")
         return self.material.precio_unidad_venta
 
 
@@ -385,6 +387,7 @@ class HojaPreciosSubcontrato(models.Model):
         verbose_name_plural = "Hojas de Precios Subcontrato"
         ordering = ["-creado_en"]
         unique_together = ("company", "nombre")
+        indexes = [models.Index(fields=["company", "creado_en"])]
 
     def __str__(self):
         return self.nombre
@@ -412,6 +415,7 @@ class HojaPrecioSubcontrato(models.Model):
         verbose_name = "Precio de Subcontrato en Hoja"
         verbose_name_plural = "Precios de Subcontrato en Hoja"
         ordering = ["subcontrato__rubro__nombre", "subcontrato__subrubro__nombre", "subcontrato__tarea"]
+        indexes = [models.Index(fields=["hoja", "subcontrato"])]
 
     def __str__(self):
         return f"{self.subcontrato.tarea} @ {self.hoja.nombre}"
@@ -447,6 +451,7 @@ class HojaPreciosManoDeObra(models.Model):
         verbose_name_plural = "Hojas de Precios Mano de Obra"
         ordering = ["-creado_en"]
         unique_together = ("company", "nombre")
+        indexes = [models.Index(fields=["company", "creado_en"])]
 
     def __str__(self):
         return self.nombre
@@ -475,6 +480,7 @@ class HojaPrecioManoDeObra(models.Model):
             "mano_de_obra__subrubro__nombre",
             "mano_de_obra__tarea",
         ]
+        indexes = [models.Index(fields=["hoja", "mano_de_obra"])]
 
     def __str__(self):
         return f"{self.mano_de_obra.tarea} @ {self.hoja.nombre}"
@@ -535,23 +541,20 @@ class Lote(models.Model):
         verbose_name_plural = "Lotes"
         ordering = ["-creado_en"]
         unique_together = ("company", "nombre")
+        indexes = [models.Index(fields=["company", "creado_en"])]
 
     def __str__(self):
         return self.nombre
 
     def get_cotizacion_usd(self):
         """Cotización ARS/USD para este lote. None si no está configurado."""
-        if not self.tipo_dolar_id or not self.fecha_dolar:
-            return None
-        try:
-            c = CotizacionDolar.objects.get(
-                company=self.company,
-                fecha=self.fecha_dolar,
-                tipo=self.tipo_dolar,
-            )
-            return c.valor
-        except CotizacionDolar.DoesNotExist:
-            return None
+        return cotizacion(self.company_id, self.tipo_dolar_id, self.fecha_dolar)
+
+
+class TareaQuerySet(models.QuerySet):
+    def con_costos(self, lote):
+        """Anota costo_total, costo_materiales, costo_mo y sus *_usd calculados en SQL."""
+        return anotar_costos(self, lote)
 
 
 class Tarea(models.Model):
@@ -577,69 +580,53 @@ class Tarea(models.Model):
         related_name="tareas",
     )
 
+    objects = TareaQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Tarea"
         verbose_name_plural = "Maestro Tareas"
         ordering = ["rubro__nombre", "subrubro__nombre", "nombre"]
         unique_together = ("company", "lote", "nombre")
+        indexes = [models.Index(fields=["lote", "rubro", "subrubro"])]
 
     def __str__(self):
         return self.nombre
 
+    def _costos(self):
+        """Motor de costos del lote (el asignado por la vista o uno solo para esta tarea)."""
+        costos = getattr(self, "_costos_lote", None)
+        if costos is None:
+            costos = CostosLote(self.lote, tareas=[self])
+            self._costos_lote = costos
+        return costos
+
     def precio_total(self):
-        total = Decimal("0")
-        for rec in self.recursos.select_related(
-            "material", "mano_de_obra", "subcontrato", "mezcla"
-        ).all():
-            total += rec.costo_total()
-        return total
+        return self._costos().total_tarea(self.pk)
 
     def precio_total_usd(self):
         """Total en USD (ARS convertidos). None si el lote no tiene cotización."""
-        total = Decimal("0")
-        for rec in self.recursos.all():
-            c = rec.costo_total_usd()
-            if c is None:
-                return None
-            total += c
-        return total
+        return self._costos().total_tarea_usd(self.pk)
 
     def costo_materiales_mezcla(self):
         """Costo de materiales y mezclas (precio unitario de la tarea)."""
-        total = Decimal("0")
-        for rec in self.recursos.all():
-            if rec.get_tipo() in ("material", "mezcla"):
-                total += rec.costo_total()
-        return total
+        return self._costos().total_tarea(self.pk, TIPOS_MATERIALES)
 
     def costo_mo_subcontratos(self):
         """Costo de mano de obra y subcontratos (precio unitario de la tarea)."""
-        total = Decimal("0")
-        for rec in self.recursos.all():
-            if rec.get_tipo() in ("mano_de_obra", "subcontrato"):
-                total += rec.costo_total()
-        return total
+        return self._costos().total_tarea(self.pk, TIPOS_MANO_DE_OBRA)
 
     def costo_materiales_mezcla_usd_usando_cotizacion(self, cotizacion, cantidad=Decimal("1")):
         """Costo materiales/mezcla en USD, usando cotización externa. cantidad multiplica."""
-        total_usd = Decimal("0")
-        for rec in self.recursos.all():
-            if rec.get_tipo() in ("material", "mezcla"):
-                c = rec.costo_total_usd_con_cotizacion(cotizacion)
-                if c is None:
-                    return None
-                total_usd += c
+        total_usd = self._costos().total_tarea_usd(self.pk, TIPOS_MATERIALES, cotizacion)
+        if total_usd is None:
+            return None
         return total_usd * cantidad
 
     def costo_mo_subcontratos_usd_usando_cotizacion(self, cotizacion, cantidad=Decimal("1")):
         """Costo MO/subcontratos en USD, usando cotización externa. cantidad multiplica."""
-        total_usd = Decimal("0")
-        for rec in self.recursos.all():
-            if rec.get_tipo() in ("mano_de_obra", "subcontrato"):
-                c = rec.costo_total_usd_con_cotizacion(cotizacion)
-                if c is None:
-                    return None
-                total_usd += c
+        total_usd = self._costos().total_tarea_usd(self.pk, TIPOS_MANO_DE_OBRA, cotizacion)
+        if total_usd is None:
+            return None
         return total_usd * cantidad
 
     def get_unidad(self):
@@ -722,12 +709,17 @@ class TareaRecurso(models.Model):
             return "mezcla"
         return None
 
+    def _costo(self):
+        """Costo resuelto por el motor del lote (asignado por la vista o propio)."""
+        costos = getattr(self, "_costos_lote", None)
+        if costos is None:
+            costos = CostosLote(self.tarea.lote, recursos=[self])
+            self._costos_lote = costos
+        return costos.recurso(self.pk)
+
     def precio_unitario(self):
         """Precio por unidad del recurso según el lote."""
-        total = self.costo_total()
-        if total and self.cantidad:
-            return total / self.cantidad
-        return Decimal("0")
+        return self._costo().precio_unitario()
 
     def precio_unitario_usd(self):
         """UA en USD: precio unitario convertido a dólares."""
@@ -736,83 +728,84 @@ class TareaRecurso(models.Model):
             return total_usd / self.cantidad
         return None
 
-    def _get_hoja_precio_material(self, lote):
-        try:
-            return HojaPrecioMaterial.objects.get(
-                hoja=lote.hoja_materiales, material=self.material
-            )
-        except HojaPrecioMaterial.DoesNotExist:
-            return None
-
-    def _get_moneda(self, lote):
-        """Moneda del recurso: ARS o USD."""
-        if self.material_id:
-            hp = self._get_hoja_precio_material(lote)
-            return (hp.moneda if hp else "ARS") or "ARS"
-        if self.mano_de_obra_id:
-            return "ARS"
-        if self.subcontrato_id:
-            try:
-                hp = HojaPrecioSubcontrato.objects.get(
-                    hoja=lote.hoja_subcontratos, subcontrato=self.subcontrato
-                )
-                return hp.moneda or "ARS"
-            except HojaPrecioSubcontrato.DoesNotExist:
-                return "ARS"
-        if self.mezcla_id:
-            return "ARS"
-        return "ARS"
-
     def costo_total(self):
-        lote = self.tarea.lote
-        if self.material_id:
-            hp = self._get_hoja_precio_material(lote)
-            return (self.cantidad * hp.precio_unidad_venta) if hp else Decimal("0")
-        if self.mano_de_obra_id:
-            try:
-                hp = HojaPrecioManoDeObra.objects.get(
-                    hoja=lote.hoja_mano_de_obra, mano_de_obra=self.mano_de_obra
-                )
-                return self.cantidad * hp.precio_unidad_venta
-            except HojaPrecioManoDeObra.DoesNotExist:
-                return Decimal("0")
-        if self.subcontrato_id:
-            try:
-                hp = HojaPrecioSubcontrato.objects.get(
-                    hoja=lote.hoja_subcontratos, subcontrato=self.subcontrato
-                )
-                return self.cantidad * hp.precio_unidad_venta
-            except HojaPrecioSubcontrato.DoesNotExist:
-                return Decimal("0")
-        if self.mezcla_id:
-            if self.mezcla.hoja_id == lote.hoja_materiales_id:
-                return self.cantidad * self.mezcla.precio_por_unidad_mezcla()
-            return Decimal("0")
-        return Decimal("0")
+        return self._costo().total
 
     def costo_total_usd(self):
         """Costo en USD: ARS se convierte según cotización del lote, USD queda igual."""
-        total = self.costo_total()
-        if total == 0:
-            return Decimal("0")
-        lote = self.tarea.lote
-        moneda = self._get_moneda(lote)
-        if moneda == "USD":
-            return total
-        cotiz = lote.get_cotizacion_usd()
-        if cotiz and cotiz > 0:
-            return total / cotiz
-        return None
+        costo = self._costo()
+        return costo.total_usd(self._costos_lote.cotizacion)
 
     def costo_total_usd_con_cotizacion(self, cotizacion):
         """Costo en USD usando cotización externa (para presupuestos)."""
-        total = self.costo_total()
-        if total == 0:
-            return Decimal("0")
-        lote = self.tarea.lote
-        moneda = self._get_moneda(lote)
-        if moneda == "USD":
-            return total
-        if cotizacion and cotizacion > 0:
-            return total / cotizacion
-        return None
\ No newline at end of file
+        return self._costo().total_usd(cotizacion)
+
+
+class OperacionPrecios(models.Model):
+    """
+    Actualización masiva de precios (por porcentaje o reversión de otra).
+    Los precios que cambió quedan en CambioPrecio, uno por fila.
+    """
+    RECURSOS = [
+        ("material", "Materiales"),
+        ("mano_de_obra", "Mano de obra"),
+        ("subcontrato", "Subcontratos"),
+    ]
+
+    company = models.ForeignKey(
+        Company,
+        on_delete=models.CASCADE,
+        related_name="operaciones_precios",
+    )
+    recurso = models.CharField(max_length=20, choices=RECURSOS)
+    # Hoja del recurso (HojaPrecios, HojaPreciosManoDeObra o HojaPreciosSubcontrato); vacío = catálogo.
+    hoja_id = models.PositiveBigIntegerField(null=True, blank=True)
+    porcentaje = models.DecimalField(max_digits=9, decimal_places=4, null=True, blank=True)
+    revierte = models.ForeignKey(
+        "self",
+        on_delete=models.SET_NULL,
+        related_name="reversiones",
+        null=True,
+        blank=True,
+    )
+    filas = models.PositiveIntegerField(default=0)
+    usuario = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        related_name="operaciones_precios",
+        null=True,
+        blank=True,
+    )
+    creado_en = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Operación de precios"
+        verbose_name_plural = "Operaciones de precios"
+        ordering = ["-creado_en"]
+        indexes = [models.Index(fields=["company", "recurso", "hoja_id", "creado_en"])]
+
+    def __str__(self):
+        if self.revierte_id:
+            return f"Reversión de la operación #{self.revierte_id}"
+        return f"{self.get_recurso_display()} {self.porcentaje:+}%"
+
+
+class CambioPrecio(models.Model):
+    """Precio de una fila (del catálogo o de una hoja) antes y después de una operación."""
+    operacion = models.ForeignKey(
+        OperacionPrecios, on_delete=models.CASCADE, related_name="cambios"
+    )
+    # pk de la fila cambiada (recurso del catálogo o detalle de la hoja)
+    fila_id = models.PositiveBigIntegerField()
+    # pk del recurso del catálogo (igual a fila_id sin hoja)
+    recurso_id = models.PositiveBigIntegerField()
+    precio_anterior = models.DecimalField(max_digits=12, decimal_places=4)
+    precio_nuevo = models.DecimalField(max_digits=12, decimal_places=4)
+
+    class Meta:
+        verbose_name = "Cambio de precio"
+        verbose_name_plural = "Cambios de precio"
+        indexes = [models.Index(fields=["operacion", "fila_id"])]
+
+    def __str__(self):
+        return f"{self.fila_id}: {self.precio_anterior} → {self.precio_nuevo}"
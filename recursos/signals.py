@@ -0,0 +1,47 @@
+"""
+Signals para recursos app: invalidan el índice de precios cacheado de una hoja
+cuando cambian sus detalles, y los precios de mezclas de la hoja cuando cambia
+una mezcla o su composición.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .indice_precios import MANO_DE_OBRA, MATERIALES, MEZCLAS, SUBCONTRATOS, invalidar_hoja
+from .models import (
+    HojaPrecioManoDeObra,
+    HojaPrecioMaterial,
+    HojaPrecioSubcontrato,
+    Mezcla,
+    MezclaMaterial,
+)
+
+
+@receiver(post_save, sender=HojaPrecioMaterial)
+@receiver(post_delete, sender=HojaPrecioMaterial)
+def hoja_material_cambiada(sender, instance, **kwargs):
+    invalidar_hoja(MATERIALES, instance.hoja_id)
+
+
+@receiver(post_save, sender=HojaPrecioManoDeObra)
+@receiver(post_delete, sender=HojaPrecioManoDeObra)
+def hoja_mano_de_obra_cambiada(sender, instance, **kwargs):
+    invalidar_hoja(MANO_DE_OBRA, instance.hoja_id)
+
+
+@receiver(post_save, sender=HojaPrecioSubcontrato)
+@receiver(post_delete, sender=HojaPrecioSubcontrato)
+def hoja_subcontrato_cambiada(sender, instance, **kwargs):
+    invalidar_hoja(SUBCONTRATOS, instance.hoja_id)
+
+
+@receiver(post_save, sender=Mezcla)
+@receiver(post_delete, sender=Mezcla)
+def mezcla_cambiada(sender, instance, **kwargs):
+    invalidar_hoja(MEZCLAS, instance.hoja_id)
+
+
+@receiver(post_save, sender=MezclaMaterial)
+@receiver(post_delete, sender=MezclaMaterial)
+def mezcla_material_cambiado(sender, instance, **kwargs):
+    hoja_id = Mezcla.objects.filter(pk=instance.mezcla_id).values_list("hoja_id", flat=True).first()
+    invalidar_hoja(MEZCLAS, hoja_id)
@@ -1,3 +1,800 @@
-from django.test import TestCase
+import base64
+import threading
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from django.core.cache import cache
+
+from general import memo, trabajos
+from general.models import CategoriaMaterial, Proveedor, Subrubro, Trabajo
+from general.lectura import leer_decimal
+from general.testing import EmpresaDePruebaMixin, PlanesDeConsultaMixin, crear_empresa_de_prueba
+
+from presupuestos.models import Presupuesto
+from presupuestos.totales import guardar_totales
+
+from . import historial, lotes
+from .comparacion_hojas import ComparacionHojas
+from .costos import TIPOS_MANO_DE_OBRA, TIPOS_MATERIALES, CostosLote, margen_sql
+from .importacion import ErrorImportacion, importar_precios
+from .listados import LISTADOS
+from .lotes import clonar_lote
+from .indice_precios import MATERIALES, _clave_version, indice_materiales, precios_mezclas
+from .models import (
+    HojaPrecioManoDeObra,
+    HojaPrecioMaterial,
+    HojaPrecios,
+    HojaPrecioSubcontrato,
+    Lote,
+    ManoDeObra,
+    Material,
+    Mezcla,
+    MezclaMaterial,
+    OperacionPrecios,
+    Subcontrato,
+    Tarea,
+    TareaRecurso,
+)
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN de SQLite")
+class PlanesRecursosTests(PlanesDeConsultaMixin, TestCase):
+    """Las vistas de recursos no deben recorrer tablas enteras."""
+
+    def test_listados_de_catalogo(self):
+        for nombre in ("material_list", "mano_de_obra_list", "subcontrato_list", "mezcla_list", "lote_list"):
+            with self.subTest(nombre):
+                self.assertSinEscaneoCompleto(reverse(f"recursos:{nombre}"))
+
+    def test_listados_de_hoja_y_agregar(self):
+        d = self.datos
+        for nombre, hoja in (
+            ("material_list", d.hoja_materiales),
+            ("mano_de_obra_list", d.hoja_mano_de_obra),
+            ("subcontrato_list", d.hoja_subcontratos),
+        ):
+            with self.subTest(nombre):
+                url = f"{reverse(f'recursos:{nombre}')}?hoja={hoja.pk}"
+                self.assertSinEscaneoCompleto(url)
+                self.assertSinEscaneoCompleto(f"{url}&agregar=1&q=a&orden=-precio")
+        self.assertSinEscaneoCompleto(f"{reverse('recursos:mezcla_list')}?hoja={d.hoja_materiales.pk}")
+
+    def test_lote_y_tareas(self):
+        d = self.datos
+        self.assertSinEscaneoCompleto(reverse("recursos:lote_detalle", args=[d.lote.pk]))
+        self.assertSinEscaneoCompleto(reverse("recursos:tarea_list", args=[d.lote.pk]))
+        self.assertSinEscaneoCompleto(f"{reverse('recursos:tarea_list', args=[d.lote.pk])}?orden=-costo")
+        self.assertSinEscaneoCompleto(reverse("recursos:tarea_detalle", args=[d.lote.pk, d.tarea.pk]))
+
+    def test_busquedas_de_precio_por_hoja(self):
+        d = self.datos
+        self.assertUsaIndice(
+            HojaPrecioMaterial.objects.filter(hoja=d.hoja_materiales, material=d.material),
+            "hoja_id", "material_id",
+        )
+        self.assertUsaIndice(
+            HojaPrecioManoDeObra.objects.filter(hoja=d.hoja_mano_de_obra, mano_de_obra=d.mano_de_obra),
+            "hoja_id", "mano_de_obra_id",
+        )
+        self.assertUsaIndice(
+            HojaPrecioSubcontrato.objects.filter(hoja=d.hoja_subcontratos, subcontrato=d.subcontrato),
+            "hoja_id", "subcontrato_id",
+        )
+
+    def test_tareas_por_lote_rubro_y_subrubro(self):
+        d = self.datos
+        self.assertUsaIndice(
+            Tarea.objects.filter(lote=d.lote, rubro=d.rubro, subrubro=d.subrubro),
+            "lote_id", "rubro_id", "subrubro_id",
+        )
+
+
+class IndicePreciosTests(EmpresaDePruebaMixin, TestCase):
+    def test_guardar_un_precio_actualiza_el_indice(self):
+        d = self.datos
+        hoja_id = d.hoja_materiales.pk
+        indice_materiales(hoja_id)
+        detalle = HojaPrecioMaterial.objects.get(hoja=d.hoja_materiales, material=d.material)
+        detalle.precio_unidad_venta = Decimal("123")
+        detalle.save()
+        self.assertEqual(indice_materiales(hoja_id)[d.material.pk][0], Decimal("123"))
+
+    def test_version_subida_por_otro_proceso(self):
+        d = self.datos
+        hoja_id = d.hoja_materiales.pk
+        antes = indice_materiales(hoja_id)[d.material.pk][0]
+        # Otro proceso: cambia la base y sube la versión en el cache compartido.
+        HojaPrecioMaterial.objects.filter(hoja_id=hoja_id).update(precio_unidad_venta=Decimal("99"))
+        cache.incr(_clave_version(MATERIALES, hoja_id))
+        with self.assertNumQueries(0):
+            self.assertEqual(indice_materiales(hoja_id)[d.material.pk][0], antes)
+        memo.limpiar()  # próximo request
+        self.assertEqual(indice_materiales(hoja_id)[d.material.pk][0], Decimal("99"))
+
+    def test_precio_de_mezcla_sin_redondear(self):
+        d = self.datos
+        detalle = HojaPrecioMaterial.objects.get(hoja=d.hoja_materiales, material=d.material)
+        detalle.precio_unidad_venta = Decimal("1234567.8901")
+        detalle.save()
+        MezclaMaterial.objects.filter(mezcla=d.mezcla).update(cantidad=Decimal("12345.6789"))
+        d.mezcla.save()  # sube la versión de las mezclas de la hoja
+        # El producto exacto, con sus 8 decimales (un SUM en SQL lo redondea o lo pasa por float).
+        exacto = Decimal("15241578751.42508889")
+        self.assertEqual(precios_mezclas(d.hoja_materiales.pk), {d.mezcla.pk: exacto})
+        self.assertEqual(Mezcla.objects.get(pk=d.mezcla.pk).precio_por_unidad_mezcla(), exacto)
+
+
+    def test_mezcla_sin_hoja_en_una_consulta(self):
+        d = self.datos
+        mezcla = Mezcla.objects.create(nombre="Revoque", company=d.company, unidad_de_mezcla=d.unidad)
+        cal = Material.objects.create(
+            nombre="Cal", company=d.company, tipo=d.tipo, categoria=d.categoria,
+            unidad_de_venta=d.unidad, precio_unidad_venta=Decimal("40"),
+        )
+        MezclaMaterial.objects.create(mezcla=mezcla, material=d.material, cantidad=Decimal("2"))
+        MezclaMaterial.objects.create(mezcla=mezcla, material=cal, cantidad=Decimal("0.5"))
+        # Sin hoja: precios actuales del catálogo, con los materiales en la misma consulta.
+        with self.assertNumQueries(1):
+            self.assertEqual(mezcla.precio_por_unidad_mezcla(), Decimal("220"))
+
+
+class ListadosTests(EmpresaDePruebaMixin, TestCase):
+    """Cursor (keyset) de recursos.listados, por el endpoint JSON de los catálogos."""
+
+    def setUp(self):
+        super().setUp()
+        d = self.datos
+        acme = Proveedor.objects.create(nombre="Acme", company=d.company)
+        cales = CategoriaMaterial.objects.create(nombre="Cales", tipo=d.tipo, company=d.company)
+        # Empates de nombre, precio y categoría, y proveedores NULL.
+        for nombre, proveedor, categoria, precio in (
+            ("Arena", None, d.categoria, "100"),
+            ("Arena", acme, cales, "90"),
+            ("Cal", None, cales, "100"),
+            ("Cal", None, cales, "100"),
+            ("Cemento", acme, d.categoria, "250"),
+            ("Piedra", d.proveedor, d.categoria, "90"),
+        ):
+            Material.objects.create(
+                nombre=nombre, company=d.company, proveedor=proveedor, tipo=d.tipo, categoria=categoria,
+                unidad_de_venta=d.unidad, precio_unidad_venta=Decimal(precio),
+            )
+        tabiques = Subrubro.objects.create(nombre="Tabiques", rubro=d.rubro, company=d.company)
+        for tarea, subrubro, proveedor, precio in (
+            ("Revoque", tabiques, None, "800"),
+            ("Pintura", d.subrubro, acme, "800"),
+            ("Pintura", tabiques, None, "50"),
+        ):
+            Subcontrato.objects.create(
+                company=d.company, rubro=d.rubro, subrubro=subrubro, tarea=tarea, proveedor=proveedor,
+                unidad_de_venta=d.unidad, precio_unidad_venta=Decimal(precio),
+            )
+        for tarea, subrubro, precio in (
+            ("Levantar muro", tabiques, "500"),
+            ("Contrapiso", d.subrubro, "500"),
+            ("Carpeta", tabiques, "300"),
+        ):
+            ManoDeObra.objects.create(
+                company=d.company, rubro=d.rubro, subrubro=subrubro, tarea=tarea, equipo=d.equipo,
+                ref_equipo=d.ref_equipo, unidad_de_venta=d.unidad, precio_unidad_venta=Decimal(precio),
+            )
+        self.catalogos = {"material": Material, "mano_de_obra": ManoDeObra, "subcontrato": Subcontrato}
+
+    def json(self, recurso, **params):
+        respuesta = self.client.get(reverse(f"recursos:{recurso}_list"), {"formato": "json", **params})
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.json()
+
+    def esperado(self, recurso, orden):
+        """pks en el orden que debería dar el listado (los NULL como "")."""
+        campos = LISTADOS[recurso]["ordenes"][orden.lstrip("-")]
+
+        def valor(objeto, ruta):
+            for parte in ruta.split("__"):
+                objeto = getattr(objeto, parte) if objeto is not None else None
+            return "" if objeto is None else objeto
+
+        objetos = self.catalogos[recurso].objects.filter(company=self.datos.company).select_related()
+        claves = {o.pk: (*(valor(o, c) for c in campos), o.pk) for o in objetos}
+        return sorted(claves, key=claves.get, reverse=orden.startswith("-"))
+
+    def test_adelante_y_atras_en_todos_los_ordenes(self):
+        for recurso, config in LISTADOS.items():
+            for orden in (o for nombre in config["ordenes"] for o in (nombre, f"-{nombre}")):
+                with self.subTest(recurso=recurso, orden=orden):
+                    paginas, params = [], {"orden": orden, "por_pagina": 2}
+                    datos = self.json(recurso, **params)
+                    self.assertIsNone(datos["anterior"])
+                    while True:
+                        paginas.append([r["id"] for r in datos["resultados"]])
+                        if not datos["siguiente"]:
+                            break
+                        datos = self.json(recurso, **params, despues=datos["siguiente"])
+                    self.assertEqual([pk for pagina in paginas for pk in pagina], self.esperado(recurso, orden))
+                    self.assertTrue(all(len(p) == 2 for p in paginas[:-1]))
+                    # Volviendo con ?antes= se repasan las mismas páginas.
+                    for pagina in reversed(paginas[:-1]):
+                        datos = self.json(recurso, **params, antes=datos["anterior"])
+                        self.assertEqual([r["id"] for r in datos["resultados"]], pagina)
+                        self.assertIsNotNone(datos["siguiente"])
+                    self.assertIsNone(datos["anterior"])
+
+    def test_cursor_invalido_vuelve_a_la_primera_pagina(self):
+        primera = self.json("material", orden="precio", por_pagina=2)
+
+        def cursor(texto):
+            return base64.urlsafe_b64encode(texto.encode()).decode().rstrip("=")
+
+        for valor in (
+            "no-es-un-cursor!",
+            cursor("{no es json"),
+            cursor('{"a": 1}'),
+            cursor('["100"]'),
+            cursor('["100", 1, 2]'),
+            cursor('[null, 1]'),
+            cursor('["caro", 1]'),
+            cursor('["100", "uno"]'),
+            cursor('[["100"], 1]'),
+        ):
+            for parametro in ("despues", "antes"):
+                with self.subTest(cursor=valor, parametro=parametro):
+                    datos = self.json("material", orden="precio", por_pagina=2, **{parametro: valor})
+                    self.assertEqual(datos["resultados"], primera["resultados"])
+                    self.assertIsNone(datos["anterior"])
+
+    def test_json(self):
+        d = self.datos
+        datos = self.json("material", orden="-proveedor", por_pagina=10)
+        self.assertEqual(datos["orden"], "-proveedor")
+        self.assertIsNone(datos["siguiente"])
+        self.assertEqual(
+            [r["proveedor"] for r in datos["resultados"]],
+            ["Corralón", "Corralón", "Acme", "Acme", None, None, None],
+        )
+        fila = next(r for r in datos["resultados"] if r["id"] == d.material.pk)
+        self.assertEqual(
+            {c: fila[c] for c in ("nombre", "proveedor", "tipo", "categoria", "unidad_de_venta")},
+            {"nombre": "Arena", "proveedor": "Corralón", "tipo": "Áridos", "categoria": "Arena",
+             "unidad_de_venta": "m2"},
+        )
+        self.assertEqual((fila["precio_unidad_venta"], fila["moneda"]), ("100.0000", "ARS"))
+        # Un orden desconocido vuelve al de defecto.
+        self.assertEqual(self.json("material", orden="color")["orden"], "nombre")
+
+
+class CostosSqlTests(EmpresaDePruebaMixin, TestCase):
+    """Tarea.objects.con_costos (SQL) contra CostosLote (Decimal exacto)."""
+
+    def setUp(self):
+        super().setUp()
+        d = self.datos
+        cal = Material.objects.create(
+            nombre="Cal", company=d.company, tipo=d.tipo, categoria=d.categoria,
+            unidad_de_venta=d.unidad, precio_unidad_venta=Decimal("1"),
+        )
+        cemento = Material.objects.create(
+            nombre="Cemento", company=d.company, tipo=d.tipo, categoria=d.categoria,
+            unidad_de_venta=d.unidad, precio_unidad_venta=Decimal("1"), moneda="USD",
+        )
+        HojaPrecioMaterial.objects.create(
+            hoja=d.hoja_materiales, material=cal, cantidad_por_unidad_venta=1,
+            precio_unidad_venta=Decimal("1234567.8901"),
+        )
+        HojaPrecioMaterial.objects.create(
+            hoja=d.hoja_materiales, material=cemento, cantidad_por_unidad_venta=1,
+            precio_unidad_venta=Decimal("7.25"), moneda="USD",
+        )
+        otra_hoja = HojaPrecios.objects.create(nombre="Abril", company=d.company)
+        ajena = Mezcla.objects.create(
+            nombre="Ajena", company=d.company, unidad_de_mezcla=d.unidad, hoja=otra_hoja
+        )
+        MezclaMaterial.objects.create(mezcla=ajena, material=d.material, cantidad=Decimal("5"))
+        MezclaMaterial.objects.create(mezcla=d.mezcla, material=cal, cantidad=Decimal("0.3333"))
+        d.mezcla.save()
+
+        def tarea(nombre, *recursos):
+            t = Tarea.objects.create(
+                nombre=nombre, company=d.company, rubro=d.rubro, subrubro=d.subrubro, lote=d.lote
+            )
+            for campo, objeto, cantidad in recursos:
+                TareaRecurso.objects.create(tarea=t, cantidad=Decimal(cantidad), **{campo: objeto})
+            return t
+
+        self.tareas = [
+            d.tarea,
+            tarea("Solo ARS", ("material", cal, "12345.6789"), ("mano_de_obra", d.mano_de_obra, "1.75")),
+            tarea("Solo USD", ("material", cemento, "11.5"), ("subcontrato", d.subcontrato, "0.7")),
+            tarea("Mezclas", ("mezcla", d.mezcla, "1.5"), ("mezcla", ajena, "4")),
+            tarea("Vacía"),
+        ]
+
+    def assertCoinciden(self, lote):
+        costos = CostosLote(lote)
+        cerca = lambda sql, exacto: abs(Decimal(str(sql)) - exacto) <= margen_sql(exacto)
+        for t in Tarea.objects.filter(lote=lote).con_costos(lote):
+            with self.subTest(tarea=t.nombre):
+                for campo, tipos in (
+                    ("costo_materiales", TIPOS_MATERIALES),
+                    ("costo_mo", TIPOS_MANO_DE_OBRA),
+                    ("costo_total", None),
+                ):
+                    exacto = costos.total_tarea(t.pk, tipos)
+                    self.assertTrue(cerca(getattr(t, campo), exacto), (campo, getattr(t, campo), exacto))
+                    usd = costos.total_tarea_usd(t.pk, tipos)
+                    sql_usd = getattr(t, f"{campo}_usd")
+                    if usd is None:
+                        self.assertIsNone(sql_usd)
+                    else:
+                        self.assertTrue(cerca(sql_usd, usd), (f"{campo}_usd", sql_usd, usd))
+
+    def test_coincide_con_costos_lote(self):
+        costos = CostosLote(self.datos.lote)
+        # La mezcla ajena no tiene precio en este lote.
+        self.assertEqual(
+            costos.total_tarea(self.tareas[3].pk), Decimal("1.5") * (200 + Decimal("0.3333") * Decimal("1234567.8901"))
+        )
+        self.assertEqual(costos.total_tarea(self.tareas[4].pk), 0)
+        self.assertCoinciden(self.datos.lote)
+
+    def test_coincide_sin_cotizacion(self):
+        lote = self.datos.lote
+        lote.tipo_dolar = None
+        lote.save()
+        # Sin cotización solo las tareas en USD (o vacías) tienen costo en USD.
+        self.assertIsNone(CostosLote(lote).total_tarea_usd(self.tareas[1].pk))
+        self.assertIsNotNone(CostosLote(lote).total_tarea_usd(self.tareas[2].pk))
+        self.assertCoinciden(lote)
+
+    def test_lista_muestra_y_filtra_con_costos_lote(self):
+        lote = self.datos.lote
+        costos = CostosLote(lote)
+        totales = {t.pk: costos.total_tarea(t.pk) for t in self.tareas}
+        url = reverse("recursos:tarea_list", args=[lote.pk])
+        for costo_min, costo_max in (
+            (None, None),
+            (totales[self.tareas[1].pk], None),  # justo en el borde
+            (None, totales[self.tareas[3].pk]),
+            (totales[self.tareas[2].pk], totales[self.tareas[1].pk]),
+            (Decimal("0.000001"), None),
+        ):
+            with self.subTest(costo_min=costo_min, costo_max=costo_max):
+                params = {"orden": "-costo"}
+                if costo_min is not None:
+                    params["costo_min"] = str(costo_min)
+                if costo_max is not None:
+                    params["costo_max"] = str(costo_max)
+                listadas = self.client.get(url, params).context["tareas"]
+                esperadas = [
+                    pk for pk, total in sorted(totales.items(), key=lambda x: -x[1])
+                    if (costo_min is None or total >= costo_min) and (costo_max is None or total <= costo_max)
+                ]
+                self.assertEqual([t.pk for t in listadas], esperadas)
+                for t in listadas:
+                    self.assertEqual(t.costo_total, totales[t.pk])
+                    self.assertEqual(t.costo_total_usd, costos.total_tarea_usd(t.pk))
+
+
+class ComparacionHojasTests(EmpresaDePruebaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        d = self.datos
+        otros = CategoriaMaterial.objects.create(nombre="Otros", tipo=d.tipo, company=d.company)
+        self.hoja_b = HojaPrecios.objects.create(nombre="Abril", company=d.company)
+        # nombre: (categoría, precio en A, precio en B); None = no está en esa hoja.
+        precios = {
+            "Cal": (otros, "0", "20"),
+            "Cemento": (d.categoria, "200", "200"),
+            "Hierro": (otros, "1000", "900"),
+            "Ladrillo": (otros, None, "30"),
+            "Piedra": (d.categoria, "80", None),
+        }
+        HojaPrecioMaterial.objects.create(
+            hoja=self.hoja_b, material=d.material, cantidad_por_unidad_venta=1,
+            precio_unidad_venta=Decimal("150"),
+        )
+        for nombre, (categoria, precio_a, precio_b) in precios.items():
+            material = Material.objects.create(
+                nombre=nombre, company=d.company, tipo=d.tipo, categoria=categoria,
+                unidad_de_venta=d.unidad, precio_unidad_venta=Decimal("1"),
+            )
+            for hoja, precio in ((d.hoja_materiales, precio_a), (self.hoja_b, precio_b)):
+                if precio is not None:
+                    HojaPrecioMaterial.objects.create(
+                        hoja=hoja, material=material, cantidad_por_unidad_venta=1,
+                        precio_unidad_venta=Decimal(precio),
+                    )
+        self.comparacion = ComparacionHojas(d.company, "material", d.hoja_materiales.pk, self.hoja_b.pk)
+
+    def nombres(self, filas):
+        return [f["nombre"] for f in filas]
+
+    def test_una_fila_por_recurso_aunque_este_en_una_sola_hoja(self):
+        with self.assertNumQueries(1):
+            filas = {f["nombre"]: f for f in self.comparacion.filas("todos")}
+        self.assertEqual(sorted(filas), ["Arena", "Cal", "Cemento", "Hierro", "Ladrillo", "Piedra"])
+        arena = filas["Arena"]
+        self.assertEqual((arena["precio_a"], arena["precio_b"]), (Decimal("100"), Decimal("150")))
+        self.assertEqual(arena["diferencia"], Decimal("50"))
+        self.assertAlmostEqual(arena["variacion"], 50.0)
+        self.assertAlmostEqual(filas["Hierro"]["variacion"], -10.0)
+        self.assertEqual(filas["Cemento"]["diferencia"], 0)
+        # Precio 0 en A: hay diferencia pero no variación.
+        self.assertEqual(filas["Cal"]["diferencia"], Decimal("20"))
+        self.assertIsNone(filas["Cal"]["variacion"])
+        self.assertEqual((filas["Ladrillo"]["precio_a"], filas["Ladrillo"]["diferencia"]), (None, None))
+        self.assertEqual((filas["Piedra"]["precio_b"], filas["Piedra"]["variacion"]), (None, None))
+        self.assertEqual(filas["Piedra"]["grupo"], "Arena")
+
+    def test_estados(self):
+        esperados = {
+            "": ["Arena", "Cal", "Hierro", "Ladrillo", "Piedra"],
+            "cambiados": ["Arena", "Cal", "Hierro"],
+            "nuevos": ["Ladrillo"],
+            "quitados": ["Piedra"],
+            "todos": ["Arena", "Cal", "Cemento", "Hierro", "Ladrillo", "Piedra"],
+        }
+        for estado, nombres in esperados.items():
+            with self.subTest(estado=estado):
+                self.assertEqual(self.nombres(self.comparacion.filas(estado)), nombres)
+
+    def test_orden_con_nulos_al_final(self):
+        self.assertEqual(
+            self.nombres(self.comparacion.filas("todos", "variacion")),
+            ["Arena", "Hierro", "Cemento", "Cal", "Ladrillo", "Piedra"],
+        )
+        self.assertEqual(
+            self.nombres(self.comparacion.filas("todos", "diferencia")),
+            ["Hierro", "Arena", "Cal", "Cemento", "Ladrillo", "Piedra"],
+        )
+
+    def test_pagina(self):
+        paginas = [self.comparacion.pagina(n, 2, "todos") for n in (1, 2, 3, 4)]
+        self.assertEqual(
+            [(self.nombres(filas), hay_mas) for filas, hay_mas in paginas],
+            [
+                (["Arena", "Cal"], True),
+                (["Cemento", "Hierro"], True),
+                (["Ladrillo", "Piedra"], False),
+                ([], False),
+            ],
+        )
+        filas, hay_mas = self.comparacion.pagina(1, 2, "", "diferencia")
+        self.assertEqual((self.nombres(filas), hay_mas), (["Hierro", "Arena"], True))
+
+    def test_impacto(self):
+        with self.assertNumQueries(1):
+            grupos, total = self.comparacion.impacto()
+        claves = ("nuevos", "quitados", "cambiados", "iguales", "suma_a", "suma_b", "diferencia")
+        resumen = {g["grupo"]: tuple(g[c] for c in claves) for g in (*grupos, total)}
+        self.assertEqual(
+            resumen,
+            {
+                "Arena": (0, 1, 1, 1, Decimal("300"), Decimal("350"), Decimal("50")),
+                "Otros": (1, 0, 2, 0, Decimal("1000"), Decimal("920"), Decimal("-80")),
+                "Total": (1, 1, 3, 1, Decimal("1300"), Decimal("1270"), Decimal("-30")),
+            },
+        )
+        self.assertEqual([g["grupo"] for g in grupos], ["Arena", "Otros"])
+        self.assertAlmostEqual(float(grupos[1]["variacion"]), -8.0)
+        self.assertAlmostEqual(float(grupos[0]["variacion"]), 50 / 3)
+
+    def test_no_mezcla_hojas_de_otra_empresa(self):
+        otra = crear_empresa_de_prueba("Otra")
+        comparacion = ComparacionHojas(otra.company, "material", self.datos.hoja_materiales.pk, self.hoja_b.pk)
+        self.assertEqual(list(comparacion.filas("todos")), [])
+        self.assertEqual(comparacion.impacto()[0], [])
+
+
+class HistorialPreciosTests(EmpresaDePruebaMixin, TestCase):
+    """Actualización por porcentaje con historial y su reversión."""
+
+    def setUp(self):
+        super().setUp()
+        d = self.datos
+        self.cal = Material.objects.create(
+            nombre="Cal", company=d.company, tipo=d.tipo, categoria=d.categoria,
+            unidad_de_venta=d.unidad, precio_unidad_venta=Decimal("40"),
+        )
+        self.arena = HojaPrecioMaterial.objects.get(hoja=d.hoja_materiales, material=d.material)
+        self.fila_cal = HojaPrecioMaterial.objects.create(
+            hoja=d.hoja_materiales, material=self.cal, cantidad_por_unidad_venta=1,
+            precio_unidad_venta=Decimal("40"),
+        )
+        self.ids = [self.arena.pk, self.fila_cal.pk]
+
+    def precios(self):
+        return dict(
+            HojaPrecioMaterial.objects.filter(pk__in=self.ids).values_list("pk", "precio_unidad_venta")
+        )
+
+    def aumentar(self, porcentaje="10"):
+        d = self.datos
+        return historial.actualizar_por_porcentaje(
+            d.company, "material", self.ids, porcentaje, hoja_id=d.hoja_materiales.pk, usuario=d.user
+        )
+
+    def test_aplicar(self):
+        d = self.datos
+        guardar_totales(Presupuesto.objects.get(pk=d.presupuesto.pk))
+        indice_materiales(d.hoja_materiales.pk)
+        operacion = self.aumentar()
+        self.assertEqual(self.precios(), {self.arena.pk: Decimal("110"), self.fila_cal.pk: Decimal("44")})
+        self.assertEqual(
+            (operacion.filas, operacion.porcentaje, operacion.hoja_id), (2, Decimal("10"), d.hoja_materiales.pk)
+        )
+        self.assertEqual(
+            set(operacion.cambios.values_list("fila_id", "recurso_id", "precio_anterior", "precio_nuevo")),
+            {
+                (self.arena.pk, d.material.pk, Decimal("100"), Decimal("110")),
+                (self.fila_cal.pk, self.cal.pk, Decimal("40"), Decimal("44")),
+            },
+        )
+        # update() no dispara signals: el índice y los totales se invalidan a mano.
+        self.assertEqual(indice_materiales(d.hoja_materiales.pk)[d.material.pk][0], Decimal("110"))
+        self.assertFalse(Presupuesto.objects.get(pk=d.presupuesto.pk).totales_vigentes)
+
+    def test_aplicar_al_catalogo(self):
+        d = self.datos
+        operacion = historial.actualizar_por_porcentaje(d.company, "material", [self.cal.pk], "-50")
+        self.cal.refresh_from_db()
+        self.assertEqual(self.cal.precio_unidad_venta, Decimal("20"))
+        self.assertIsNone(operacion.hoja_id)
+        self.assertEqual(operacion.filas, 1)
+
+    def test_revertir(self):
+        operacion = self.aumentar()
+        nueva, saltadas = historial.revertir(operacion, self.datos.user)
+        self.assertEqual(saltadas, 0)
+        self.assertEqual((nueva.revierte, nueva.filas), (operacion, 2))
+        self.assertEqual(self.precios(), {self.arena.pk: Decimal("100"), self.fila_cal.pk: Decimal("40")})
+
+    def test_revertir_saltea_las_filas_cambiadas_despues(self):
+        operacion = self.aumentar()
+        HojaPrecioMaterial.objects.filter(pk=self.fila_cal.pk).update(precio_unidad_venta=Decimal("50"))
+        nueva, saltadas = historial.revertir(operacion)
+        self.assertEqual((saltadas, nueva.filas), (1, 1))
+        self.assertEqual(self.precios(), {self.arena.pk: Decimal("100"), self.fila_cal.pk: Decimal("50")})
+
+    def test_accion_del_admin_queda_en_el_historial(self):
+        d = self.datos
+        otra = crear_empresa_de_prueba("Otra")
+        d.user.is_staff = d.user.is_superuser = True
+        d.user.save()
+        respuesta = self.client.post(
+            reverse("admin:recursos_material_changelist"),
+            {
+                "action": "actualizar_precios_materiales",
+                "apply": "1",
+                "porcentaje": "10",
+                "_selected_action": [self.cal.pk, otra.material.pk],
+            },
+        )
+        self.assertRedirects(respuesta, reverse("admin:recursos_material_changelist"), fetch_redirect_response=False)
+        self.cal.refresh_from_db()
+        otra.material.refresh_from_db()
+        self.assertEqual((self.cal.precio_unidad_venta, otra.material.precio_unidad_venta), (Decimal("44"), Decimal("110")))
+        # Una operación por empresa, con el usuario, que se puede revertir.
+        operacion = OperacionPrecios.objects.get(company=d.company)
+        self.assertEqual((operacion.usuario, operacion.porcentaje, operacion.filas), (d.user, Decimal("10"), 1))
+        self.assertEqual(OperacionPrecios.objects.get(company=otra.company).filas, 1)
+        historial.revertir(operacion, d.user)
+        self.cal.refresh_from_db()
+        self.assertEqual(self.cal.precio_unidad_venta, Decimal("40"))
+
+    def test_revertir_relee_los_precios_dentro_de_la_transaccion(self):
+        operacion = self.aumentar()
+        aplicar = historial._aplicar
+
+        def cambio_concurrente(*args, **kwargs):
+            # Otro usuario cambia un precio después de que revertir leyó el historial.
+            HojaPrecioMaterial.objects.filter(pk=self.arena.pk).update(precio_unidad_venta=Decimal("120"))
+            return aplicar(*args, **kwargs)
+
+        with mock.patch("recursos.historial._aplicar", side_effect=cambio_concurrente):
+            nueva, saltadas = historial.revertir(operacion)
+        self.assertEqual((saltadas, nueva.filas), (1, 1))
+        self.assertEqual(self.precios(), {self.arena.pk: Decimal("120"), self.fila_cal.pk: Decimal("40")})
+
+
+class ClonarLoteTests(EmpresaDePruebaMixin, TestCase):
+    """clonar_lote copia hojas, mezclas y tareas del lote de prueba."""
+
+    def clonar(self, **origenes):
+        d = self.datos
+        origenes.setdefault("hoja_materiales_origen", d.hoja_materiales)
+        origenes.setdefault("hoja_mano_de_obra_origen", d.hoja_mano_de_obra)
+        origenes.setdefault("hoja_subcontratos_origen", d.hoja_subcontratos)
+        origenes.setdefault("hoja_mezclas_origen", d.hoja_materiales)
+        origenes.setdefault("lote_maestro_origen", d.lote)
+        return clonar_lote(d.company, "Lote 2", **origenes)
+
+    def filas(self, hoja, campo, *campos):
+        return set(hoja.detalles.values_list(f"{campo}_id", *campos))
+
+    def test_copia_hojas_mezclas_y_tareas(self):
+        d = self.datos
+        lote, reporte = self.clonar()
+        self.assertEqual(lote.nombre, "Lote 2")
+        for nueva, vieja, campo in (
+            (lote.hoja_materiales, d.hoja_materiales, "material"),
+            (lote.hoja_mano_de_obra, d.hoja_mano_de_obra, "mano_de_obra"),
+            (lote.hoja_subcontratos, d.hoja_subcontratos, "subcontrato"),
+        ):
+            with self.subTest(campo):
+                self.assertNotEqual(nueva.pk, vieja.pk)
+                campos = ("cantidad_por_unidad_venta", "precio_unidad_venta")
+                self.assertEqual(self.filas(nueva, campo, *campos), self.filas(vieja, campo, *campos))
+                self.assertEqual(nueva.origen_id, vieja.pk)
+
+        mezcla = Mezcla.objects.get(hoja=lote.hoja_materiales)
+        self.assertEqual((mezcla.nombre, mezcla.unidad_de_mezcla_id), ("Mortero", d.unidad.pk))
+        self.assertEqual(
+            list(MezclaMaterial.objects.filter(mezcla=mezcla).values_list("material_id", "cantidad")),
+            [(d.material.pk, Decimal("2"))],
+        )
+
+        tarea = Tarea.objects.get(lote=lote)
+        self.assertEqual(
+            (tarea.nombre, tarea.rubro_id, tarea.subrubro_id), ("Muro 15", d.rubro.pk, d.subrubro.pk)
+        )
+        recursos = TareaRecurso.objects.filter(tarea=tarea)
+        self.assertEqual(
+            set(recursos.values_list("material_id", "mano_de_obra_id", "subcontrato_id", "cantidad")),
+            set(
+                TareaRecurso.objects.filter(tarea=d.tarea).values_list(
+                    "material_id", "mano_de_obra_id", "subcontrato_id", "cantidad"
+                )
+            ),
+        )
+        # La mezcla del recurso es la copia de la hoja nueva, no la original.
+        self.assertEqual(list(recursos.exclude(mezcla=None).values_list("mezcla_id", flat=True)), [mezcla.pk])
+        # 3 hojas con una fila, mezcla + material, tarea + 4 recursos.
+        self.assertEqual(reporte.filas, 3 + 2 + 5)
+
+    def test_sin_mezclas_el_recurso_queda_sin_mezcla(self):
+        lote, _ = self.clonar(hoja_mezclas_origen=None)
+        self.assertFalse(Mezcla.objects.filter(hoja=lote.hoja_materiales).exists())
+        recursos = TareaRecurso.objects.filter(tarea__lote=lote)
+        self.assertEqual(recursos.count(), 4)
+        self.assertFalse(recursos.exclude(mezcla=None).exists())
+
+    def test_hojas_vacias_sin_origen(self):
+        lote, reporte = clonar_lote(self.datos.company, "Vacío")
+        self.assertFalse(lote.hoja_materiales.detalles.exists())
+        self.assertFalse(Tarea.objects.filter(lote=lote).exists())
+        self.assertEqual(reporte.filas, 0)
+
+    def test_un_error_a_mitad_de_camino_borra_lo_creado(self):
+        hojas = HojaPrecios.objects.count()
+        with mock.patch("recursos.lotes.copiar_mezclas", side_effect=RuntimeError("falla")):
+            with self.assertRaises(RuntimeError):
+                self.clonar()
+        self.assertEqual(HojaPrecios.objects.count(), hojas)
+        self.assertFalse(HojaPrecioMaterial.objects.filter(hoja__nombre="Lote 2").exists())
+
+    def test_un_error_no_deja_nada(self):
+        def contar():
+            return [modelo.objects.count() for modelo in (Lote, HojaPrecios, Mezcla, MezclaMaterial, Tarea)]
+
+        antes = contar()
+        with mock.patch("recursos.lotes.copiar_tareas", side_effect=RuntimeError("falla")):
+            with self.assertRaises(RuntimeError):
+                self.clonar()
+        self.assertEqual(contar(), antes)
+        self.assertFalse(HojaPrecioMaterial.objects.filter(hoja__nombre="Lote 2").exists())
+
+
+class ImportarPreciosTests(EmpresaDePruebaMixin, TestCase):
+    """Importación de un CSV de precios a la hoja de materiales de prueba."""
+
+    def setUp(self):
+        super().setUp()
+        d = self.datos
+        self.hoja = d.hoja_materiales
+        otro = Proveedor.objects.create(nombre="Ferretería", company=d.company)
+        for nombre, proveedor in (("Cal", d.proveedor), ("Cemento", d.proveedor), ("Cemento", otro)):
+            Material.objects.create(
+                nombre=nombre, company=d.company, proveedor=proveedor, tipo=d.tipo, categoria=d.categoria,
+                unidad_de_venta=d.unidad, precio_unidad_venta=Decimal("1"), moneda="USD",
+            )
+
+    def precios(self):
+        return dict(self.hoja.detalles.values_list("material__nombre", "precio_unidad_venta"))
+
+    def test_leer_decimal(self):
+        for texto, valor in (
+            ("1234.56", "1234.56"), ("1234,56", "1234.56"), ("1.234,56", "1234.56"),
+            ("1,234.56", "1234.56"), ("$ 1.000,5", "1000.5"), ("12", "12"),
+        ):
+            with self.subTest(texto):
+                self.assertEqual(leer_decimal(texto), Decimal(valor))
+        self.assertIsNone(leer_decimal("  "))
+        with self.assertRaises(ValueError):
+            leer_decimal("doce")
+
+    def test_actualiza_crea_y_reporta(self):
+        lineas = [
+            "Nombre;Precio;Proveedor",
+            "ARENA;1.234,50;",          # actualiza (sin importar mayúsculas)
+            "Cal;80,25;",               # no está en la hoja: se agrega con la moneda del catálogo
+            "Cemento;10;",              # dos con ese nombre
+            "Cemento;11;Ferretería",    # el proveedor desempata
+            "Yeso;5;",                  # no está en el catálogo
+            "Cal;90;",                  # repetido
+            ";;",
+        ]
+        resultado = importar_precios(self.hoja, "material", lineas)
+        self.assertEqual(
+            (resultado.leidas, resultado.actualizadas, resultado.creadas, resultado.ambiguas,
+             resultado.no_encontradas, resultado.con_error),
+            (6, 1, 2, 1, 1, 1),
+        )
+        self.assertEqual(
+            [(linea, motivo) for linea, _, motivo in resultado.problemas],
+            [(4, "ambiguo"), (6, "no encontrado"), (7, "repetido en el archivo")],
+        )
+        self.assertEqual(
+            self.precios(), {"Arena": Decimal("1234.5"), "Cal": Decimal("80.25"), "Cemento": Decimal("11")}
+        )
+        self.assertEqual(self.hoja.detalles.get(material__nombre="Cal").moneda, "USD")
+        # La hoja cambió: el índice cacheado se renueva.
+        self.assertEqual(indice_materiales(self.hoja.pk)[self.datos.material.pk][0], Decimal("1234.5"))
+
+    def test_sin_cambios_y_sin_crear_faltantes(self):
+        resultado = importar_precios(
+            self.hoja, "material", ["nombre,precio", "Arena,100", "Cal,3"], crear_faltantes=False
+        )
+        self.assertEqual((resultado.sin_cambios, resultado.no_encontradas, resultado.creadas), (1, 1, 0))
+        self.assertEqual(self.precios(), {"Arena": Decimal("100")})
+
+    def test_filas_invalidas_no_tocan_la_hoja(self):
+        lineas = ["nombre;precio;moneda", "Arena;cien;", "Arena;;", "Arena;5;EUR", "Cal;;"]
+        resultado = importar_precios(self.hoja, "material", lineas)
+        self.assertEqual((resultado.con_error, resultado.actualizadas, resultado.creadas), (4, 0, 0))
+        self.assertEqual(self.precios(), {"Arena": Decimal("100")})
+
+    def test_faltan_columnas(self):
+        with self.assertRaisesMessage(ErrorImportacion, "Faltan columnas: precio."):
+            importar_precios(self.hoja, "material", ["nombre;costo", "Arena;5"])
+        self.assertEqual(self.precios(), {"Arena": Decimal("100")})
+
+
+@override_settings(TRABAJOS_EN_PROCESO=False)
+class ProgresoClonadoTests(TransactionTestCase):
+    """El progreso del clonado se ve desde otra conexión mientras el trabajo corre."""
+
+    def test_progreso_visible_durante_el_clonado(self):
+        d = crear_empresa_de_prueba()
+        job = trabajos.encolar(
+            "recursos.clonar_lote", company=d.company, nombre="Lote 2",
+            hoja_materiales_id=d.hoja_materiales.pk, hoja_mezclas_id=d.hoja_materiales.pk,
+            lote_maestro_id=d.lote.pk,
+        )
+        llego, seguir = threading.Event(), threading.Event()
+        copiar_tareas = lotes.copiar_tareas
+
+        def pausar(*args, **kwargs):
+            llego.set()
+            seguir.wait(10)
+            return copiar_tareas(*args, **kwargs)
+
+        with mock.patch("recursos.lotes.copiar_tareas", side_effect=pausar):
+            # El hilo usa su propia conexión, como el pool de trabajos.
+            hilo = threading.Thread(target=trabajos._ejecutar_en_hilo, args=[job.pk])
+            hilo.start()
+            try:
+                self.assertTrue(llego.wait(10))
+                job.refresh_from_db()
+                self.assertEqual(job.estado, Trabajo.EN_CURSO)
+                self.assertEqual(job.progreso, "mezclas: 2 filas")
+            finally:
+                seguir.set()
+                hilo.join(10)
+        job.refresh_from_db()
+        self.assertEqual(job.estado, Trabajo.TERMINADO, job.error)
+        self.assertEqual(job.progreso, "tareas: 5 filas")
+        self.assertTrue(Lote.objects.filter(nombre="Lote 2", company=d.company).exists())
@@ -0,0 +1,114 @@
+"""
+Trabajos en segundo plano de recursos (ver general.trabajos).
+"""
+from django.urls import reverse
+
+from general.trabajos import informar_progreso, trabajo
+
+from .historial import actualizar_por_porcentaje, revertir
+from .indice_precios import MANO_DE_OBRA, MATERIALES, SUBCONTRATOS
+from .lotes import clonar_lote
+from .models import (
+    HojaPrecioManoDeObra,
+    HojaPrecioMaterial,
+    HojaPrecios,
+    HojaPrecioSubcontrato,
+    HojaPreciosManoDeObra,
+    HojaPreciosSubcontrato,
+    ManoDeObra,
+    Material,
+    OperacionPrecios,
+    Subcontrato,
+)
+
+# recurso → (catálogo, detalle de hoja, hoja, índice, campo de hoja en Lote, url de la lista)
+RECURSOS_CON_PRECIO = {
+    "material": (
+        Material, HojaPrecioMaterial, HojaPrecios, MATERIALES,
+        "hoja_materiales", "recursos:material_list",
+    ),
+    "mano_de_obra": (
+        ManoDeObra, HojaPrecioManoDeObra, HojaPreciosManoDeObra, MANO_DE_OBRA,
+        "hoja_mano_de_obra", "recursos:mano_de_obra_list",
+    ),
+    "subcontrato": (
+        Subcontrato, HojaPrecioSubcontrato, HojaPreciosSubcontrato, SUBCONTRATOS,
+        "hoja_subcontratos", "recursos:subcontrato_list",
+    ),
+}
+
+
+def actualizar_precios(company, recurso, ids, porcentaje, hoja_id=None, usuario=None):
+    """
+    Actualiza precio_unidad_venta por porcentaje y guarda el historial (ver
+    recursos.historial). Sin hoja: recursos del catálogo. Con hoja: detalles
+    de la hoja. Devuelve la OperacionPrecios.
+    """
+    if hoja_id:
+        modelo_hoja = RECURSOS_CON_PRECIO[recurso][2]
+        hoja_id = modelo_hoja.objects.get(pk=hoja_id, company=company).pk
+    return actualizar_por_porcentaje(company, recurso, ids, porcentaje, hoja_id, usuario)
+
+
+def _url_lista(recurso, hoja_id):
+    url = reverse(RECURSOS_CON_PRECIO[recurso][5])
+    if hoja_id:
+        url += f"?hoja={hoja_id}"
+    return url
+
+
+@trabajo("recursos.actualizar_precios")
+def actualizar_precios_trabajo(job, recurso, ids, porcentaje, hoja_id=None):
+    operacion = actualizar_precios(job.company, recurso, ids, porcentaje, hoja_id, job.usuario)
+    return {
+        "filas": operacion.filas,
+        "operacion_id": operacion.pk,
+        "url": _url_lista(recurso, hoja_id),
+        "mensaje": f"{operacion.filas} precios actualizados ({porcentaje}%).",
+    }
+
+
+@trabajo("recursos.revertir_precios")
+def revertir_precios_trabajo(job, operacion_id):
+    operacion = OperacionPrecios.objects.get(pk=operacion_id, company=job.company)
+    reversion, saltadas = revertir(operacion, job.usuario)
+    mensaje = f"{reversion.filas} precios vueltos al valor anterior a la operación #{operacion.pk}."
+    if saltadas:
+        mensaje += f" {saltadas} no se tocaron porque cambiaron después."
+    return {
+        "filas": reversion.filas,
+        "saltadas": saltadas,
+        "operacion_id": reversion.pk,
+        "url": reverse("recursos:precios_historial"),
+        "mensaje": mensaje,
+    }
+
+
+@trabajo("recursos.clonar_lote")
+def clonar_lote_trabajo(
+    job,
+    nombre,
+    hoja_materiales_id=None,
+    hoja_mano_de_obra_id=None,
+    hoja_subcontratos_id=None,
+    hoja_mezclas_id=None,
+    lote_maestro_id=None,
+):
+    from .models import Lote
+
+    company = job.company
+    lote, reporte = clonar_lote(
+        company,
+        nombre,
+        hoja_materiales_origen=HojaPrecios.objects.filter(pk=hoja_materiales_id, company=company).first(),
+        hoja_mano_de_obra_origen=HojaPreciosManoDeObra.objects.filter(pk=hoja_mano_de_obra_id, company=company).first(),
+        hoja_subcontratos_origen=HojaPreciosSubcontrato.objects.filter(pk=hoja_subcontratos_id, company=company).first(),
+        hoja_mezclas_origen=HojaPrecios.objects.filter(pk=hoja_mezclas_id, company=company).first(),
+        lote_maestro_origen=Lote.objects.filter(pk=lote_maestro_id, company=company).first(),
+        progreso=lambda paso, filas: informar_progreso(job, f"{paso}: {filas} filas"),
+    )
+    return {
+        "lote_id": lote.pk,
+        "url": reverse("tareas"),
+        "mensaje": f"Lote «{lote.nombre}» creado: {reporte}.",
+    }
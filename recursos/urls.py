@@ -43,6 +43,11 @@ urlpatterns = [
         views.hoja_mano_de_obra_detalle,
         name="hoja_mano_de_obra_detalle",
     ),
+    path(
+        "hojas-mano-de-obra/<int:pk>/importar/",
+        views.hoja_mano_de_obra_importar,
+        name="hoja_mano_de_obra_importar",
+    ),
     path(
         "hojas-mano-de-obra/<int:hoja_pk>/detalle/<int:detalle_pk>/editar/",
         views.hoja_mano_de_obra_detalle_edit,
@@ -81,6 +86,11 @@ urlpatterns = [
         views.hoja_subcontrato_detalle,
         name="hoja_subcontrato_detalle",
     ),
+    path(
+        "hojas-subcontrato/<int:pk>/importar/",
+        views.hoja_subcontrato_importar,
+        name="hoja_subcontrato_importar",
+    ),
     path(
         "hojas-subcontrato/<int:hoja_pk>/detalle/<int:detalle_pk>/editar/",
         views.hoja_subcontrato_detalle_edit,
@@ -133,6 +143,11 @@ urlpatterns = [
         views.hoja_precios_detalle,
         name="hoja_precios_detalle",
     ),
+    path(
+        "hojas-precio/<int:pk>/importar/",
+        views.hoja_precios_importar,
+        name="hoja_precios_importar",
+    ),
     path(
         "hojas-precio/<int:hoja_pk>/detalle/<int:detalle_pk>/editar/",
         views.hoja_detalle_edit,
@@ -143,5 +158,9 @@ urlpatterns = [
         views.hoja_detalle_delete,
         name="hoja_detalle_delete",
     ),
+    # Historial de precios
+    path("precios/historial/", views.precios_historial, name="precios_historial"),
+    path("precios/historial/<int:pk>/", views.precios_operacion, name="precios_operacion"),
+    path("precios/historial/<int:pk>/revertir/", views.precios_revertir, name="precios_revertir"),
+    path("precios/diferencias/", views.precios_diferencias, name="precios_diferencias"),
 ]
-
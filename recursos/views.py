@@ -1,28 +1,23 @@
+import io
 from datetime import datetime
 from decimal import Decimal, InvalidOperation
 
 from django.contrib.auth.decorators import login_required
+from django.db.models import Exists, F, OuterRef
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 
-from general.models import CategoriaMaterial, TipoMaterial
-
-
-def _categorias_por_tipo(company):
-    """Dict tipo_pk -> [{id, nombre}, ...] para filtrar categorías por tipo en el form de material."""
-    result = {}
-    for t in TipoMaterial.objects.filter(company=company).order_by("nombre"):
-        result[str(t.pk)] = [
-            {"id": c.pk, "nombre": c.nombre}
-            for c in CategoriaMaterial.objects.filter(company=company, tipo=t).order_by("nombre")
-        ]
-    return result
-
+from general.estadisticas import invalidar_estadisticas
+from general.models import CategoriaMaterial, Proveedor, Rubro, Subrubro, TipoMaterial
+from general.trabajos import encolar
 
+from .costos import CostosLote, con_costos_exactos, margen_sql
 from .forms import (
     HojaPrecioMaterialForm,
     HojaPrecioManoDeObraForm,
     HojaPrecioSubcontratoForm,
+    ImportarPreciosForm,
     ManoDeObraForm,
     MaterialForm,
     MezclaForm,
@@ -31,6 +26,7 @@ from .forms import (
     TareaForm,
     TareaRecursoForm,
 )
+from .listados import Listado
 from .models import (
     HojaPrecioMaterial,
     HojaPrecioManoDeObra,
@@ -43,12 +39,59 @@ from .models import (
     Material,
     Mezcla,
     MezclaMaterial,
+    OperacionPrecios,
     Subcontrato,
     Tarea,
     TareaRecurso,
 )
 
 
+def _categorias_por_tipo(company):
+    """Dict tipo_pk -> [{id, nombre}, ...] para filtrar categorías por tipo en el form de material."""
+    result = {}
+    for t in TipoMaterial.objects.filter(company=company).order_by("nombre"):
+        result[str(t.pk)] = [
+            {"id": c.pk, "nombre": c.nombre}
+            for c in CategoriaMaterial.objects.filter(company=company, tipo=t).order_by("nombre")
+        ]
+    return result
+
+
+def _no_en_hoja(request, recurso, catalogo, detalle, hoja):
+    """Página de recursos del catálogo que todavía no están en la hoja (anti-join)."""
+    listado = Listado(recurso, request, prefijo="agregar_")
+    queryset = catalogo.objects.filter(company=hoja.company).filter(
+        ~Exists(detalle.objects.filter(hoja=hoja, **{recurso: OuterRef("pk")}))
+    )
+    return listado, listado.paginar(queryset)
+
+
+def _filtros_material(company):
+    return {
+        "proveedores": Proveedor.objects.filter(company=company).order_by("nombre"),
+        "tipos": TipoMaterial.objects.filter(company=company).order_by("nombre"),
+        "categorias": CategoriaMaterial.objects.filter(company=company).order_by("nombre"),
+    }
+
+
+def _filtros_rubro(company, con_proveedores=False):
+    opciones = {
+        "rubros": Rubro.objects.filter(company=company).order_by("nombre"),
+        "subrubros": Subrubro.objects.filter(company=company)
+        .select_related("rubro")
+        .order_by("rubro__nombre", "nombre"),
+    }
+    if con_proveedores:
+        opciones["proveedores"] = Proveedor.objects.filter(company=company).order_by("nombre")
+    return opciones
+
+
+def _incluir_fila(pagina, fila):
+    """La fila en edición se muestra aunque no caiga en la página pedida."""
+    if fila is not None and fila not in pagina.filas:
+        pagina.filas.insert(0, fila)
+
+
 @login_required
 def material_list(request):
     company = request.company
@@ -64,15 +107,6 @@ def material_list(request):
     if hoja_id:
         hoja_seleccionada = get_object_or_404(HojaPrecios, pk=hoja_id, company=company)
         modo_hoja = True
-        materiales = list(
-            hoja_seleccionada.detalles.select_related(
-                "material",
-                "material__proveedor",
-                "material__tipo",
-                "material__categoria",
-                "material__unidad_de_venta",
-            ).all()
-        )
 
         # Agregar material a la hoja
         if agregar and request.method == "POST":
@@ -126,16 +160,17 @@ def material_list(request):
 
         materiales_no_en_hoja = None
         if agregar:
-            ids_en_hoja = set(
-                hoja_seleccionada.detalles.values_list("material_id", flat=True)
-            )
-            todos = list(
-                Material.objects.filter(company=company)
-                .select_related("proveedor", "tipo", "categoria", "unidad_de_venta")
-            )
-            materiales_no_en_hoja = (
-                [m for m in todos if m.pk not in ids_en_hoja] if ids_en_hoja else todos
+            listado_agregar, materiales_no_en_hoja = _no_en_hoja(
+                request, "material", Material, HojaPrecioMaterial, hoja_seleccionada
             )
+            if request.GET.get("formato") == "json":
+                return JsonResponse(listado_agregar.como_json(materiales_no_en_hoja))
+
+        listado = Listado("material", request, en_hoja=True)
+        materiales = listado.paginar(hoja_seleccionada.detalles.all())
+        if request.GET.get("formato") == "json":
+            return JsonResponse(listado.como_json(materiales))
+        _incluir_fila(materiales, editing_hoja)
 
         lote = Lote.objects.filter(hoja_materiales=hoja_seleccionada).first()
         return render(
@@ -143,6 +178,8 @@ def material_list(request):
             "recursos/material_list.html",
             {
                 "materiales": materiales,
+                "listado": listado,
+                **_filtros_material(company),
                 "form_new": form_new,
                 "hojas": hojas,
                 "hoja_seleccionada": hoja_seleccionada,
@@ -166,14 +203,17 @@ def material_list(request):
     else:
         form_new = MaterialForm(request=request)
 
-    materiales = Material.objects.filter(company=company).select_related(
-        "proveedor", "tipo", "categoria", "unidad_de_venta"
-    )
+    listado = Listado("material", request)
+    materiales = listado.paginar(Material.objects.filter(company=company))
+    if request.GET.get("formato") == "json":
+        return JsonResponse(listado.como_json(materiales))
     return render(
         request,
         "recursos/material_list.html",
         {
             "materiales": materiales,
+            "listado": listado,
+            **_filtros_material(company),
             "form_new": form_new,
             "hojas": hojas,
             "hoja_seleccionada": hoja_seleccionada,
@@ -196,15 +236,17 @@ def material_edit(request, pk):
     else:
         form_edit = MaterialForm(instance=material, request=request)
 
-    materiales = Material.objects.filter(company=company).select_related(
-        "proveedor", "tipo", "categoria", "unidad_de_venta"
-    )
+    listado = Listado("material", request)
+    materiales = listado.paginar(Material.objects.filter(company=company))
+    _incluir_fila(materiales, material)
     form_new = MaterialForm(request=request)
     return render(
         request,
         "recursos/material_list.html",
         {
             "materiales": materiales,
+            "listado": listado,
+            **_filtros_material(company),
             "form_new": form_new,
             "form_edit": form_edit,
             "editing": material,
@@ -254,21 +296,17 @@ def material_bulk_update(request):
         return redirect(redirect_url)
 
     if hoja_id:
-        hoja = get_object_or_404(HojaPrecios, pk=hoja_id, company=request.company)
-        queryset = HojaPrecioMaterial.objects.filter(
-            hoja=hoja, pk__in=ids
-        )
-        from django.db.models import F
-        factor = Decimal("1") + (porcentaje / Decimal("100"))
-        queryset.update(precio_unidad_venta=F("precio_unidad_venta") * factor)
-    else:
-        queryset = Material.objects.filter(company=request.company, pk__in=ids)
-        Material.actualizar_precios_por_porcentaje(queryset, porcentaje)
-
-    redirect_url = reverse("recursos:material_list")
-    if hoja_id:
-        redirect_url += f"?hoja={hoja_id}"
-    return redirect(redirect_url)
+        get_object_or_404(HojaPrecios, pk=hoja_id, company=request.company)
+    job = encolar(
+        "recursos.actualizar_precios",
+        company=request.company,
+        usuario=request.user,
+        recurso="material",
+        ids=[int(pk) for pk in ids if pk.isdigit()],
+        porcentaje=str(porcentaje),
+        hoja_id=int(hoja_id) if hoja_id else None,
+    )
+    return redirect("general:trabajo_detalle", pk=job.pk)
 
 
 @login_required
@@ -321,6 +359,8 @@ def hoja_precios_list(request):
                 ]
             )
 
+        # Los detalles se cargan con bulk_create (sin signals).
+        invalidar_estadisticas(company.pk)
         return redirect("recursos:hoja_precios_list")
 
     hojas = HojaPrecios.objects.filter(company=company)
@@ -331,6 +371,65 @@ def hoja_precios_list(request):
     )
 
 
+# recurso → (modelo de hoja, url del detalle de la hoja, título)
+HOJAS_IMPORTABLES = {
+    "material": (HojaPrecios, "recursos:hoja_precios_detalle", "Materiales"),
+    "mano_de_obra": (HojaPreciosManoDeObra, "recursos:hoja_mano_de_obra_detalle", "Mano de obra"),
+    "subcontrato": (HojaPreciosSubcontrato, "recursos:hoja_subcontrato_detalle", "Subcontratos"),
+}
+
+
+def _hoja_importar(request, recurso, pk):
+    """Sube un CSV de precios a la hoja y muestra el reporte de la importación."""
+    from .importacion import CLAVES, ErrorImportacion, importar_precios
+
+    modelo_hoja, url_hoja, titulo = HOJAS_IMPORTABLES[recurso]
+    hoja = get_object_or_404(modelo_hoja, pk=pk, company=request.company)
+    resultado = None
+    if request.method == "POST":
+        form = ImportarPreciosForm(request.POST, request.FILES)
+        if form.is_valid():
+            archivo = io.TextIOWrapper(
+                form.cleaned_data["archivo"].file, encoding="utf-8-sig", errors="replace", newline=""
+            )
+            try:
+                resultado = importar_precios(
+                    hoja, recurso, archivo, crear_faltantes=form.cleaned_data["crear_faltantes"]
+                )
+            except ErrorImportacion as exc:
+                form.add_error("archivo", str(exc))
+    else:
+        form = ImportarPreciosForm()
+    return render(
+        request,
+        "recursos/hoja_importar.html",
+        {
+            "hoja": hoja,
+            "form": form,
+            "resultado": resultado,
+            "titulo": titulo,
+            "url_hoja": reverse(url_hoja, args=[hoja.pk]),
+            "con_moneda": recurso != "mano_de_obra",
+            "desempates": ", ".join(columna for columna, _ in CLAVES[recurso][1]),
+        },
+    )
+
+
+@login_required
+def hoja_precios_importar(request, pk):
+    return _hoja_importar(request, "material", pk)
+
+
+@login_required
+def hoja_mano_de_obra_importar(request, pk):
+    return _hoja_importar(request, "mano_de_obra", pk)
+
+
+@login_required
+def hoja_subcontrato_importar(request, pk):
+    return _hoja_importar(request, "subcontrato", pk)
+
+
 @login_required
 def hoja_precios_detalle(request, pk):
     hoja = get_object_or_404(HojaPrecios, pk=pk, company=request.company)
@@ -383,16 +482,6 @@ def mano_de_obra_list(request):
             HojaPreciosManoDeObra, pk=hoja_id, company=company
         )
         modo_hoja = True
-        items = list(
-            hoja_seleccionada.detalles.select_related(
-                "mano_de_obra",
-                "mano_de_obra__rubro",
-                "mano_de_obra__subrubro",
-                "mano_de_obra__equipo",
-                "mano_de_obra__ref_equipo",
-                "mano_de_obra__unidad_de_venta",
-            ).all()
-        )
 
         if agregar and request.method == "POST":
             md_id = request.POST.get("mano_de_obra_id")
@@ -446,17 +535,17 @@ def mano_de_obra_list(request):
 
         items_no_en_hoja = None
         if agregar:
-            ids_en_hoja = set(
-                hoja_seleccionada.detalles.values_list("mano_de_obra_id", flat=True)
-            )
-            todos = list(
-                ManoDeObra.objects.filter(company=company).select_related(
-                    "rubro", "subrubro", "equipo", "ref_equipo", "unidad_de_venta"
-                )
-            )
-            items_no_en_hoja = (
-                [m for m in todos if m.pk not in ids_en_hoja] if ids_en_hoja else todos
+            listado_agregar, items_no_en_hoja = _no_en_hoja(
+                request, "mano_de_obra", ManoDeObra, HojaPrecioManoDeObra, hoja_seleccionada
             )
+            if request.GET.get("formato") == "json":
+                return JsonResponse(listado_agregar.como_json(items_no_en_hoja))
+
+        listado = Listado("mano_de_obra", request, en_hoja=True)
+        items = listado.paginar(hoja_seleccionada.detalles.all())
+        if request.GET.get("formato") == "json":
+            return JsonResponse(listado.como_json(items))
+        _incluir_fila(items, editing_hoja)
 
         lote = Lote.objects.filter(hoja_mano_de_obra=hoja_seleccionada).first()
         return render(
@@ -464,6 +553,8 @@ def mano_de_obra_list(request):
             "recursos/mano_de_obra_list.html",
             {
                 "items": items,
+                "listado": listado,
+                **_filtros_rubro(company),
                 "form_new": form_new,
                 "hojas": hojas,
                 "hoja_seleccionada": hoja_seleccionada,
@@ -486,14 +577,17 @@ def mano_de_obra_list(request):
     else:
         form_new = ManoDeObraForm(request=request)
 
-    items = ManoDeObra.objects.filter(company=company).select_related(
-        "rubro", "subrubro", "equipo", "ref_equipo", "unidad_de_venta"
-    )
+    listado = Listado("mano_de_obra", request)
+    items = listado.paginar(ManoDeObra.objects.filter(company=company))
+    if request.GET.get("formato") == "json":
+        return JsonResponse(listado.como_json(items))
     return render(
         request,
         "recursos/mano_de_obra_list.html",
         {
             "items": items,
+            "listado": listado,
+            **_filtros_rubro(company),
             "form_new": form_new,
             "hojas": hojas,
             "hoja_seleccionada": hoja_seleccionada,
@@ -516,9 +610,9 @@ def mano_de_obra_edit(request, pk):
     else:
         form = ManoDeObraForm(instance=item, request=request)
 
-    items = ManoDeObra.objects.filter(company=company).select_related(
-        "rubro", "subrubro", "equipo", "ref_equipo", "unidad_de_venta"
-    )
+    listado = Listado("mano_de_obra", request)
+    items = listado.paginar(ManoDeObra.objects.filter(company=company))
+    _incluir_fila(items, item)
     form_new = ManoDeObraForm(request=request)
     hojas = HojaPreciosManoDeObra.objects.filter(company=company).order_by("-creado_en")
     return render(
@@ -526,6 +620,8 @@ def mano_de_obra_edit(request, pk):
         "recursos/mano_de_obra_list.html",
         {
             "items": items,
+            "listado": listado,
+            **_filtros_rubro(company),
             "form_new": form_new,
             "form_edit": form,
             "editing": item,
@@ -578,19 +674,17 @@ def mano_de_obra_bulk_update(request):
         return redirect(redirect_url)
 
     if hoja_id:
-        hoja = get_object_or_404(HojaPreciosManoDeObra, pk=hoja_id, company=request.company)
-        queryset = HojaPrecioManoDeObra.objects.filter(hoja=hoja, pk__in=ids)
-        from django.db.models import F
-        factor = Decimal("1") + (porcentaje / Decimal("100"))
-        queryset.update(precio_unidad_venta=F("precio_unidad_venta") * factor)
-    else:
-        queryset = ManoDeObra.objects.filter(company=request.company, pk__in=ids)
-        ManoDeObra.actualizar_precios_por_porcentaje(queryset, porcentaje)
-
-    redirect_url = reverse("recursos:mano_de_obra_list")
-    if hoja_id:
-        redirect_url += f"?hoja={hoja_id}"
-    return redirect(redirect_url)
+        get_object_or_404(HojaPreciosManoDeObra, pk=hoja_id, company=request.company)
+    job = encolar(
+        "recursos.actualizar_precios",
+        company=request.company,
+        usuario=request.user,
+        recurso="mano_de_obra",
+        ids=[int(pk) for pk in ids if pk.isdigit()],
+        porcentaje=str(porcentaje),
+        hoja_id=int(hoja_id) if hoja_id else None,
+    )
+    return redirect("general:trabajo_detalle", pk=job.pk)
 
 
 @login_required
@@ -644,6 +738,8 @@ def hoja_mano_de_obra_list(request):
                 ]
             )
 
+        # Los detalles se cargan con bulk_create (sin signals).
+        invalidar_estadisticas(company.pk)
         return redirect("recursos:hoja_mano_de_obra_list")
 
     hojas = HojaPreciosManoDeObra.objects.filter(company=company)
@@ -719,6 +815,9 @@ def mezcla_list(request):
         mezclas = Mezcla.objects.filter(company=company, hoja__isnull=True)
 
     mezclas = mezclas.select_related("unidad_de_mezcla", "hoja").order_by("nombre")
+    if hoja_seleccionada is None:
+        # Sin hoja el precio sale de los precios actuales de cada material.
+        mezclas = mezclas.prefetch_related("detalles__material")
 
     if request.method == "POST":
         form = MezclaForm(request.POST, request=request)
@@ -754,7 +853,10 @@ def mezcla_detalle(request, pk):
         "material__proveedor",
         "material__unidad_de_venta",
     ).all()
-    total = sum(d.costo_en_hoja() for d in detalles)
+    if mezcla.hoja_id:
+        total = mezcla.precio_por_unidad_mezcla()
+    else:
+        total = sum(d.costo_en_hoja() for d in detalles)
     return render(
         request,
         "recursos/mezcla_detalle.html",
@@ -823,146 +925,6 @@ def mezcla_material_delete(request, mezcla_pk, detalle_pk):
     return redirect("recursos:mezcla_detalle", pk=mezcla.pk)
 
 
-def _copy_hoja_materiales_desde_origen(hoja_origen, nombre, company):
-    """Copia una hoja de materiales desde otra hoja o desde precios actuales."""
-    hoja = HojaPrecios.objects.create(nombre=nombre, company=company)
-    if hoja_origen:
-        hoja.origen = hoja_origen
-        hoja.save()
-        for d in hoja_origen.detalles.select_related("material").all():
-            HojaPrecioMaterial.objects.create(
-                hoja=hoja,
-                material=d.material,
-                cantidad_por_unidad_venta=d.cantidad_por_unidad_venta,
-                precio_unidad_venta=d.precio_unidad_venta,
-                moneda=d.moneda,
-            )
-    else:
-        for m in Material.objects.filter(company=company):
-            HojaPrecioMaterial.objects.create(
-                hoja=hoja,
-                material=m,
-                cantidad_por_unidad_venta=m.cantidad_por_unidad_venta,
-                precio_unidad_venta=m.precio_unidad_venta,
-                moneda=m.moneda,
-            )
-    return hoja
-
-
-def _create_hoja_materiales_vacia(nombre, company):
-    """Crea una hoja de materiales vacía (sin copiar)."""
-    return HojaPrecios.objects.create(nombre=nombre, company=company)
-
-
-def _copy_hoja_mo_desde_origen(hoja_origen, nombre, company):
-    """Copia hoja de mano de obra."""
-    hoja = HojaPreciosManoDeObra.objects.create(nombre=nombre, company=company)
-    if hoja_origen:
-        hoja.origen = hoja_origen
-        hoja.save()
-        for d in hoja_origen.detalles.select_related("mano_de_obra").all():
-            HojaPrecioManoDeObra.objects.create(
-                hoja=hoja,
-                mano_de_obra=d.mano_de_obra,
-                cantidad_por_unidad_venta=d.cantidad_por_unidad_venta,
-                precio_unidad_venta=d.precio_unidad_venta,
-            )
-    else:
-        for md in ManoDeObra.objects.filter(company=company):
-            HojaPrecioManoDeObra.objects.create(
-                hoja=hoja,
-                mano_de_obra=md,
-                cantidad_por_unidad_venta=md.cantidad_por_unidad_venta,
-                precio_unidad_venta=md.precio_unidad_venta,
-            )
-    return hoja
-
-
-def _create_hoja_mo_vacia(nombre, company):
-    """Crea una hoja de mano de obra vacía (sin copiar)."""
-    return HojaPreciosManoDeObra.objects.create(nombre=nombre, company=company)
-
-
-def _copy_hoja_subcontratos_desde_origen(hoja_origen, nombre, company):
-    """Copia hoja de subcontratos."""
-    hoja = HojaPreciosSubcontrato.objects.create(nombre=nombre, company=company)
-    if hoja_origen:
-        hoja.origen = hoja_origen
-        hoja.save()
-        for d in hoja_origen.detalles.select_related("subcontrato").all():
-            HojaPrecioSubcontrato.objects.create(
-                hoja=hoja,
-                subcontrato=d.subcontrato,
-                cantidad_por_unidad_venta=d.cantidad_por_unidad_venta,
-                precio_unidad_venta=d.precio_unidad_venta,
-                moneda=d.moneda,
-            )
-    else:
-        for s in Subcontrato.objects.filter(company=company):
-            HojaPrecioSubcontrato.objects.create(
-                hoja=hoja,
-                subcontrato=s,
-                cantidad_por_unidad_venta=s.cantidad_por_unidad_venta,
-                precio_unidad_venta=s.precio_unidad_venta,
-                moneda=s.moneda,
-            )
-    return hoja
-
-
-def _create_hoja_subcontratos_vacia(nombre, company):
-    """Crea una hoja de subcontratos vacía (sin copiar)."""
-    return HojaPreciosSubcontrato.objects.create(nombre=nombre, company=company)
-
-
-def _copy_mezclas_desde_hoja(hoja_origen, hoja_nueva, company):
-    """Copia mezclas que usan hoja_origen, creando nuevas que usan hoja_nueva."""
-    if not hoja_origen:
-        return
-    for mezcla in Mezcla.objects.filter(company=company, hoja=hoja_origen).prefetch_related("detalles"):
-        nueva_mezcla = Mezcla.objects.create(
-            nombre=mezcla.nombre,
-            company=company,
-            unidad_de_mezcla=mezcla.unidad_de_mezcla,
-            hoja=hoja_nueva,
-        )
-        for det in mezcla.detalles.all():
-            MezclaMaterial.objects.create(
-                mezcla=nueva_mezcla,
-                material=det.material,
-                cantidad=det.cantidad,
-            )
-
-
-def _copy_tareas_desde_lote(lote_origen, lote_nuevo, company):
-    """Copia tareas y recursos desde un lote a otro."""
-    if not lote_origen:
-        return
-    hoja_nueva = lote_nuevo.hoja_materiales
-    for t in Tarea.objects.filter(lote=lote_origen, company=company).select_related("rubro", "subrubro"):
-        nueva_t = Tarea.objects.create(
-            nombre=t.nombre,
-            company=company,
-            rubro=t.rubro,
-            subrubro=t.subrubro,
-            lote=lote_nuevo,
-        )
-        for r in t.recursos.all():
-            mezcla_nueva = None
-            if r.mezcla_id:
-                # Buscar la mezcla copiada (misma nombre, hoja del nuevo lote)
-                mezcla_nueva = Mezcla.objects.filter(
-                    company=company, nombre=r.mezcla.nombre, hoja=hoja_nueva
-                ).first()
-            TareaRecurso.objects.create(
-                tarea=nueva_t,
-                material=r.material,
-                mano_de_obra=r.mano_de_obra,
-                subcontrato=r.subcontrato,
-                mezcla=mezcla_nueva,
-                cantidad=r.cantidad,
-            )
-
-
 @login_required
 def lote_list(request):
     company = request.company
@@ -1010,31 +972,18 @@ def lote_create(request):
         if origen_maestro:
             lote_maestro_origen = get_object_or_404(Lote, pk=origen_maestro, company=company)
 
-        if hoja_mat_origen:
-            hoja_mat = _copy_hoja_materiales_desde_origen(hoja_mat_origen, nombre, company)
-        else:
-            hoja_mat = _create_hoja_materiales_vacia(nombre, company)
-        if hoja_mo_origen:
-            hoja_mo = _copy_hoja_mo_desde_origen(hoja_mo_origen, nombre, company)
-        else:
-            hoja_mo = _create_hoja_mo_vacia(nombre, company)
-        if hoja_sub_origen:
-            hoja_sub = _copy_hoja_subcontratos_desde_origen(hoja_sub_origen, nombre, company)
-        else:
-            hoja_sub = _create_hoja_subcontratos_vacia(nombre, company)
-
-        _copy_mezclas_desde_hoja(hoja_mezclas_origen, hoja_mat, company)
-
-        lote_nuevo = Lote.objects.create(
-            nombre=nombre,
+        job = encolar(
+            "recursos.clonar_lote",
             company=company,
-            hoja_materiales=hoja_mat,
-            hoja_mano_de_obra=hoja_mo,
-            hoja_subcontratos=hoja_sub,
+            usuario=request.user,
+            nombre=nombre,
+            hoja_materiales_id=hoja_mat_origen.pk if hoja_mat_origen else None,
+            hoja_mano_de_obra_id=hoja_mo_origen.pk if hoja_mo_origen else None,
+            hoja_subcontratos_id=hoja_sub_origen.pk if hoja_sub_origen else None,
+            hoja_mezclas_id=hoja_mezclas_origen.pk if hoja_mezclas_origen else None,
+            lote_maestro_id=lote_maestro_origen.pk if lote_maestro_origen else None,
         )
-        _copy_tareas_desde_lote(lote_maestro_origen, lote_nuevo, company)
-
-        return redirect("tareas")
+        return redirect("general:trabajo_detalle", pk=job.pk)
 
     return render(request, "recursos/lote_form.html", {"lotes": lotes})
 
@@ -1090,31 +1039,75 @@ def lote_detalle(request, pk):
     )
 
 
+TAREA_ORDENES = {
+    "": ("rubro__nombre", "subrubro__nombre", "nombre"),
+    "costo": ("costo_total", "nombre"),
+    "-costo": ("-costo_total", "nombre"),
+    "costo_usd": (F("costo_total_usd").asc(nulls_last=True), "nombre"),
+    "-costo_usd": (F("costo_total_usd").desc(nulls_last=True), "nombre"),
+}
+
+
+def _decimal_o_none(valor):
+    try:
+        return Decimal(valor.replace(",", ".")) if valor else None
+    except InvalidOperation:
+        return None
+
+
 @login_required
 def tarea_list(request, lote_pk):
     lote = get_object_or_404(Lote.objects.select_related("tipo_dolar"), pk=lote_pk, company=request.company)
-    tareas = lote.tareas.select_related("rubro", "subrubro").order_by(
-        "rubro__nombre", "subrubro__nombre", "nombre"
-    )
+    # Costos calculados en la misma consulta (ver recursos.costos.anotar_costos).
+    tareas = lote.tareas.con_costos(lote).select_related("rubro", "subrubro", "subrubro__rubro")
+
+    # En SQL se filtra con margen; el corte final y los importes salen de CostosLote.
+    costo_min = _decimal_o_none(request.GET.get("costo_min"))
+    costo_max = _decimal_o_none(request.GET.get("costo_max"))
+    if costo_min is not None:
+        tareas = tareas.filter(costo_total__gte=costo_min - margen_sql(costo_min))
+    if costo_max is not None:
+        tareas = tareas.filter(costo_total__lte=costo_max + margen_sql(costo_max))
+
+    orden = request.GET.get("orden", "")
+    if orden not in TAREA_ORDENES:
+        orden = ""
+    tareas = con_costos_exactos(tareas.order_by(*TAREA_ORDENES[orden]), lote, costo_min, costo_max)
     return render(
         request,
         "recursos/tarea_list.html",
-        {"lote": lote, "tareas": tareas, "lote_nav_active": "maestro_tareas"},
+        {
+            "lote": lote,
+            "tareas": tareas,
+            "orden": orden,
+            "costo_min": request.GET.get("costo_min", ""),
+            "costo_max": request.GET.get("costo_max", ""),
+            "lote_nav_active": "maestro_tareas",
+        },
     )
 
 
 @login_required
 def tarea_detalle(request, lote_pk, pk):
-    lote = get_object_or_404(Lote, pk=lote_pk, company=request.company)
-    tarea = get_object_or_404(Tarea, pk=pk, lote=lote, company=request.company)
-    recursos = tarea.recursos.select_related(
-        "material", "material__proveedor", "material__unidad_de_venta",
-        "mano_de_obra", "mano_de_obra__unidad_de_venta", "mano_de_obra__equipo", "mano_de_obra__ref_equipo",
-        "subcontrato", "subcontrato__proveedor", "subcontrato__unidad_de_venta",
-        "mezcla", "mezcla__unidad_de_mezcla",
-    ).all()
-    total = sum(r.costo_total() for r in recursos)
-    total_usd = tarea.precio_total_usd()
+    lote = get_object_or_404(Lote.objects.select_related("tipo_dolar"), pk=lote_pk, company=request.company)
+    tarea = get_object_or_404(
+        Tarea.objects.select_related("rubro", "subrubro", "subrubro__rubro"),
+        pk=pk,
+        lote=lote,
+        company=request.company,
+    )
+    recursos = list(
+        tarea.recursos.select_related(
+            "material", "material__proveedor", "material__unidad_de_venta",
+            "mano_de_obra", "mano_de_obra__unidad_de_venta", "mano_de_obra__equipo", "mano_de_obra__ref_equipo",
+            "subcontrato", "subcontrato__proveedor", "subcontrato__unidad_de_venta",
+            "mezcla", "mezcla__unidad_de_mezcla",
+        )
+    )
+    costos = CostosLote(lote, tareas=[tarea])
+    costos.asignar([tarea, *recursos])
+    total = costos.total_tarea(tarea.pk)
+    total_usd = costos.total_tarea_usd(tarea.pk)
     return render(
         request,
         "recursos/tarea_detalle.html",
@@ -1251,15 +1244,6 @@ def subcontrato_list(request):
             HojaPreciosSubcontrato, pk=hoja_id, company=company
         )
         modo_hoja = True
-        subcontratos = list(
-            hoja_seleccionada.detalles.select_related(
-                "subcontrato",
-                "subcontrato__rubro",
-                "subcontrato__subrubro",
-                "subcontrato__proveedor",
-                "subcontrato__unidad_de_venta",
-            ).all()
-        )
 
         if agregar and request.method == "POST":
             subcontrato_id = request.POST.get("subcontrato_id")
@@ -1317,17 +1301,17 @@ def subcontrato_list(request):
 
         subcontratos_no_en_hoja = None
         if agregar:
-            ids_en_hoja = set(
-                hoja_seleccionada.detalles.values_list("subcontrato_id", flat=True)
-            )
-            todos = list(
-                Subcontrato.objects.filter(company=company).select_related(
-                    "rubro", "subrubro", "proveedor", "unidad_de_venta"
-                )
-            )
-            subcontratos_no_en_hoja = (
-                [s for s in todos if s.pk not in ids_en_hoja] if ids_en_hoja else todos
+            listado_agregar, subcontratos_no_en_hoja = _no_en_hoja(
+                request, "subcontrato", Subcontrato, HojaPrecioSubcontrato, hoja_seleccionada
             )
+            if request.GET.get("formato") == "json":
+                return JsonResponse(listado_agregar.como_json(subcontratos_no_en_hoja))
+
+        listado = Listado("subcontrato", request, en_hoja=True)
+        subcontratos = listado.paginar(hoja_seleccionada.detalles.all())
+        if request.GET.get("formato") == "json":
+            return JsonResponse(listado.como_json(subcontratos))
+        _incluir_fila(subcontratos, editing_hoja)
 
         lote = Lote.objects.filter(hoja_subcontratos=hoja_seleccionada).first()
         return render(
@@ -1335,6 +1319,8 @@ def subcontrato_list(request):
             "recursos/subcontrato_list.html",
             {
                 "subcontratos": subcontratos,
+                "listado": listado,
+                **_filtros_rubro(company, con_proveedores=True),
                 "form_new": form_new,
                 "hojas": hojas,
                 "hoja_seleccionada": hoja_seleccionada,
@@ -1357,14 +1343,17 @@ def subcontrato_list(request):
     else:
         form_new = SubcontratoForm(request=request)
 
-    subcontratos = Subcontrato.objects.filter(company=company).select_related(
-        "rubro", "subrubro", "proveedor", "unidad_de_venta"
-    )
+    listado = Listado("subcontrato", request)
+    subcontratos = listado.paginar(Subcontrato.objects.filter(company=company))
+    if request.GET.get("formato") == "json":
+        return JsonResponse(listado.como_json(subcontratos))
     return render(
         request,
         "recursos/subcontrato_list.html",
         {
             "subcontratos": subcontratos,
+            "listado": listado,
+            **_filtros_rubro(company, con_proveedores=True),
             "form_new": form_new,
             "hojas": hojas,
             "hoja_seleccionada": hoja_seleccionada,
@@ -1387,9 +1376,9 @@ def subcontrato_edit(request, pk):
     else:
         form = SubcontratoForm(instance=subcontrato, request=request)
 
-    subcontratos = Subcontrato.objects.filter(company=company).select_related(
-        "rubro", "subrubro", "proveedor", "unidad_de_venta"
-    )
+    listado = Listado("subcontrato", request)
+    subcontratos = listado.paginar(Subcontrato.objects.filter(company=company))
+    _incluir_fila(subcontratos, subcontrato)
     form_new = SubcontratoForm(request=request)
     hojas = HojaPreciosSubcontrato.objects.filter(company=company).order_by("-creado_en")
     return render(
@@ -1397,6 +1386,8 @@ def subcontrato_edit(request, pk):
         "recursos/subcontrato_list.html",
         {
             "subcontratos": subcontratos,
+            "listado": listado,
+            **_filtros_rubro(company, con_proveedores=True),
             "form_new": form_new,
             "form_edit": form,
             "editing": subcontrato,
@@ -1449,19 +1440,17 @@ def subcontrato_bulk_update(request):
         return redirect(redirect_url)
 
     if hoja_id:
-        hoja = get_object_or_404(HojaPreciosSubcontrato, pk=hoja_id, company=request.company)
-        queryset = HojaPrecioSubcontrato.objects.filter(hoja=hoja, pk__in=ids)
-        from django.db.models import F
-        factor = Decimal("1") + (porcentaje / Decimal("100"))
-        queryset.update(precio_unidad_venta=F("precio_unidad_venta") * factor)
-    else:
-        queryset = Subcontrato.objects.filter(company=request.company, pk__in=ids)
-        Subcontrato.actualizar_precios_por_porcentaje(queryset, porcentaje)
-
-    redirect_url = reverse("recursos:subcontrato_list")
-    if hoja_id:
-        redirect_url += f"?hoja={hoja_id}"
-    return redirect(redirect_url)
+        get_object_or_404(HojaPreciosSubcontrato, pk=hoja_id, company=request.company)
+    job = encolar(
+        "recursos.actualizar_precios",
+        company=request.company,
+        usuario=request.user,
+        recurso="subcontrato",
+        ids=[int(pk) for pk in ids if pk.isdigit()],
+        porcentaje=str(porcentaje),
+        hoja_id=int(hoja_id) if hoja_id else None,
+    )
+    return redirect("general:trabajo_detalle", pk=job.pk)
 
 
 @login_required
@@ -1518,6 +1507,8 @@ def hoja_subcontrato_list(request):
                 ]
             )
 
+        # Los detalles se cargan con bulk_create (sin signals).
+        invalidar_estadisticas(company.pk)
         return redirect("recursos:hoja_subcontrato_list")
 
     hojas = HojaPreciosSubcontrato.objects.filter(company=company)
@@ -1577,3 +1568,238 @@ def hoja_subcontrato_detalle_delete(request, hoja_pk, detalle_pk):
         return redirect(f"{reverse('recursos:subcontrato_list')}?hoja={hoja_pk}")
     return redirect(f"{reverse('recursos:subcontrato_list')}?hoja={hoja_pk}")
 
+
+# --- Historial de precios ----------------------------------------------------
+
+# Operaciones por página y cambios que se muestran de una operación.
+HISTORIAL_POR_PAGINA = 100
+HISTORIAL_MAX_CAMBIOS = 1000
+
+
+def _recurso_param(valor):
+    recursos = dict(OperacionPrecios.RECURSOS)
+    return valor if valor in recursos else None
+
+
+def _nombres_de_hojas(company, pares):
+    """{(recurso, hoja_id): nombre} con una consulta por tipo de hoja usado."""
+    from .trabajos import RECURSOS_CON_PRECIO
+
+    ids_por_recurso = {}
+    for recurso, hoja_id in pares:
+        if hoja_id:
+            ids_por_recurso.setdefault(recurso, set()).add(hoja_id)
+    nombres = {}
+    for recurso, ids in ids_por_recurso.items():
+        modelo_hoja = RECURSOS_CON_PRECIO[recurso][2]
+        for pk, nombre in modelo_hoja.objects.filter(company=company, pk__in=ids).values_list("pk", "nombre"):
+            nombres[(recurso, pk)] = nombre
+    return nombres
+
+
+def _fecha_hora(texto):
+    """datetime-local del form (AAAA-MM-DDTHH:MM) en la zona horaria actual, o None."""
+    from django.utils import timezone
+
+    try:
+        return timezone.make_aware(datetime.strptime(texto, "%Y-%m-%dT%H:%M"))
+    except (TypeError, ValueError):
+        return None
+
+
+@login_required
+def precios_historial(request):
+    """Últimas actualizaciones masivas de precios, con enlace a sus cambios y para revertirlas."""
+    company = request.company
+    recurso = _recurso_param(request.GET.get("recurso"))
+    operaciones = (
+        OperacionPrecios.objects.filter(company=company)
+        .select_related("usuario")
+        .annotate(revertida=Exists(OperacionPrecios.objects.filter(revierte=OuterRef("pk"))))
+    )
+    if recurso:
+        operaciones = operaciones.filter(recurso=recurso)
+        hoja_id = request.GET.get("hoja")
+        if hoja_id and hoja_id.isdigit():
+            operaciones = operaciones.filter(hoja_id=int(hoja_id))
+    operaciones = list(operaciones[:HISTORIAL_POR_PAGINA])
+    hojas = _nombres_de_hojas(company, ((o.recurso, o.hoja_id) for o in operaciones))
+    for operacion in operaciones:
+        operacion.hoja_nombre = hojas.get((operacion.recurso, operacion.hoja_id))
+    return render(
+        request,
+        "recursos/precios_historial.html",
+        {
+            "operaciones": operaciones,
+            "recurso": recurso,
+            "recursos": OperacionPrecios.RECURSOS,
+            "limite": HISTORIAL_POR_PAGINA,
+        },
+    )
+
+
+@login_required
+def precios_operacion(request, pk):
+    """Precios que cambió una operación (los primeros HISTORIAL_MAX_CAMBIOS)."""
+    from .historial import NOMBRES
+    from .trabajos import RECURSOS_CON_PRECIO
+
+    operacion = get_object_or_404(
+        OperacionPrecios.objects.select_related("usuario"), pk=pk, company=request.company
+    )
+    catalogo = RECURSOS_CON_PRECIO[operacion.recurso][0]
+    cambios = list(
+        operacion.cambios.order_by("pk").values("fila_id", "recurso_id", "precio_anterior", "precio_nuevo")[
+            :HISTORIAL_MAX_CAMBIOS
+        ]
+    )
+    nombres = dict(
+        catalogo.objects.filter(pk__in={c["recurso_id"] for c in cambios}).values_list(
+            "pk", NOMBRES[operacion.recurso]
+        )
+    )
+    for cambio in cambios:
+        cambio["nombre"] = nombres.get(cambio["recurso_id"])
+    hoja = _nombres_de_hojas(request.company, [(operacion.recurso, operacion.hoja_id)])
+    return render(
+        request,
+        "recursos/precios_operacion.html",
+        {
+            "operacion": operacion,
+            "hoja_nombre": hoja.get((operacion.recurso, operacion.hoja_id)),
+            "cambios": cambios,
+            "revertida": operacion.reversiones.exists(),
+            "limite": HISTORIAL_MAX_CAMBIOS,
+        },
+    )
+
+
+@login_required
+def precios_revertir(request, pk):
+    """Encola la reversión de una operación (vuelve los precios que no cambiaron después)."""
+    operacion = get_object_or_404(OperacionPrecios, pk=pk, company=request.company)
+    if request.method != "POST" or operacion.revierte_id or operacion.reversiones.exists():
+        return redirect("recursos:precios_operacion", pk=operacion.pk)
+    job = encolar(
+        "recursos.revertir_precios",
+        company=request.company,
+        usuario=request.user,
+        operacion_id=operacion.pk,
+    )
+    return redirect("general:trabajo_detalle", pk=job.pk)
+
+
+def _lote_anterior(lote):
+    return (
+        Lote.objects.filter(company_id=lote.company_id, creado_en__lt=lote.creado_en)
+        .order_by("-creado_en")
+        .first()
+    )
+
+
+@login_required
+def precios_diferencias(request):
+    """
+    Compara precios de un recurso entre dos hojas (hoja_a, hoja_b, o las de dos
+    lotes: lote_b y lote_a, por defecto el lote anterior) o de una hoja (o del
+    catálogo) entre dos momentos (desde, hasta) según el historial.
+    formato=csv: la comparación entre hojas completa, en CSV.
+    """
+    from .comparacion_hojas import (
+        ESTADOS,
+        MAX_POR_PAGINA,
+        ORDENES,
+        POR_PAGINA,
+        ComparacionHojas,
+        csv_comparacion,
+    )
+    from .historial import diferencias_en_el_tiempo
+    from .trabajos import RECURSOS_CON_PRECIO
+
+    company = request.company
+    recurso = _recurso_param(request.GET.get("recurso")) or "material"
+    modelo_hoja, campo_lote = RECURSOS_CON_PRECIO[recurso][2], RECURSOS_CON_PRECIO[recurso][4]
+    hojas = modelo_hoja.objects.filter(company=company).order_by("-creado_en")
+    lotes = Lote.objects.filter(company=company).order_by("-creado_en")
+    params = request.GET
+
+    def elegido(queryset, nombre):
+        valor = params.get(nombre, "")
+        return queryset.filter(pk=int(valor)).first() if valor.isdigit() else None
+
+    modo = params.get("modo") if params.get("modo") in ("tiempo", "lotes") else "hojas"
+    contexto = {
+        "recurso": recurso,
+        "recursos": OperacionPrecios.RECURSOS,
+        "hojas": hojas,
+        "lotes": lotes,
+        "modo": modo,
+        "filas": None,
+        "comparacion": None,
+    }
+    if modo == "tiempo":
+        desde, hasta = _fecha_hora(params.get("desde")), _fecha_hora(params.get("hasta"))
+        hoja_t = elegido(hojas, "hoja")
+        if desde:
+            contexto["filas"] = diferencias_en_el_tiempo(
+                company, recurso, hoja_t.pk if hoja_t else None, desde, hasta
+            )
+            contexto["titulos"] = (
+                f"{desde:%d/%m/%Y %H:%M}",
+                f"{hasta:%d/%m/%Y %H:%M}" if hasta else "Actual",
+            )
+        return render(request, "recursos/precios_diferencias.html", contexto)
+
+    if modo == "lotes":
+        lote_b = elegido(lotes, "lote_b")
+        lote_a = elegido(lotes, "lote_a") or (lote_b and _lote_anterior(lote_b))
+        contexto.update(lote_a=lote_a, lote_b=lote_b)
+        hoja_a = lote_a and getattr(lote_a, campo_lote)
+        hoja_b = lote_b and getattr(lote_b, campo_lote)
+        titulos = (lote_a.nombre, lote_b.nombre) if lote_a and lote_b else ("", "")
+    else:
+        hoja_a, hoja_b = elegido(hojas, "hoja_a"), elegido(hojas, "hoja_b")
+        titulos = (hoja_a.nombre, hoja_b.nombre) if hoja_a and hoja_b else ("", "")
+    if not (hoja_a and hoja_b):
+        return render(request, "recursos/precios_diferencias.html", contexto)
+
+    comparacion = ComparacionHojas(company, recurso, hoja_a.pk, hoja_b.pk)
+    estado = params.get("estado") if params.get("estado") in dict(ESTADOS) else ""
+    orden = params.get("orden") if params.get("orden") in dict(ORDENES) else "nombre"
+    if params.get("formato") == "csv":
+        response = StreamingHttpResponse(
+            csv_comparacion(comparacion, titulos, estado, orden), content_type="text/csv; charset=utf-8"
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="precios_{recurso}_{hoja_a.pk}_{hoja_b.pk}.csv"'
+        )
+        return response
+
+    try:
+        pagina = max(1, int(params.get("pagina") or 1))
+        por_pagina = max(1, min(int(params.get("por_pagina") or POR_PAGINA), MAX_POR_PAGINA))
+    except ValueError:
+        pagina, por_pagina = 1, POR_PAGINA
+    filas, hay_mas = comparacion.pagina(pagina, por_pagina, estado, orden)
+    grupos, total = comparacion.impacto()
+    sin_pagina = params.copy()
+    sin_pagina.pop("pagina", None)
+    sin_pagina.pop("formato", None)
+    contexto.update(
+        comparacion=comparacion,
+        hoja_a=hoja_a,
+        hoja_b=hoja_b,
+        titulos=titulos,
+        filas=filas,
+        grupos=grupos,
+        total=total,
+        estado=estado,
+        estados=ESTADOS,
+        orden=orden,
+        ordenes=ORDENES,
+        pagina=pagina,
+        anterior=pagina - 1 if pagina > 1 else None,
+        siguiente=pagina + 1 if hay_mas else None,
+        querystring=sin_pagina.urlencode(),
+    )
+    return render(request, "recursos/precios_diferencias.html", contexto)